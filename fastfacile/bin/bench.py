@@ -0,0 +1,339 @@
+#!/usr/bin/python
+'''bench.py times the whole pipeline of a set of models and the throughput
+of their engines, and keeps the results in a history file.
+
+For every model the stages of buildtool.py (facile -> maple, genRange,
+genDefaultPar, factools, vfgen, genMexfile, one gcc per engine variant)
+and vftool.py are run cold, without the build cache, in a scratch
+directory, and timed one by one. Every engine library that was built is
+then run on nsamps samples of the default parameters and its samples/sec
+is recorded. The models are example_hello, example_yeast, the
+facile/test/examples models and synthetic chains (factools.ScaledModel of
+hello) scaled to large numbers of species, which start at the maple stage.
+
+With -m every .eqn model is also built with the conservation laws of
+factools.py -m and its engines are timed again as '<model>+moiety', which
+shows the solve time before and after the reduction. With -c every model
+is also built with the cv files of cvgen.py instead of vfgen and timed as
+'<model>+cvgen'. With -f every .eqn model is also built with its fixed
+parameters folded by factools.py -f and timed as '<model>+fold'.
+
+Each run appends one json line to the history file (bench_history.jsonl by
+default) and is compared with the last run marked as baseline (-B), or
+with the last run if there is none. A stage that got slower or an engine
+that got slower than the tolerance is reported as a regression, and the
+exit status is 1.
+
+usage:
+    bench.py [options] [model.eqn ...]
+'''
+import os, sys, time, json, glob
+import shutil, socket, subprocess, tempfile
+import numpy as np
+import buildtool
+import factools
+import modelir
+import pyengine
+
+ROOT_DIR = os.path.dirname(buildtool.BIN_DIR)
+HISTORY_FILE = 'bench_history.jsonl'
+DEFAULT_TOLERANCE = 0.10
+DEFAULT_SAMPLES = 1000
+DEFAULT_NUM_TVEC = 20
+DEFAULT_T_FINAL = 10.0
+# an engine is timed on batches of 1, 2, 4, ... samples until nsamps
+# samples or this many seconds, so slow variants of large models stay short
+ENGINE_SECONDS = 5.0
+# stages that changed by less than this are not reported as regressions
+MIN_STAGE_DELTA = 0.05
+# copies of hello in the synthetic models (one species each)
+SYNTHETIC_COPIES = (100, 1000, 10000)
+
+# engine flavours that can be built and run without matlab: plain, _L and
+# the steady langevin engine _LSS of the Makefiles, and the stochastic ones.
+# the cmex engine (_c) needs matlab and is not timed here.
+VARIANTS = [('', ''), ('_L', '-DLANGEVIN'), ('_LSS', '-DLANGEVIN -DSTEADY'),
+        ('_SDE', '-DSDE'), ('_SSA', '-DSSA')]
+
+def Models(root=ROOT_DIR):
+    '''the .eqn files of the examples and of the facile test models. '''
+    models = sorted(glob.glob(os.path.join(root, 'example_*', '*.eqn')))
+    models += sorted(glob.glob(os.path.join(root, 'facile', 'test', 'examples', '*', '*.eqn')))
+    return models
+
+def SyntheticMaple(copies, outdir):
+    '''writes a chain of copies of the hello model as outdir/synthetic_x<copies>.maple. '''
+    base = modelir.Model('hello')
+    base.parameters = [modelir.Parameter('k1', '1'), modelir.Parameter('k2', '1')]
+    base.species = [modelir.Species('A', '1e-5', 'k1 - k2*A')]
+    model = factools.ScaledModel(base, copies)
+    name = 'synthetic_x%d' % copies
+    return modelir.WriteMaple(model, os.path.join(outdir, name + '.maple')), name
+
+def TimeStages(name, workdir, flags, synthetic=False, vf_flags='',
+        codegen=buildtool.DEFAULT_CODEGEN):
+    '''runs the build stages of name in workdir cold and returns
+    ({stage: seconds}, error). stops at the first stage that fails.
+    '''
+    stages = buildtool.ModelStages(name, flags, VARIANTS, vf_flags, codegen)
+    if synthetic:
+        stages = [ s for s in stages if s.name not in ('maple', 'ranges', 'defpar') ]
+    # vftool.py has no #! line
+    script = os.path.join(buildtool.BIN_DIR, 'vftool.py')
+    vftool = buildtool.Stage('vftool', [name + '.vf', script], ['rates.csv', 'ivalues.csv'],
+            'python %s -i %s.vf > /dev/null' % (script, name), [])
+    stages.insert([ s.name for s in stages ].index('vf') + 1, vftool)
+    times = {}
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for stage in stages:
+            try:
+                report = buildtool.Build([stage], None, verbose=False)
+            except (RuntimeError, OSError), e:
+                return times, str(e)
+            times[stage.name] = report[0][2]
+    finally:
+        os.chdir(cwd)
+    return times, None
+
+def TimeEngine(libfile, nsamps, num_tvec=DEFAULT_NUM_TVEC, t_final=DEFAULT_T_FINAL,
+        num_threads=None, seconds=ENGINE_SECONDS):
+    '''samples/sec of an engine library on up to nsamps samples of the
+    default parameters, in doubling batches until seconds are spent. the
+    first batch of one sample also loads the library and warms up.
+    '''
+    eng = pyengine.Engine(libfile)
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues,
+            np.repeat(eng.default_rates[None, :], nsamps, axis=0))
+    if eng.langevin and eng.seedable:
+        eng.set_seed(1)
+    eng.run(tvec, ivalues[:1], rates[:1], num_threads=num_threads)
+    done, elapsed, batch = 0, 0.0, 1
+    while done < nsamps and elapsed < seconds:
+        batch = min(batch, nsamps - done)
+        t0 = time.time()
+        eng.run(tvec, ivalues[done:done+batch], rates[done:done+batch],
+                num_threads=num_threads)
+        elapsed += time.time() - t0
+        done += batch
+        batch *= 2
+    return done/elapsed if elapsed > 0 else float('inf')
+
+def Run(eqnfiles, synthetic=SYNTHETIC_COPIES, nsamps=DEFAULT_SAMPLES,
+        flags=buildtool.EXTRA_FLAG, num_threads=None, verbose=True, moiety=False,
+        cvgen=False, fold=False):
+    '''benchmarks the models and returns the results as a flat dict:
+    '<model>/stage/<stage>' in seconds and '<model>/engine/<variant>' in
+    samples/sec. errors of a model are kept as '<model>/error'. with
+    moiety, the .eqn models are benchmarked once more as '<model>+moiety'
+    with their conservation laws reduced (factools.py -m). with cvgen,
+    every model is benchmarked once more as '<model>+cvgen' with the cv
+    files of cvgen.py. with fold, the .eqn models are benchmarked once more as
+    '<model>+fold' with their fixed parameters folded (factools.py -f).
+    '''
+    results = {}
+    scratch = tempfile.mkdtemp(prefix='bench-')
+    try:
+        jobs = []
+        for e in eqnfiles:
+            jobs.append((os.path.basename(e)[:-4], e, False, None))
+            if moiety:
+                jobs.append((os.path.basename(e)[:-4], e, False, 'moiety'))
+            if cvgen:
+                jobs.append((os.path.basename(e)[:-4], e, False, 'cvgen'))
+            if fold:
+                jobs.append((os.path.basename(e)[:-4], e, False, 'fold'))
+        for c in synthetic:
+            jobs.append(('synthetic_x%d' % c, c, True, None))
+            if cvgen:
+                jobs.append(('synthetic_x%d' % c, c, True, 'cvgen'))
+        for name, source, is_synthetic, tag in jobs:
+            key = name + ('+' + tag if tag else '')
+            workdir = os.path.join(scratch, key)
+            os.makedirs(workdir)
+            if is_synthetic:
+                SyntheticMaple(source, workdir)
+            else:
+                shutil.copy(source, workdir)
+            times, error = TimeStages(name, workdir, flags, is_synthetic,
+                    {'moiety': '-m', 'fold': '-f'}.get(tag, ''),
+                    'cvgen' if tag == 'cvgen' else buildtool.DEFAULT_CODEGEN)
+            for stage, seconds in times.items():
+                results['%s/stage/%s' % (key, stage)] = seconds
+            if error is not None:
+                results['%s/error' % key] = error
+            for suffix, define in VARIANTS:
+                libfile = os.path.join(workdir, name + suffix + '.so')
+                if not os.path.isfile(libfile):
+                    continue
+                try:
+                    rate = TimeEngine(libfile, nsamps, num_threads=num_threads)
+                except (OSError, ValueError, RuntimeError), e:
+                    results['%s/error' % key] = str(e)
+                    continue
+                results['%s/engine/%s' % (key, suffix or 'plain')] = rate
+            if verbose:
+                Print(results, key)
+                if tag:
+                    PrintSpeedup(results, name, tag)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return results
+
+def Print(results, name):
+    for key in sorted(results):
+        if not key.startswith(name + '/'):
+            continue
+        value = results[key]
+        if key.endswith('/error'):
+            print '%-48s %s' % (key, value.splitlines()[0] if value else '')
+        elif '/engine/' in key:
+            print '%-48s %12.4g samples/s' % (key, value)
+        else:
+            print '%-48s %12.4f s' % (key, value)
+    sys.stdout.flush()
+
+def PrintSpeedup(results, name, tag):
+    '''the samples/sec of the engines of '<name>+<tag>' over the ones of
+    name: the speedup from the moiety reduction, from folding or from
+    cvgen.py.
+    '''
+    for key in sorted(results):
+        if not key.startswith('%s+%s/engine/' % (name, tag)):
+            continue
+        before = results.get(key.replace('+' + tag, '', 1))
+        if before:
+            print '%-48s %12.2fx' % (key.replace('/engine/', '/speedup/'),
+                    results[key]/before)
+    sys.stdout.flush()
+
+def _revision():
+    try:
+        p = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=ROOT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out = p.communicate()[0].strip()
+        return out if p.returncode == 0 else None
+    except OSError:
+        return None
+
+def ReadHistory(path):
+    if not os.path.isfile(path):
+        return []
+    return [ json.loads(line) for line in open(path) if line.strip() ]
+
+def AppendHistory(path, results, baseline=False):
+    '''appends one run to the history file and returns its record. '''
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': socket.gethostname(), 'revision': _revision(),
+            'baseline': baseline, 'results': results}
+    f = open(path, 'a')
+    f.write(json.dumps(record, sort_keys=True) + '\n')
+    f.close()
+    return record
+
+def Baseline(history):
+    '''the last run marked as baseline, or the last run. '''
+    for record in reversed(history):
+        if record.get('baseline'):
+            return record
+    return history[-1] if history else None
+
+def Compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''[(key, old, new, change)] of the results that got worse than
+    tolerance against baseline: stages that take longer (by at least
+    MIN_STAGE_DELTA seconds), engines with fewer samples/sec. change is the
+    relative slowdown.
+    '''
+    regressions = []
+    old = baseline['results']
+    for key in sorted(results):
+        if key not in old or key.endswith('/error'):
+            continue
+        if '/engine/' in key:
+            change = old[key]/results[key] - 1.0 if results[key] > 0 else float('inf')
+        else:
+            if results[key] - old[key] < MIN_STAGE_DELTA:
+                continue
+            change = results[key]/old[key] - 1.0 if old[key] > 0 else 0.0
+        if change > tolerance:
+            regressions.append((key, old[key], results[key], change))
+    return regressions
+
+def usage():
+    print 'usage: bench.py [options] [model.eqn ...]'
+    print 'without models, the examples and the facile test models are benchmarked.'
+    print '-n nsamps        : samples per engine run (default %d).' % DEFAULT_SAMPLES
+    print '-s c1,c2,...     : copies of hello in the synthetic models (default %s,' % \
+            ','.join(map(str, SYNTHETIC_COPIES))
+    print '                   none with -s "").'
+    print '-j num_threads   : engine threads (default all processors).'
+    print '-D flags         : extra compiler flags (default "%s").' % buildtool.EXTRA_FLAG
+    print '-o history       : history file (default %s).' % HISTORY_FILE
+    print '-B               : mark this run as the new baseline.'
+    print '-t tolerance     : relative slowdown reported as a regression (default %g).' % DEFAULT_TOLERANCE
+    print '-m               : also time the .eqn models with their conservation laws'
+    print '                   reduced (factools.py -m), as <model>+moiety.'
+    print '-c               : also time the models with the cv files of cvgen.py instead'
+    print '                   of vfgen, as <model>+cvgen.'
+    print '-f               : also time the .eqn models with their fixed parameters folded'
+    print '                   (factools.py -f), as <model>+fold.'
+
+def main(argv):
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv, "hn:s:j:D:o:Bt:mcf",
+                ["help", "nsamps", "synthetic", "threads", "flags", "history",
+                    "baseline", "tolerance", "moiety", "cvgen", "fold"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    nsamps, synthetic, num_threads = DEFAULT_SAMPLES, SYNTHETIC_COPIES, None
+    flags, history, baseline = buildtool.EXTRA_FLAG, HISTORY_FILE, False
+    tolerance, moiety, cvgen, fold = DEFAULT_TOLERANCE, False, False, False
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-n', '--nsamps'):
+            nsamps = int(float(arg))
+        elif opt in ('-s', '--synthetic'):
+            synthetic = [ int(c) for c in arg.split(',') if c.strip() ]
+        elif opt in ('-j', '--threads'):
+            num_threads = int(arg)
+        elif opt in ('-D', '--flags'):
+            flags = arg
+        elif opt in ('-o', '--history'):
+            history = arg
+        elif opt in ('-B', '--baseline'):
+            baseline = True
+        elif opt in ('-t', '--tolerance'):
+            tolerance = float(arg)
+        elif opt in ('-m', '--moiety'):
+            moiety = True
+        elif opt in ('-c', '--cvgen'):
+            cvgen = True
+        elif opt in ('-f', '--fold'):
+            fold = True
+
+    eqnfiles = [ os.path.abspath(a) for a in args ] or Models()
+    results = Run(eqnfiles, synthetic, nsamps, flags, num_threads, moiety=moiety,
+            cvgen=cvgen, fold=fold)
+    reference = Baseline(ReadHistory(history))
+    AppendHistory(history, results, baseline)
+    if reference is None:
+        print 'no earlier run in %s to compare with' % history
+        return
+    regressions = Compare(results, reference, tolerance)
+    print 'compared with the run of %s (%s):' % (reference['time'],
+            reference.get('revision') or 'unknown revision')
+    for key, old, new, change in regressions:
+        print '%-48s %12.4g -> %12.4g (%+.0f%%)' % (key, old, new, 100*change)
+    if regressions:
+        print '%d regressions over %.0f%%' % (len(regressions), 100*tolerance)
+        sys.exit(1)
+    print 'no regressions over %.0f%%' % (100*tolerance)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
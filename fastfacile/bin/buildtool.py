@@ -0,0 +1,352 @@
+#!/usr/bin/python
+'''buildtool.py builds a model like the example Makefiles do
+(eqn -> maple -> vf -> _cv.c -> .so), but decides what to rebuild from
+content hashes instead of timestamps. The _cv.c is written by vfgen, or
+by cvgen.py with -g cvgen.
+
+Every stage is keyed on the contents of its input files, the tools it runs
+(facile.pl, factools.py, vfgen, gcc, ...) and its flags. The outputs of a
+stage are stored under that key in a shared on-disk cache, so a model
+variant whose intermediates are identical to one built before (by any user
+of the same cache) gets them by a copy instead of running vfgen or gcc. The
+cache is bounded in size; the least recently used entries are evicted first.
+
+usage:
+    buildtool.py [options] MODEL        (in the directory of MODEL.eqn)
+'''
+import os, sys, time, json
+import getopt, glob, hashlib, shutil, subprocess, tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'fastfacile')
+DEFAULT_CACHE_SIZE = 2*1024**3 # bytes
+STAMP_FILE = '.buildtool'
+BIN_DIR = os.path.dirname(os.path.realpath(__file__))
+
+SUNDIALS_DIR = '/usr/local/sundials-2.3.0'
+GSL_DIR = '/usr/local/gsl-2.2'
+USR_DIR = '/home/pbs/usr'
+LIBS = '-lsundials_cvodes -lsundials_cvode -lsundials_nvecserial -lgomp -lgsl -lgslcblas -lm'
+EXTRA_FLAG = '-DWITH_OMP'
+
+# the generators of MODEL_cv.c and MODEL_cv.h from MODEL.vf: (command,
+# scripts of BIN_DIR, tools)
+CODEGEN = {
+    'cvgen': ('cvgen.py %s.vf', ['cvgen.py', 'factools.py', 'modelir.py'], []),
+    'vfgen': ('vfgen cvode:version=2.5.0 %s.vf', [], ['vfgen']),
+    }
+DEFAULT_CODEGEN = 'vfgen'
+
+def Which(program):
+    '''full path of program on PATH (or next to this script), or None. '''
+    candidates = [os.path.join(BIN_DIR, program)]
+    candidates += [ os.path.join(d, program) for d in os.environ.get('PATH', '').split(os.pathsep) ]
+    for path in candidates:
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+_file_hashes = {}
+def FileHash(path):
+    '''sha1 of a file, memoized on (path, size, mtime) for tools like vfgen
+    and gcc that are hashed by every stage.
+    '''
+    st = os.stat(path)
+    memo = (path, st.st_size, st.st_mtime)
+    if memo in _file_hashes:
+        return _file_hashes[memo]
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    while True:
+        block = f.read(1 << 20)
+        if not block:
+            break
+        h.update(block)
+    f.close()
+    _file_hashes[memo] = h.hexdigest()
+    return _file_hashes[memo]
+
+def ToolVersion(program):
+    '''identifies a tool by the hash of its executable. '''
+    path = Which(program)
+    if path is None:
+        raise RuntimeError('%s is not found on PATH' % program)
+    return '%s:%s' % (program, FileHash(os.path.realpath(path)))
+
+def ToolModules(program):
+    '''the perl modules that a tool loads from the modules directory next
+    to it (facile.pl: use lib "$Bin/modules"), which ToolVersion() does not
+    hash. '''
+    path = Which(program)
+    if path is None:
+        return []
+    return sorted(glob.glob(os.path.join(os.path.dirname(os.path.realpath(path)),
+        'modules', '*.pm')))
+
+class Stage(object):
+    '''one build step. command is run by the shell in the model directory
+    and must create every file of outputs from the files of inputs. the
+    files of optional are inputs when they exist.
+    '''
+    def __init__(self, name, inputs, outputs, command, tools, flags='', optional=()):
+        self.name = name
+        self.inputs = inputs
+        self.optional = optional
+        self.outputs = outputs
+        self.command = command
+        self.tools = tools
+        self.flags = flags
+
+    def key(self):
+        h = hashlib.sha1()
+        h.update('stage=%s\n' % self.name)
+        h.update('command=%s\n' % self.command)
+        h.update('flags=%s\n' % self.flags)
+        h.update('outputs=%s\n' % ' '.join(self.outputs))
+        for tool in self.tools:
+            h.update('tool=%s\n' % ToolVersion(tool))
+        for path in self.inputs:
+            h.update('input=%s:%s\n' % (os.path.basename(path), FileHash(path)))
+        for path in self.optional:
+            h.update('input=%s:%s\n' % (os.path.basename(path),
+                FileHash(path) if os.path.isfile(path) else 'absent'))
+        return h.hexdigest()
+
+class Cache(object):
+    '''content addressed store of stage outputs with LRU eviction.
+
+    Layout: <root>/<key[:2]>/<key>/<output files>. The mtime of an entry
+    directory is its last use. Entries are written to a temporary directory
+    and renamed into place, so concurrent builds never see a partial entry.
+    '''
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        self.root = root
+        self.max_size = max_size
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key, outputs):
+        entry = self._path(key)
+        if not os.path.isdir(entry):
+            return False
+        for name in outputs:
+            if not os.path.isfile(os.path.join(entry, name)):
+                return False
+        for name in outputs:
+            shutil.copy(os.path.join(entry, name), name)
+        os.utime(entry, None)
+        return True
+
+    def put(self, key, outputs):
+        entry = self._path(key)
+        if os.path.isdir(entry):
+            os.utime(entry, None)
+            return
+        parent = os.path.dirname(entry)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+        for name in outputs:
+            shutil.copy(name, os.path.join(tmp, name))
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another build stored the same key in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def entries(self):
+        result = []
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if key.startswith('.tmp-'):
+                    continue
+                entry = os.path.join(prefix_dir, key)
+                size = sum([ os.path.getsize(os.path.join(entry, f))
+                    for f in os.listdir(entry) ])
+                result.append((os.path.getmtime(entry), size, entry))
+        return result
+
+    def evict(self):
+        '''removes least recently used entries until the cache fits in
+        max_size. returns the number of removed entries.
+        '''
+        entries = sorted(self.entries())
+        total = sum([ e[1] for e in entries ])
+        removed = 0
+        for mtime, size, entry in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+# engine libraries (suffix, defines) built by ModelStages()
+VARIANTS = [('', ''), ('_L', '-DLANGEVIN'), ('_SDE', '-DSDE'), ('_SSA', '-DSSA'),
+        ('_SENS', '-DSENS')]
+
+def CompilerPaths():
+    '''(include flags, library flags) of gsl and sundials. '''
+    inc = '-I%s/include -I%s/include -I%s/include' % (GSL_DIR, SUNDIALS_DIR, USR_DIR)
+    lib = '-L%s/lib -L%s/lib -L%s/lib' % (GSL_DIR, SUNDIALS_DIR, USR_DIR)
+    return inc, lib
+
+def ModelStages(model, flags=EXTRA_FLAG, variants=VARIANTS, vf_flags='',
+        codegen=DEFAULT_CODEGEN):
+    '''the stages of the example Makefiles for MODEL.eqn, with one .so per
+    entry of variants. vf_flags are extra options of factools.py, codegen
+    names the generator of the cv files in CODEGEN.
+    '''
+    inc, lib = CompilerPaths()
+    cv_command, cv_scripts, cv_tools = CODEGEN[codegen]
+    eqn = model + '.eqn'
+    bin = lambda name: os.path.join(BIN_DIR, name)
+    compile_inputs = [model + '_mex_mat.c', 'ode_size.h', model + '_cv.c', model + '_cv.h']
+    so = 'gcc %s %s %s -fopenmp -fPIC -g -c -Wall %s_mex_mat.c -o %s && ' \
+            'gcc %s %s -shared -Wl,-soname,%s -Wl,--no-undefined -o %s %s %s && rm -f %s'
+    stages = [
+        Stage('maple', [eqn] + ToolModules('facile.pl'), [model + '.maple'],
+            'facile.pl -L %s' % eqn, ['facile.pl']),
+        # with reduce_moieties = 1 the columns depend on the laws of the maple
+        Stage('ranges', [eqn, bin('genRange.py'), bin('factools.py'), bin('modelir.py')],
+            ['ranges.m'], 'genRange.py %s' % eqn, [], optional=[model + '.maple']),
+        Stage('defpar', [eqn, bin('genDefaultPar.py'), bin('factools.py'), bin('modelir.py')],
+            [model + '_ivalues.m', model + '_rates.m'],
+            'genDefaultPar.py %s' % eqn, [], optional=[model + '.maple']),
+        Stage('vf', [model + '.maple', bin('factools.py'), bin('modelir.py')],
+            [model + '.vf', 'ode_size.h', 'statesLabels.m', 'ratesLabels.m',
+                model + '_engine.m'],
+            'factools.py %s%s.maple > %s.vf' % (vf_flags and vf_flags + ' ', model, model),
+            [], optional=[eqn]),
+        Stage('cv', [model + '.vf'] + [ bin(a) for a in cv_scripts ],
+            [model + '_cv.c', model + '_cv.h'], cv_command % model, cv_tools),
+        Stage('mexsrc', [bin('mex.c'), bin('mex_mat.c'), bin('genMexfile.py')],
+            [model + '_mex.c', model + '_mex_mat.c'],
+            'genMexfile.py %s' % model, []),
+        ]
+    for suffix, define in variants:
+        target = model + suffix + '.so'
+        obj = model + suffix + '.o'
+        stages.append(Stage('so' + suffix, compile_inputs, [target],
+            so % (define, flags, inc, model, obj, define, lib, target, target, obj, LIBS, obj),
+            ['gcc'], flags=define + ' ' + flags))
+    return stages
+
+def ReadStamps():
+    if os.path.isfile(STAMP_FILE):
+        return json.load(open(STAMP_FILE))
+    return {}
+
+def WriteStamps(stamps):
+    f = open(STAMP_FILE + '.tmp', 'w')
+    json.dump(stamps, f, indent=1, sort_keys=True)
+    f.close()
+    os.rename(STAMP_FILE + '.tmp', STAMP_FILE)
+
+def Build(stages, cache=None, verbose=True):
+    '''runs the stages in order. a stage is skipped when its outputs are
+    already present with the same key, copied from the cache on a hit and
+    run (then stored) otherwise. returns [(stage, status, seconds)].
+    '''
+    stamps = ReadStamps()
+    report = []
+    # the python tools of a stage are the ones next to this script
+    env = dict(os.environ)
+    env['PATH'] = BIN_DIR + os.pathsep + env.get('PATH', '')
+    for stage in stages:
+        t0 = time.time()
+        key = stage.key()
+        present = all([ os.path.isfile(f) for f in stage.outputs ])
+        if present and stamps.get(stage.name) == key:
+            status = 'up-to-date'
+        elif cache is not None and cache.get(key, stage.outputs):
+            status = 'cached'
+        else:
+            if verbose:
+                print stage.command
+            if subprocess.call(stage.command, shell=True, env=env) != 0:
+                raise RuntimeError('stage %s failed: %s' % (stage.name, stage.command))
+            for f in stage.outputs:
+                if not os.path.isfile(f):
+                    raise RuntimeError('stage %s did not create %s' % (stage.name, f))
+            if cache is not None:
+                cache.put(key, stage.outputs)
+            status = 'built'
+        stamps[stage.name] = key
+        WriteStamps(stamps)
+        report.append((stage.name, status, time.time() - t0))
+    if cache is not None:
+        cache.evict()
+    return report
+
+def PrintReport(report):
+    total = 0.0
+    for name, status, seconds in report:
+        print '%-10s %-12s %8.3fs' % (name, status, seconds)
+        total += seconds
+    counts = {}
+    for name, status, seconds in report:
+        counts[status] = counts.get(status, 0) + 1
+    print '%-10s %-12s %8.3fs (%s)' % ('total', '', total,
+            ', '.join([ '%d %s' % (counts[s], s) for s in sorted(counts) ]))
+
+def usage():
+    print 'options and arguments:'
+    print '-c cache_dir     : cache directory (default %s).' % DEFAULT_CACHE_DIR
+    print '-s size_mb       : maximum cache size in MB (default %d).' % (DEFAULT_CACHE_SIZE/1024**2)
+    print '-n               : do not use the cache (cold build).'
+    print '-f               : ignore up-to-date stamps and the cache, rebuild everything.'
+    print '-D flags         : extra compiler flags (default "%s").' % EXTRA_FLAG
+    print '-g generator     : generator of the cv files, %s (default %s).' % (
+            ' or '.join(sorted(CODEGEN)), DEFAULT_CODEGEN)
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "hc:s:nfD:g:",
+                ["help", "cache", "size", "no-cache", "force", "flags", "codegen"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    cache_dir = os.environ.get('FASTFACILE_CACHE', DEFAULT_CACHE_DIR)
+    cache_size = DEFAULT_CACHE_SIZE
+    use_cache = True
+    flags = EXTRA_FLAG
+    codegen = DEFAULT_CODEGEN
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-c', '--cache'):
+            cache_dir = arg
+        elif opt in ('-s', '--size'):
+            cache_size = int(float(arg)*1024**2)
+        elif opt in ('-n', '--no-cache'):
+            use_cache = False
+        elif opt in ('-f', '--force'):
+            use_cache = False
+            if os.path.isfile(STAMP_FILE):
+                os.remove(STAMP_FILE)
+        elif opt in ('-D', '--flags'):
+            flags = arg
+        elif opt in ('-g', '--codegen'):
+            if arg not in CODEGEN:
+                usage()
+                sys.exit(2)
+            codegen = arg
+    if len(args) != 1:
+        usage()
+        sys.exit(2)
+
+    model = args[0]
+    if model.endswith('.eqn'):
+        model = model[:-4]
+    cache = Cache(cache_dir, cache_size) if use_cache else None
+    PrintReport(Build(ModelStages(model, flags, codegen=codegen), cache))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
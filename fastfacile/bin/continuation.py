@@ -0,0 +1,191 @@
+#!/usr/bin/python
+'''continuation.py follows the steady states of a compiled model along the
+bifurcation parameter of its .eqn file (the BIFURC_PARAM section), with
+engine_continuation() of the engine library (see pyengine.continuation).
+
+The sweep is an ordered grid of the parameter between its #{min, max} range
+of the .eqn file, or between 0.1 and 10 times its default value where the
+.eqn file gives no range. Every point starts from the steady state of the
+points before it and is corrected with newton iterations on the jacobian of
+the model, so a point costs a few rhs and jacobian evaluations instead of an
+integration from the initial values. With a second parameter, the sweep is
+run along every value of it (a 2-d grid), one branch per value, and the
+branches run in parallel. With -u every branch is swept back down as well;
+where the model is bistable, the up and down sweeps jump at different folds.
+
+The output .npz holds the values of the grid, the steady states
+(branches, points, species), the flags of the points (0 newton, 1
+integrated, -1 failed) and the number of unstable eigenvalues of the
+jacobian at every point (0 for a stable steady state).
+
+usage:
+    continuation.py [options] MODEL.eqn MODEL.so [output.npz]
+'''
+import sys, time
+import numpy as np
+import modelir
+import pyengine
+
+DEFAULT_POINTS = 200
+DEFAULT_BRANCHES = 10
+
+def Grid(lower, upper, count, log=False):
+    '''count ordered values from lower to upper. '''
+    if log:
+        if lower <= 0.0 or upper <= 0.0:
+            raise ValueError('log scale needs positive bounds')
+        return np.logspace(np.log10(lower), np.log10(upper), count)
+    return np.linspace(lower, upper, count)
+
+def Range(eng, model, name):
+    '''(min, max) of parameter name: its #{min, max} range of the .eqn file,
+    else 0.1 and 10 times its default value. '''
+    if name not in eng.parameters:
+        raise ValueError('%s is not a parameter of %s (moiety totals need '
+                'reduce_moieties = 1)' % (name, eng.libfile))
+    ranges = model.ranges()
+    if name in ranges:
+        lower, upper = [ float(b) for b in ranges[name] ]
+        if lower != upper:
+            return lower, upper
+    value = eng.default_rates[eng.parameters.index(name)]
+    value = value if value != 0.0 else 1.0
+    return 0.1*value, 10.0*value
+
+def Transitions(values, flag, unstable):
+    '''(lower, upper, before, after) for every pair of neighbouring points
+    of a branch where the number of unstable eigenvalues changes (a hopf
+    point or a fold lies between lower and upper), and with before = after
+    = None where newton lost the branch and the point was integrated to
+    another steady state (the branch ended at a fold). '''
+    result = []
+    for k in range(1, len(values)):
+        if flag[k-1] < 0 or flag[k] < 0:
+            continue
+        if unstable[k-1] != unstable[k]:
+            result.append((values[k-1], values[k], unstable[k-1], unstable[k]))
+        elif flag[k] == 1:
+            result.append((values[k-1], values[k], None, None))
+    return result
+
+def usage():
+    print 'usage: continuation.py [options] MODEL.eqn MODEL.so [output.npz]'
+    print '-p parameter     : parameter of the sweep (default: the first of'
+    print '                   BIFURC_PARAM).'
+    print '-q parameter     : second parameter of a 2-d grid, one branch per value'
+    print '                   (default: the second of BIFURC_PARAM with -m).'
+    print '-n points        : points of the sweep (default %d).' % DEFAULT_POINTS
+    print '-m branches      : values of the second parameter (default %d).' % DEFAULT_BRANCHES
+    print '-r min,max       : range of the sweep (default: #{min, max} of the .eqn).'
+    print '-s min,max       : range of the second parameter.'
+    print '-l               : log spaced values.'
+    print '-u               : sweep every branch back down as well.'
+    print '-t t_settle      : longest integration of a point (default %g).' % \
+            pyengine.CONTINUATION_T_SETTLE
+    print '-j num_threads   : number of threads (0 = all processors).'
+    print '-b t_final       : compare with cold starts integrated to t_final.'
+
+def main(argv):
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv, "hp:q:n:m:r:s:lut:j:b:",
+                ["help", "parameter", "second", "points", "branches", "range",
+                    "second_range", "log", "updown", "t_settle", "threads",
+                    "benchmark"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    first, second, num_points, num_branches = None, None, DEFAULT_POINTS, None
+    first_range, second_range, log, updown = None, None, False, False
+    t_settle, threads, t_final = pyengine.CONTINUATION_T_SETTLE, None, None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-p', '--parameter'):
+            first = arg
+        elif opt in ('-q', '--second'):
+            second = arg
+        elif opt in ('-n', '--points'):
+            num_points = int(arg)
+        elif opt in ('-m', '--branches'):
+            num_branches = int(arg)
+        elif opt in ('-r', '--range'):
+            first_range = [ float(b) for b in arg.split(',') ]
+        elif opt in ('-s', '--second_range'):
+            second_range = [ float(b) for b in arg.split(',') ]
+        elif opt in ('-l', '--log'):
+            log = True
+        elif opt in ('-u', '--updown'):
+            updown = True
+        elif opt in ('-t', '--t_settle'):
+            t_settle = float(arg)
+        elif opt in ('-j', '--threads'):
+            threads = int(arg)
+        elif opt in ('-b', '--benchmark'):
+            t_final = float(arg)
+    if len(args) not in (2, 3):
+        usage()
+        sys.exit(2)
+
+    model = modelir.Load(eqnfile=args[0])
+    eng = pyengine.Engine(args[1])
+    if first is None:
+        if not model.bifurc_params:
+            print '%s has no BIFURC_PARAM, use -p' % args[0]
+            sys.exit(2)
+        first = model.bifurc_params[0]
+    if second is None and num_branches is not None and len(model.bifurc_params) > 1:
+        second = [ p for p in model.bifurc_params if p != first ][0]
+    if threads is not None:
+        eng.set_schedule(num_threads=threads)
+
+    values = Grid(*tuple(first_range or Range(eng, model, first)) + (num_points, log))
+    rates = eng.default_rates[None, :]
+    second_values = None
+    if second is not None:
+        second_values = Grid(*tuple(second_range or Range(eng, model, second))
+                + (num_branches or DEFAULT_BRANCHES, log))
+        rates = np.repeat(rates, len(second_values), axis=0)
+        rates[:, eng.parameters.index(second)] = second_values
+    sweeps = np.repeat(values[None, :], rates.shape[0], axis=0)
+    if updown:
+        sweeps = np.vstack([sweeps, sweeps[:, ::-1]])
+        rates = np.vstack([rates, rates])
+
+    if t_final is not None:
+        pyengine.ContinuationBenchmark(eng, first, values, t_final,
+                rates=rates[0])
+        return
+
+    t0 = time.time()
+    yss, flag, unstable = eng.continuation(first, sweeps, rates=rates,
+            t_settle=t_settle)
+    elapsed = time.time() - t0
+    print '%d branches of %d points of %s in %.3fs: %d by newton, %d ' \
+            'integrated, %d failed' % (sweeps.shape[0], num_points, first,
+                    elapsed, (flag == 0).sum(), (flag == 1).sum(),
+                    (flag < 0).sum())
+    for b in range(sweeps.shape[0]):
+        label = 'branch %d' % b
+        if second_values is not None:
+            label += ' (%s = %g)' % (second, second_values[b % len(second_values)])
+        if updown:
+            label += ' down' if b >= sweeps.shape[0]//2 else ' up'
+        for lower, upper, before, after in Transitions(sweeps[b], flag[b],
+                unstable[b]):
+            if before is None:
+                print '%s: jumps to another steady state between %s = %g ' \
+                        'and %g' % (label, first, lower, upper)
+            else:
+                print '%s: %d -> %d unstable eigenvalues between %s = %g ' \
+                        'and %g' % (label, before, after, first, lower, upper)
+
+    if len(args) == 3:
+        np.savez(args[2], values=sweeps, yss=yss, flag=flag,
+                unstable=unstable, rates=rates, parameter=first,
+                species=eng.species)
+        print 'saved to %s' % args[2]
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
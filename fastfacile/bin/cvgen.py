@@ -0,0 +1,915 @@
+#!/usr/bin/python
+'''cvgen.py writes the CVODE right hand side and jacobian of a model,
+MODEL_cv.c and MODEL_cv.h, from the MODEL.vf that factools.py writes. It
+replaces 'vfgen cvode:version=2.5.0 MODEL.vf' in the pipeline and keeps
+its interface (MODEL_vf and MODEL_jac of the CVODE 2.5 api), so the cv
+files drop into mex.c and mex_mat.c as before.
+
+The formulas of the vf are parsed into one expression graph in which equal
+subexpressions are the same node. The expressions and dependent species
+are inlined, the jacobian is differentiated on the same graph, and only
+its structurally nonzero entries are written. A node that is used more
+than once by a function is computed once into a temporary, so a
+subexpression shared by several odes, or by the odes and their
+derivatives, is evaluated once per call. MODEL_bjac writes the same
+entries into a band matrix for the band linear solver.
+
+usage:
+    cvgen.py MODEL.vf
+    cvgen.py -b [-R vfgen_dir] MODEL.vf
+'''
+import os, re, sys, math, time
+import shutil, subprocess, tempfile
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+import modelir
+import factools
+
+# kinds of the nodes of the expression graph
+NUM, SYM, ADD, MUL, POW, CALL, SELECT = range(7)
+
+# the python value of the maple functions, for folding constant arguments
+_functions = {
+    'exp': math.exp, 'log': math.log, 'log10': math.log10, 'sqrt': math.sqrt,
+    'abs': abs, 'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+    'tanh': math.tanh, 'min': min, 'max': max,
+    }
+_arity = {'min': 2, 'max': 2, 'pow': 2}
+
+def _collectable(exponents):
+    '''whether powers of one base with these exponents can be collected
+    into one power without changing the value anywhere: integers of one
+    sign. x*x^-1 stays as it is (NaN at x = 0, like the vfgen code), and so
+    does x^0.5*x^0.5 (NaN for x < 0). '''
+    if None in exponents:
+        return False
+    if [ e for e in exponents if math.floor(e) != e ]:
+        return False
+    return min(exponents) > 0 or max(exponents) < 0
+
+class Graph(object):
+    '''an expression graph with one node per distinct subexpression. a
+    node is an index into nodes, whose entries are (kind, payload, args):
+    (NUM, value, ()), (SYM, name, ()), (ADD, None, terms), (MUL, None,
+    factors), (POW, None, (base, exponent)), (CALL, function, args) and
+    (SELECT, None, (a, b, x, y)) for a <= b ? x : y. sums and products are
+    flattened, their numbers folded and their like terms and powers
+    collected, so equal formulas get equal nodes. the args of a node are
+    created before it, so the node order is an evaluation order. deps[node]
+    is the bitmask of the states the node depends on.
+    '''
+    def __init__(self, states=()):
+        self.nodes = []
+        self.deps = []
+        self.index = {}
+        self.state_bit = dict([ (name, 1 << i) for i, name in enumerate(states) ])
+        self.zero = self.num(0.0)
+        self.one = self.num(1.0)
+
+    def node(self, key):
+        n = self.index.get(key)
+        if n is None:
+            n = len(self.nodes)
+            deps = 0
+            if key[0] == SYM:
+                deps = self.state_bit.get(key[1], 0)
+            for a in key[2]:
+                deps |= self.deps[a]
+            self.nodes.append(key)
+            self.deps.append(deps)
+            self.index[key] = n
+        return n
+
+    def num(self, value):
+        return self.node((NUM, float(value), ()))
+
+    def sym(self, name):
+        return self.node((SYM, name, ()))
+
+    def value(self, n):
+        '''the number of a NUM node, None for the other nodes. '''
+        kind, payload, args = self.nodes[n]
+        return payload if kind == NUM else None
+
+    def fold(self, function, *values):
+        try:
+            return self.num(function(*values))
+        except (ValueError, OverflowError, ZeroDivisionError):
+            return None
+
+    def split(self, n):
+        '''(coefficient, rest) of a term: 2*k*A is (2.0, k*A). '''
+        kind, payload, args = self.nodes[n]
+        if kind == MUL:
+            for a in args:
+                if self.nodes[a][0] == NUM:
+                    rest = tuple([ b for b in args if b != a ])
+                    if len(rest) == 1:
+                        return self.nodes[a][1], rest[0]
+                    return self.nodes[a][1], self.node((MUL, None, rest))
+        return 1.0, n
+
+    def add(self, terms):
+        constant = 0.0
+        coefficients = {}
+        pending = list(terms)
+        while pending:
+            t = pending.pop()
+            kind, payload, args = self.nodes[t]
+            if kind == ADD:
+                pending.extend(args)
+            elif kind == NUM:
+                constant += payload
+            else:
+                c, rest = self.split(t)
+                coefficients[rest] = coefficients.get(rest, 0.0) + c
+        terms = []
+        for rest in sorted(coefficients):
+            c = coefficients[rest]
+            if c == 1.0:
+                terms.append(rest)
+            elif c != 0.0:
+                terms.append(self.mul([self.num(c), rest]))
+        if constant != 0.0 or not terms:
+            terms.append(self.num(constant))
+        if len(terms) == 1:
+            return terms[0]
+        return self.node((ADD, None, tuple(sorted(terms))))
+
+    def mul(self, factors):
+        constant = 1.0
+        powers = {}
+        pending = list(factors)
+        while pending:
+            f = pending.pop()
+            kind, payload, args = self.nodes[f]
+            if kind == MUL:
+                pending.extend(args)
+            elif kind == NUM:
+                constant *= payload
+            elif kind == POW and self.nodes[args[1]][0] == NUM:
+                powers.setdefault(args[0], []).append(self.nodes[args[1]][1])
+            else:
+                powers.setdefault(f, []).append(1.0)
+        if constant == 0.0:
+            return self.zero
+        factors = []
+        for base in sorted(powers):
+            exponents = powers[base]
+            if _collectable(exponents):
+                exponents = [sum(exponents)]
+            for e in exponents:
+                f = self.pow(base, self.num(e))
+                if self.nodes[f][0] == NUM:
+                    constant *= self.nodes[f][1]
+                else:
+                    factors.append(f)
+        if constant != 1.0 or not factors:
+            factors.append(self.num(constant))
+        if len(factors) == 1:
+            return factors[0]
+        return self.node((MUL, None, tuple(sorted(factors))))
+
+    def pow(self, base, exponent):
+        e = self.value(exponent)
+        if e is not None:
+            if e == 0.0:
+                return self.one
+            if e == 1.0:
+                return base
+            b = self.value(base)
+            if b is not None:
+                folded = self.fold(math.pow, b, e)
+                if folded is not None:
+                    return folded
+            kind, payload, args = self.nodes[base]
+            if abs(e) < 1e9 and e == int(e):
+                # (a*b)^-1 is a^-1*b^-1 and (a^2)^-1 is a^-2, so that
+                # products collect the powers of their factors
+                if kind == MUL:
+                    return self.mul([ self.pow(f, exponent) for f in args ])
+                # (x^0.5)^2 is not x for x < 0
+                if kind == POW and self.value(args[1]) is not None and \
+                        math.floor(self.value(args[1])) == self.value(args[1]):
+                    return self.pow(args[0], self.num(self.value(args[1])*e))
+        return self.node((POW, None, (base, exponent)))
+
+    def call(self, function, args):
+        if function == 'ln':
+            function = 'log'
+        if len(args) != _arity.get(function, 1):
+            raise ValueError('%s takes %d arguments' % (function, _arity.get(function, 1)))
+        if function == 'pow':
+            return self.pow(args[0], args[1])
+        values = [ self.value(a) for a in args ]
+        if None not in values:
+            folded = self.fold(_functions[function], *values)
+            if folded is not None:
+                return folded
+        return self.node((CALL, function, tuple(args)))
+
+    def select(self, a, b, x, y):
+        if x == y:
+            return x
+        if self.value(a) is not None and self.value(b) is not None:
+            return x if self.value(a) <= self.value(b) else y
+        return self.node((SELECT, None, (a, b, x, y)))
+
+    def diff(self, n, bit, memo):
+        '''the node of the derivative of n by the state of bit. memo
+        keeps the derivatives by the same state.
+        '''
+        if not self.deps[n] & bit:
+            return self.zero
+        if n in memo:
+            return memo[n]
+        kind, payload, args = self.nodes[n]
+        if kind == SYM:
+            d = self.one
+        elif kind == ADD:
+            d = self.add([ self.diff(a, bit, memo) for a in args ])
+        elif kind == MUL:
+            terms = []
+            for k, a in enumerate(args):
+                if self.deps[a] & bit:
+                    terms.append(self.mul(list(args[:k] + args[k+1:]) +
+                        [self.diff(a, bit, memo)]))
+            d = self.add(terms)
+        elif kind == POW:
+            base, exponent = args
+            db = self.diff(base, bit, memo)
+            if not self.deps[exponent] & bit:
+                d = self.mul([exponent, db,
+                    self.pow(base, self.add([exponent, self.num(-1.0)]))])
+            else:
+                de = self.diff(exponent, bit, memo)
+                d = self.mul([n, self.add([
+                    self.mul([de, self.call('log', [base])]),
+                    self.mul([exponent, db, self.pow(base, self.num(-1.0))])])])
+        elif kind == CALL:
+            d = self.chain(n, payload, args, [ self.diff(a, bit, memo) for a in args ])
+        else:
+            a, b, x, y = args
+            d = self.select(a, b, self.diff(x, bit, memo), self.diff(y, bit, memo))
+        memo[n] = d
+        return d
+
+    def chain(self, n, function, args, dargs):
+        '''the derivative of the call n = function(args) from the
+        derivatives of its arguments.
+        '''
+        u, du = args[0], dargs[0]
+        minus_one = self.num(-1.0)
+        if function == 'exp':
+            return self.mul([n, du])
+        if function == 'log':
+            return self.mul([du, self.pow(u, minus_one)])
+        if function == 'log10':
+            return self.mul([du, self.pow(u, minus_one), self.num(1.0/math.log(10.0))])
+        if function == 'sqrt':
+            return self.mul([self.num(0.5), du, self.pow(n, minus_one)])
+        if function == 'abs':
+            return self.select(self.zero, u, du, self.mul([minus_one, du]))
+        if function == 'sin':
+            return self.mul([self.call('cos', [u]), du])
+        if function == 'cos':
+            return self.mul([minus_one, self.call('sin', [u]), du])
+        if function == 'tan':
+            return self.mul([self.add([self.one, self.pow(n, self.num(2.0))]), du])
+        if function == 'tanh':
+            return self.mul([self.add([self.one,
+                self.mul([minus_one, self.pow(n, self.num(2.0))])]), du])
+        if function == 'min':
+            return self.select(args[0], args[1], dargs[0], dargs[1])
+        if function == 'max':
+            return self.select(args[1], args[0], dargs[0], dargs[1])
+        raise ValueError('no derivative of %s' % function)
+
+class _GraphParser(factools._CParser):
+    '''parses a maple formula into nodes of graph, with the same grammar
+    as the C translation of factools.py. names maps the names of the
+    formula to their nodes.
+    '''
+    def __init__(self, formula, names, graph):
+        factools._CParser.__init__(self, formula, names)
+        self.graph = graph
+
+    def sum(self):
+        terms = [self.product()]
+        while self.peek() in ('+', '-'):
+            sign = self.take()
+            term = self.product()
+            if sign == '-':
+                term = self.graph.mul([self.graph.num(-1.0), term])
+            terms.append(term)
+        return terms[0] if len(terms) == 1 else self.graph.add(terms)
+
+    def product(self):
+        factors = [self.unary()]
+        while self.peek() in ('*', '/'):
+            op = self.take()
+            factor = self.unary()
+            if op == '/':
+                factor = self.graph.pow(factor, self.graph.num(-1.0))
+            factors.append(factor)
+        return factors[0] if len(factors) == 1 else self.graph.mul(factors)
+
+    def unary(self):
+        if self.peek() in ('+', '-'):
+            sign = self.take()
+            operand = self.unary()
+            if sign == '-':
+                return self.graph.mul([self.graph.num(-1.0), operand])
+            return operand
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() in ('^', '**'):
+            self.take()
+            return self.graph.pow(base, self.unary())
+        return base
+
+    def atom(self):
+        token = self.take()
+        if token == '(':
+            node = self.sum()
+            self.take(')')
+            return node
+        if factools._is_number(token):
+            return self.graph.num(float(token))
+        if self.peek() == '(':
+            if token not in factools.C_FUNCTIONS:
+                raise ValueError('unknown function %s in %s' % (token, self.formula))
+            self.take('(')
+            args = [self.sum()]
+            while self.peek() == ',':
+                self.take()
+                args.append(self.sum())
+            self.take(')')
+            return self.graph.call(token, args)
+        if token in self.names:
+            return self.names[token]
+        if token in factools.C_CONSTANTS:
+            return self.graph.num(math.pi)
+        raise ValueError('unknown symbol %s in %s' % (token, self.formula))
+
+def LoadVf(vffile):
+    '''the model of a vf file: its parameters, expressions (the dependent
+    species of factools.py included) and state variables in vf order.
+    '''
+    root = ElementTree.parse(vffile).getroot()
+    model = modelir.Model(root.get('Name'))
+    for e in root.findall('Parameter'):
+        model.parameters.append(modelir.Parameter(e.get('Name'), e.get('DefaultValue')))
+    for e in root.findall('Expression'):
+        model.expressions.append(modelir.Expression(e.get('Name'), e.get('Formula')))
+    for e in root.findall('StateVariable'):
+        model.species.append(modelir.Species(e.get('Name'),
+            e.get('DefaultInitialCondition'), e.get('Formula')))
+    return model
+
+def BuildGraph(model):
+    '''(graph, rhs, jacobian) of model: the node of every ode with the
+    expressions inlined, and the nonzero entries of the jacobian as
+    [(row, column, node)] in row order.
+    '''
+    graph = Graph([ s.name for s in model.species ])
+    names = {'t': graph.sym('t')}
+    for a in model.parameters + model.species:
+        names[a.name] = graph.sym(a.name)
+    for e in factools.SortedExpressions(model):
+        names[e.name] = _GraphParser(e.formula, names, graph).parse()
+    rhs = []
+    for s in model.species:
+        if s.ode and s.ode.strip() not in ('', 'None'):
+            rhs.append(_GraphParser(s.ode, names, graph).parse())
+        else:
+            rhs.append(graph.zero)
+    memos = {}
+    jacobian = []
+    for i, f in enumerate(rhs):
+        deps = graph.deps[f]
+        while deps:
+            bit = deps & -deps
+            deps ^= bit
+            d = graph.diff(f, bit, memos.setdefault(bit, {}))
+            if d != graph.zero:
+                jacobian.append((i, bit.bit_length() - 1, d))
+    return graph, rhs, jacobian
+
+# C precedence of the text of a node
+_SUM, _PRODUCT, _ATOM = 1, 2, 3
+
+def _c_number(value):
+    if value != value:
+        return '(0.0/0.0)', _ATOM
+    if value in (float('inf'), float('-inf')):
+        return value > 0 and 'HUGE_VAL' or '(-HUGE_VAL)', _ATOM
+    text = repr(value)
+    if '.' not in text and 'e' not in text:
+        text += '.0'
+    return text, value < 0 and _SUM or _ATOM
+
+class _CWriter(object):
+    '''the C code of a set of root nodes of a graph: temporaries for the
+    nodes used more than once, then the text of every root.
+    '''
+    def __init__(self, graph, names, roots):
+        self.graph = graph
+        self.names = names
+        refs = {}
+        stack = []
+        for r in roots:
+            if r not in refs:
+                stack.append(r)
+            refs[r] = refs.get(r, 0) + 1
+        while stack:
+            n = stack.pop()
+            kind, payload, args = graph.nodes[n]
+            for a in args:
+                if a not in refs:
+                    stack.append(a)
+                refs[a] = refs.get(a, 0) + 1
+            # x^2 and x^3 are written as products of x
+            if kind == POW and graph.value(args[1]) in (2.0, 3.0, -2.0, -3.0):
+                refs[args[0]] += 1
+        self.used = set([ graph.nodes[n][1] for n in refs if graph.nodes[n][0] == SYM ])
+        self.temps = {}
+        self.lines = []
+        for n in sorted(refs):
+            if refs[n] > 1 and not self.cheap(n):
+                text = self.text(n)[0]
+                self.temps[n] = 'x_%d' % len(self.temps)
+                self.lines.append('    const realtype %s = %s;\n' % (self.temps[n], text))
+
+    def cheap(self, n):
+        '''a number, a name or a multiple of a name, which is not worth a
+        temporary.
+        '''
+        kind, payload, args = self.graph.nodes[n]
+        if kind == MUL and len(args) == 2:
+            return self.cheap(args[0]) and self.cheap(args[1])
+        return kind in (NUM, SYM)
+
+    def operand(self, n, precedence):
+        text, p = self.text(n)
+        return text if p >= precedence else '(%s)' % text
+
+    def product(self, coefficient, factors):
+        '''the text of coefficient*factors, with the negative powers as a
+        denominator. coefficient is positive.
+        '''
+        numerator, denominator = [], []
+        for f in factors:
+            kind, payload, args = self.graph.nodes[f]
+            e = None
+            if kind == POW and f not in self.temps:
+                e = self.graph.value(args[1])
+            if e is not None and e < 0:
+                if e != -1.0:
+                    f = self.graph.pow(args[0], self.graph.num(-e))
+                else:
+                    f = args[0]
+                denominator.append(self.text(f))
+            else:
+                numerator.append(self.operand(f, _PRODUCT))
+        if coefficient != 1.0 or not numerator:
+            numerator.insert(0, _c_number(coefficient)[0])
+        text = '*'.join(numerator)
+        if len(denominator) == 1:
+            t, p = denominator[0]
+            text += p == _ATOM and '/' + t or '/(%s)' % t
+        elif denominator:
+            text += '/(%s)' % '*'.join([ p >= _PRODUCT and t or '(%s)' % t
+                for t, p in denominator ])
+        return text
+
+    def term(self, n):
+        '''(sign, text) of a term of a sum. '''
+        if n in self.temps:
+            return 1, self.temps[n]
+        kind, payload, args = self.graph.nodes[n]
+        if kind == NUM:
+            return payload < 0 and -1 or 1, _c_number(abs(payload))[0]
+        c, rest = self.graph.split(n)
+        if c == 1.0:
+            return 1, self.operand(n, _SUM)
+        factors = [rest]
+        if rest not in self.temps and self.graph.nodes[rest][0] == MUL:
+            factors = self.graph.nodes[rest][2]
+        return c < 0 and -1 or 1, self.product(abs(c), factors)
+
+    def text(self, n):
+        '''(C text, precedence) of node n. '''
+        if n in self.temps:
+            return self.temps[n], _ATOM
+        kind, payload, args = self.graph.nodes[n]
+        if kind == NUM:
+            return _c_number(payload)
+        if kind == SYM:
+            return self.names[payload], _ATOM
+        if kind == ADD:
+            out = []
+            for a in args:
+                sign, text = self.term(a)
+                if not out:
+                    out.append(sign < 0 and '-' + text or text)
+                else:
+                    out.append('%s %s' % (sign < 0 and '-' or '+', text))
+            return ' '.join(out), _SUM
+        if kind == MUL:
+            c, rest = self.graph.split(n)
+            factors = args
+            if c != 1.0:
+                factors = [rest]
+                if self.graph.nodes[rest][0] == MUL:
+                    factors = self.graph.nodes[rest][2]
+            if c < 0:
+                return '-' + self.product(-c, factors), _SUM
+            return self.product(c, factors), _PRODUCT
+        if kind == POW:
+            base, exponent = args
+            e = self.graph.value(exponent)
+            if e == 0.5:
+                return 'sqrt(%s)' % self.text(base)[0], _ATOM
+            if e in (2.0, 3.0):
+                return '*'.join([self.operand(base, _ATOM)]*int(e)), _PRODUCT
+            if e is not None and e < 0:
+                return self.product(1.0, [n]), _PRODUCT
+            return 'pow(%s, %s)' % (self.text(base)[0], self.text(exponent)[0]), _ATOM
+        if kind == CALL:
+            return '%s(%s)' % (factools.C_FUNCTIONS[payload],
+                    ', '.join([ self.text(a)[0] for a in args ])), _ATOM
+        a, b, x, y = [ self.text(a)[0] for a in args ]
+        return '(%s <= %s ? %s : %s)' % (a, b, x, y), _ATOM
+
+# identifiers of C and of the generated functions, which the names of a
+# model can not take
+_reserved = set('''auto break case char const continue default do double else
+    enum extern float for goto if inline int long register restrict return
+    short signed sizeof static struct switch typedef union unsigned void
+    volatile while realtype HUGE_VAL M_PI t f p_ y_ f_ fy_ params jac_ N_
+    mupper_ mlower_ tmp1 tmp2 tmp3'''.split()) | set(factools.C_FUNCTIONS.values())
+
+def _c_names(model):
+    '''{name: C identifier} of the parameters and states of model: the
+    name itself, with '_' appended where it would clash.
+    '''
+    names = {'t': 't'}
+    taken = set(_reserved)
+    for a in model.parameters + model.species:
+        c = a.name
+        while c in taken or re.match(r'^x_\d+$', c):
+            c += '_'
+        taken.add(c)
+        names[a.name] = c
+    return names
+
+def _locals(writer, model, names):
+    '''the parameters and states a function uses, as locals. '''
+    lines = []
+    for i, p in enumerate(model.parameters):
+        if p.name in writer.used:
+            lines.append('    const realtype %s = p_[%d];\n' % (names[p.name], i))
+    for i, s in enumerate(model.species):
+        if s.name in writer.used:
+            lines.append('    const realtype %s = NV_Ith_S(y_, %d);\n' % (names[s.name], i))
+    if lines and any([ p.name in writer.used for p in model.parameters ]):
+        lines.insert(0, '    const realtype *p_ = (const realtype *) params;\n')
+    return lines
+
+def EmitCv(model):
+    '''(MODEL_cv.c, MODEL_cv.h) of a model read by LoadVf. '''
+    graph, rhs, jacobian = BuildGraph(model)
+    names = _c_names(model)
+    name = model.name
+    mupper = max([ j - i for i, j, d in jacobian ] + [0])
+    mlower = max([ i - j for i, j, d in jacobian ] + [0])
+
+    h = []
+    w = h.append
+    w('/* %s_cv.h: written by cvgen.py from %s.vf */\n' % (name, name))
+    w('#ifndef %s_CV_H\n' % name.upper())
+    w('#define %s_CV_H\n' % name.upper())
+    w('#include <math.h>\n')
+    w('#include <sundials/sundials_types.h>\n')
+    w('#include <nvector/nvector_serial.h>\n')
+    w('#include <cvode/cvode_dense.h>\n')
+    w('#include <cvode/cvode_band.h>\n')
+    w('/* the engines pass %s_bjac to CVBandSetJacFn */\n' % name)
+    w('#define __ANALYTIC_BAND_JAC__\n')
+    w('int %s_vf(realtype t, N_Vector y_, N_Vector f_, void *params);\n' % name)
+    w('int %s_jac(long N_, DenseMat jac_, realtype t, N_Vector y_, N_Vector fy_, '
+            'void *params, N_Vector tmp1, N_Vector tmp2, N_Vector tmp3);\n' % name)
+    w('int %s_bjac(long N_, long mupper_, long mlower_, BandMat jac_, realtype t, '
+            'N_Vector y_, N_Vector fy_, void *params, N_Vector tmp1, N_Vector tmp2, '
+            'N_Vector tmp3);\n' % name)
+    w('#endif\n')
+
+    c = []
+    w = c.append
+    w('/* %s_cv.c: the right hand side and jacobian of %s, written by cvgen.py\n' % (name, name))
+    w(' * from %s.vf. %d states, %d parameters, %d nonzero jacobian entries. */\n' % (
+        name, len(model.species), len(model.parameters), len(jacobian)))
+    w('#include "%s_cv.h"\n' % name)
+    w('\n')
+    writer = _CWriter(graph, names, rhs)
+    w('int %s_vf(realtype t, N_Vector y_, N_Vector f_, void *params)\n' % name)
+    w('{\n')
+    c.extend(_locals(writer, model, names))
+    w('    realtype *f = NV_DATA_S(f_);\n')
+    c.extend(writer.lines)
+    for i, f in enumerate(rhs):
+        w('    f[%d] = %s;\n' % (i, writer.text(f)[0]))
+    w('    return 0;\n')
+    w('}\n')
+
+    # cvode zeroes the matrix before it calls the jacobian. the entries are
+    # written column by column, the storage order of both matrices.
+    jacobian.sort(key=lambda entry: (entry[1], entry[0]))
+    writer = _CWriter(graph, names, [ d for i, j, d in jacobian ])
+    body = _locals(writer, model, names) + writer.lines
+    entries = [ (i, j, writer.text(d)[0]) for i, j, d in jacobian ]
+    w('\n')
+    w('int %s_jac(long N_, DenseMat jac_, realtype t, N_Vector y_, N_Vector fy_, '
+            'void *params, N_Vector tmp1, N_Vector tmp2, N_Vector tmp3)\n' % name)
+    w('{\n')
+    c.extend(body)
+    for i, j, text in entries:
+        w('    DENSE_ELEM(jac_, %d, %d) = %s;\n' % (i, j, text))
+    w('    return 0;\n')
+    w('}\n')
+    w('\n')
+    w('int %s_bjac(long N_, long mupper_, long mlower_, BandMat jac_, realtype t, '
+            'N_Vector y_, N_Vector fy_, void *params, N_Vector tmp1, N_Vector tmp2, '
+            'N_Vector tmp3)\n' % name)
+    w('{\n')
+    c.extend(body)
+    w('    if (mupper_ < %d || mlower_ < %d)\n' % (mupper, mlower))
+    w('        return -1;\n')
+    for i, j, text in entries:
+        w('    BAND_ELEM(jac_, %d, %d) = %s;\n' % (i, j, text))
+    w('    return 0;\n')
+    w('}\n')
+    return ''.join(c), ''.join(h)
+
+def WriteCv(vffile, outdir='.'):
+    '''writes MODEL_cv.c and MODEL_cv.h of vffile into outdir. returns
+    their paths.
+    '''
+    model = LoadVf(vffile)
+    source, header = EmitCv(model)
+    paths = []
+    for suffix, text in (('_cv.c', source), ('_cv.h', header)):
+        path = os.path.join(outdir, model.name + suffix)
+        factools.WriteAtomic(path, text)
+        paths.append(path)
+    return paths
+
+# the vfgen command that cvgen.py replaces, for the benchmark
+VFGEN = 'vfgen cvode:version=2.5.0'
+# the dense jacobian of the benchmark is allocated for at most this many states
+BENCHMARK_MAX_DENSE = 2000
+
+_harness = r'''#include <stdio.h>
+#include <stdlib.h>
+#include <sys/time.h>
+#include <sundials/sundials_types.h>
+#include <sundials/sundials_dense.h>
+#include <nvector/nvector_serial.h>
+#include <cvode/cvode.h>
+#include <cvode/cvode_dense.h>
+#include "%(model)s_cv.c"
+
+const realtype y0_[%(n)d] = { %(y)s };
+realtype p0_[%(np)d] = { %(p)s };
+
+static double now(void)
+{
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + 1e-6*tv.tv_usec;
+}
+
+int main(int argc, char **argv)
+{
+    const long n = %(n)d;
+    const double seconds = atof(argv[1]);
+    N_Vector y = N_VNew_Serial(n), f = N_VNew_Serial(n);
+    DenseMat jac = NULL;
+    double t0, elapsed, check = 0.0;
+    long i, j, calls;
+
+    for (i = 0; i < n; ++i)
+        NV_Ith_S(y, i) = y0_[i];
+    %(model)s_vf(0.0, y, f, p0_);
+    for (i = 0; i < n; ++i)
+        printf("f %%ld %%.17g\n", i, NV_Ith_S(f, i));
+    if (n <= %(max_dense)d) {
+        jac = DenseAllocMat(n, n);
+        for (j = 0; j < n; ++j)
+            for (i = 0; i < n; ++i)
+                DENSE_ELEM(jac, i, j) = 0.0;
+        %(model)s_jac(n, jac, 0.0, y, f, p0_, NULL, NULL, NULL);
+        for (j = 0; j < n; ++j)
+            for (i = 0; i < n; ++i)
+                if (DENSE_ELEM(jac, i, j) != 0.0)
+                    printf("J %%ld %%ld %%.17g\n", i, j, DENSE_ELEM(jac, i, j));
+    }
+
+    calls = 0;
+    t0 = now();
+    do {
+        for (i = 0; i < 100; ++i) {
+            %(model)s_vf(0.0, y, f, p0_);
+            check += NV_Ith_S(f, i %% n);
+        }
+        calls += 100;
+        elapsed = now() - t0;
+    } while (elapsed < seconds);
+    printf("vf %%g\n", calls/elapsed);
+    if (jac != NULL) {
+        calls = 0;
+        t0 = now();
+        do {
+            for (i = 0; i < 10; ++i) {
+                %(model)s_jac(n, jac, 0.0, y, f, p0_, NULL, NULL, NULL);
+                check += DENSE_ELEM(jac, i %% n, i %% n);
+            }
+            calls += 10;
+            elapsed = now() - t0;
+        } while (elapsed < seconds);
+        printf("jac %%g\n", calls/elapsed);
+    }
+    printf("check %%g\n", check);
+    return 0;
+}
+'''
+
+def _harness_values(model):
+    '''a state away from the initial values, where few rhs and jacobian
+    terms vanish, and the default parameters.
+    '''
+    y = []
+    for i, s in enumerate(model.species):
+        try:
+            value = float(s.initial)
+        except (TypeError, ValueError):
+            value = 0.0
+        y.append(value + 0.1*(1 + i % 7)*(abs(value) + 1e-2))
+    p = []
+    for a in model.parameters:
+        try:
+            p.append(float(a.value))
+        except (TypeError, ValueError):
+            p.append(1.0)
+    return y, p
+
+def _run_harness(model, cvdir, flags, seconds):
+    '''compiles the harness against the cv files in cvdir and returns
+    ({'vf': evals/sec, 'jac': evals/sec}, f values, {(i, j): jacobian value}).
+    '''
+    y, p = _harness_values(model)
+    source = os.path.join(cvdir, 'cvbench.c')
+    f = open(source, 'w')
+    f.write(_harness % {'model': model.name, 'n': len(y), 'np': max(len(p), 1),
+        'y': ', '.join([ repr(v) for v in y ]), 'p': ', '.join([ repr(v) for v in p ] or ['0.0']),
+        'max_dense': BENCHMARK_MAX_DENSE})
+    f.close()
+    exe = os.path.join(cvdir, 'cvbench')
+    command = 'gcc -O2 -I%s %s -o %s %s' % (cvdir, source, exe, flags)
+    if subprocess.call(command, shell=True) != 0:
+        raise RuntimeError('benchmark build failed: %s' % command)
+    p = subprocess.Popen([exe, str(seconds)], stdout=subprocess.PIPE)
+    out = p.communicate()[0]
+    if p.returncode != 0:
+        raise RuntimeError('%s failed' % exe)
+    rates, values, jacobian = {}, {}, {}
+    for line in out.splitlines():
+        words = line.split()
+        if words[0] == 'f':
+            values[int(words[1])] = float(words[2])
+        elif words[0] == 'J':
+            jacobian[int(words[1]), int(words[2])] = float(words[3])
+        elif words[0] in ('vf', 'jac'):
+            rates[words[0]] = float(words[1])
+    return rates, values, jacobian
+
+def _flags(flags):
+    '''flags, by default the sundials paths and libraries of buildtool.py. '''
+    if flags is None:
+        import buildtool
+        flags = '%s %s %s' % (' '.join(buildtool.CompilerPaths()), buildtool.LIBS, '-lm')
+    return flags
+
+def Evaluate(vffile, workdir, flags=None, seconds=1.0):
+    '''writes the cv files of vffile into workdir and times them in the
+    benchmark harness. returns ({'vf': evals/sec, 'jac': evals/sec}, f
+    values, {(i, j): jacobian value}) at the state of the harness.
+    '''
+    WriteCv(vffile, workdir)
+    return _run_harness(LoadVf(vffile), workdir, _flags(flags), seconds)
+
+def _difference(a, b):
+    '''the largest difference of two {key: value}, relative to the largest value. '''
+    scale = max([ abs(v) for v in a.values() + b.values() ] + [1e-300])
+    keys = set(a) | set(b)
+    return max([ abs(a.get(k, 0.0) - b.get(k, 0.0)) for k in keys ] + [0.0])/scale
+
+def Benchmark(vffile, reference=None, flags=None, seconds=1.0):
+    '''compares the cv files of cvgen.py with the ones of vfgen (from the
+    reference directory, or from VFGEN run on vffile): prints the
+    evaluations/sec of MODEL_vf and MODEL_jac, the size of both sources and
+    the largest relative difference of their values at one state.
+    '''
+    flags = _flags(flags)
+    model = LoadVf(vffile)
+    scratch = tempfile.mkdtemp(prefix='cvgen-')
+    try:
+        mine = os.path.join(scratch, 'cvgen')
+        os.makedirs(mine)
+        t0 = time.time()
+        WriteCv(vffile, mine)
+        generate = time.time() - t0
+        if reference is None:
+            reference = os.path.join(scratch, 'vfgen')
+            os.makedirs(reference)
+            shutil.copy(vffile, reference)
+            command = '%s %s' % (VFGEN, os.path.basename(vffile))
+            t0 = time.time()
+            if subprocess.call(command, shell=True, cwd=reference) != 0:
+                raise RuntimeError('%s failed' % command)
+            print '%-10s %12.3f s' % ('vfgen', time.time() - t0)
+        else:
+            reference = os.path.abspath(reference)
+        print '%-10s %12.3f s' % ('cvgen', generate)
+        results = {}
+        for label, cvdir in (('vfgen', reference), ('cvgen', mine)):
+            workdir = os.path.join(scratch, 'run_' + label)
+            os.makedirs(workdir)
+            for suffix in ('_cv.c', '_cv.h'):
+                shutil.copy(os.path.join(cvdir, model.name + suffix), workdir)
+            results[label] = _run_harness(model, workdir, flags, seconds)
+            size = os.path.getsize(os.path.join(workdir, model.name + '_cv.c'))
+            rates = results[label][0]
+            print '%-10s %10d bytes %12.4g vf/s %12s jac/s %8d nonzeros' % (label, size,
+                    rates['vf'], '%.4g' % rates['jac'] if 'jac' in rates else '-',
+                    len(results[label][2]))
+        old, new = results['vfgen'], results['cvgen']
+        for key in ('vf', 'jac'):
+            if key in old[0] and key in new[0]:
+                print '%-10s %12.2fx' % ('speedup/' + key, new[0][key]/old[0][key])
+        print '%-10s %12.3g' % ('diff/vf', _difference(old[1], new[1]))
+        if old[2] or new[2]:
+            print '%-10s %12.3g' % ('diff/jac', _difference(old[2], new[2]))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def usage():
+    print 'usage: cvgen.py [options] MODEL.vf'
+    print 'writes MODEL_cv.c and MODEL_cv.h, like %s MODEL.vf.' % VFGEN
+    print '-d out_dir       : directory of the cv files (default .).'
+    print '-b               : benchmark the evaluations/sec of MODEL_vf and MODEL_jac'
+    print '                   against the vfgen output.'
+    print '-R vfgen_dir     : the vfgen output to compare with (default: run vfgen).'
+    print '-D flags         : compiler and linker flags of the benchmark (default the'
+    print '                   sundials paths and libraries of buildtool.py).'
+
+def main(argv):
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv, "hd:bR:D:",
+                ["help", "outdir", "benchmark", "reference", "flags"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    outdir, benchmark, reference, flags = '.', False, None, None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-d', '--outdir'):
+            outdir = arg
+        elif opt in ('-b', '--benchmark'):
+            benchmark = True
+        elif opt in ('-R', '--reference'):
+            reference = arg
+        elif opt in ('-D', '--flags'):
+            flags = arg
+    if len(args) != 1:
+        usage()
+        sys.exit(2)
+    if benchmark:
+        Benchmark(args[0], reference, flags)
+        return
+    try:
+        WriteCv(args[0], outdir)
+    except ValueError, e:
+        sys.stderr.write('cvgen.py: %s\n' % e)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,580 @@
+#!/usr/bin/python
+'''engined.py keeps compiled model libraries loaded in one long lived local
+process and runs batches for clients on the same machine, so that a batch
+pays neither the load of the library nor the start of the OpenMP team.
+
+Clients connect to a Unix domain socket (mode 0600, no network). Arrays are
+not sent over it: a client keeps one shared memory file (in /dev/shm) that
+holds tvec, ivalues and rates of a batch and receives y, yss and flag, and
+the socket only carries one json line per request and reply with the
+offsets of the arrays in that file. The daemon maps the file and the engine
+reads and writes it in place.
+
+Every library has a worker thread that makes the engine calls of its model
+one at a time. The batches that arrive while the engine is busy (or within
+the coalescing window) are merged into one engine call when they have the
+same tvec and zeta, so many clients with tens of samples each keep the
+engine threads busy with large calls. The latency of every request (time
+in the queue, in the engine and in total) is kept for the percentiles of
+stats().
+
+usage:
+    engined.py [options] socket_path model.so [model.so ...]
+
+    client = engined.Client(socket_path)
+    y, yss, flag = client.run('g4n', tvec, ivalues, rates)
+
+The engine would seed the noise of langevin, SDE and SSA libraries from
+the clock, which changes once a second, so the daemon seeds every engine
+call itself: with a random 64 bit seed, or with FASTFACILE_SEED and the
+noise streams that follow the samples of the calls before, so that every
+sample of every batch draws independent noise. Which streams a batch gets
+depends on how it was merged, so a batch is not reproducible on its own.
+'''
+import os, sys, time, json, mmap, socket, struct, tempfile, threading, collections
+import Queue, SocketServer
+import numpy as np
+import pyengine
+
+# seconds a batch waits for others to merge with when the engine is idle
+DEFAULT_WINDOW = 0.0
+# largest number of samples of a merged engine call
+DEFAULT_MAX_SAMPLES = 100000
+# requests per model kept for the latency percentiles
+LATENCY_HISTORY = 100000
+PERCENTILES = [50, 90, 99, 99.9]
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+SHM_PREFIX = 'fastfacile-'
+
+class SharedBuffer(object):
+    '''a file of SHM_DIR mapped into memory. a client creates it (path
+    None), the daemon opens it by path. '''
+    def __init__(self, size, path=None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix=SHM_PREFIX, dir=SHM_DIR)
+            os.ftruncate(fd, size)
+            self.owner = True
+        else:
+            if os.path.dirname(os.path.realpath(path)) != os.path.realpath(SHM_DIR) \
+                    or not os.path.basename(path).startswith(SHM_PREFIX):
+                raise ValueError('%s is not a shared buffer' % path)
+            fd = os.open(path, os.O_RDWR)
+            size = os.fstat(fd).st_size
+            self.owner = False
+        self.path = path
+        self.size = size
+        try:
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def array(self, offset, shape):
+        '''the float64 array of shape at byte offset of the buffer. '''
+        return np.ndarray(shape, dtype=np.float64, buffer=self.map, offset=offset)
+
+    def close(self):
+        self.map.close()
+        if self.owner:
+            os.unlink(self.path)
+
+class Job(object):
+    '''a batch of one request: the input and output arrays (views of the
+    shared buffer of the client) and its timings. '''
+    def __init__(self, tvec, ivalues, rates, zeta, out):
+        self.tvec, self.ivalues, self.rates, self.zeta = tvec, ivalues, rates, zeta
+        self.out = out
+        self.key = (tvec.tostring(), zeta)
+        self.arrival = time.time()
+        self.start = self.finish = None
+        self.batch = 0
+        self.error = None
+        self.done = threading.Event()
+
+class ModelWorker(threading.Thread):
+    '''the engine of one library and the thread that runs its batches. '''
+    def __init__(self, libfile, window=DEFAULT_WINDOW, max_samples=DEFAULT_MAX_SAMPLES):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.eng = pyengine.Engine(libfile)
+        self.name = os.path.splitext(os.path.basename(libfile))[0]
+        self.window = window
+        self.max_samples = max_samples
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.calls = self.requests = self.samples = 0
+        self.latency = collections.deque(maxlen=LATENCY_HISTORY)
+        self.noise = self.eng.langevin and self.eng.seedable
+        self.next_sample = 0
+
+    def info(self):
+        eng = self.eng
+        return {'name': self.name, 'libfile': eng.libfile, 'variant': eng.variant,
+                'species': eng.species, 'parameters': eng.parameters,
+                'default_ivalues': list(eng.default_ivalues),
+                'default_rates': list(eng.default_rates)}
+
+    def output(self, num_timepoints):
+        '''(timepoints, species columns) of y for num_timepoints points, or
+        (0, []) for engines without trajectories. '''
+        if self.eng.steady:
+            return 0, []
+        num_times, stride, columns = self.eng._output(num_timepoints)
+        return num_times, columns
+
+    def submit(self, job):
+        self.queue.put(job)
+        job.done.wait()
+
+    def _take(self):
+        '''the jobs queued now, or within the window after the first one. '''
+        jobs = [self.queue.get()]
+        samples = jobs[0].ivalues.shape[0]
+        deadline = jobs[0].arrival + self.window
+        while samples < self.max_samples:
+            try:
+                timeout = deadline - time.time()
+                job = self.queue.get(timeout > 0, max(timeout, 0.0))
+            except Queue.Empty:
+                break
+            jobs.append(job)
+            samples += job.ivalues.shape[0]
+        return jobs
+
+    def run(self):
+        while True:
+            jobs = self._take()
+            groups = collections.OrderedDict()
+            for job in jobs:
+                groups.setdefault(job.key, []).append(job)
+            for group in groups.values():
+                while group:
+                    # merged calls stay below max_samples
+                    count, samples = 0, 0
+                    while count < len(group) and (count == 0 or samples +
+                            group[count].ivalues.shape[0] <= self.max_samples):
+                        samples += group[count].ivalues.shape[0]
+                        count += 1
+                    self._call(group[:count])
+                    group = group[count:]
+
+    def _seed(self, num_samples):
+        '''seeds the noise of the next engine call of num_samples samples
+        (see the module docstring). '''
+        value = os.environ.get('FASTFACILE_SEED', '')
+        if value:
+            self.eng.set_seed(int(value, 0), self.next_sample)
+            self.next_sample += num_samples
+        else:
+            self.eng.set_seed(struct.unpack('<Q', os.urandom(8))[0])
+
+    def _call(self, jobs):
+        '''one engine call for jobs; a single job is run in place in its
+        shared buffer, merged ones are copied in and out. '''
+        start = time.time()
+        first = jobs[0]
+        samples = sum([ job.ivalues.shape[0] for job in jobs ])
+        try:
+            if self.noise:
+                self._seed(samples)
+            if len(jobs) == 1:
+                self.eng.run(first.tvec, first.ivalues, first.rates, first.zeta,
+                        out=first.out)
+            else:
+                ivalues = np.concatenate([ job.ivalues for job in jobs ])
+                rates = np.concatenate([ job.rates for job in jobs ])
+                y, yss, flag = self.eng.run(first.tvec, ivalues, rates, first.zeta)
+                k = 0
+                for job in jobs:
+                    n = job.ivalues.shape[0]
+                    if y is not None:
+                        job.out[0][...] = y[k:k+n]
+                    job.out[1][...] = yss[k:k+n]
+                    job.out[2][...] = flag[k:k+n]
+                    k += n
+        except Exception, e:
+            for job in jobs:
+                job.error = str(e)
+        finish = time.time()
+        with self.lock:
+            self.calls += 1
+            self.requests += len(jobs)
+            self.samples += samples
+            for job in jobs:
+                self.latency.append((start - job.arrival, finish - start,
+                    finish - job.arrival))
+        for job in jobs:
+            job.start, job.finish, job.batch = start, finish, samples
+            job.done.set()
+
+    def stats(self, reset=False):
+        '''requests, engine calls, samples and the percentiles of the
+        queue, engine and total time of the requests since the last reset
+        (in seconds). '''
+        with self.lock:
+            latency = np.array(self.latency).reshape(-1, 3)
+            result = {'requests': self.requests, 'calls': self.calls,
+                    'samples': self.samples}
+            if reset:
+                self.latency.clear()
+                self.calls = self.requests = self.samples = 0
+        for i, name in enumerate(['queue', 'engine', 'total']):
+            result[name] = dict([ (str(p), float(np.percentile(latency[:, i], p))
+                if len(latency) else 0.0) for p in PERCENTILES ])
+        return result
+
+class Handler(SocketServer.StreamRequestHandler):
+    '''the requests of one client connection, one json line each. '''
+    def handle(self):
+        self.buffer = None
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                try:
+                    reply = self.dispatch(json.loads(line))
+                except Exception, e:
+                    reply = {'error': str(e)}
+                self.wfile.write(json.dumps(reply) + '\n')
+                self.wfile.flush()
+        finally:
+            if self.buffer is not None:
+                self.buffer.close()
+
+    def model(self, request):
+        models = self.server.models
+        if request.get('model') not in models:
+            raise ValueError('unknown model %s (loaded: %s)' % (request.get('model'),
+                ', '.join(sorted(models))))
+        return models[request['model']]
+
+    def dispatch(self, request):
+        op = request.get('op')
+        if op == 'models':
+            return {'models': [ w.info() for w in self.server.models.values() ]}
+        elif op == 'output':
+            num_times, columns = self.model(request).output(int(request['num_timepoints']))
+            return {'num_times': num_times, 'columns': columns}
+        elif op == 'run':
+            return self.run(request)
+        elif op == 'stats':
+            return {'stats': dict([ (name, w.stats(request.get('reset', False)))
+                for name, w in self.server.models.items() ])}
+        elif op == 'shutdown':
+            threading.Thread(target=self.server.shutdown).start()
+            return {}
+        raise ValueError('unknown op %s' % op)
+
+    def run(self, request):
+        worker = self.model(request)
+        eng = worker.eng
+        if self.buffer is None or self.buffer.path != request['shm']:
+            # a client replaces its buffer when it grows
+            if self.buffer is not None:
+                self.buffer.close()
+            self.buffer = None
+            self.buffer = SharedBuffer(0, request['shm'])
+        num_samples = int(request['num_samples'])
+        num_timepoints = int(request['num_timepoints'])
+        num_times, columns = worker.output(num_timepoints)
+        buf = self.buffer
+        offsets = request['offsets']
+        job = Job(buf.array(offsets['tvec'], (num_timepoints,)),
+                buf.array(offsets['ivalues'], (num_samples, eng.num_species)),
+                buf.array(offsets['rates'], (num_samples, eng.num_parameters)),
+                float(request.get('zeta', pyengine.DEFAULT_ZETA)),
+                (buf.array(offsets['y'], (num_samples, num_times, len(columns)))
+                    if num_times else None,
+                    buf.array(offsets['yss'], (num_samples, eng.num_species)),
+                    buf.array(offsets['flag'], (num_samples,))))
+        worker.submit(job)
+        if job.error is not None:
+            raise RuntimeError(job.error)
+        return {'queue': job.start - job.arrival, 'engine': job.finish - job.start,
+                'batch': job.batch}
+
+class Server(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, libfiles, window=DEFAULT_WINDOW,
+            max_samples=DEFAULT_MAX_SAMPLES):
+        self.models = collections.OrderedDict()
+        for libfile in libfiles:
+            worker = ModelWorker(libfile, window, max_samples)
+            if worker.name in self.models:
+                raise ValueError('two libraries named %s' % worker.name)
+            self.models[worker.name] = worker
+        if os.path.exists(path):
+            # a socket left behind by a daemon that is gone
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise RuntimeError('a daemon is already listening on %s' % path)
+            except socket.error:
+                os.unlink(path)
+            finally:
+                probe.close()
+        old = os.umask(0177)
+        try:
+            SocketServer.ThreadingUnixStreamServer.__init__(self, path, Handler)
+        finally:
+            os.umask(old)
+        self.path = path
+        for worker in self.models.values():
+            worker.start()
+
+    def server_close(self):
+        SocketServer.ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class Client(object):
+    '''a connection to a daemon. run() writes the inputs into the shared
+    buffer of the connection, which grows as needed, and returns the
+    outputs as copies (or, with copy False, as views of the buffer that
+    the next run() overwrites). '''
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+        self.buffer = None
+        self.models = dict([ (m['name'], m) for m in self.request({'op': 'models'})['models'] ])
+        self._outputs = {}
+
+    def request(self, message):
+        self.sock.sendall(json.dumps(message) + '\n')
+        line = self.rfile.readline()
+        if not line:
+            raise RuntimeError('the daemon closed the connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def output(self, model, num_timepoints):
+        '''(timepoints, species columns) of the trajectories of model over
+        num_timepoints points of tvec. '''
+        key = (model, num_timepoints)
+        if key not in self._outputs:
+            reply = self.request({'op': 'output', 'model': model,
+                'num_timepoints': num_timepoints})
+            self._outputs[key] = reply['num_times'], reply['columns']
+        return self._outputs[key]
+
+    def _reserve(self, size):
+        if self.buffer is None or self.buffer.size < size:
+            if self.buffer is not None:
+                self.buffer.close()
+            self.buffer = SharedBuffer(max(size, 2*(self.buffer.size
+                if self.buffer is not None else 0), mmap.PAGESIZE))
+
+    def run(self, model, tvec, ivalues, rates, zeta=pyengine.DEFAULT_ZETA,
+            copy=True):
+        '''(y, yss, flag) of a batch, as pyengine.Engine.run(); a single
+        row of ivalues or rates is repeated to the samples of the other.
+        '''
+        if model not in self.models:
+            raise ValueError('unknown model %s' % model)
+        info = self.models[model]
+        num_species, num_parameters = len(info['species']), len(info['parameters'])
+        tvec = np.asarray(tvec, dtype=np.float64)
+        ivalues = np.atleast_2d(np.asarray(ivalues, dtype=np.float64))
+        rates = np.atleast_2d(np.asarray(rates, dtype=np.float64))
+        if ivalues.shape[0] == 1 and rates.shape[0] > 1:
+            ivalues = np.repeat(ivalues, rates.shape[0], axis=0)
+        elif rates.shape[0] == 1 and ivalues.shape[0] > 1:
+            rates = np.repeat(rates, ivalues.shape[0], axis=0)
+        if tvec.ndim != 1 or tvec.size < 3:
+            raise ValueError('tvec should be a 1-d vector of at least 3 timepoints')
+        if ivalues.shape[1:] != (num_species,) or rates.shape[1:] != (num_parameters,) \
+                or ivalues.shape[0] != rates.shape[0]:
+            raise ValueError('ivalues and rates should be (samples, %d) and '
+                    '(samples, %d) arrays' % (num_species, num_parameters))
+        num_samples = ivalues.shape[0]
+        num_times, columns = self.output(model, tvec.size)
+
+        shapes = [('tvec', tvec.shape), ('ivalues', ivalues.shape),
+                ('rates', rates.shape), ('y', (num_samples, num_times, len(columns))),
+                ('yss', (num_samples, num_species)), ('flag', (num_samples,))]
+        offsets, size = {}, 0
+        for name, shape in shapes:
+            offsets[name] = size
+            size += 8*int(np.prod(shape))
+        self._reserve(size)
+        arrays = dict([ (name, self.buffer.array(offsets[name], shape))
+            for name, shape in shapes ])
+        arrays['tvec'][...] = tvec
+        arrays['ivalues'][...] = ivalues
+        arrays['rates'][...] = rates
+        self.last = self.request({'op': 'run', 'model': model,
+            'shm': self.buffer.path, 'num_samples': num_samples,
+            'num_timepoints': tvec.size, 'zeta': zeta, 'offsets': offsets})
+        result = (arrays['y'] if num_times else None, arrays['yss'], arrays['flag'])
+        if copy:
+            result = tuple([ a.copy() if a is not None else None for a in result ])
+        return result
+
+    def stats(self, reset=False):
+        '''stats() of every model of the daemon, by name. '''
+        return self.request({'op': 'stats', 'reset': reset})['stats']
+
+    def shutdown(self):
+        self.request({'op': 'shutdown'})
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def StatsReport(stats):
+    for name, s in sorted(stats.items()):
+        print '%s: %d requests, %d engine calls, %d samples (%.1f samples/call)' % (
+                name, s['requests'], s['calls'], s['samples'],
+                s['samples']/float(max(s['calls'], 1)))
+        print '  %-8s %s' % ('ms', ' '.join([ '%9s' % ('p%s' % p) for p in PERCENTILES ]))
+        for part in ['queue', 'engine', 'total']:
+            print '  %-8s %s' % (part, ' '.join([ '%9.3f' % (1e3*s[part][str(p)])
+                for p in PERCENTILES ]))
+
+def DaemonBenchmark(path, model, libfile, num_batches=1000, batch=20,
+        num_clients=8, num_tvec=20, t_final=10.0):
+    '''runs num_batches batches of batch samples of model (default ivalues,
+    random rates) in this process with pyengine, one engine() call per batch
+    as an optimisation loop would, and through the daemon from num_clients
+    client threads at once. prints the time and the latency percentiles of
+    both and returns the largest difference of yss. '''
+    tvec = np.linspace(0, t_final, num_tvec)
+    eng = pyengine.Engine(libfile)
+    rng = np.random.RandomState(0)
+    batches = [ rng.rand(batch, eng.num_parameters) for k in range(num_batches) ]
+
+    local, latency = [], []
+    t0 = time.time()
+    for rates in batches:
+        t1 = time.time()
+        local.append(eng.run(tvec, *eng.broadcast(eng.default_ivalues, rates))[1])
+        latency.append(time.time() - t1)
+    local_time = time.time() - t0
+
+    with Client(path) as client:
+        client.stats(reset=True)
+    remote = [None]*num_batches
+    def client_loop(first):
+        with Client(path) as client:
+            for k in range(first, num_batches, num_clients):
+                remote[k] = client.run(model, tvec, eng.default_ivalues, batches[k])[1]
+    threads = [ threading.Thread(target=client_loop, args=(i,))
+            for i in range(num_clients) ]
+    t0 = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    remote_time = time.time() - t0
+    with Client(path) as client:
+        stats = client.stats()
+
+    error = max([ np.abs(a - b).max() for a, b in zip(local, remote) ])
+    print '%d batches of %d samples of %s:' % (num_batches, batch, model)
+    print '  in process: %8.3fs, %.1f batches/sec, latency p50 %.3fms p99 %.3fms' % (
+            local_time, num_batches/local_time, 1e3*np.percentile(latency, 50),
+            1e3*np.percentile(latency, 99))
+    print '  daemon (%d clients): %8.3fs, %.1f batches/sec' % (num_clients,
+            remote_time, num_batches/remote_time)
+    StatsReport(dict([ (model, stats[model]) ]))
+    print '  largest difference of yss: %.3g' % error
+    return error
+
+def usage():
+    print 'usage: engined.py [options] socket_path [model.so ...]'
+    print 'with libraries, loads them and serves batches on socket_path until'
+    print 'stopped (model names are the library names without .so).'
+    print '-w window        : milliseconds a batch waits for others to merge with'
+    print '                   when the engine is idle (default 0).'
+    print '-m max_samples   : largest merged engine call (default %d).' % DEFAULT_MAX_SAMPLES
+    print '-j num_threads   : engine threads (0 = all processors).'
+    print '-S               : print the latency statistics of a running daemon.'
+    print '-Q               : stop a running daemon.'
+    print '-b model.so      : benchmark small batches of model.so, which the'
+    print '                   daemon has loaded, in process and through the daemon.'
+    print '-n batches       : batches of the benchmark (default 1000).'
+    print '-k samples       : samples per batch of the benchmark (default 20).'
+    print '-c clients       : client threads of the benchmark (default 8).'
+
+def main(argv):
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv, "hw:m:j:SQb:n:k:c:",
+                ["help", "window", "max_samples", "threads", "stats", "quit",
+                    "benchmark", "batches", "samples", "clients"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    window, max_samples, threads = DEFAULT_WINDOW, DEFAULT_MAX_SAMPLES, None
+    stats, quit, benchmark = False, False, None
+    num_batches, batch, num_clients = 1000, 20, 8
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-w', '--window'):
+            window = float(arg)*1e-3
+        elif opt in ('-m', '--max_samples'):
+            max_samples = int(arg)
+        elif opt in ('-j', '--threads'):
+            threads = int(arg)
+        elif opt in ('-S', '--stats'):
+            stats = True
+        elif opt in ('-Q', '--quit'):
+            quit = True
+        elif opt in ('-b', '--benchmark'):
+            benchmark = arg
+        elif opt in ('-n', '--batches'):
+            num_batches = int(arg)
+        elif opt in ('-k', '--samples'):
+            batch = int(arg)
+        elif opt in ('-c', '--clients'):
+            num_clients = int(arg)
+    if len(args) < 1:
+        usage()
+        sys.exit(2)
+    path = args[0]
+
+    if stats or quit or benchmark is not None:
+        if benchmark is not None:
+            model = os.path.splitext(os.path.basename(benchmark))[0]
+            DaemonBenchmark(path, model, benchmark, num_batches, batch, num_clients)
+        with Client(path) as client:
+            if stats:
+                StatsReport(client.stats())
+            if quit:
+                client.shutdown()
+        return
+    if len(args) < 2:
+        usage()
+        sys.exit(2)
+
+    server = Server(path, args[1:], window, max_samples)
+    if threads is not None:
+        for worker in server.models.values():
+            worker.eng.set_schedule(num_threads=threads)
+    print 'serving %s on %s' % (', '.join(server.models), path)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
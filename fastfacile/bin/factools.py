@@ -1,5 +1,7 @@
 #!/usr/bin/python
-import os, unittest, sys
+import os, re, unittest, sys, copy, math
+from fractions import Fraction, gcd
+import modelir
 
 template_ratesLabels = """% author: Je-Hoon Song
 function labels = ratesLabels(i)
@@ -17,212 +19,1172 @@ if nargin == 1
 end
 """
 
-def MapleToVfgen(inputfile) :
-    currentBlockType = '?' # EQN, INIT, MOIETY PROBE BIFURC_PARAM:
-    ivaluesDict = {}
-    constantDict = {} 
-    expressionDict = {}
-    speciesDict = {}
-    dependentSpeciesDict = {} 
-    ivaluesList = []
-    constantsList = []
-    for a_line in file(inputfile):
-        a_line = a_line.strip()
-        if a_line == '': continue
-        #if a_line[0] == '#': continue
-        if a_line.find(' #') > -1:
-            a_line = a_line[0:a_line.find(' #')]
-        if a_line == '# initial values' :
-            currentBlockType = 'iv'
-            continue
-        elif a_line == '# constants' :
-            currentBlockType = 'con'
-            continue
-        elif a_line == '# dependent species' :
-            currentBlockType = 'depspec'
+# artifacts written by MapleToVfgen and their file names (%s is the model)
+ARTIFACTS = ['vf', 'statesLabels', 'ratesLabels', 'ode_size', 'engine']
+ARTIFACT_FILES = {
+    'vf': '%s.vf',
+    'statesLabels': 'statesLabels.m',
+    'ratesLabels': 'ratesLabels.m',
+    'ode_size': 'ode_size.h',
+    'engine': '%s_engine.m',
+    }
+
+# the band solver is used for models of at least BAND_MIN_SPECIES species
+# whose jacobian bandwidth (mupper + mlower + 1) is at most
+# BAND_MAX_FRACTION of the number of species.
+BAND_MIN_SPECIES = 20
+BAND_MAX_FRACTION = 0.25
+
+_token = re.compile(r'(\d*\.?\d+(?:[eE][-+]?\d+)?)|([A-Za-z_]\w*)')
+
+def Identifiers(formula):
+    '''the names used in a maple formula (numbers like 1e-5 excluded). '''
+    return set([ m.group(2) for m in _token.finditer(formula) if m.group(2) ])
+
+def JacobianStructure(model, rhs=None):
+    '''the structural sparsity of the jacobian: for each species (in model
+    order) the set of species indices its ode depends on, directly or
+    through the expressions and dependent species. with rhs, the same for
+    each formula of rhs instead of the odes.
+    '''
+    index = dict([ (s.name, i) for i, s in enumerate(model.species) ])
+    formulas = dict([ (e.name, e.formula) for e in
+        model.dependent_species + model.expressions ])
+    resolved = {}
+
+    def species_of(name, visiting):
+        if name in index:
+            return set([index[name]])
+        if name in resolved:
+            return resolved[name]
+        if name not in formulas or name in visiting:
+            return set()
+        visiting.add(name)
+        deps = set()
+        for a_name in Identifiers(formulas[name]):
+            deps |= species_of(a_name, visiting)
+        visiting.discard(name)
+        resolved[name] = deps
+        return deps
+
+    if rhs is None:
+        rhs = [ s.ode or '' for s in model.species ]
+    structure = []
+    for formula in rhs:
+        deps = set()
+        for a_name in Identifiers(formula):
+            deps |= species_of(a_name, set())
+        structure.append(deps)
+    return structure
+
+def Bandwidth(structure, order=None):
+    '''(mupper, mlower) of the jacobian with the species in order
+    (order[k] is the model index of engine state k).
+    '''
+    n = len(structure)
+    if order is None:
+        order = range(n)
+    position = [0]*n
+    for k, i in enumerate(order):
+        position[i] = k
+    mupper, mlower = 0, 0
+    for i, deps in enumerate(structure):
+        for j in deps:
+            d = position[j] - position[i]
+            if d > mupper:
+                mupper = d
+            elif -d > mlower:
+                mlower = -d
+    return mupper, mlower
+
+def ReverseCuthillMcKee(structure):
+    '''a bandwidth reducing order of the species, from the symmetric
+    pattern of the jacobian.
+    '''
+    n = len(structure)
+    neighbors = [ set() for i in range(n) ]
+    for i, deps in enumerate(structure):
+        for j in deps:
+            if i != j:
+                neighbors[i].add(j)
+                neighbors[j].add(i)
+    degree = [ len(a) for a in neighbors ]
+    visited = [False]*n
+    order = []
+    for start in sorted(range(n), key=lambda i: degree[i]):
+        if visited[start]:
             continue
-        elif a_line == '# expressions' :
-            currentBlockType = 'expr'
+        visited[start] = True
+        queue = [start]
+        head = 0
+        while head < len(queue):
+            i = queue[head]
+            head += 1
+            for j in sorted(neighbors[i], key=lambda j: degree[j]):
+                if not visited[j]:
+                    visited[j] = True
+                    queue.append(j)
+        order += queue
+    order.reverse()
+    return order
+
+# c names of the maple functions allowed in formulas
+C_FUNCTIONS = {
+    'exp': 'exp', 'log': 'log', 'ln': 'log', 'log10': 'log10',
+    'sqrt': 'sqrt', 'abs': 'fabs', 'sin': 'sin', 'cos': 'cos', 'tan': 'tan',
+    'tanh': 'tanh', 'min': 'fmin', 'max': 'fmax', 'pow': 'pow',
+    }
+C_CONSTANTS = {'Pi': 'M_PI', 'pi': 'M_PI'}
+
+_c_token = re.compile(r'\s*(?:(\d*\.?\d+(?:[eE][-+]?\d+)?|\d+\.)|([A-Za-z_]\w*)|(\S))')
+
+def Tokens(formula):
+    '''the numbers, names and operators of a maple formula. '''
+    tokens = []
+    pos = 0
+    formula = formula.rstrip()
+    while pos < len(formula):
+        m = _c_token.match(formula, pos)
+        tokens.append(m.group(m.lastindex))
+        pos = m.end()
+    return tokens
+
+def _is_number(token):
+    return token[0].isdigit() or (token[0] == '.' and len(token) > 1)
+
+class _CParser(object):
+    '''translates a maple formula to a C expression: a^b becomes
+    pow(a, b), integer literals become doubles so that 1/2 is not 0, and
+    names are replaced through names.
+    '''
+    def __init__(self, formula, names):
+        self.formula = formula
+        self.tokens = Tokens(formula)
+        self.pos = 0
+        self.names = names
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token is None or (expected is not None and token != expected):
+            raise ValueError('%s expected in %s' % (expected or 'operand', self.formula))
+        self.pos += 1
+        return token
+
+    def parse(self):
+        text = self.sum()
+        if self.peek() is not None:
+            raise ValueError('unexpected %s in %s' % (self.peek(), self.formula))
+        return text
+
+    def sum(self):
+        text = self.product()
+        while self.peek() in ('+', '-'):
+            text += ' %s %s' % (self.take(), self.product())
+        return text
+
+    def product(self):
+        text = self.unary()
+        while self.peek() in ('*', '/'):
+            text += '%s%s' % (self.take(), self.unary())
+        return text
+
+    def unary(self):
+        if self.peek() in ('+', '-'):
+            sign = self.take()
+            return '%s%s' % (sign == '-' and '-' or '', self.unary())
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() in ('^', '**'):
+            self.take()
+            return 'pow(%s, %s)' % (base, self.unary())
+        return base
+
+    def atom(self):
+        token = self.take()
+        if token == '(':
+            text = self.sum()
+            self.take(')')
+            return '(%s)' % text
+        if _is_number(token):
+            if re.match(r'^\d+$', token):
+                return token + '.0'
+            return token
+        if self.peek() == '(':
+            if token not in C_FUNCTIONS:
+                raise ValueError('unknown function %s in %s' % (token, self.formula))
+            self.take('(')
+            args = [self.sum()]
+            while self.peek() == ',':
+                self.take()
+                args.append(self.sum())
+            self.take(')')
+            return '%s(%s)' % (C_FUNCTIONS[token], ', '.join(args))
+        if token in self.names:
+            return self.names[token]
+        if token in C_CONSTANTS:
+            return C_CONSTANTS[token]
+        raise ValueError('unknown symbol %s in %s' % (token, self.formula))
+
+def MapleToC(formula, names):
+    '''the C expression of a maple formula, with the names of the model
+    replaced by names[name].
+    '''
+    return _CParser(formula, names).parse()
+
+# precedence of the maple text of a folded formula
+_SUM, _NEG, _PRODUCT, _POWER, _ATOM = 1, 2, 3, 4, 5
+
+# the functions of C_FUNCTIONS that FoldFormula evaluates on constants
+FOLD_FUNCTIONS = {
+    'exp': math.exp, 'log': math.log, 'ln': math.log, 'log10': math.log10,
+    'sqrt': math.sqrt, 'abs': abs, 'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+    'tanh': math.tanh, 'min': min, 'max': max, 'pow': math.pow,
+    }
+
+def _maple_number(value):
+    if value == int(value) and abs(value) < 1e15:
+        return '%d' % value
+    return repr(value)
+
+def _constant(value):
+    if math.isinf(value) or math.isnan(value):
+        raise ValueError('constant %r in a folded formula' % value)
+    return _maple_number(value), value < 0 and _NEG or _ATOM, value
+
+def _evaluate(function, *args):
+    '''function(*args), or None where it is not a finite number. '''
+    try:
+        value = float(function(*args))
+    except (ValueError, OverflowError, ZeroDivisionError):
+        return None
+    if math.isinf(value) or math.isnan(value):
+        return None
+    return value
+
+class _FoldParser(_CParser):
+    '''rewrites a maple formula with the names of values replaced by their
+    numbers. constant subexpressions are evaluated, a product with a zero
+    factor becomes 0 and is left out of its sum, and factors of one,
+    powers of one and zero terms are dropped. every method returns (text,
+    precedence, value), value being the number of a constant and None
+    otherwise.
+    '''
+    def __init__(self, formula, values):
+        _CParser.__init__(self, formula, {})
+        self.values = values
+
+    def parse(self):
+        text, precedence, value = self.sum()
+        if self.peek() is not None:
+            raise ValueError('unexpected %s in %s' % (self.peek(), self.formula))
+        return text, value
+
+    def sum(self):
+        terms = [(1, self.product())]
+        while self.peek() in ('+', '-'):
+            terms.append((self.take() == '-' and -1 or 1, self.product()))
+        if len(terms) == 1:
+            return terms[0][1]
+        # the constants are added up where the first of them was
+        constant, at = 0.0, None
+        kept = []
+        for sign, (text, precedence, value) in terms:
+            if value is not None:
+                constant += sign*value
+                if at is None:
+                    at = len(kept)
+            elif kept and precedence == _NEG:
+                # a + -b is a - b
+                kept.append((-sign, text[1:], _PRODUCT))
+            else:
+                kept.append((sign, text, precedence))
+        if not kept:
+            return _constant(constant)
+        if constant != 0.0:
+            kept.insert(at, (constant < 0 and -1 or 1, _maple_number(abs(constant)), _ATOM))
+        sign, text, precedence = kept[0]
+        if sign < 0:
+            text = '-' + (precedence <= _NEG and '(%s)' % text or text)
+        for sign, term, precedence in kept[1:]:
+            if precedence <= _NEG:
+                term = '(%s)' % term
+            text += ' %s %s' % (sign < 0 and '-' or '+', term)
+        if len(kept) == 1:
+            return text, sign < 0 and _NEG or precedence, None
+        return text, _SUM, None
+
+    def product(self):
+        factors = [('*', self.unary())]
+        while self.peek() in ('*', '/'):
+            factors.append((self.take(), self.unary()))
+        if len(factors) == 1:
+            return factors[0][1]
+        constant = 1.0
+        kept = []
+        for op, (text, precedence, value) in factors:
+            if value is None or (op == '/' and value == 0.0):
+                kept.append((op, text, precedence))
+            elif op == '*':
+                constant *= value
+            else:
+                constant /= value
+        # a zero factor removes the whole term
+        if constant == 0.0 or not kept:
+            return _constant(constant)
+        negative = constant < 0
+        if abs(constant) != 1.0:
+            kept.insert(0, ('*', _maple_number(abs(constant)), _ATOM))
+        if kept[0][0] == '*' and kept[0][2] == _NEG:
+            negative = not negative
+            kept[0] = ('*', kept[0][1][1:], _PRODUCT)
+        text = ''
+        for op, factor, precedence in kept:
+            if precedence < _PRODUCT or (op == '/' and precedence == _PRODUCT):
+                factor = '(%s)' % factor
+            if not text:
+                text = op == '/' and '1/' + factor or factor
+            else:
+                text += op + factor
+        if negative:
+            return '-' + text, _NEG, None
+        if len(kept) == 1 and kept[0][0] == '*':
+            return text, kept[0][2], None
+        return text, _PRODUCT, None
+
+    def unary(self):
+        if self.peek() in ('+', '-'):
+            negate = self.take() == '-'
+            text, precedence, value = self.unary()
+            if not negate:
+                return text, precedence, value
+            if value is not None:
+                return _constant(-value)
+            if precedence == _NEG:
+                return text[1:], _PRODUCT, None
+            if precedence < _NEG:
+                text = '(%s)' % text
+            return '-' + text, _NEG, None
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() not in ('^', '**'):
+            return base
+        self.take()
+        exponent = self.unary()
+        b, e = base[2], exponent[2]
+        if e == 0.0 or b == 1.0:
+            return _constant(1.0)
+        if e == 1.0:
+            return base
+        if b == 0.0 and e is not None and e > 0:
+            return _constant(0.0)
+        if b is not None and e is not None:
+            value = _evaluate(pow, b, e)
+            if value is not None:
+                return _constant(value)
+        text = [ item[1] < _ATOM and '(%s)' % item[0] or item[0] for item in (base, exponent) ]
+        return '%s^%s' % tuple(text), _POWER, None
+
+    def atom(self):
+        token = self.take()
+        if token == '(':
+            item = self.sum()
+            self.take(')')
+            if item[2] is not None or item[1] == _ATOM:
+                return item
+            return '(%s)' % item[0], _ATOM, None
+        if _is_number(token):
+            return token, _ATOM, float(token)
+        if self.peek() == '(':
+            if token not in C_FUNCTIONS:
+                raise ValueError('unknown function %s in %s' % (token, self.formula))
+            self.take('(')
+            args = [self.sum()]
+            while self.peek() == ',':
+                self.take()
+                args.append(self.sum())
+            self.take(')')
+            values = [ a[2] for a in args ]
+            if token in FOLD_FUNCTIONS and None not in values:
+                value = _evaluate(FOLD_FUNCTIONS[token], *values)
+                if value is not None:
+                    return _constant(value)
+            return '%s(%s)' % (token, ', '.join([ a[0] for a in args ])), _ATOM, None
+        if token in self.values:
+            return _constant(self.values[token])
+        return token, _ATOM, None
+
+def FoldFormula(formula, values):
+    '''(text, value) of a maple formula with the names in values replaced
+    by their numbers and simplified (see _FoldParser). value is the number
+    the formula folds to, or None.
+    '''
+    return _FoldParser(formula, values).parse()
+
+def SplitTerms(formula):
+    '''[(sign, term)] of the top level sum of a formula. '''
+    terms = []
+    depth = 0
+    sign, term = 1, []
+    for token in Tokens(formula):
+        if depth == 0 and token in ('+', '-') and \
+                (not term or term[-1] not in ('*', '/', '^', '**', '(', ',')):
+            if term:
+                terms.append((sign, term))
+            sign, term = (token == '-' and -1 or 1), []
             continue
-        elif a_line == '# ode for independent species' :
-            currentBlockType = 'species'
-            continue                        
-        if currentBlockType == 'iv':
-            if a_line[0] == '#' : continue
-            words = a_line.split(':=')
-            words[1] = words[1].replace(';','')
-            ivaluesDict[words[0][1:].strip()] = words[1].strip()
-            ivaluesList.append(words[0][1:].strip())
-        elif currentBlockType == 'con':
-            if a_line[0] == '#' : continue
-            words = a_line.split(':=')
-            words[1] = words[1].replace(';','')
-            constantDict[words[0].strip()] = words[1].strip()
-            constantsList.append(words[0].strip())
-        elif currentBlockType == 'expr':
-            if a_line[0] == '#' : continue
-            words = a_line.split(':=')
-            words[1] = words[1].replace(';','')
-            expressionDict[words[0].strip()] = words[1].strip()
-        elif currentBlockType == 'species':
-            if a_line[0] == '#' : continue
-            words = a_line.split(':=')
-            words[1] = words[1].replace(';','')
-            words[0] = words[0][1:]
-            words[0] = words[0][0:-3]
-            speciesDict[words[0].strip()] = words[1].strip()
-        elif currentBlockType == 'depspec':
-            if a_line[0] == '#' : continue
-            words = a_line.split(':=')
-            words[1] = words[1].replace(';','')
-            dependentSpeciesDict[words[0].strip()] = words[1].strip()
-
-    print '<?xml version="1.0"?>'
-    print '<VectorField Name="%s">' % (os.path.basename(inputfile).split('.'))[0]
-
-    # print parameter section: 
-    for a_key in constantsList: 
-        print '<Parameter Name="%s"' % a_key, 
-        print 'DefaultValue="%s"' % constantDict[a_key], 
-        print '/>'
-
-    # print expression (for dependent species) section: 
-    for a_key in dependentSpeciesDict: 
-        print '<Expression Name="%s"' % a_key, 
-        print 'Formula="%s"' % dependentSpeciesDict[a_key], 
-        print '/>'
-
-    # print expression section: 
-    for a_key in expressionDict: 
-        print '<Expression Name="%s"' % a_key, 
-        print 'Formula="%s"' % expressionDict[a_key], 
-        print '/>'
-
-    # print statevariable section: 
-    for a_key in ivaluesList: 
-        print '<StateVariable Name="%s"' % a_key, 
-        print 'Formula="%s"' % speciesDict[a_key], 
-        print 'DefaultInitialCondition="%s"' % ivaluesDict[a_key], 
-        print '/>'
-
-    print '</VectorField>'
-
-    #ivaluesDict = {}
-    #constantDict = {} 
-    print 
-    print '<!-- '
-    print '#include "%s_cv.h"' % (os.path.basename(inputfile).split('.'))[0]
-    print 'const int N_ = %d;' % len(ivaluesDict)
-    print 'const int P_ = %d;' % len(constantDict)
-    print 'realtype def_y_[%d] = {' % len(ivaluesDict), 
-    _firstQ = True
-    for a_ivs in ivaluesList: 
-        if _firstQ:
-            print 'RCONST(%s)' % ivaluesDict[a_ivs], 
-            _firstQ = False
-        else:
-            print ', RCONST(%s)' % ivaluesDict[a_ivs], 
-    print '};'
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        term.append(token)
+    if term:
+        terms.append((sign, term))
+    return terms
 
-    print 'const realtype def_p_[%d] = {' % len(constantDict), 
-    _firstQ = True
-    for a_cons in constantsList: 
-        if _firstQ:
-            print 'RCONST(%s) ' % constantDict[a_cons], 
-            _firstQ = False
+# the reaction arrows of facile, as parse_equation of Parser.pm tries them:
+# (pattern, reversed, rate law); a rate law (=>) has the rate itself as
+# its velocity, mass action (->) the rate times the substrates
+_arrows = [
+    (re.compile(r'\s*(.*)<->\s*(.*)'), None, False),
+    (re.compile(r'\s*(.*)<=>\s*(.*)'), None, True),
+    (re.compile(r'\s*(.*)=>\s*(.*)'), False, True),
+    (re.compile(r'\s*(.*)<=\s*(.*)'), True, True),
+    (re.compile(r'\s*(.*)<-\s*(.*)'), True, False),
+    (re.compile(r'\s*(.*)[-=]>\s*(.*)'), False, False),
+    ]
+_rate = re.compile(r'\s*(\w+)\s*(=\s*(.+?)\s*)?$')
+
+def _node_names(side):
+    return [ n for n in re.split(r'[\s+]+', side) if n and not re.search(r'null|\+', n) ]
+
+def EqnReactions(model):
+    '''[(substrates, products, velocity)] of the reaction lines of the .eqn
+    file of model, in the order facile.pl reads them (parse_equation of
+    Parser.pm): a reversible line gives the forward and then the backward
+    reaction. facile writes the ode of a species as + velocity for each time
+    it is a product and - velocity for each time it is a substrate of a
+    reaction, so two reactions with the same rate and substrates have the
+    same velocity and only the reaction lines tell them apart.
+    '''
+    reactions = []
+    for line in getattr(model, 'reactions', []):
+        words = line.split(';')
+        if len(words) < 2:
+            raise ValueError('a rate constant is required in %s' % line)
+        for pattern, backward, rate_law in _arrows:
+            m = pattern.match(words[0])
+            if m:
+                break
         else:
-            print ', RCONST(%s) ' % constantDict[a_cons], 
-    print '}; '
-
-    print 'realtype y_[%d];' % len(ivaluesDict)
-    print 'realtype p_[%d];' % len(constantDict)
-
-    print 'char *varnames_[%d] = {' % len(ivaluesDict), 
-    _firstQ = True
-    for a_ivs in ivaluesList: 
-        if _firstQ:
-            print '"'+a_ivs+'"', 
-            _firstQ = False
+            raise ValueError('reaction %s not in correct form' % line)
+        left, right = m.group(1), m.group(2)
+        if backward is None:
+            if len(words) < 3:
+                raise ValueError('a 2nd rate constant is required in %s' % line)
+            steps = [(left, right, words[1]), (right, left, words[2])]
+        elif backward:
+            steps = [(right, left, words[1])]
         else:
-            print ',', '"'+a_ivs+'"', 
-    print '}; '
-    
-    print 'char *parnames_[%d] = {' % len(constantDict), 
-    _firstQ = True
-    for a_cons in constantsList: 
-        if _firstQ:
-            print '"'+a_cons+'"', 
-            _firstQ=False 
+            steps = [(left, right, words[1])]
+        for substrates, products, rate in steps:
+            # the easystoch order of a dynamic rate, e.g. f1=2:1
+            r = _rate.match(re.sub(r'(\S+):\d', r'\1', rate))
+            if not r:
+                raise ValueError('missing reaction rate constant in %s' % line)
+            substrates, products = _node_names(substrates), _node_names(products)
+            velocity = r.group(1)
+            if not rate_law:
+                velocity += ''.join([ '*' + n for n in substrates ])
+            reactions.append((substrates, products, velocity))
+    return reactions
+
+def _term_key(tokens):
+    return ''.join(tokens)
+
+def _eqn_network(model, reactions):
+    '''(propensities, stoichiometry) of the reactions of EqnReactions(model)
+    on the species of model, or None if the odes of model are not the sums
+    of their velocities. the velocities are folded like the odes (see
+    FoldParameters); the species that are not states of model (dependent
+    ones) are left out of the stoichiometry.
+    '''
+    values = getattr(model, 'folded_values', {})
+    index = dict([ (s.name, i) for i, s in enumerate(model.species) ])
+    expected = [ [] for s in model.species ]
+    propensities = []
+    stoichiometry = []
+    for substrates, products, velocity in reactions:
+        if values:
+            velocity, value = FoldFormula(velocity, values)
+            if value == 0.0:
+                continue
+        key = _term_key(Tokens(velocity))
+        change = {}
+        for sign, names in ((1, products), (-1, substrates)):
+            for n in names:
+                if n in index:
+                    expected[index[n]].append((sign, key))
+                    change[index[n]] = change.get(index[n], 0.0) + sign
+        st = sorted([ (i, c) for i, c in change.items() if c != 0.0 ])
+        if st:
+            propensities.append(velocity)
+            stoichiometry.append(st)
+    for i, s in enumerate(model.species):
+        terms = [ (sign, _term_key(term)) for sign, term in SplitTerms(s.ode or '0')
+                if not (len(term) == 1 and _is_number(term[0]) and float(term[0]) == 0.0) ]
+        if sorted(terms) != sorted(expected[i]):
+            return None
+    return propensities, stoichiometry
+
+def _ode_network(model):
+    '''(propensities, stoichiometry) guessed from the terms of the odes:
+    each distinct term (without its sign and leading numeric factor) is
+    taken as one reaction and its factor as the stoichiometry. a term that
+    comes twice with the same sign in one ode belongs to two reactions with
+    the same velocity, which can not be told apart this way.
+    '''
+    propensities = []
+    stoichiometry = []
+    index = {}
+    for i, s in enumerate(model.species):
+        seen = set()
+        for sign, term in SplitTerms(s.ode or '0'):
+            factor = 1.0
+            if len(term) > 2 and _is_number(term[0]) and term[1] == '*':
+                factor, term = float(term[0]), term[2:]
+            key = _term_key(term)
+            if len(term) == 1 and _is_number(key):
+                if float(key) == 0.0:
+                    continue
+                factor, key = float(key), '1'
+            if (sign, key) in seen:
+                raise ValueError('%s appears twice in the ode of %s: two reactions '
+                        'with the same velocity need the reaction lines of the .eqn '
+                        'file' % (key, s.name))
+            seen.add((sign, key))
+            if key not in index:
+                index[key] = len(propensities)
+                propensities.append(key)
+                stoichiometry.append({})
+            j = index[key]
+            stoichiometry[j][i] = stoichiometry[j].get(i, 0.0) + sign*factor
+    stoichiometry = [ sorted([ (i, c) for i, c in st.items() if c != 0.0 ])
+            for st in stoichiometry ]
+    return propensities, stoichiometry
+
+def ReactionNetwork(model):
+    '''the reactions behind the species odes, for the stochastic engines
+    and the conservation laws. returns (propensities, stoichiometry): the
+    formula of each reaction and, for each reaction, [(species index,
+    coefficient)]; the drift sum_j coefficient*propensity reproduces the
+    odes exactly. the reactions are the ones of the .eqn file (see
+    EqnReactions) when the odes of model follow from them; otherwise, as
+    for a .maple file without its .eqn, they are guessed from the terms of
+    the odes (see _ode_network).
+    '''
+    reactions = EqnReactions(model)
+    if reactions:
+        network = _eqn_network(model, reactions)
+        if network is not None:
+            return network
+        sys.stderr.write('the odes of %s do not follow from its reaction lines, '
+                'the reactions are taken from the terms of the odes\n' % model.name)
+    return _ode_network(model)
+
+# stoichiometric coefficients are taken as fractions with at most this
+# denominator, so the conservation laws are found in exact arithmetic
+MOIETY_MAX_DENOMINATOR = 1000000
+
+def ConservationLaws(model, keep=(), drop=()):
+    '''the conservation laws (moieties) of the odes of model: the left null
+    space of the stoichiometry of ReactionNetwork(model), found by a row
+    reduction of its transpose over the rationals. every law is returned
+    as (dependent, [(species, coefficient)]) of species indices: dependent
+    plus the sum of coefficient*species is constant, and the other species
+    of the laws stay independent. the species are tried as independent
+    ones in the order keep, model order, drop reversed (names).
+    '''
+    propensities, stoichiometry = ReactionNetwork(model)
+    index = dict([ (s.name, i) for i, s in enumerate(model.species) ])
+    kept = [ index[n] for n in keep if n in index ]
+    dropped = [ index[n] for n in drop if n in index and n not in keep ]
+    ends = set(kept + dropped)
+    # a species listed twice is simply tried twice; the first species of
+    # drop is tried last
+    order = kept + [ i for i in range(len(model.species)) if i not in ends ] + dropped[::-1]
+
+    # integer rows (each reaction scaled by the common denominator of its
+    # coefficients) and fraction free elimination: python ints are much
+    # faster than Fractions, and the rows are divided by their gcd to keep
+    # the numbers small
+    rows = []
+    for st in stoichiometry:
+        row = dict([ (i, Fraction(c).limit_denominator(MOIETY_MAX_DENOMINATOR))
+            for i, c in st ])
+        scale = 1
+        for c in row.values():
+            scale = scale*c.denominator//gcd(scale, c.denominator)
+        rows.append(dict([ (i, int(c*scale)) for i, c in row.items() ]))
+    where = {}
+    for r, row in enumerate(rows):
+        for i in row:
+            where.setdefault(i, set()).add(r)
+
+    def update(r, i, value):
+        if value == 0:
+            rows[r].pop(i, None)
+            where[i].discard(r)
         else:
-            print ',', '"'+a_cons+'"', 
-    print '}; '
-
-    # print molecular names with matlab style 
-    print 'stateLbl = {', 
-    _firstQ = True
-    for a_ivs in ivaluesList: 
-        if _firstQ:
-            print '\''+a_ivs+'\'', 
-            _firstQ = False
+            rows[r][i] = value
+            where.setdefault(i, set()).add(r)
+
+    pivots = {}
+    used = set()
+    for col in order:
+        candidates = [ r for r in where.get(col, ()) if r not in used ]
+        if not candidates:
+            continue
+        p = min(candidates, key=lambda r: (len(rows[r]), r))
+        a = rows[p][col]
+        for r in list(where[col]):
+            if r == p:
+                continue
+            b = rows[r][col]
+            if a in (1, -1):
+                # row_r - b/a*row_p, without touching the rest of row_r
+                for i, c in rows[p].items():
+                    update(r, i, rows[r].get(i, 0) - b*a*c)
+                continue
+            g = gcd(a, b)
+            ra, rb = a//g, b//g
+            for i in set(rows[r]) | set(rows[p]):
+                update(r, i, ra*rows[r].get(i, 0) - rb*rows[p].get(i, 0))
+            divisor = reduce(gcd, rows[r].values(), 0)
+            if divisor not in (0, 1, -1):
+                for i in rows[r]:
+                    rows[r][i] //= divisor
+        used.add(p)
+        pivots[col] = p
+
+    # row p of pivot species s reads a*s + sum c*f over the dependent f
+    coefficients = {}
+    for s in sorted(pivots):
+        row = rows[pivots[s]]
+        for f, c in row.items():
+            if f != s:
+                coefficients.setdefault(f, []).append((s, -Fraction(c, row[s])))
+    return [ (f, coefficients.get(f, [])) for f in range(len(model.species))
+            if f not in pivots ]
+
+def _coefficient(c):
+    if c.denominator == 1:
+        return '%d' % c.numerator
+    return '%r' % float(c)
+
+def ReduceMoieties(model, laws=None):
+    '''model with the dependent species of its conservation laws (see
+    ConservationLaws) replaced by algebraic expressions, in the form of
+    facile.pl -r: a constant X_tot, the total of the moiety at the initial
+    values, and the dependent species X = X_tot - sum of coefficient*species.
+    the engines then integrate only the independent species. the species
+    of the PROBE and READOUT sections and the 'independent' species of the
+    MOIETY section stay independent where they can, 'dependent' species
+    become dependent where they can. returns (reduced model, laws).
+    '''
+    if laws is None:
+        keep, drop = [], []
+        for line in getattr(model, 'moieties', []):
+            words = [ w for w in re.split(r'[\s,]+', line) if w ]
+            if words and words[0] == 'independent':
+                keep += words[1:]
+            elif words and words[0] == 'dependent':
+                drop += words[1:]
+        for line in getattr(model, 'probes', []):
+            keep += [ n.strip() for n in line.split('=', 1)[0].split(',') ]
+        names = set([ s.name for s in model.species ])
+        for r in getattr(model, 'readouts', []):
+            keep += sorted(Identifiers(r.formula) & names)
+        laws = ConservationLaws(model, keep, drop)
+    if not laws:
+        return model, laws
+    taken = set([ s.name for s in model.species ] + [ p.name for p in model.parameters ] +
+            [ e.name for e in model.dependent_species + model.expressions ])
+    dependent = set()
+    totals, expressions = [], []
+    for f, coefficients in laws:
+        species = model.species[f]
+        total = species.name + '_tot'
+        while total in taken:
+            total += '_'
+        taken.add(total)
+        try:
+            value = float(species.initial) + sum([ float(c)*float(model.species[i].initial)
+                for i, c in coefficients ])
+        except ValueError:
+            raise ValueError('the initial values of the moiety of %s are not numbers' % species.name)
+        formula = total
+        for i, c in coefficients:
+            if c == 1:
+                formula += ' - %s' % model.species[i].name
+            elif c == -1:
+                formula += ' + %s' % model.species[i].name
+            elif c > 0:
+                formula += ' - %s*%s' % (_coefficient(c), model.species[i].name)
+            else:
+                formula += ' + %s*%s' % (_coefficient(-c), model.species[i].name)
+        totals.append(modelir.Parameter(total, '%r' % value))
+        expressions.append(modelir.Expression(species.name, formula))
+        dependent.add(f)
+    reduced = copy.copy(model)
+    reduced.species = [ s for i, s in enumerate(model.species) if i not in dependent ]
+    reduced.parameters = model.parameters + totals
+    # earlier dependent species may use the species that became dependent
+    reduced.dependent_species = expressions + model.dependent_species
+    return reduced, laws
+
+def FoldParameters(model, names=None):
+    '''model specialised for the values of some of its parameters: the
+    ones in names, by default the fixed ones whose #{min, max} range is a
+    single value (like the topology switches e2..e10 of g4n.eqn). their
+    values are put into every formula (see FoldFormula); an expression
+    that becomes zero is left out, and so are the terms of the odes it
+    multiplies. the folded parameters leave the parameter vector of the
+    engines. returns (specialised model, folded parameters).
+    '''
+    if names is None:
+        names = [ p.name for p in model.parameters if p.fixed() ]
+    values = {}
+    folded = []
+    for p in model.parameters:
+        if p.name in names:
+            try:
+                values[p.name] = float(p.value)
+            except ValueError:
+                raise ValueError('parameter %s = %s is not a number' % (p.name, p.value))
+            folded.append(p)
+    if not folded:
+        return model, folded
+    dependent_species = [ modelir.Expression(e.name, FoldFormula(e.formula, values)[0])
+            for e in model.dependent_species ]
+    kept = {}
+    for e in SortedExpressions(model):
+        text, value = FoldFormula(e.formula, values)
+        if value == 0.0:
+            values[e.name] = 0.0
         else:
-            print ',', '\''+a_ivs+'\'', 
-    print '}; '
+            kept[e.name] = text
+    def substitute(m):
+        if m.group(2) in values:
+            return '(%s)' % _maple_number(values[m.group(2)])
+        return m.group(0)
+    specialised = copy.copy(model)
+    # the velocities of the .eqn reactions are folded with the same values
+    # (see ReactionNetwork)
+    specialised.folded_values = dict(getattr(model, 'folded_values', {}), **values)
+    specialised.parameters = [ p for p in model.parameters if p.name not in values ]
+    specialised.dependent_species = dependent_species
+    specialised.expressions = [ modelir.Expression(e.name, kept[e.name])
+            for e in model.expressions if e.name in kept ]
+    specialised.species = [ modelir.Species(s.name, s.initial,
+        s.ode and FoldFormula(s.ode, values)[0]) for s in model.species ]
+    # readouts use the folded parameters by name
+    specialised.readouts = [ modelir.Expression(r.name, _token.sub(substitute, r.formula))
+            for r in getattr(model, 'readouts', []) ]
+    return specialised, folded
 
-    f = open('statesLabels.m', 'w')
-    stateNamesStr = ",".join([ "'%s'" % state for state in ivaluesList])
-    code_statesLabels = template_statesLabels.replace('@labels',stateNamesStr)
-    f.write(code_statesLabels) 
-    f.close()
+def SortedExpressions(model):
+    '''the expressions of model, each after the expressions it uses. '''
+    formulas = dict([ (e.name, e.formula) for e in model.expressions ])
+    ordered = []
+    done = set()
+    def visit(name, stack):
+        if name in done:
+            return
+        if name in stack:
+            raise ValueError('circular expression: %s' % ' -> '.join(stack + [name]))
+        for dep in Identifiers(formulas[name]):
+            if dep in formulas and dep != name:
+                visit(dep, stack + [name])
+        done.add(name)
+        ordered.append(model.expressions[names.index(name)])
+    names = [ e.name for e in model.expressions ]
+    for e in model.expressions:
+        visit(e.name, [])
+    return ordered
 
-    # print parameter names with matlab style
-    print 'rateLbl = {', 
-    _firstQ = True
-    for a_cons in constantsList: 
-        if _firstQ:
-            print '\''+a_cons+'\'', 
-            _firstQ = False
+def UsedNames(model, formulas):
+    '''the names that formulas use, directly or through the dependent
+    species and expressions of model.
+    '''
+    definitions = dict([ (e.name, e.formula) for e in
+        model.dependent_species + model.expressions ])
+    used = set()
+    pending = set()
+    for formula in formulas:
+        pending |= Identifiers(formula)
+    while pending:
+        name = pending.pop()
+        if name in used:
+            continue
+        used.add(name)
+        if name in definitions:
+            pending |= Identifiers(definitions[name])
+    return used
+
+def _locals(model, expressions, names, used, indent):
+    '''C declarations of the dependent species and expressions in used. '''
+    lines = []
+    for i, d in enumerate(model.dependent_species):
+        if d.name in used:
+            lines.append('%sconst double d_%d = %s;\n' % (indent, i,
+                MapleToC(d.formula, names)))
+    for i, e in enumerate(expressions):
+        if e.name in used:
+            lines.append('%sconst double e_%d = %s;\n' % (indent, i,
+                MapleToC(e.formula, names)))
+    return lines
+
+def EmitReactionsC(model):
+    '''the reaction network of model for the stochastic engines of
+    mex_mat.c: the stoichiometry by reaction (stoich_start_,
+    stoich_species_, stoich_coef_), for -DSDE reaction_rates_(), which
+    evaluates the propensities of a block of n samples held column major
+    (entry (i, k) of y is y[i*n + k]), and for -DSSA reaction_rate_(), the
+    propensity of one reaction of one sample, with the dependency graph
+    (depend_start_, depend_reaction_): the reactions whose propensity
+    changes when reaction j fires.
+    '''
+    propensities, stoichiometry = ReactionNetwork(model)
+    expressions = SortedExpressions(model)
+    names = {}
+    for i, d in enumerate(model.dependent_species):
+        names[d.name] = 'd_%d' % i
+    for i, e in enumerate(expressions):
+        names[e.name] = 'e_%d' % i
+
+    nnz = sum([ len(st) for st in stoichiometry ])
+    out = []
+    w = out.append
+    w('#define __N_REACTIONS__    %d\n' % len(propensities))
+    _csr(w, 'stoich_start_', 'stoich_species_', 'int',
+            [ [ i for i, c in st ] for st in stoichiometry ])
+    w('const double stoich_coef_[%d] = { ' % max(nnz, 1))
+    w(','.join([ '%r' % c for st in stoichiometry for i, c in st ] or ['0.0']))
+    w(' };\n')
+
+    # a block of samples, in local variables per sample
+    w('#ifdef SDE\n')
+    block = dict(names)
+    for i, a_s in enumerate(model.species):
+        block[a_s.name] = 's_%d' % i
+    for i, p in enumerate(model.parameters):
+        block[p.name] = 'p_%d' % i
+    used = UsedNames(model, propensities)
+    w('static void reaction_rates_(int n, const double *y, const double *p, double *a)\n')
+    w('{\n')
+    w('    int k_;\n')
+    w('    for (k_ = 0; k_ < n; ++k_) {\n')
+    for i, a_s in enumerate(model.species):
+        if a_s.name in used:
+            w('        const double s_%d = y[%d*n + k_];\n' % (i, i))
+    for i, p in enumerate(model.parameters):
+        if p.name in used:
+            w('        const double p_%d = p[%d*n + k_];\n' % (i, i))
+    out.extend(_locals(model, expressions, block, used, '        '))
+    for j, formula in enumerate(propensities):
+        w('        a[%d*n + k_] = %s;\n' % (j, MapleToC(formula, block)))
+    w('    }\n')
+    w('}\n')
+    w('#endif\n')
+
+    # one reaction of one sample
+    w('#ifdef SSA\n')
+    single = dict(names)
+    for i, a_s in enumerate(model.species):
+        single[a_s.name] = 'y[%d]' % i
+    for i, p in enumerate(model.parameters):
+        single[p.name] = 'p[%d]' % i
+    w('static double reaction_rate_(int j, const double *y, const double *p)\n')
+    w('{\n')
+    w('    switch (j) {\n')
+    for j, formula in enumerate(propensities):
+        w('    case %d: {\n' % j)
+        out.extend(_locals(model, expressions, single,
+            UsedNames(model, [formula]), '        '))
+        w('        return %s;\n' % MapleToC(formula, single))
+        w('    }\n')
+    w('    }\n')
+    w('    return 0.0;\n')
+    w('}\n')
+    depends = JacobianStructure(model, propensities)
+    changes = [ set([ i for i, c in st ]) for st in stoichiometry ]
+    _csr(w, 'depend_start_', 'depend_reaction_', 'int',
+            [ [ k for k in range(len(propensities)) if depends[k] & changes[j] ]
+                for j in range(len(propensities)) ])
+    w('#endif\n')
+    return ''.join(out)
+
+# time reductions of a species in the READOUT section, e.g. max(FUS1), and
+# the C helpers of ode_size.h that compute them from a trajectory
+READOUT_REDUCTIONS = {
+    'max': 'readout_max', 'min': 'readout_min', 'mean': 'readout_mean',
+    'auc': 'readout_auc', 'argmax': 'readout_argmax', 'argmin': 'readout_argmin',
+    }
+
+template_readout_helpers = """/* species k of a trajectory y (nt x n, time major) over the times t */
+static inline double readout_at(const double *t, const double *y, int nt, int n, int k, int i)
+{ if (i < 0) i += nt; return i >= 0 && i < nt ? y[(size_t) i*n + k] : NAN; }
+static inline double readout_max(const double *t, const double *y, int nt, int n, int k)
+{ int i; double m = y[k]; for (i = 1; i < nt; ++i) if (y[(size_t) i*n + k] > m) m = y[(size_t) i*n + k]; return m; }
+static inline double readout_min(const double *t, const double *y, int nt, int n, int k)
+{ int i; double m = y[k]; for (i = 1; i < nt; ++i) if (y[(size_t) i*n + k] < m) m = y[(size_t) i*n + k]; return m; }
+static inline double readout_mean(const double *t, const double *y, int nt, int n, int k)
+{ int i; double s = 0.0; for (i = 0; i < nt; ++i) s += y[(size_t) i*n + k]; return s/nt; }
+static inline double readout_auc(const double *t, const double *y, int nt, int n, int k)
+{ int i; double s = 0.0; for (i = 1; i < nt; ++i) s += 0.5*(t[i] - t[i-1])*(y[(size_t) i*n + k] + y[(size_t) (i-1)*n + k]); return s; }
+static inline double readout_argmax(const double *t, const double *y, int nt, int n, int k)
+{ int i, m = 0; for (i = 1; i < nt; ++i) if (y[(size_t) i*n + k] > y[(size_t) m*n + k]) m = i; return t[m]; }
+static inline double readout_argmin(const double *t, const double *y, int nt, int n, int k)
+{ int i, m = 0; for (i = 1; i < nt; ++i) if (y[(size_t) i*n + k] < y[(size_t) m*n + k]) m = i; return t[m]; }
+"""
+
+class _ReadoutParser(_CParser):
+    '''translates a readout formula to C. a species is its value at the
+    last time point, X[i] its value at time point i (negative from the
+    end) and max, min, mean, auc, argmax and argmin of a single species
+    reduce its trajectory; everything else is as in MapleToC.
+    '''
+    def __init__(self, formula, names, species):
+        _CParser.__init__(self, formula, names)
+        self.species = species
+
+    def atom(self):
+        token = self.peek()
+        ahead = self.tokens[self.pos+1:self.pos+4]
+        if token in READOUT_REDUCTIONS and len(ahead) == 3 and ahead[0] == '(' \
+                and ahead[1] in self.species and ahead[2] == ')':
+            self.pos += 4
+            return '%s(t, y, nt, %d, %d)' % (READOUT_REDUCTIONS[token],
+                    len(self.species), self.species[ahead[1]])
+        if token in self.species:
+            self.take()
+            index = '-1'
+            if self.peek() == '[':
+                self.take('[')
+                index = '(int) (%s)' % self.sum()
+                self.take(']')
+            return 'readout_at(t, y, nt, %d, %d, %s)' % (len(self.species),
+                    self.species[token], index)
+        return _CParser.atom(self)
+
+def ProbeSpecies(model):
+    '''the indices of the species of the PROBE section, in the order they
+    are probed. probes of expressions, parameters or dependent species
+    (and probes defined as name = formula) are not states of the engines
+    and are left out with a warning.
+    '''
+    index = dict([ (s.name, i) for i, s in enumerate(model.species) ])
+    selected = []
+    for line in getattr(model, 'probes', []):
+        if '=' in line:
+            names = [line.split('=', 1)[0].strip()]
         else:
-            print ',', '\''+a_cons+'\'', 
-    print '}; '
+            names = [ n.strip() for n in line.split(',') if n.strip() ]
+        for name in names:
+            if name not in index:
+                sys.stderr.write('warning: probe %s is not a species, the engines do not store it\n' % name)
+            elif index[name] not in selected:
+                selected.append(index[name])
+    return selected
 
-    f = open('ratesLabels.m', 'w')
-    rateNamesStr = ",".join([ "'%s'" % rate for rate in constantsList])
-    code_ratesLabels = template_ratesLabels.replace('@labels',rateNamesStr)
-    f.write(code_ratesLabels) 
-    f.close()
+def EmitOutputC(model):
+    '''what the engines of mex_mat.c store of every trajectory: the
+    probed species (probe_species_, all species when there are none) at
+    every OUTPUT_STRIDE-th time point (output_stride of the CONFIG
+    section, 1 by default).
+    '''
+    probes = ProbeSpecies(model)
+    stride = model.config_value('output_stride', '1')
+    out = []
+    w = out.append
+    w('#define __N_PROBES__       %d\n' % len(probes))
+    w('const int probe_species_[%d] = { ' % max(len(probes), 1))
+    w(','.join([ '%d' % i for i in probes ] or ['0']))
+    w(' };\n')
+    w('#define OUTPUT_STRIDE      %d\n' % max(1, int(stride)))
+    return ''.join(out)
+
+def EmitReadoutC(model):
+    '''the READOUT section of model for the in-engine reduction of
+    mex_mat.c (engine_readout): readout_() evaluates every readout of one
+    sample from its trajectory y (timepoints x species, model order), the
+    times t and its rates p into r. formulas can use the species (see
+    _ReadoutParser), the parameters and the readouts above them.
+    '''
+    readouts = getattr(model, 'readouts', [])
+    species = dict([ (s.name, i) for i, s in enumerate(model.species) ])
+    names = {}
+    for i, p in enumerate(model.parameters):
+        names[p.name] = 'p[%d]' % i
+    out = []
+    w = out.append
+    w(template_readout_helpers)
+    w('#define __N_READOUTS__     %d\n' % len(readouts))
+    w('const int R_ = %d;\n' % len(readouts))
+    w('char *readoutnames_[%d] = { ' % max(len(readouts), 1))
+    w(','.join([ '"%s"' % r.name for r in readouts ] or ['""']))
+    w(' };\n')
+    w('static inline void readout_(const double *t, int nt, const double *y, const double *p, double *r)\n')
+    w('{\n')
+    for j, r in enumerate(readouts):
+        w('    r[%d] = %s;\n' % (j, _ReadoutParser(r.formula, names, species).parse()))
+        names[r.name] = 'r[%d]' % j
+    w('}\n')
+    return ''.join(out)
+
+def _csr(w, start_name, index_name, ctype, rows):
+    '''writes rows (lists of ints) as a compressed sparse row pair of
+    arrays: row j is index_name[start_name[j] .. start_name[j+1]-1].
+    '''
+    start = [0]
+    for row in rows:
+        start.append(start[-1] + len(row))
+    w('const int %s[%d] = { ' % (start_name, len(rows) + 1))
+    w(','.join([ '%d' % k for k in start ]))
+    w(' };\n')
+    w('const %s %s[%d] = { ' % (ctype, index_name, max(start[-1], 1)))
+    w(','.join([ '%d' % k for row in rows for k in row ] or ['0']))
+    w(' };\n')
+
+class LinearSolver(object):
+    '''the linear solver of the engine for a model. kind is 'dense' or
+    'band'; order is None or the model index of every engine state when
+    the states are reordered for a smaller bandwidth.
+    '''
+    def __init__(self, kind, mupper, mlower, order=None, nnz=0):
+        self.kind = kind
+        self.mupper = mupper
+        self.mlower = mlower
+        self.order = order
+        self.nnz = nnz
+
+    def __repr__(self):
+        return 'LinearSolver(%s, mupper=%d, mlower=%d, reordered=%s, nnz=%d)' % (
+                self.kind, self.mupper, self.mlower, self.order is not None, self.nnz)
+
+def ChooseLinearSolver(model, reorder=False, structure=None):
+    '''picks a band solver when the jacobian of model (optionally after a
+    reverse Cuthill-McKee reordering) has a narrow band, dense otherwise.
+    '''
+    if structure is None:
+        structure = JacobianStructure(model)
+    n = len(structure)
+    nnz = sum([ len(deps | set([i])) for i, deps in enumerate(structure) ])
+    order = None
+    mupper, mlower = Bandwidth(structure)
+    if reorder and n > 2:
+        rcm = ReverseCuthillMcKee(structure)
+        rcm_mupper, rcm_mlower = Bandwidth(structure, rcm)
+        if rcm_mupper + rcm_mlower < mupper + mlower:
+            order, mupper, mlower = rcm, rcm_mupper, rcm_mlower
+    if n >= BAND_MIN_SPECIES and mupper + mlower + 1 <= BAND_MAX_FRACTION*n:
+        return LinearSolver('band', mupper, mlower, order, nnz)
+    return LinearSolver('dense', mupper, mlower, None, nnz)
+
+def EmitVf(model, solver=None):
+    '''the vfgen input of model, followed by the C/matlab declarations in
+    an xml comment. every line is collected into one list and joined once.
+    the state variables follow solver.order when the solver reorders them.
+    '''
+    ivaluesList = [ s.name for s in model.species ]
+    constantsList = [ p.name for p in model.parameters ]
+    out = []
+    w = out.append
+
+    w('<?xml version="1.0"?>\n')
+    w('<VectorField Name="%s">\n' % model.name)
+
+    # parameter section: 
+    for p in model.parameters: 
+        w('<Parameter Name="%s" DefaultValue="%s" />\n' % (p.name, p.value))
+
+    # expression (for dependent species) section: 
+    for an_expr in model.dependent_species: 
+        w('<Expression Name="%s" Formula="%s" />\n' % (an_expr.name, an_expr.formula))
+
+    # expression section: 
+    for an_expr in model.expressions: 
+        w('<Expression Name="%s" Formula="%s" />\n' % (an_expr.name, an_expr.formula))
+
+    # statevariable section: 
+    species = model.species
+    if solver is not None and solver.order is not None:
+        species = [ model.species[i] for i in solver.order ]
+    for s in species: 
+        w('<StateVariable Name="%s" Formula="%s" DefaultInitialCondition="%s" />\n' \
+                % (s.name, s.ode, s.initial))
+
+    w('</VectorField>\n')
 
-    # print default parameter ranges with matlab style
-    print 'ratesRange = {' 
-    # _firstQ = True
+    w('\n')
+    w('<!-- \n')
+    w('#include "%s_cv.h"\n' % model.name)
+    w('const int N_ = %d;\n' % len(model.species))
+    w('const int P_ = %d;\n' % len(model.parameters))
+    w('realtype def_y_[%d] = { %s };\n' % (len(model.species),
+        ' , '.join([ 'RCONST(%s)' % s.initial for s in model.species ])))
+    w('const realtype def_p_[%d] = { %s }; \n' % (len(model.parameters),
+        ' , '.join([ 'RCONST(%s) ' % p.value for p in model.parameters ])))
+    w('realtype y_[%d];\n' % len(model.species))
+    w('realtype p_[%d];\n' % len(model.parameters))
+    w('char *varnames_[%d] = { %s }; \n' % (len(model.species),
+        ' , '.join([ '"%s"' % a for a in ivaluesList ])))
+    w('char *parnames_[%d] = { %s }; \n' % (len(model.parameters),
+        ' , '.join([ '"%s"' % a for a in constantsList ])))
+
+    # molecular and parameter names with matlab style 
+    w('stateLbl = { %s }; \n' % ' , '.join([ "'%s'" % a for a in ivaluesList ]))
+    w('rateLbl = { %s }; \n' % ' , '.join([ "'%s'" % a for a in constantsList ]))
+
+    # default parameter ranges with matlab style
+    w('ratesRange = {\n')
     for a_cons in constantsList: 
-        print '\t\'%s\',\t1.0e-3,\t1.0e+3' % a_cons  
-    print '};'
+        w('\t\'%s\',\t1.0e-3,\t1.0e+3\n' % a_cons)
+    w('};\n')
 
-    # print default parameter ranges with matlab style
-    print 'ratesRange = [' 
-    # _firstQ = True
+    w('ratesRange = [\n')
     for a_cons in constantsList: 
-        print '\t1.0e-3,\t1.0e+3\t%% %s' % a_cons  
-    print '];'
+        w('\t1.0e-3,\t1.0e+3\t%% %s\n' % a_cons)
+    w('];\n')
 
-    print 'parfix = [' 
-    # _firstQ = True
+    w('parfix = [\n')
     for a_cons in constantsList: 
-        print '\t1e-3,\t0\t%% %s' % a_cons  
-    print '];'
+        w('\t1e-3,\t0\t%% %s\n' % a_cons)
+    w('];\n')
 
-    print '-->'
+    w('-->\n')
+    return ''.join(out)
 
-    MakeOdeSizeH(inputfile,constantDict,ivaluesDict,ivaluesList,constantsList)
-    MakeOdeEngineOde23(inputfile)
+def EmitStatesLabels(model, solver=None):
+    stateNamesStr = ",".join([ "'%s'" % s.name for s in model.species ])
+    return template_statesLabels.replace('@labels',stateNamesStr)
 
-    return ivaluesDict, constantDict
+def EmitRatesLabels(model, solver=None):
+    rateNamesStr = ",".join([ "'%s'" % p.name for p in model.parameters ])
+    return template_ratesLabels.replace('@labels',rateNamesStr)
 
-def MakeOdeEngineOde23(inputfile):
-    projectName  = inputfile.split('.')[0]
-    matlabFunctionName  = inputfile.split('.')[0] + '_engine'
-    filename = inputfile.split('.')[0] + '_engine' + '.m'
-    f = open(filename, 'w')
+def EmitEngineM(model, solver=None):
+    projectName = model.name
+    matlabFunctionName = model.name + '_engine'
 
     code = """ %%author: Je-Hoon Song email: gistmecha@gmail.com
 function [output, yf, flag] = %s(tvec, ivalues, rates, modeString)
@@ -283,51 +1245,456 @@ end
 function [output, yf, flag] = MexSolver(tvec, ivalues, rates)
     [output, yf, flag] = %s_mex(tvec, ivalues, rates); """ \
             % (matlabFunctionName, projectName, projectName)
-    f.write(code) 
-    f.close()
+    return code
 
-def MakeOdeSizeH(inputfile,constantDict,ivaluesDict,ivaluesList,constantsList):
-    f = open('ode_size.h', 'w')
-    # print parameter names with matlab style
-    f.write('#ifndef _ode_size_h_\n')
-    f.write('#define _ode_size_h_\n')
-    f.write('#include "%s_cv.h"\n' % (os.path.basename(inputfile).split('.'))[0])
-    f.write('#define __N_SPECIES__      %d\n' % len(ivaluesDict))
-    f.write('#define __N_PARAMETERS__   %d\n' % len(constantDict))
-    f.write('const int N_ = %d;\n' % len(ivaluesDict))
-    f.write('const int P_ = %d;\n' % len(constantDict))
-    f.write('realtype def_y_[%d] = { ' % len(ivaluesDict)) 
-    s = []
-    for iv in ivaluesList:
-        s.append('RCONST(%s)' % ivaluesDict[iv])
-    f.write(",".join(s))
-    f.write(" };\n")
-    f.write('const realtype def_p_[%d] = { ' % len(constantDict))
-    s = []
-    for p in constantsList:
-        s.append('RCONST(%s)' % constantDict[p])
-    f.write(",".join(s))
-    f.write(" };\n")
-    f.write('realtype y_[%d];\n' % len(ivaluesDict))
-    f.write('realtype p_[%d];\n' % len(constantDict))
-    f.write('char *varnames_[%d] = { ' % len(ivaluesDict))
-    s = []
-    for iv in ivaluesList:
-        s.append('\"%s\"'%iv)
-    f.write(",".join(s))
-    f.write(' };\n')
-    f.write('char *parnames_[%d] = { ' % len(constantDict))
-    s = []
-    for p in constantsList:
-        s.append('\"%s\"'%p)
-    f.write(",".join(s))
-    f.write(' };\n')
-    f.write('#endif\n')    
+def EmitOdeSizeH(model, solver=None):
+    '''the sizes, defaults and names of the model for the C engines, and
+    the linear solver they should use. STATE_INDEX(k) is the model index of
+    engine state k.
+    '''
+    if solver is None:
+        solver = ChooseLinearSolver(model)
+    out = []
+    w = out.append
+    w('#ifndef _ode_size_h_\n')
+    w('#define _ode_size_h_\n')
+    w('#include "%s_cv.h"\n' % model.name)
+    w('#define __N_SPECIES__      %d\n' % len(model.species))
+    w('#define __N_PARAMETERS__   %d\n' % len(model.parameters))
+    w('const int N_ = %d;\n' % len(model.species))
+    w('const int P_ = %d;\n' % len(model.parameters))
+    w('realtype def_y_[%d] = { ' % len(model.species)) 
+    w(",".join([ 'RCONST(%s)' % s.initial for s in model.species ]))
+    w(" };\n")
+    w('const realtype def_p_[%d] = { ' % len(model.parameters))
+    w(",".join([ 'RCONST(%s)' % p.value for p in model.parameters ]))
+    w(" };\n")
+    w('realtype y_[%d];\n' % len(model.species))
+    w('realtype p_[%d];\n' % len(model.parameters))
+    w('char *varnames_[%d] = { ' % len(model.species))
+    w(",".join([ '\"%s\"' % s.name for s in model.species ]))
+    w(' };\n')
+    w('char *parnames_[%d] = { ' % len(model.parameters))
+    w(",".join([ '\"%s\"' % p.name for p in model.parameters ]))
+    w(' };\n')
+    if solver.kind == 'band':
+        w('#define __LINEAR_SOLVER_BAND__\n')
+        w('#define __BAND_MUPPER__    %d\n' % solver.mupper)
+        w('#define __BAND_MLOWER__    %d\n' % solver.mlower)
+    else:
+        w('#define __LINEAR_SOLVER_DENSE__\n')
+    if solver.order is not None:
+        w('const int state_order_[%d] = { ' % len(model.species))
+        w(",".join([ '%d' % i for i in solver.order ]))
+        w(' };\n')
+        w('#define STATE_INDEX(k) (state_order_[k])\n')
+    else:
+        w('#define STATE_INDEX(k) (k)\n')
+    w(EmitOutputC(model))
+    w(EmitReadoutC(model))
+    # the reaction network is only compiled into the stochastic engines; a model
+    # whose formulas can not be translated fails that build alone
+    w('#if defined(SDE) || defined(SSA)\n')
+    try:
+        w(EmitReactionsC(model))
+    except ValueError, e:
+        w('#error "no reaction network for the stochastic engines: %s"\n' % str(e).replace('"', "'"))
+    w('#endif\n')
+    w('#endif\n')    
+    return ''.join(out)
+
+EMITTERS = {
+    'vf': EmitVf,
+    'statesLabels': EmitStatesLabels,
+    'ratesLabels': EmitRatesLabels,
+    'ode_size': EmitOdeSizeH,
+    'engine': EmitEngineM,
+    }
+
+def WriteAtomic(path, text):
+    '''writes text to path through a temporary file in the same directory,
+    so readers never see a partially written file.
+    '''
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp, 'w')
+    f.write(text)
     f.close()
+    os.rename(tmp, path)
+
+def EmitArtifacts(model, artifacts=None, solver=None):
+    '''{artifact name: text} for the requested artifacts (all by default).
+    the linear solver (and state order) is chosen once for all of them.
+    '''
+    if artifacts is None:
+        artifacts = ARTIFACTS
+    if solver is None:
+        solver = ChooseLinearSolver(model)
+    result = {}
+    for name in artifacts:
+        if name not in EMITTERS:
+            raise ValueError('unknown artifact %s (one of %s)' % (name, ', '.join(ARTIFACTS)))
+        result[name] = EMITTERS[name](model, solver)
+    return result
+
+def WriteArtifacts(model, artifacts=None, outdir='.', paths=None, solver=None):
+    '''emits the requested artifacts and writes each to its own file.
+    paths can override the file name of an artifact. returns the list of
+    written paths.
+    '''
+    if paths is None:
+        paths = {}
+    written = []
+    for name, text in EmitArtifacts(model, artifacts, solver).items():
+        path = paths.get(name)
+        if path is None:
+            pattern = ARTIFACT_FILES[name]
+            if '%s' in pattern:
+                pattern = pattern % model.name
+            path = os.path.join(outdir, pattern)
+        WriteAtomic(path, text)
+        written.append(path)
+    return written
+
+def EngineModel(model, fold=None, reduce=None, verbose=False):
+    '''model as the engines integrate it: with fold (by default fold_fixed
+    of the CONFIG section) its fixed parameters folded (see
+    FoldParameters), then with reduce (by default reduce_moieties) the
+    dependent species of its conservation laws left out (see
+    ReduceMoieties). verbose reports both on stderr.
+    '''
+    if fold is None:
+        fold = model.config_value('fold_fixed', '0') not in ('0', 'no', 'false')
+    if fold:
+        model, folded = FoldParameters(model)
+        if folded and verbose:
+            sys.stderr.write('%d fixed parameters folded: %s\n' % (len(folded),
+                ', '.join([ p.name for p in folded ])))
+    if reduce is None:
+        reduce = model.config_value('reduce_moieties', '0') not in ('0', 'no', 'false')
+    if reduce:
+        model, laws = ReduceMoieties(model)
+        if laws and verbose:
+            sys.stderr.write('%d conservation laws, dependent species: %s\n' % (len(laws),
+                ', '.join([ e.name for e in model.dependent_species[:len(laws)] ])))
+    return model
+
+def MoietyColumns(eqnfile, model=None):
+    '''(dependent species, totals) of the engines of eqnfile with
+    reduce_moieties = 1: the names of the species that leave ivalues and y,
+    and the X_tot Parameters that are appended to rates. the laws are found
+    on the odes of the .maple file next to eqnfile. ([], []) without the
+    reduction.
+    '''
+    if model is None:
+        model = modelir.Load(eqnfile=eqnfile)
+    if model.config_value('reduce_moieties', '0') in ('0', 'no', 'false'):
+        return [], []
+    maplefile = os.path.splitext(eqnfile)[0] + '.maple'
+    if not os.path.isfile(maplefile):
+        raise IOError('reduce_moieties needs %s (facile.pl -L %s)' % (maplefile, eqnfile))
+    full = modelir.Load(eqnfile, maplefile)
+    folded = EngineModel(full, reduce=False)
+    reduced = EngineModel(folded, fold=False, reduce=True)
+    kept = set([ s.name for s in reduced.species ])
+    return ([ s.name for s in folded.species if s.name not in kept ],
+            reduced.parameters[len(folded.parameters):])
+
+def MapleToVfgen(inputfile, vffile=None, artifacts=None, outdir='.', reorder=False,
+        reduce=None, fold=None) :
+    '''converts a maple file to the vfgen input. the vf is written to
+    vffile, or to stdout when vffile is None as the Makefiles expect; the
+    other artifacts are written into outdir. with reorder, the states of
+    the vf are put in a bandwidth reducing order (the engines map them back
+    to the model order). with fold (by default fold_fixed of the CONFIG
+    section), the parameters with a single valued range are folded into the
+    formulas and left out of the parameters (see FoldParameters). with
+    reduce (by default reduce_moieties of the CONFIG section), the
+    conservation laws of the odes are found and their dependent species are
+    left out of the states (see ReduceMoieties). the MOIETY, PROBE, CONFIG
+    and READOUT sections and the ranges come from the .eqn file next to the
+    maple file, if there is one.
+    '''
+    eqnfile = os.path.splitext(inputfile)[0] + '.eqn'
+    model = modelir.Load(eqnfile if os.path.isfile(eqnfile) else None, inputfile)
+    model = EngineModel(model, fold, reduce, verbose=True)
+    solver = ChooseLinearSolver(model, reorder)
+    if artifacts is None:
+        artifacts = ARTIFACTS
+    paths = {}
+    if 'vf' in artifacts:
+        if vffile is None:
+            sys.stdout.write(EmitVf(model, solver))
+            artifacts = [ a for a in artifacts if a != 'vf' ]
+        else:
+            paths['vf'] = vffile
+    WriteArtifacts(model, artifacts, outdir, paths, solver)
+
+    ivaluesDict = dict([ (s.name, s.initial) for s in model.species ])
+    constantDict = dict([ (p.name, p.value) for p in model.parameters ])
+    return ivaluesDict, constantDict
+
+def SyntheticModel(num_species, num_parameters):
+    '''a chain model A0 -> A1 -> ... of the given size for benchmarks. '''
+    model = modelir.Model('synthetic')
+    for i in range(num_parameters):
+        model.parameters.append(modelir.Parameter('k%d' % i, '1.0'))
+    for i in range(num_species):
+        k = 'k%d' % (i % max(num_parameters, 1))
+        ode = '- %s*A%d' % (k, i)
+        if i > 0:
+            ode = '+ %s*A%d ' % (k, i-1) + ode
+        model.species.append(modelir.Species('A%d' % i, '1e-3', ode))
+    return model
+
+def Benchmark(sizes=(1000, 10000, 100000)):
+    '''times the emission of every artifact for synthetic models and
+    prints the time per species, which stays flat when emission is linear.
+    '''
+    import tempfile, shutil, time
+    outdir = tempfile.mkdtemp()
+    try:
+        print '%10s %10s %12s %16s' % ('species', 'params', 'seconds', 'usec/species')
+        for n in sizes:
+            model = SyntheticModel(n, n)
+            t0 = time.time()
+            WriteArtifacts(model, outdir=outdir)
+            elapsed = time.time() - t0
+            print '%10d %10d %12.4f %16.3f' % (n, n, elapsed, 1e6*elapsed/n)
+    finally:
+        shutil.rmtree(outdir)
+
+def ScaledModel(model, copies):
+    '''copies of model coupled in a chain: every species of copy c also
+    exchanges with the same species of copies c-1 and c+1 at rate kx. the
+    species are listed species by species (A_0, A_1, ..., B_0, ...), so the
+    natural order has a wide band that a reordering can remove.
+    '''
+    names = set([ s.name for s in model.species ] + [ p.name for p in model.parameters ] +
+            [ e.name for e in model.dependent_species + model.expressions ])
+    def rename(formula, c):
+        def sub(m):
+            if m.group(2) and m.group(2) in names:
+                return '%s_%d' % (m.group(2), c)
+            return m.group(0)
+        return _token.sub(sub, formula)
+    scaled = modelir.Model('%s_x%d' % (model.name, copies))
+    scaled.parameters.append(modelir.Parameter('kx', '0.1'))
+    for c in range(copies):
+        scaled.parameters += [ modelir.Parameter('%s_%d' % (p.name, c), p.value)
+                for p in model.parameters ]
+        scaled.dependent_species += [ modelir.Expression('%s_%d' % (e.name, c),
+            rename(e.formula, c)) for e in model.dependent_species ]
+        scaled.expressions += [ modelir.Expression('%s_%d' % (e.name, c),
+            rename(e.formula, c)) for e in model.expressions ]
+    for s in model.species:
+        for c in range(copies):
+            ode = rename(s.ode, c)
+            for d in (c-1, c+1):
+                if 0 <= d < copies:
+                    ode += ' + kx*%s_%d - kx*%s_%d' % (s.name, d, s.name, c)
+            scaled.species.append(modelir.Species('%s_%d' % (s.name, c),
+                s.initial, ode))
+    return scaled
+
+def SparsityBenchmark(maplefile, copies_list=(1, 4, 16, 64)):
+    '''for chains of copies of a model, prints the jacobian bandwidth in
+    model order and after reverse Cuthill-McKee, the chosen solver and the
+    time to factor a newton matrix of that pattern densely and as a band.
+    '''
+    import time
+    import numpy as np
+    import scipy.linalg
+    base = modelir.Load(maplefile=maplefile)
+    print '%7s %6s %11s %11s %6s %4s %12s %12s' % ('species', 'nnz',
+            'natural', 'reordered', 'solver', '', 'dense LU', 'band LU')
+    for copies in copies_list:
+        model = ScaledModel(base, copies) if copies > 1 else base
+        structure = JacobianStructure(model)
+        n = len(structure)
+        natural = Bandwidth(structure)
+        solver = ChooseLinearSolver(model, True, structure)
+        order = solver.order if solver.order is not None else range(n)
+        position = [0]*n
+        for k, i in enumerate(order):
+            position[i] = k
+        # I - gamma*J with the pattern of the jacobian, diagonally dominant
+        a = np.eye(n)*(n + 1.0)
+        for i, deps in enumerate(structure):
+            for j in deps:
+                a[position[i], position[j]] += 0.5
+        repeat = max(1, 20000/n)
+        t0 = time.time()
+        for r in range(repeat):
+            scipy.linalg.lu_factor(a)
+        dense = (time.time() - t0)/repeat
+        mu, ml = solver.mupper, solver.mlower
+        ab = np.zeros((mu + ml + 1, n))
+        for j in range(n):
+            for i in range(max(0, j - mu), min(n, j + ml + 1)):
+                ab[mu + i - j, j] = a[i, j]
+        rhs = np.ones(n)
+        t0 = time.time()
+        for r in range(repeat if n > 1 else 0):
+            scipy.linalg.solve_banded((ml, mu), ab, rhs)
+        band = (time.time() - t0)/repeat
+        print '%7d %6d %11s %11s %6s %4s %10.1fus %10.1fus' % (n, solver.nnz,
+                '%d+%d' % natural, '%d+%d' % (mu, ml), solver.kind,
+                'rcm' if solver.order is not None else '', 1e6*dense, 1e6*band)
+
+def FoldBenchmark(maplefile, variants=None, flags=None, seconds=1.0):
+    '''for each variant of the model ({parameter: value} over its default
+    values, the model itself by default), compares the rhs and jacobian of
+    cvgen.py for the full model and for the model with its fixed parameters
+    folded (FoldParameters): prints the parameters, expressions and ode
+    terms of both, the evaluations/sec, the speedup and the largest
+    relative difference of the rhs.
+    '''
+    import tempfile, shutil
+    import cvgen
+    eqnfile = os.path.splitext(maplefile)[0] + '.eqn'
+    base = modelir.Load(eqnfile if os.path.isfile(eqnfile) else None, maplefile)
+    if not variants:
+        variants = [{}]
+    names = set([ p.name for p in base.parameters ])
+    scratch = tempfile.mkdtemp(prefix='fold-')
+    try:
+        print '%-24s %11s %11s %11s %12s %12s %8s %8s %9s' % ('variant', 'params',
+                'exprs', 'terms', 'full vf/s', 'folded vf/s', 'vf', 'jac', 'diff/vf')
+        for k, variant in enumerate(variants):
+            unknown = sorted(set(variant) - names)
+            if unknown:
+                raise ValueError('no parameter %s in %s' % (', '.join(unknown), maplefile))
+            model = copy.copy(base)
+            model.parameters = [ copy.copy(p) for p in base.parameters ]
+            for p in model.parameters:
+                if p.name in variant:
+                    p.value = variant[p.name]
+            specialised, folded = FoldParameters(model)
+            results, sizes = [], []
+            for label, m in (('full', model), ('folded', specialised)):
+                workdir = os.path.join(scratch, '%d_%s' % (k, label))
+                os.makedirs(workdir)
+                vffile = os.path.join(workdir, m.name + '.vf')
+                WriteAtomic(vffile, EmitVf(m))
+                results.append(cvgen.Evaluate(vffile, workdir, flags, seconds))
+                sizes.append((len(m.parameters), len(m.expressions),
+                    sum([ len(SplitTerms(s.ode or '0')) for s in m.species ])))
+            (full, full_f, full_j), (mine, mine_f, mine_j) = results
+            scale = max([ abs(v) for v in full_f.values() ] + [1e-300])
+            diff = max([ abs(full_f[i] - mine_f[i]) for i in full_f ] + [0.0])/scale
+            speedup = [ key in full and key in mine and '%.2fx' % (mine[key]/full[key]) or '-'
+                    for key in ('vf', 'jac') ]
+            label = ','.join([ '%s=%s' % (n, variant[n]) for n in sorted(variant) ]) or 'default'
+            print '%-24s %11s %11s %11s %12.4g %12.4g %8s %8s %9.3g' % (label,
+                    '%d->%d' % (sizes[0][0], sizes[1][0]), '%d->%d' % (sizes[0][1], sizes[1][1]),
+                    '%d->%d' % (sizes[0][2], sizes[1][2]), full['vf'], mine['vf'],
+                    speedup[0], speedup[1], diff)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+class RepeatedVelocityTest(unittest.TestCase):
+    '''facile/test/examples/moiety_repeated_velocity, whose reactions b ->
+    c + d and b -> e both have the velocity f1*b, with the odes of facile.pl
+    -L. run with python -m unittest factools.
+    '''
+    eqnfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'facile',
+            'test', 'examples', 'moiety_repeated_velocity', 'moiety_repeated_velocity.eqn')
+
+    def model(self):
+        model = modelir.ParseEqn(self.eqnfile)
+        model.parameters = [ modelir.Parameter('f1', '1') ]
+        model.species = [ modelir.Species('b', '100', '- f1*b - f1*b'),
+                modelir.Species('c', '0', '+ f1*b'), modelir.Species('d', '0', '+ f1*b'),
+                modelir.Species('e', '0', '+ f1*b') ]
+        return model
+
+    def test_reactions(self):
+        propensities, stoichiometry = ReactionNetwork(self.model())
+        self.assertEqual(propensities, ['f1*b', 'f1*b'])
+        self.assertEqual(stoichiometry, [[(0, -1.0), (1, 1.0), (2, 1.0)],
+            [(0, -1.0), (3, 1.0)]])
+
+    def test_conservation_laws(self):
+        # c - d and b + c + e, but not c - e
+        laws = ConservationLaws(self.model(), keep=['e'])
+        self.assertEqual(len(laws), 2)
+
+    def test_folded(self):
+        model, folded = FoldParameters(self.model(), ['f1'])
+        propensities, stoichiometry = ReactionNetwork(model)
+        self.assertEqual(propensities, ['b', 'b'])
+        self.assertEqual(stoichiometry, ReactionNetwork(self.model())[1])
+
+    def test_odes_only(self):
+        model = self.model()
+        model.reactions = []
+        self.assertRaises(ValueError, ReactionNetwork, model)
+
+def usage():
+    print 'usage: factools.py [options] model.maple [> model.vf]'
+    print '-o vf_file       : write the vf file here instead of stdout.'
+    print '-d out_dir       : directory of the other artifacts (default .).'
+    print '-a a1,a2,...     : emit only these artifacts (%s).' % ','.join(ARTIFACTS)
+    print '-r               : reorder the states for a narrower jacobian band.'
+    print '-m               : leave the dependent species of the conservation laws'
+    print '                   out of the states (reduce_moieties = 1 in CONFIG).'
+    print '-b               : benchmark the emitter on synthetic models.'
+    print '-f               : fold the parameters with a {v, v} range into the formulas'
+    print '                   and leave them out of the parameters (fold_fixed = 1 in CONFIG).'
+    print '-S               : benchmark the linear solver choice on scaled copies of model.maple.'
+    print '-F               : benchmark the rhs of model.maple with and without folding.'
+    print '-V p1=v1,p2=v2   : a variant of the parameter values for -F (repeatable).'
+    print '-D flags         : compiler and linker flags of -F (see cvgen.py -D).'
 
 def main(argv):
-    MapleToVfgen(argv[0])
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv, "ho:d:a:rmfbSFV:D:",
+                ["help", "output", "outdir", "artifacts", "reorder", "moiety", "fold",
+                    "benchmark", "sparsity", "fold-benchmark", "variant", "flags"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    vffile, outdir, artifacts, reorder, sparsity = None, '.', None, False, False
+    reduce, fold, fold_benchmark, variants, flags = None, None, False, [], None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-o', '--output'):
+            vffile = arg
+        elif opt in ('-d', '--outdir'):
+            outdir = arg
+        elif opt in ('-a', '--artifacts'):
+            artifacts = [ a.strip() for a in arg.split(',') if a.strip() ]
+        elif opt in ('-r', '--reorder'):
+            reorder = True
+        elif opt in ('-m', '--moiety'):
+            reduce = True
+        elif opt in ('-b', '--benchmark'):
+            Benchmark()
+            return
+        elif opt in ('-f', '--fold'):
+            fold = True
+        elif opt in ('-S', '--sparsity'):
+            sparsity = True
+        elif opt in ('-F', '--fold-benchmark'):
+            fold_benchmark = True
+        elif opt in ('-V', '--variant'):
+            variants.append(dict([ [ w.strip() for w in a.split('=', 1) ]
+                for a in arg.split(',') if '=' in a ]))
+        elif opt in ('-D', '--flags'):
+            flags = arg
+    if len(args) != 1:
+        usage()
+        sys.exit(2)
+    if sparsity:
+        SparsityBenchmark(args[0])
+        return
+    if fold_benchmark:
+        FoldBenchmark(args[0], variants, flags)
+        return
+    MapleToVfgen(args[0], vffile, artifacts, outdir, reorder, reduce, fold)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
-
@@ -1,38 +1,18 @@
 #!/usr/bin/python
 import os, unittest, sys
+import modelir
+import factools
 
-def Rates(argv):
+def Rates(argv, model=None):
     filename = argv[0]
-    found_target_section = False 
-    rates_lines = [ ] 
-    for a_line in file(filename):
-        a_line = a_line.strip()
-        if a_line == '' or a_line[0] == '#':
-            continue 
-        # first find and set found_target_section 
-        if a_line == 'EQN:':
-            found_target_section = True
-            continue 
-        # found another section? 
-        if found_target_section == True and a_line[-1] == ':':
-            break
-        if found_target_section: 
-            if a_line[:8] == 'variable':
-                rates_lines.append(a_line)
-
-    labels = [ ] 
-    values = [ ]
-    for a in rates_lines:
-        a = a.replace('variable', '')
-        a = a.strip()
-        a = a.split('#')
-        a = a[0]
-        a = a.split('=')
-        labels.append(a[0].strip())
-        values.append(a[1].strip())
-
-    values = [value for value in values]
-    labels = ['\''+label+'\'' for label in labels]
+    if model is None:
+        model = modelir.Load(eqnfile=filename)
+
+    # the engines of factools.py -f (fold_fixed = 1) have no fixed parameters
+    fold = model.config_value('fold_fixed', '0') not in ('0', 'no', 'false')
+    values = [ p.value for p in model.eqn_parameters if not (fold and p.fixed()) ]
+    # and with reduce_moieties = 1 the totals of the conservation laws last
+    values += [ p.value for p in factools.MoietyColumns(filename, model)[1] ]
     project = filename.split('.')[0]
     fout = open('%s_rates.m' % project,'w')
 
@@ -40,37 +20,15 @@ def Rates(argv):
     fout.write('values = [' + ",".join(values)+'];\n');
     fout.close() 
 
-def Ivalues(argv):
+def Ivalues(argv, model=None):
     filename = argv[0]
-    found_target_section = False 
-    ivalues_lines = [ ] 
-    for a_line in file(filename):
-        a_line = a_line.strip()
-        if a_line == '' or a_line[0] == '#':
-            continue 
-        # first find and set found_target_section 
-        if a_line == 'INIT:':
-            found_target_section = True
-            continue 
-        # found another section? 
-        if found_target_section == True and a_line[-1] == ':':
-            break
-        if found_target_section: 
-            ivalues_lines.append(a_line)
-
-    labels = [ ] 
-    values = [ ]
-    for a in ivalues_lines:
-        a = a.strip()
-        a = a.split('=')
-        labels.append(a[0].strip())
-        values.append(a[1].strip())
+    if model is None:
+        model = modelir.Load(eqnfile=filename)
 
-    values = [value for value in values]
-
-    values = [value.replace('uM','') for value in values]
-
-    labels = ['\''+label+'\'' for label in labels]
+    # with reduce_moieties = 1 the dependent species are not engine states
+    dependent = factools.MoietyColumns(filename, model)[0]
+    values = [ s.initial.replace('uM','') for s in model.eqn_species
+            if s.name not in dependent ]
     project = filename.split('.')[0]
     fout = open('%s_ivalues.m' % project,'w')
 
@@ -79,6 +37,6 @@ def Ivalues(argv):
     fout.close()
 
 if __name__ == '__main__':
-    Ivalues(sys.argv[1:])
-    Rates(sys.argv[1:])
-
+    model = modelir.Load(eqnfile=sys.argv[1])
+    Ivalues(sys.argv[1:], model)
+    Rates(sys.argv[1:], model)
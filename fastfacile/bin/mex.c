@@ -14,12 +14,21 @@
 #include <nvector/nvector_serial.h>
 #include <cvode/cvode.h>
 #include <cvode/cvode_dense.h>
+#include <cvode/cvode_band.h>
 #include <omp.h>
 #include "ode_size.h"
 #include "$(MODEL)_cv.c"
 
-#define PACKAGE_SIZE   (10) 
-#define THREAD_NUM     (64)
+/* linear solver and state order chosen by factools.py, see mex_mat.c */
+#ifndef STATE_INDEX
+#   define STATE_INDEX(k) (k)
+#endif
+
+/* the sample loop uses the runtime schedule of openmp. it is set from the 
+ * environment variables FASTFACILE_THREADS (0 = all processors), 
+ * FASTFACILE_SCHEDULE (static, dynamic or guided) and FASTFACILE_CHUNK. */
+#define DEFAULT_THREADS     (0)
+#define DEFAULT_CHUNK       (1)
 
 #define SOLVER_ABS_ERROR    1.0e-8
 #define SOLVER_REL_ERROR    1.0e-7
@@ -28,53 +37,99 @@
 
 void transpose(mxArray*dest, const mxArray*src);
 
+static int env_int(const char *name, int def) {
+    const char *value = getenv(name); 
+    if (value == NULL || value[0] == '\0') return def; 
+    return atoi(value); 
+}
+
+static int set_schedule(void) {
+    int num_threads = env_int("FASTFACILE_THREADS", DEFAULT_THREADS); 
+    int chunk = env_int("FASTFACILE_CHUNK", DEFAULT_CHUNK); 
+    const char *kind = getenv("FASTFACILE_SCHEDULE"); 
+    omp_sched_t omp_kind = omp_sched_dynamic; 
+    if (kind != NULL && strcmp(kind, "static") == 0) omp_kind = omp_sched_static; 
+    if (kind != NULL && strcmp(kind, "guided") == 0) omp_kind = omp_sched_guided; 
+    if (num_threads <= 0) num_threads = omp_get_num_procs(); 
+    omp_set_num_threads(num_threads); 
+    omp_set_schedule(omp_kind, chunk); 
+    return num_threads; 
+}
+
+/* solver state of one thread, created for its first sample and 
+ * re-initialised with CVodeReInit for every further sample. */
+typedef struct {
+    void *cvode_mem; 
+    N_Vector y0_; 
+} solver_context; 
+
+static int solver_init(solver_context *ctx, int num_species, realtype *ivalues, 
+        realtype *rates, realtype *solver_param_) {
+    int i, flag; 
+    realtype t0 = RCONST(0.0); 
+    if (ctx->cvode_mem == NULL) {
+        ctx->y0_ = N_VNew_Serial(num_species);
+        for (i = 0; i < num_species; ++i)
+            NV_Ith_S(ctx->y0_, i) = ivalues[STATE_INDEX(i)];
+        /* For non-stiff problems:   */
+        /* ctx->cvode_mem = CVodeCreate(CV_ADAMS, CV_FUNCTIONAL);*/
+
+        /* For stiff problems:       */
+        ctx->cvode_mem = CVodeCreate(CV_BDF,CV_NEWTON);
+        /* failures are returned as the flag of the sample instead of 
+         * being printed for every sample, as in mex_mat.c */
+        CVodeSetErrFile(ctx->cvode_mem, NULL); 
+        flag = CVodeMalloc(ctx->cvode_mem, $(MODEL)_vf, t0, ctx->y0_, CV_SS, 
+                solver_param_[1], &(solver_param_[0]));
+#ifdef __LINEAR_SOLVER_BAND__
+        flag = CVBand(ctx->cvode_mem, num_species, __BAND_MUPPER__, __BAND_MLOWER__);
+#else
+        flag = CVDense(ctx->cvode_mem, num_species);
+#endif
+    } else {
+        for (i = 0; i < num_species; ++i)
+            NV_Ith_S(ctx->y0_, i) = ivalues[STATE_INDEX(i)];
+        flag = CVodeReInit(ctx->cvode_mem, $(MODEL)_vf, t0, ctx->y0_, CV_SS, 
+                solver_param_[1], &(solver_param_[0]));
+    }
+    /* rates stay valid for the whole mexFunction call */
+    flag = CVodeSetFdata(ctx->cvode_mem, &(rates[0]));
+#ifndef __LINEAR_SOLVER_BAND__
+    flag = CVDenseSetJacFn(ctx->cvode_mem, $(MODEL)_jac, &(rates[0]));
+#elif defined(__ANALYTIC_BAND_JAC__)
+    flag = CVBandSetJacFn(ctx->cvode_mem, $(MODEL)_bjac, &(rates[0]));
+#endif
+    flag = CVodeSetStopTime(ctx->cvode_mem, solver_param_[2]);
+    return flag; 
+}
+
+static void solver_free(solver_context *ctx) {
+    if (ctx->cvode_mem != NULL) CVodeFree(&ctx->cvode_mem);
+    if (ctx->y0_ != NULL) N_VDestroy_Serial(ctx->y0_);
+    ctx->cvode_mem = NULL; 
+    ctx->y0_ = NULL; 
+}
+
 int worker(double *tvec, int tvec_size, int num_species, int num_parameter, 
         realtype *ivalues, realtype *rates, double* ptr_y_dynamics, 
-        double* ptr_y_steady) {
-    int i, j;
+        double* ptr_y_steady, solver_context *ctx) {
+    int j;
     int flag;
-    int argc = 1;
-    char *argv[] = { "default" };
-    realtype *y_ = (realtype*) malloc(sizeof(realtype) * num_species);
-    realtype *p_ = (realtype*) malloc(sizeof(realtype) * num_parameter);
-    char *solver_param_names_[4] = { "abserr", "relerr", "stoptime", "maxsteps" };
     double Tend = tvec[tvec_size - 1];
     realtype solver_param_[4] = { RCONST(SOLVER_ABS_ERROR), RCONST(SOLVER_REL_ERROR), 
         RCONST(Tend), RCONST(MAX_STEPS) };
     int t_idx;
 
-#define Ydynamics(ti,y) ptr_y_dynamics[(ti) + (y)*tvec_size] 
-#define Ysteady(ky) ptr_y_steady[ky]
-    
-    for (i = 0; i < num_species; ++i)
-        y_[i] = ivalues[i];
-    
-    for (i = 0; i < num_parameter; ++i)
-        p_[i] = rates[i];
-    
-    N_Vector y0_;
-    y0_ = N_VNew_Serial(num_species);
- 
-    for (i = 0; i < num_species; ++i)
-        NV_Ith_S(y0_, i) = y_[i];
+#define Ydynamics(ti,y) ptr_y_dynamics[(ti) + STATE_INDEX(y)*tvec_size] 
+#define Ysteady(ky) ptr_y_steady[STATE_INDEX(ky)]
     
-    /* For non-stiff problems:   */
-    /* void *cvode_mem = CVodeCreate(CV_ADAMS, CV_FUNCTIONAL);*/
+    flag = solver_init(ctx, num_species, ivalues, rates, solver_param_); 
+    void *cvode_mem = ctx->cvode_mem; 
+    N_Vector y0_ = ctx->y0_; 
 
-    /* For stiff problems:       */
-    void *cvode_mem = CVodeCreate(CV_BDF,CV_NEWTON);
-    realtype t, t1 ; 
+    realtype t; 
     t_idx = 0; 
     int n_try = 1;
-
-    t = RCONST(0.0);
-    flag = CVodeMalloc(cvode_mem, $(MODEL)_vf, t, y0_, CV_SS, solver_param_[1], 
-            &(solver_param_[0]));
-    flag = CVodeSetFdata(cvode_mem, &(p_[0]));
-    flag = CVDense(cvode_mem, num_species);
-    flag = CVDenseSetJacFn(cvode_mem, $(MODEL)_jac, &(p_[0]));
-    t1 = solver_param_[2];
-    flag = CVodeSetStopTime(cvode_mem, t1);
  
     while(t_idx < tvec_size && n_try <= MAX_SOLVER_TRY) {
         t = RCONST(0.0); /* reset start time */
@@ -88,7 +143,7 @@ int worker(double *tvec, int tvec_size, int num_species, int num_parameter,
                 /* Advance the solution */
                 flag = CVode(cvode_mem, tout, y0_, &t, CV_NORMAL);
                 if (flag != CV_SUCCESS && flag != CV_TSTOP_RETURN) {
-                    fprintf(stderr, "flag=%d (%dth try)\n", flag, n_try++);
+                    n_try++; 
                     break;
                 }
                 for (j = 0; j < num_species; ++j)
@@ -102,12 +157,6 @@ int worker(double *tvec, int tvec_size, int num_species, int num_parameter,
         Ysteady(j) = Ydynamics (tvec_size-1, j);
     }
 
-    /* free sundials memory */
-    N_VDestroy_Serial(y0_);
-    CVodeFree(&cvode_mem);
-    free(y_);
-    free(p_);
-
     return flag; 
 }
 
@@ -211,41 +260,26 @@ void mexFunction(int nlhs, mxArray *plhs[], /* Output variables */
     if(MRateConstants != __N_PARAMETERS__)
         mexErrMsgTxt("wrong number of rates\n");
 
-    /*int chunk_size = NRateConstants/THREAD_NUM/PACKAGE_SIZE; */
-    int chunk_size = PACKAGE_SIZE; 
-    if (chunk_size==0) chunk_size = 1; 
-    if (chunk_size==1) omp_set_num_threads(1); 
-    else omp_set_num_threads(THREAD_NUM); /* bug??? */
-
-    /*mexPrintf("max_thread: %d\n",omp_get_max_threads());*/
+    int num_threads = set_schedule(); 
+    solver_context *contexts = (solver_context*) mxCalloc(num_threads, 
+            sizeof(solver_context)); 
 
 #define P_RATECONSTANTS(k) &pRateConstants[0+(k)*MRateConstants] 
 #define P_INITIALCOND(k) &pInitialConditions[0+(k)*MInitialConditions] 
 #define P_FV(k) &pOutputFV[0+(k)*MInitialConditions] /* dim_fv == dim_ic */
 
-    if (THREAD_NUM==-1) /* auto detection */
-        omp_set_num_threads(omp_get_max_threads()); 
-    else
-        omp_set_num_threads(THREAD_NUM); /* fix the thread number */
-
-    /* There's too many error output in sundials, 
-     * so i decided to close it. */
-    FILE * freopenResult;    
-    freopenResult = freopen("/dev/null","w",stderr);
 #ifdef WITH_OMP
-#pragma omp parallel for shared(chunk_size, NRateConstants,pTimeVector,SizeTimeVector, \
-        MInitialConditions,MRateConstants,pRateConstants,pInitialConditions,pOutputFV,plhs) private (j,i)
+#pragma omp parallel for schedule(runtime) shared(NRateConstants,pTimeVector,SizeTimeVector, \
+        MInitialConditions,MRateConstants,pRateConstants,pInitialConditions,pOutputFV,plhs) private (i)
 #endif
-    for (j=0; j<NRateConstants; j+=chunk_size){
-        for(i=j;i<=j+chunk_size-1;++i) {
-            if(i>=NRateConstants) continue; 
-            /*mexPrintf("i = %d\n", i);*/
-            pOutputFlag[i] = (double)worker(pTimeVector, SizeTimeVector, MInitialConditions, MRateConstants, 
-                    P_INITIALCOND(i), P_RATECONSTANTS(i), mxGetPr(mxGetCell(Y,i)), 
-                    P_FV(i));
-        }
+    for (i=0; i<NRateConstants; ++i) {
+        pOutputFlag[i] = (double)worker(pTimeVector, SizeTimeVector, MInitialConditions, MRateConstants, 
+                P_INITIALCOND(i), P_RATECONSTANTS(i), mxGetPr(mxGetCell(Y,i)), 
+                P_FV(i), &contexts[omp_get_thread_num()]);
     }
-    freopenResult = freopen("/dev/tty","w",stderr);
+    for (i=0; i<num_threads; ++i) 
+        solver_free(&contexts[i]); 
+    mxFree(contexts); 
 
     /*transpose*/
     yf = mxCreateDoubleMatrix(NInitialConditions,MInitialConditions,mxREAL);
@@ -35,19 +35,110 @@
 #include <sys/types.h>
 #include <sys/wait.h>
 #include <assert.h>
+#include <stdint.h>
 #include <sundials/sundials_types.h>
 #include <sundials/sundials_dense.h>
 #include <sundials/sundials_nvector.h>
 #include <nvector/nvector_serial.h>
 #include <cvode/cvode.h>
 #include <cvode/cvode_dense.h>
+#include <cvode/cvode_band.h>
+#ifdef SENS
+#   include <cvodes/cvodes.h>
+#endif
 #include <omp.h>
-#include <gsl/gsl_rng.h>
 #include "ode_size.h"
 #include "$(MODEL)_cv.c"
 
-#define PACKAGE_SIZE   (10) 
-#define THREAD_NUM     (64)
+/* ode_size.h picks the linear solver from the structure of the jacobian 
+ * (factools.py). STATE_INDEX(k) is the model index of the k-th state of 
+ * the solver, which differs from k when the states were reordered for a 
+ * narrower band. */
+#ifndef STATE_INDEX
+#   define STATE_INDEX(k) (k)
+#endif
+
+#ifdef SDE
+/* -DSDE builds the chemical langevin engine: the samples are integrated 
+ * with euler-maruyama steps of the reaction network that factools.py 
+ * extracts from the odes (ode_size.h), a block of SDE_BLOCK samples in 
+ * lockstep, instead of kicking the cvode state at the output times. the 
+ * step is at most SDE_DT and is shortened to hit every output time; 
+ * FASTFACILE_SDE_DT or engine_set_sde() change it. it takes zeta like the 
+ * langevin engine. */
+#   ifdef STEADY
+#       error "the SDE engine has no steady state mode"
+#   endif
+#   ifndef LANGEVIN
+#       define LANGEVIN
+#   endif
+#   define SDE_DT       1.0e-3
+#   define SDE_BLOCK    (32)
+static double sde_dt_ = -1.0; /* -1 means not set by engine_set_sde() */
+#endif
+
+#ifdef SSA
+/* -DSSA builds the exact stochastic engine: every sample is simulated with 
+ * the gillespie direct method on the reaction network of ode_size.h, in 
+ * numbers of molecules (concentration*zeta). after a reaction fires, only 
+ * the propensities that depend on the species it changed are evaluated 
+ * again (depend_reaction_). with SSA_TAU_LEAPING (FASTFACILE_SSA=tau or 
+ * engine_set_ssa()), the engine leaps over many events at a time with the 
+ * step selection of cao, gillespie and petzold (2006) and takes exact 
+ * steps where a leap would hold few events. it takes zeta like the 
+ * langevin engine. */
+#   if defined(STEADY) || defined(SDE)
+#       error "the SSA engine has no steady state or SDE mode"
+#   endif
+#   ifndef LANGEVIN
+#       define LANGEVIN
+#   endif
+#   define SSA_DIRECT           (1)
+#   define SSA_TAU_LEAPING      (2)
+#   define SSA_EPSILON          3.0e-2
+#   define SSA_MAX_EVENTS       1.0e+9
+/* a leap that is expected to hold fewer events than SSA_LEAP_MIN_EVENTS is 
+ * replaced by up to SSA_EXACT_STEPS exact steps */
+#   define SSA_LEAP_MIN_EVENTS  (10.0)
+#   define SSA_EXACT_STEPS      (100)
+/* the total propensity is summed again every SSA_RESUM events, so that 
+ * its incremental updates do not accumulate rounding errors */
+#   define SSA_RESUM            (1000)
+/* -1 means not set by engine_set_ssa() */
+static int ssa_method_ = -1; 
+static double ssa_epsilon_ = -1.0; 
+#endif
+
+/* the stochastic engines integrate the reaction network instead of 
+ * calling cvode */
+#if defined(SDE) || defined(SSA)
+#   define NETWORK_ENGINE
+#endif
+
+#ifdef SENS
+/* -DSENS builds the forward sensitivity engine: cvodes integrates, with 
+ * every sample, dy/dp of the parameters selected by engine_set_sens() (by 
+ * default FASTFACILE_SENS, a comma separated list of parameter names, or 
+ * else all parameters). the sensitivity rhs are the difference quotients 
+ * of cvodes, scaled by pbar = |p| (1 for p = 0), and the sensitivities take 
+ * part in the error test. engine() and engine_to_file() take the trailing 
+ * sens_array and sens_path arguments. */
+#   if defined(STEADY) || defined(LANGEVIN) || defined(NETWORK_ENGINE)
+#       error "the SENS engine has no steady state, langevin or stochastic mode"
+#   endif
+#endif
+
+/* scheduling of the sample loop. the defaults can be changed with the 
+ * environment variables FASTFACILE_THREADS (0 = all processors), 
+ * FASTFACILE_SCHEDULE (static, dynamic or guided) and FASTFACILE_CHUNK, 
+ * or at call time with engine_set_schedule(). */
+#define SCHEDULE_STATIC     (1)
+#define SCHEDULE_DYNAMIC    (2)
+#define SCHEDULE_GUIDED     (3)
+#define DEFAULT_THREADS     (0)
+#define DEFAULT_SCHEDULE    SCHEDULE_DYNAMIC
+#define DEFAULT_CHUNK       (1)
+#define MAX_THREAD_STATS    (1024)
 
 #define SOLVER_ABS_ERROR    1.0e-8
 #define SOLVER_REL_ERROR    1.0e-7
@@ -55,6 +146,36 @@
 #define MAX_STEPS           1.0e+5
 #define MAX_SOLVER_TRY      1
 
+/* per-sample solver statistics: the columns of the (samples, NUM_STATS) 
+ * array of engine_set_stats(). the counters are the ones of cvode for the 
+ * sample; retries are the tries that ended in a solver error and wall is 
+ * the time of the sample in seconds. the stochastic engines count their 
+ * steps (SDE) or events (SSA) as steps. */
+#define STAT_STEPS          (0)
+#define STAT_RHS_EVALS      (1)
+#define STAT_JAC_EVALS      (2)
+#define STAT_ERR_TEST_FAILS (3)
+#define STAT_NONLIN_FAILS   (4)
+#define STAT_RETRIES        (5)
+#define STAT_WALL           (6)
+#define NUM_STATS           (7)
+
+/* samples integrated at a time by engine_to_file() when the caller gives 
+ * no chunk size; bounds its memory to OUTPUT_CHUNK_SAMPLES trajectories. */
+#define OUTPUT_CHUNK_SAMPLES (10000)
+
+#ifdef STEADY
+/* a sample has converged when max_i |dy_i/dt| / (abs_tol + rel_tol*|y_i|) 
+ * <= 1 at window consecutive points of tvec. its integration stops there 
+ * and yss is the state at that time (t_conv). engine_set_steady() changes 
+ * the tolerances at call time. */
+#   define STEADY_REL_TOL   1.0e-6
+#   define STEADY_ABS_TOL   1.0e-12
+#   define STEADY_WINDOW    (2)
+static double steady_rel_tol_ = STEADY_REL_TOL; 
+static double steady_abs_tol_ = STEADY_ABS_TOL; 
+static int steady_window_ = STEADY_WINDOW; 
+#endif
 
 
 
@@ -63,8 +184,22 @@ void transp(mxArray*dest, const mxArray*src);
 #endif 
 
 
+/* langevin noise. every sample draws from its own counter based stream 
+ * (philox4x32-10) keyed by the master seed and numbered by the index of 
+ * the sample, so the noise of a sample does not depend on the thread that 
+ * runs it, the number of threads or the schedule. the master seed is the 
+ * one of engine_set_seed(), else FASTFACILE_SEED, else drawn from the 
+ * clock and the process id for every call; engine_last_seed() returns the 
+ * seed of the last call. */
+typedef struct {
+    uint32_t key[2]; 
+    uint32_t ctr[4]; /* draw (ctr[0], ctr[1]) of sample (ctr[2], ctr[3]) */
+    double spare;    /* second normal of the last draw (SDE engine) */
+    int has_spare; 
+} noise_stream; 
+
 #ifdef LANGEVIN
-double noise2(gsl_rng *r, double x, double zeta);
+double noise2(noise_stream *stream, double x, double zeta);
 #endif 
 
 
@@ -81,8 +216,675 @@ int engine(
         double *ptr_output_flag
 #ifdef LANGEVIN
         ,double zeta
+#endif 
+#ifdef SENS
+        ,double *sens_array
+#endif 
+        );
+
+
+#ifndef STEADY
+int engine_to_file(
+        int num_timepoints, 
+        double *ptr_timepoints, 
+        int num_samples_rates, 
+        int num_species_ival, 
+        double *ivalues_array, 
+        int num_params_rates, 
+        double *rates_array, 
+        const char *path, 
+        int chunk_samples, 
+        double *yss_array, 
+        double *ptr_output_flag
+#ifdef LANGEVIN
+        ,double zeta
+#endif 
+#ifdef SENS
+        ,const char *sens_path
+#endif 
+        );
+#endif 
+
+#ifndef STEADY
+int engine_readout(
+        int num_timepoints, 
+        double *ptr_timepoints, 
+        int num_samples_rates, 
+        int num_species_ival, 
+        double *ivalues_array, 
+        int num_params_rates, 
+        double *rates_array, 
+        double *scores_array, 
+        int top_k, 
+        int rank_by, 
+        double *top_y_array, 
+        double *top_index_array, 
+        double *yss_array, 
+        double *ptr_output_flag
+#ifdef LANGEVIN
+        ,double zeta
+#endif 
+        );
+#endif 
+
+#ifdef STEADY
+int engine_steady(
+        int num_timepoints, 
+        double *ptr_timepoints, 
+        int num_samples_rates, 
+        int num_species_ival, 
+        double *ivalues_array, 
+        int num_params_rates, 
+        double *rates_array, 
+        double *yss_array, 
+        double *ptr_output_flag, 
+        double *tconv_array, 
+        double *converged_array
+#ifdef LANGEVIN
+        ,double zeta
 #endif 
         );
+#endif 
+
+
+/* bit flags describing how this engine was compiled. pyengine.py reads 
+ * them to decide whether engine() takes the trailing zeta (or sens_array) 
+ * argument. */
+#define ENGINE_VARIANT_LANGEVIN   (1)
+#define ENGINE_VARIANT_STEADY     (2)
+#define ENGINE_VARIANT_SDE        (4)
+#define ENGINE_VARIANT_SSA        (8)
+#define ENGINE_VARIANT_SENS       (16)
+
+int engine_variant(void)
+{
+    int variant = 0; 
+#ifdef LANGEVIN
+    variant |= ENGINE_VARIANT_LANGEVIN; 
+#endif
+#ifdef STEADY
+    variant |= ENGINE_VARIANT_STEADY; 
+#endif
+#ifdef SDE
+    variant |= ENGINE_VARIANT_SDE; 
+#endif
+#ifdef SSA
+    variant |= ENGINE_VARIANT_SSA; 
+#endif
+#ifdef SENS
+    variant |= ENGINE_VARIANT_SENS; 
+#endif
+    return variant; 
+}
+
+
+/* -1 means not set by engine_set_schedule() */
+static int sched_threads_ = -1; 
+static int sched_kind_ = -1; 
+static int sched_chunk_ = -1; 
+
+/* per-thread statistics of the last engine() call, summed over all its 
+ * run_samples() calls (the chunks of engine_to_file(), the rerun of the 
+ * top samples of engine_readout()) */
+static int stats_threads_ = 0; 
+static double stats_wall_ = 0.0; 
+static double stats_busy_[MAX_THREAD_STATS]; 
+static double stats_samples_[MAX_THREAD_STATS]; 
+#ifdef SSA
+static double stats_events_[MAX_THREAD_STATS]; 
+static double stats_leaps_[MAX_THREAD_STATS]; 
+#endif
+
+int engine_set_schedule(int num_threads, int kind, int chunk)
+{
+    if (kind != -1 && kind != SCHEDULE_STATIC && kind != SCHEDULE_DYNAMIC 
+            && kind != SCHEDULE_GUIDED)
+        return -1; 
+    sched_threads_ = num_threads; 
+    sched_kind_ = kind; 
+    sched_chunk_ = chunk; 
+    return 0; 
+}
+
+/* copies busy seconds and number of samples of each thread of the last 
+ * engine() call into busy and samples (either may be NULL), and the wall 
+ * time of its sample loop into wall. returns the number of threads. */
+int engine_thread_stats(double *busy, double *samples, int max_threads, 
+        double *wall)
+{
+    int k; 
+    for (k = 0; k < stats_threads_ && k < max_threads; ++k) {
+        if (busy != NULL) busy[k] = stats_busy_[k]; 
+        if (samples != NULL) samples[k] = stats_samples_[k]; 
+    }
+    if (wall != NULL) 
+        *wall = stats_wall_; 
+    return stats_threads_; 
+}
+
+/* clears the statistics, once at the start of every engine call */
+static void stats_reset(int num_threads)
+{
+    int k; 
+    stats_threads_ = num_threads < MAX_THREAD_STATS ? num_threads 
+        : MAX_THREAD_STATS; 
+    stats_wall_ = 0.0; 
+    for (k = 0; k < stats_threads_; ++k) { 
+        stats_busy_[k] = 0.0; 
+        stats_samples_[k] = 0.0; 
+#ifdef SSA
+        stats_events_[k] = 0.0; 
+        stats_leaps_[k] = 0.0; 
+#endif
+    }
+}
+
+/* 0 means not set by engine_set_seed() */
+static int seed_fixed_ = 0; 
+static unsigned long long seed_ = 0; 
+static long long seed_first_ = 0; 
+static unsigned long long seed_last_ = 0; 
+
+/* fixed = 1 uses seed as the master seed of the langevin noise of the 
+ * following calls, fixed = 0 goes back to FASTFACILE_SEED or the clock. 
+ * first_sample is the stream index of the first sample of a call, so that 
+ * a batch split into several calls gets the noise of one call. */
+int engine_set_seed(int fixed, unsigned long long seed, long long first_sample)
+{
+    if (first_sample < 0) 
+        return -1; 
+    seed_fixed_ = fixed ? 1 : 0; 
+    seed_ = seed; 
+    seed_first_ = first_sample; 
+    return 0; 
+}
+
+unsigned long long engine_last_seed(void)
+{
+    return seed_last_; 
+}
+
+/* the master seed of a call */
+static unsigned long long engine_seed(void)
+{
+    const char *value = getenv("FASTFACILE_SEED"); 
+    if (seed_fixed_) 
+        seed_last_ = seed_; 
+    else if (value != NULL && value[0] != '\0') 
+        seed_last_ = strtoull(value, NULL, 0); 
+    else 
+        seed_last_ = (unsigned long long) time(NULL)*getpid(); 
+    return seed_last_; 
+}
+
+static void noise_stream_init(noise_stream *stream, unsigned long long seed, 
+        long long sample)
+{
+    stream->key[0] = (uint32_t) seed; 
+    stream->key[1] = (uint32_t) (seed >> 32); 
+    stream->ctr[0] = 0; 
+    stream->ctr[1] = 0; 
+    stream->ctr[2] = (uint32_t) sample; 
+    stream->ctr[3] = (uint32_t) ((unsigned long long) sample >> 32); 
+    stream->has_spare = 0; 
+}
+
+static int env_int(const char *name, int def)
+{
+    const char *value = getenv(name); 
+    if (value == NULL || value[0] == '\0') 
+        return def; 
+    return atoi(value); 
+}
+
+static double env_double(const char *name, double def)
+{
+    const char *value = getenv(name); 
+    if (value == NULL || value[0] == '\0' || atof(value) <= 0.0) 
+        return def; 
+    return atof(value); 
+}
+
+static int env_schedule(const char *name, int def)
+{
+    const char *value = getenv(name); 
+    if (value == NULL || value[0] == '\0') 
+        return def; 
+    if (strcmp(value, "static") == 0) return SCHEDULE_STATIC; 
+    if (strcmp(value, "dynamic") == 0) return SCHEDULE_DYNAMIC; 
+    if (strcmp(value, "guided") == 0) return SCHEDULE_GUIDED; 
+    return def; 
+}
+
+/* sets the number of threads and the runtime schedule used by the sample 
+ * loop, and returns the number of threads. */
+static int engine_schedule(void)
+{
+    int num_threads = sched_threads_ >= 0 ? sched_threads_ 
+        : env_int("FASTFACILE_THREADS", DEFAULT_THREADS); 
+    int kind = sched_kind_ > 0 ? sched_kind_ 
+        : env_schedule("FASTFACILE_SCHEDULE", DEFAULT_SCHEDULE); 
+    int chunk = sched_chunk_ >= 0 ? sched_chunk_ 
+        : env_int("FASTFACILE_CHUNK", DEFAULT_CHUNK); 
+    omp_sched_t omp_kind = omp_sched_dynamic; 
+
+    if (num_threads <= 0) 
+        num_threads = omp_get_num_procs(); 
+    if (kind == SCHEDULE_STATIC) 
+        omp_kind = omp_sched_static; 
+    else if (kind == SCHEDULE_GUIDED) 
+        omp_kind = omp_sched_guided; 
+
+    omp_set_num_threads(num_threads); 
+    /* a chunk of 0 is the default of the schedule kind */
+    omp_set_schedule(omp_kind, chunk); 
+    return num_threads; 
+}
+
+
+#ifdef SENS
+/* the parameters whose sensitivities are integrated, as indices into the 
+ * rates of a sample */
+typedef struct {
+    int count; 
+    int params[__N_PARAMETERS__ > 0 ? __N_PARAMETERS__ : 1]; 
+} sens_selection; 
+
+/* -1 means not set by engine_set_sens() */
+static int sens_count_ = -1; 
+static int sens_params_[__N_PARAMETERS__ > 0 ? __N_PARAMETERS__ : 1]; 
+
+/* the following calls integrate the sensitivities of the num_params 
+ * parameters of params; num_params < 0 goes back to FASTFACILE_SENS. 
+ * returns -1 if an index is not one of a parameter. */
+int engine_set_sens(int num_params, const int *params)
+{
+    int k; 
+    if (num_params > __N_PARAMETERS__) 
+        return -1; 
+    for (k = 0; k < num_params; ++k) 
+        if (params[k] < 0 || params[k] >= __N_PARAMETERS__) 
+            return -1; 
+    for (k = 0; k < num_params; ++k) 
+        sens_params_[k] = params[k]; 
+    sens_count_ = num_params < 0 ? -1 : num_params; 
+    return 0; 
+}
+
+/* the selection of the following calls. names of FASTFACILE_SENS that are 
+ * not parameters of the model are left out. */
+static void sens_selection_init(sens_selection *sens)
+{
+    int k; 
+    const char *name = getenv("FASTFACILE_SENS"); 
+    sens->count = 0; 
+    if (sens_count_ >= 0) {
+        for (k = 0; k < sens_count_; ++k) 
+            sens->params[sens->count++] = sens_params_[k]; 
+    } else if (name != NULL && name[0] != '\0') {
+        while (*name != '\0') {
+            size_t len = strcspn(name, ", "); 
+            for (k = 0; k < __N_PARAMETERS__ && sens->count < __N_PARAMETERS__; ++k) 
+                if (len > 0 && strlen(parnames_[k]) == len 
+                        && strncmp(parnames_[k], name, len) == 0) {
+                    sens->params[sens->count++] = k; 
+                    break; 
+                }
+            name += len; 
+            name += strspn(name, ", "); 
+        }
+    } else {
+        for (k = 0; k < __N_PARAMETERS__; ++k) 
+            sens->params[sens->count++] = k; 
+    }
+}
+
+/* copies the parameters of the sensitivities of the following calls into 
+ * params and returns their number, the last axis of sens_array. */
+int engine_sens(int *params)
+{
+    int k; 
+    sens_selection sens; 
+    sens_selection_init(&sens); 
+    for (k = 0; k < sens.count; ++k) 
+        params[k] = sens.params[k]; 
+    return sens.count; 
+}
+#endif
+
+
+/* solver state of one thread. the cvode memory with its linear 
+ * solver and the state vector are created for the first sample of the 
+ * thread and re-initialised with CVodeReInit for every further sample, so 
+ * a batch allocates them once per thread instead of once per sample. */
+typedef struct {
+    void *cvode_mem; 
+    N_Vector yt; 
+#ifdef STEADY
+    N_Vector ft; /* rhs for the convergence test */
+#endif
+#ifdef SENS
+    N_Vector *yS;  /* dy/dp of the selected parameters */
+    int num_sens; 
+    realtype pbar[__N_PARAMETERS__ > 0 ? __N_PARAMETERS__ : 1]; 
+#endif
+} solver_context; 
+
+static int solver_init(
+        solver_context *ctx, 
+        int num_species, 
+        realtype *ivalues, 
+        realtype *rates, 
+        realtype *solver_param_
+#ifdef SENS
+        , const sens_selection *sens
+#endif
+        )
+{
+    int i, cvode_flag; 
+    realtype t0 = RCONST(0.0); 
+
+    if (ctx->cvode_mem == NULL) {
+        ctx->yt = N_VNew_Serial(num_species);
+        for (i = 0; i < num_species; ++i)
+            NV_Ith_S(ctx->yt, i) = ivalues[STATE_INDEX(i)];
+#ifdef STEADY
+        ctx->ft = N_VNew_Serial(num_species);
+#endif
+
+        /* For non-stiff problems: */
+        /* ctx->cvode_mem = CVodeCreate(CV_ADAMS, CV_FUNCTIONAL); */
+
+        /* For stiff problems: */
+        ctx->cvode_mem = CVodeCreate(CV_BDF, CV_NEWTON);
+        /* failures are returned as the flag of the sample and counted in 
+         * its statistics instead of being printed for every sample */
+        CVodeSetErrFile(ctx->cvode_mem, NULL); 
+
+        cvode_flag = CVodeMalloc(
+                ctx->cvode_mem, 
+                $(MODEL)_vf, 
+                t0, 
+                ctx->yt, 
+                CV_SS, 
+                solver_param_[1], 
+                &(solver_param_[0])
+                );
+
+#ifdef __LINEAR_SOLVER_BAND__
+        /* the band jacobian is $(MODEL)_bjac of cvgen.py. with the cv files 
+         * of vfgen it is approximated by difference quotients with 
+         * mupper + mlower + 1 rhs evaluations */
+        cvode_flag = CVBand(
+                ctx->cvode_mem, 
+                num_species, 
+                __BAND_MUPPER__, 
+                __BAND_MLOWER__
+                );
+#else
+        cvode_flag = CVDense(
+                ctx->cvode_mem, 
+                num_species
+                );
+#endif
+    } else {
+        for (i = 0; i < num_species; ++i)
+            NV_Ith_S(ctx->yt, i) = ivalues[STATE_INDEX(i)];
+
+        /* keeps the linear solver attached to cvode_mem */
+        cvode_flag = CVodeReInit(
+                ctx->cvode_mem, 
+                $(MODEL)_vf, 
+                t0, 
+                ctx->yt, 
+                CV_SS, 
+                solver_param_[1], 
+                &(solver_param_[0])
+                );
+    }
+
+    cvode_flag = CVodeSetFdata(
+            ctx->cvode_mem, 
+            &(rates[0])
+            );
+
+#ifndef __LINEAR_SOLVER_BAND__
+    cvode_flag = CVDenseSetJacFn(
+            ctx->cvode_mem, 
+            $(MODEL)_jac, 
+            &(rates[0])
+            );
+#elif defined(__ANALYTIC_BAND_JAC__)
+    cvode_flag = CVBandSetJacFn(
+            ctx->cvode_mem, 
+            $(MODEL)_bjac, 
+            &(rates[0])
+            );
+#endif
+
+    cvode_flag = CVodeSetStopTime(
+            ctx->cvode_mem, 
+            solver_param_[2]
+            );
+
+#ifdef SENS
+    /* the sensitivities start at 0, since the initial values do not 
+     * depend on the rates. the selection is the same for every sample of 
+     * a call, so the sensitivity memory of the thread is re-initialised 
+     * like cvode_mem. */
+    if (sens->count > 0) {
+        if (ctx->yS == NULL) {
+            ctx->yS = N_VCloneVectorArray_Serial(sens->count, ctx->yt); 
+            ctx->num_sens = sens->count; 
+            for (i = 0; i < sens->count; ++i) 
+                N_VConst(RCONST(0.0), ctx->yS[i]); 
+            cvode_flag = CVodeSensMalloc(ctx->cvode_mem, sens->count, 
+                    CV_STAGGERED, ctx->yS); 
+        } else {
+            for (i = 0; i < sens->count; ++i) 
+                N_VConst(RCONST(0.0), ctx->yS[i]); 
+            cvode_flag = CVodeSensReInit(ctx->cvode_mem, CV_STAGGERED, ctx->yS); 
+        }
+        /* pbar scales the difference quotients and the tolerances of the 
+         * sensitivities to the size of each parameter */
+        for (i = 0; i < sens->count; ++i) {
+            realtype p = rates[sens->params[i]]; 
+            ctx->pbar[i] = p != RCONST(0.0) ? fabs(p) : RCONST(1.0); 
+        }
+        cvode_flag = CVodeSetSensParams(ctx->cvode_mem, &(rates[0]), 
+                ctx->pbar, (int*) sens->params); 
+        cvode_flag = CVodeSetSensErrCon(ctx->cvode_mem, TRUE); 
+    }
+#endif
+
+    return cvode_flag; 
+}
+
+/* the cvode counters of the sample that ctx integrated last. */
+static void solver_stats(solver_context *ctx, int retries, double *stats)
+{
+    long steps = 0, rhs_evals = 0, jac_evals = 0, dq_rhs_evals = 0; 
+    long err_test_fails = 0, nonlin_fails = 0; 
+
+    CVodeGetNumSteps(ctx->cvode_mem, &steps); 
+    CVodeGetNumRhsEvals(ctx->cvode_mem, &rhs_evals); 
+    CVodeGetNumErrTestFails(ctx->cvode_mem, &err_test_fails); 
+    CVodeGetNumNonlinSolvConvFails(ctx->cvode_mem, &nonlin_fails); 
+#ifdef __LINEAR_SOLVER_BAND__
+    /* the difference quotient jacobian costs rhs evaluations as well */
+    CVBandGetNumJacEvals(ctx->cvode_mem, &jac_evals); 
+    CVBandGetNumRhsEvals(ctx->cvode_mem, &dq_rhs_evals); 
+#else
+    CVDenseGetNumJacEvals(ctx->cvode_mem, &jac_evals); 
+#endif
+#ifdef SENS
+    /* the rhs evaluations of the sensitivity difference quotients */
+    if (ctx->yS != NULL) {
+        long sens_rhs_evals = 0; 
+        CVodeGetNumRhsEvalsSens(ctx->cvode_mem, &sens_rhs_evals); 
+        rhs_evals += sens_rhs_evals; 
+    }
+#endif
+    stats[STAT_STEPS] = (double) steps; 
+    stats[STAT_RHS_EVALS] = (double) (rhs_evals + dq_rhs_evals); 
+    stats[STAT_JAC_EVALS] = (double) jac_evals; 
+    stats[STAT_ERR_TEST_FAILS] = (double) err_test_fails; 
+    stats[STAT_NONLIN_FAILS] = (double) nonlin_fails; 
+    stats[STAT_RETRIES] = (double) retries; 
+}
+
+#ifndef NETWORK_ENGINE
+static void solver_free(solver_context *ctx)
+{
+    if (ctx->cvode_mem != NULL) 
+        CVodeFree(&ctx->cvode_mem);
+    if (ctx->yt != NULL) 
+        N_VDestroy_Serial(ctx->yt);
+    ctx->cvode_mem = NULL; 
+    ctx->yt = NULL; 
+#ifdef STEADY
+    if (ctx->ft != NULL) 
+        N_VDestroy_Serial(ctx->ft);
+    ctx->ft = NULL; 
+#endif
+#ifdef SENS
+    if (ctx->yS != NULL) 
+        N_VDestroyVectorArray_Serial(ctx->yS, ctx->num_sens); 
+    ctx->yS = NULL; 
+#endif
+}
+#endif
+
+
+/* the statistics of the samples of the following engine(), 
+ * engine_steady() and engine_to_file() calls are written to stats_array, 
+ * (samples, NUM_STATS) in C order; NULL (the default) turns them off. 
+ * returns NUM_STATS. */
+static double *stats_array_ = NULL; 
+
+int engine_set_stats(double *stats_array)
+{
+    stats_array_ = stats_array; 
+    return NUM_STATS; 
+}
+
+
+/* the part of every trajectory that is stored: the points 0, stride, 
+ * 2*stride, ... of tvec and the species of the PROBE section of the model 
+ * (probe_species_ of ode_size.h), in that order, or all species. the 
+ * solver still stops at every point of tvec, so the langevin noise and 
+ * the solution do not change. by default the probes are used when the 
+ * model has any and stride is OUTPUT_STRIDE (output_stride in the CONFIG 
+ * section); FASTFACILE_OUTPUT_PROBES (0 or 1) and FASTFACILE_OUTPUT_STRIDE 
+ * override that, and engine_set_output() overrides both (-1 = default). */
+typedef struct {
+    int stride; 
+    int num_times; 
+    int num_species; 
+    int position[__N_SPECIES__ > 0 ? __N_SPECIES__ : 1]; /* column of model species k, or -1 */
+} output_layout; 
+
+static int output_probes_ = -1; 
+static int output_stride_ = -1; 
+
+int engine_set_output(int probes, int stride)
+{
+    output_probes_ = probes < 0 ? -1 : probes > 0; 
+    output_stride_ = stride > 0 ? stride : -1; 
+    return 0; 
+}
+
+/* the layout of trajectories over num_timepoints points of tvec; every 
+ * species at every point if full (the scratch blocks of the readouts). */
+static void output_layout_init(output_layout *layout, int num_timepoints, int full)
+{
+    int k; 
+    int probes = output_probes_ >= 0 ? output_probes_ 
+        : env_int("FASTFACILE_OUTPUT_PROBES", __N_PROBES__ > 0); 
+    int stride = output_stride_ > 0 ? output_stride_ 
+        : env_int("FASTFACILE_OUTPUT_STRIDE", OUTPUT_STRIDE); 
+
+    if (full || __N_PROBES__ == 0) 
+        probes = 0; 
+    if (full || stride < 1) 
+        stride = 1; 
+    layout->stride = stride; 
+    layout->num_times = num_timepoints > 0 ? (num_timepoints - 1)/stride + 1 : 0; 
+    layout->num_species = probes ? __N_PROBES__ : __N_SPECIES__; 
+    for (k = 0; k < __N_SPECIES__; ++k) 
+        layout->position[k] = probes ? -1 : k; 
+    for (k = 0; k < __N_PROBES__ && probes; ++k) 
+        layout->position[probe_species_[k]] = k; 
+}
+
+/* the values of one stored trajectory */
+#define OUTPUT_VALUES(layout) ((size_t) (layout)->num_times*(layout)->num_species)
+
+/* stores value, model species k at point tidx of tvec, into the 
+ * trajectory y of a sample if the layout keeps it */
+#define OUTPUT_STORE(layout, y, tidx, k, value) \
+    do { \
+        if ((tidx) % (layout)->stride == 0 && (layout)->position[k] >= 0) \
+            (y)[(size_t) ((tidx)/(layout)->stride)*(layout)->num_species \
+                + (layout)->position[k]] = (value); \
+    } while (0)
+
+#ifdef SENS
+/* stores the num_sens sensitivities dy_k/dp of model species k at point 
+ * tidx into the block s of a sample, (times, species, num_sens) in the 
+ * layout of its trajectory. value(is) is the is-th sensitivity. */
+#define SENS_STORE(layout, s, tidx, k, num_sens, value) \
+    do { \
+        int is_; \
+        if ((tidx) % (layout)->stride == 0 && (layout)->position[k] >= 0) \
+            for (is_ = 0; is_ < (num_sens); ++is_) \
+                (s)[((size_t) ((tidx)/(layout)->stride)*(layout)->num_species \
+                    + (layout)->position[k])*(num_sens) + is_] = value(is_); \
+    } while (0)
+#endif
+
+/* the shape of the trajectories that engine() returns for num_timepoints 
+ * points of tvec: (samples, *num_times, returned value), the points 0, 
+ * *stride, 2*(*stride), ... of tvec and the model index of every column in 
+ * species. */
+int engine_output(int num_timepoints, int *num_times, int *stride, int *species)
+{
+    int k; 
+    output_layout layout; 
+    output_layout_init(&layout, num_timepoints, 0); 
+    *num_times = layout.num_times; 
+    *stride = layout.stride; 
+    for (k = 0; k < __N_SPECIES__; ++k) 
+        if (layout.position[k] >= 0) 
+            species[layout.position[k]] = k; 
+    return layout.num_species; 
+}
+
+#ifdef STEADY
+int engine_set_steady(double rel_tol, double abs_tol, int window)
+{
+    if (rel_tol < 0.0 || abs_tol < 0.0 || window < 1) 
+        return -1; 
+    steady_rel_tol_ = rel_tol; 
+    steady_abs_tol_ = abs_tol; 
+    steady_window_ = window; 
+    return 0; 
+}
+
+/* 1 if the rhs at (t, y) is below the steady state tolerance. */
+static int steady_point(solver_context *ctx, realtype t, realtype *rates, 
+        int num_species)
+{
+    int j; 
+    $(MODEL)_vf(t, ctx->yt, ctx->ft, rates); 
+    for (j = 0; j < num_species; ++j) {
+        double scale = steady_abs_tol_ + steady_rel_tol_*fabs(NV_Ith_S(ctx->yt, j)); 
+        if (fabs(NV_Ith_S(ctx->ft, j)) > scale) 
+            return 0; 
+    }
+    return 1; 
+}
+#endif
 
 
 int worker(
@@ -93,14 +895,28 @@ int worker(
         realtype *ivalues, 
         realtype *rates, 
         double* output_y, 
+        const output_layout *layout, 
         double* output_yss,
-        gsl_rng* rng
+        noise_stream *stream, 
+        solver_context *ctx, 
+        double *output_tconv, 
+        double *output_converged, 
+        double *output_stats
 #ifdef LANGEVIN
         , double zeta
+#endif 
+#ifdef SENS
+        , double *output_sens
+        , const sens_selection *sens
 #endif 
         ) 
 {
-    int i, j, cvode_flag;
+    int j, cvode_flag;
+#ifdef STEADY
+    int num_steady = 0; 
+    int converged = 0; 
+    double t_conv = tvec[tvec_size-1]; 
+#endif
 
     char *solver_param_names_[4] = { 
         "abserr", 
@@ -116,57 +932,23 @@ int worker(
         RCONST(MAX_STEPS) 
     };
 
-#define Ydynamics(ti,y) output_y[(ti)*num_species + (y)]
-#define Ysteady(ith) output_yss[ith]
-
-    /* For non-stiff problems: */
-    /* void *cvode_mem = CVodeCreate(CV_ADAMS, CV_FUNCTIONAL); */
+#define Ysteady(ith) output_yss[STATE_INDEX(ith)]
 
-    /* For stiff problems: */
-    void *cvode_mem = CVodeCreate(CV_BDF, CV_NEWTON);
-
-    N_Vector yt;
-    yt = N_VNew_Serial(num_species);
+    cvode_flag = solver_init(ctx, num_species, ivalues, rates, 
+            solver_param_
+#ifdef SENS
+            , sens
+#endif
+            ); 
 
-    for (i = 0; i < num_species; ++i)
-        NV_Ith_S(yt, i) = ivalues[i];
+    void *cvode_mem = ctx->cvode_mem; 
+    N_Vector yt = ctx->yt; 
 
     realtype t = RCONST(0.0); 
 
     int tidx = 0; 
     int num_try = 1;
 
-    cvode_flag = CVodeMalloc(
-            cvode_mem, 
-            $(MODEL)_vf, 
-            t, 
-            yt, 
-            CV_SS, 
-            solver_param_[1], 
-            &(solver_param_[0])
-            );
-
-    cvode_flag = CVodeSetFdata(
-            cvode_mem, 
-            &(rates[0])
-            );
-
-    cvode_flag = CVDense(
-            cvode_mem, 
-            num_species
-            );
-
-    cvode_flag = CVDenseSetJacFn(
-            cvode_mem, 
-            $(MODEL)_jac, 
-            &(rates[0])
-            );
-
-    cvode_flag = CVodeSetStopTime(
-            cvode_mem, 
-            solver_param_[2]
-            );
-
     while(tidx < tvec_size && num_try <= MAX_SOLVER_TRY) {
         t = RCONST(0.0);
         for (tidx = 0; tidx < tvec_size; ++tidx) {
@@ -174,28 +956,59 @@ int worker(
             if (tout == 0) {
 #ifndef STEADY
                 for (j = 0; j < num_species; ++j)
-                    Ydynamics(tidx, j) = NV_Ith_S(yt, j); 
+                    OUTPUT_STORE(layout, output_y, tidx, STATE_INDEX(j), 
+                            NV_Ith_S(yt, j)); 
+#endif
+#ifdef SENS
+#define SENS_ZERO(is) 0.0
+                for (j = 0; j < num_species && output_sens != NULL; ++j) 
+                    SENS_STORE(layout, output_sens, tidx, STATE_INDEX(j), 
+                            sens->count, SENS_ZERO); 
 #endif
 
             } else {
                 /* Advance the solution */
                 cvode_flag = CVode(cvode_mem, tout, yt, &t, CV_NORMAL);
                 if (cvode_flag != CV_SUCCESS && cvode_flag != CV_TSTOP_RETURN) {
-                    fprintf(stderr, "cvode_flag=%d (%dth try)\n", cvode_flag, 
-                            num_try++);
+                    num_try++; 
                     break;
                 }
 
+#ifdef STEADY
+                /* tested before the langevin noise, on the deterministic 
+                 * state reached at tout */
+                if (steady_point(ctx, t, rates, num_species)) 
+                    num_steady++; 
+                else 
+                    num_steady = 0; 
+                if (num_steady >= steady_window_) {
+                    converged = 1; 
+                    t_conv = t; 
+                    tidx = tvec_size; /* also leaves the retry loop */
+                    break; 
+                }
+#endif
+
                 for (j = 0; j < num_species; ++j) {
 #ifdef LANGEVIN
-                    NV_Ith_S(yt, j) += noise2(rng, NV_Ith_S(yt, j), zeta); 
+                    NV_Ith_S(yt, j) += noise2(stream, NV_Ith_S(yt, j), zeta); 
                     if(NV_Ith_S(yt, j) < 0.0)
                         NV_Ith_S(yt, j) = 0.0; 
 #endif
 #ifndef STEADY
-                    Ydynamics(tidx, j) = NV_Ith_S(yt, j); 
+                    OUTPUT_STORE(layout, output_y, tidx, STATE_INDEX(j), 
+                            NV_Ith_S(yt, j)); 
 #endif
                 }
+#ifdef SENS
+#define SENS_VALUE(is) NV_Ith_S(ctx->yS[is], j)
+                if (output_sens != NULL && sens->count > 0) {
+                    CVodeGetSens(cvode_mem, t, ctx->yS); 
+                    for (j = 0; j < num_species; ++j) 
+                        SENS_STORE(layout, output_sens, tidx, STATE_INDEX(j), 
+                                sens->count, SENS_VALUE); 
+                }
+#endif
             } 
         } 
     }
@@ -203,8 +1016,15 @@ int worker(
     for (j = 0; j < num_species; ++j) 
         Ysteady(j) = NV_Ith_S(yt, j); 
 
-    N_VDestroy_Serial(yt);
-    CVodeFree(&cvode_mem);
+#ifdef STEADY
+    if (output_tconv != NULL) 
+        *output_tconv = converged ? t_conv : -1.0; 
+    if (output_converged != NULL) 
+        *output_converged = (double) converged; 
+#endif
+
+    if (output_stats != NULL) 
+        solver_stats(ctx, num_try - 1, output_stats); 
 
     return cvode_flag; 
 }
@@ -249,10 +1069,49 @@ double noise(gsl_rng *rng, double molar)
  *  zeta = 1.0
  * */
 #ifdef LANGEVIN
-double noise2(gsl_rng *rng, double molar, double zeta) 
+#define PHILOX_M0 0xD2511F53u
+#define PHILOX_M1 0xCD9E8D57u
+#define PHILOX_W0 0x9E3779B9u
+#define PHILOX_W1 0xBB67AE85u
+
+/* the philox4x32-10 block of ctr under key (Salmon et al., SC'11) */
+static void philox4x32(const uint32_t *ctr, const uint32_t *key, 
+        uint32_t *out)
 {
-    double u = gsl_rng_uniform(rng);
-    double v = gsl_rng_uniform(rng); 
+    int r; 
+    uint32_t c0 = ctr[0], c1 = ctr[1], c2 = ctr[2], c3 = ctr[3]; 
+    uint32_t k0 = key[0], k1 = key[1]; 
+    for (r = 0; r < 10; ++r) {
+        uint64_t p0 = (uint64_t) PHILOX_M0*c0; 
+        uint64_t p1 = (uint64_t) PHILOX_M1*c2; 
+        c0 = (uint32_t) (p1 >> 32) ^ c1 ^ k0; 
+        c2 = (uint32_t) (p0 >> 32) ^ c3 ^ k1; 
+        c1 = (uint32_t) p1; 
+        c3 = (uint32_t) p0; 
+        k0 += PHILOX_W0; 
+        k1 += PHILOX_W1; 
+    }
+    out[0] = c0; out[1] = c1; out[2] = c2; out[3] = c3; 
+}
+
+/* the next two 53 bit uniforms of stream, u in (0, 1] so that log(u) is 
+ * finite and v in [0, 1) */
+static void noise_uniforms(noise_stream *stream, double *u, double *v)
+{
+    uint32_t x[4]; 
+    philox4x32(stream->ctr, stream->key, x); 
+    if (++stream->ctr[0] == 0) 
+        ++stream->ctr[1]; 
+    *u = ((double) ((((uint64_t) x[0] << 32) | x[1]) >> 11) + 1.0)
+        *(1.0/9007199254740992.0);
+    *v = ((double) ((((uint64_t) x[2] << 32) | x[3]) >> 11))
+        *(1.0/9007199254740992.0); 
+}
+
+double noise2(noise_stream *stream, double molar, double zeta) 
+{
+    double u, v; 
+    noise_uniforms(stream, &u, &v); 
     double gau1 = sqrt(-2.0*log(u))*cos(2.0*M_PI*v);
     /*double gau2 = sqrt(-2.0*log(u))*sin(2.0*M_PI*v);*/
     return sqrt(molar*zeta)*gau1/zeta;
@@ -262,9 +1121,406 @@ double noise2(gsl_rng *rng, double molar, double zeta)
 
 
 
-#ifdef MATLAB 
-void mexFunction(
-        int nlhs, mxArray *plhs[],
+#ifdef SDE
+/* a standard normal; both normals of a box-muller pair are used. */
+static double noise_gauss(noise_stream *stream)
+{
+    double u, v, r; 
+    if (stream->has_spare) {
+        stream->has_spare = 0; 
+        return stream->spare; 
+    }
+    noise_uniforms(stream, &u, &v); 
+    r = sqrt(-2.0*log(u)); 
+    stream->spare = r*sin(2.0*M_PI*v); 
+    stream->has_spare = 1; 
+    return r*cos(2.0*M_PI*v); 
+}
+
+int engine_set_sde(double dt)
+{
+    sde_dt_ = dt > 0.0 ? dt : -1.0; 
+    return 0; 
+}
+
+/* the largest step of the SDE engine */
+static double sde_step(void)
+{
+    if (sde_dt_ > 0.0) 
+        return sde_dt_; 
+    return env_double("FASTFACILE_SDE_DT", SDE_DT); 
+}
+
+/* integrates the n <= SDE_BLOCK samples of ivalues and rates (sample 
+ * major, as engine() gets them) from t = 0 over tvec. every step of size h 
+ * adds to each reaction j the change a_j*h + sqrt(a_j*h/zeta)*N(0, 1) 
+ * (the noise of a_j*zeta*h events in the volume of zeta), and the changes 
+ * are spread over the species by the stoichiometry. as in the langevin 
+ * engine, states are kept >= 0. the block is held column major (species x 
+ * n) so that every loop runs over the samples. the flag of a sample is 0, 
+ * or -1 if its state became non finite. the noise of sample k is stream 
+ * sample_index[k], or first_sample + k when sample_index is NULL. returns 
+ * the number of steps. */
+static long sde_block(
+        int n, 
+        double *tvec, 
+        int tvec_size, 
+        int num_species, 
+        int num_parameter, 
+        double *ivalues, 
+        double *rates, 
+        double *output_y, 
+        const output_layout *layout, 
+        double *output_yss, 
+        double *output_flag, 
+        unsigned long long seed, 
+        long long first_sample, 
+        const long long *sample_index, 
+        double zeta, 
+        double dt
+        )
+{
+    int i, j, k, e, tidx, step, num_steps; 
+    long total_steps = 0; 
+    double t = 0.0, h, sqrt_h; 
+    double *y = (double*) malloc(sizeof(double)*num_species*n); 
+    double *p = (double*) malloc(sizeof(double)*num_parameter*n); 
+    double *a = (double*) malloc(sizeof(double)*(__N_REACTIONS__ > 0 ? 
+                __N_REACTIONS__ : 1)*n); 
+    noise_stream streams[SDE_BLOCK]; 
+
+    for (k = 0; k < n; ++k) {
+        noise_stream_init(&streams[k], seed, 
+                sample_index != NULL ? sample_index[k] : first_sample + k); 
+        for (i = 0; i < num_species; ++i) 
+            y[i*n + k] = ivalues[k*num_species + i]; 
+        for (i = 0; i < num_parameter; ++i) 
+            p[i*n + k] = rates[k*num_parameter + i]; 
+        output_flag[k] = 0.0; 
+    }
+
+    for (tidx = 0; tidx < tvec_size; ++tidx) {
+        double span = tvec[tidx] - t; 
+        num_steps = span > 0.0 ? (int) ceil(span/dt - 1.0e-9) : 0; 
+        h = num_steps > 0 ? span/num_steps : 0.0; 
+        sqrt_h = sqrt(h); 
+        total_steps += num_steps; 
+        for (step = 0; step < num_steps; ++step) {
+            reaction_rates_(n, y, p, a); 
+            /* a becomes the change of each reaction over the step */
+            for (k = 0; k < n; ++k) 
+                for (j = 0; j < __N_REACTIONS__; ++j) {
+                    double aj = a[j*n + k]; 
+                    a[j*n + k] = aj*h + (aj > 0.0 ? sqrt(aj/zeta)*sqrt_h
+                        *noise_gauss(&streams[k]) : 0.0); 
+                }
+            for (j = 0; j < __N_REACTIONS__; ++j) 
+                for (e = stoich_start_[j]; e < stoich_start_[j+1]; ++e) {
+                    double c = stoich_coef_[e]; 
+                    double *yi = &y[stoich_species_[e]*n]; 
+                    double *aj = &a[j*n]; 
+                    for (k = 0; k < n; ++k) 
+                        yi[k] += c*aj[k]; 
+                }
+            for (i = 0; i < num_species*n; ++i) 
+                if (y[i] < 0.0) 
+                    y[i] = 0.0; 
+        }
+        if (span > 0.0) 
+            t = tvec[tidx]; 
+        if (output_y != NULL) 
+            for (k = 0; k < n; ++k) 
+                for (i = 0; i < num_species; ++i) 
+                    OUTPUT_STORE(layout, &output_y[k*OUTPUT_VALUES(layout)], 
+                            tidx, i, y[i*n + k]); 
+    }
+
+    for (k = 0; k < n; ++k) 
+        for (i = 0; i < num_species; ++i) {
+            output_yss[k*num_species + i] = y[i*n + k]; 
+            if (!isfinite(y[i*n + k])) 
+                output_flag[k] = -1.0; 
+        }
+
+    free(y); 
+    free(p); 
+    free(a); 
+    return total_steps; 
+}
+#endif 
+
+
+
+
+#ifdef SSA
+/* a poisson number of mean mu: multiplication of uniforms for small means, 
+ * the transformed rejection of hormann (1993, PTRS) for large ones. */
+static double noise_poisson(noise_stream *stream, double mu)
+{
+    double u, v; 
+    if (mu <= 0.0) 
+        return 0.0; 
+    if (mu < 10.0) {
+        double limit = exp(-mu), prod = 1.0, k = 0.0; 
+        for (;;) {
+            noise_uniforms(stream, &u, &v); 
+            prod *= u; 
+            if (prod <= limit) 
+                return k; 
+            k += 1.0; 
+            prod *= v; 
+            if (prod <= limit) 
+                return k; 
+            k += 1.0; 
+        }
+    } else {
+        double slam = sqrt(mu), loglam = log(mu); 
+        double b = 0.931 + 2.53*slam; 
+        double a = -0.059 + 0.02483*b; 
+        double invalpha = 1.1239 + 1.1328/(b - 3.4); 
+        double vr = 0.9277 - 3.6224/(b - 2.0); 
+        for (;;) {
+            double us, k; 
+            noise_uniforms(stream, &v, &u); 
+            u -= 0.5; /* in [-0.5, 0.5), v in (0, 1] */
+            us = 0.5 - fabs(u); 
+            k = floor((2.0*a/us + b)*u + mu + 0.43); 
+            if (us >= 0.07 && v <= vr) 
+                return k; 
+            if (k < 0.0 || (us < 0.013 && v > us)) 
+                continue; 
+            if (log(v) + log(invalpha) - log(a/(us*us) + b) 
+                    <= -mu + k*loglam - lgamma(k + 1.0)) 
+                return k; 
+        }
+    }
+}
+
+/* method SSA_DIRECT or SSA_TAU_LEAPING, and epsilon (the largest relative 
+ * change of a species in a leap; <= 0 leaves it unchanged). -1 goes back 
+ * to FASTFACILE_SSA (direct or tau) and FASTFACILE_SSA_EPSILON. */
+int engine_set_ssa(int method, double epsilon)
+{
+    if (method != -1 && method != SSA_DIRECT && method != SSA_TAU_LEAPING) 
+        return -1; 
+    ssa_method_ = method; 
+    ssa_epsilon_ = epsilon > 0.0 ? epsilon : -1.0; 
+    return 0; 
+}
+
+/* copies the number of events and of leaps of each thread of the last 
+ * call into events and leaps (either may be NULL). returns the number of 
+ * threads. */
+int engine_ssa_stats(double *events, double *leaps, int max_threads)
+{
+    int k; 
+    for (k = 0; k < stats_threads_ && k < max_threads; ++k) {
+        if (events != NULL) events[k] = stats_events_[k]; 
+        if (leaps != NULL) leaps[k] = stats_leaps_[k]; 
+    }
+    return stats_threads_; 
+}
+
+static int ssa_method_resolved(void)
+{
+    const char *value = getenv("FASTFACILE_SSA"); 
+    if (ssa_method_ > 0) 
+        return ssa_method_; 
+    if (value != NULL && strcmp(value, "tau") == 0) 
+        return SSA_TAU_LEAPING; 
+    return SSA_DIRECT; 
+}
+
+/* the propensity of reaction j in events per time. */
+static double ssa_propensity(int j, double *c, double *rates, double zeta)
+{
+    double a = zeta*reaction_rate_(j, c, rates); 
+    return a > 0.0 ? a : (a == a ? 0.0 : a); /* negative -> 0, nan stays */
+}
+
+/* one sample of the SSA engine. x holds the numbers of molecules and c the 
+ * concentrations x/zeta that the propensities are evaluated at. after 
+ * each output time the concentrations are written to output_y. returns 0, 
+ * -1 after SSA_MAX_EVENTS events or -2 if a propensity is not finite. */
+static int ssa_sample(
+        double *tvec, 
+        int tvec_size, 
+        int num_species, 
+        realtype *ivalues, 
+        realtype *rates, 
+        double *output_y, 
+        const output_layout *layout, 
+        double *output_yss, 
+        noise_stream *stream, 
+        double zeta, 
+        int method, 
+        double epsilon, 
+        double *num_events, 
+        double *num_leaps
+        )
+{
+    int i, j, e, d, tidx, steps, flag = 0; 
+    int num_reactions = __N_REACTIONS__; 
+    double t = 0.0, a0 = 0.0, u, v; 
+    double *x = (double*) malloc(sizeof(double)*(5*num_species 
+                + 2*(num_reactions > 0 ? num_reactions : 1))); 
+    double *c = x + num_species; 
+    double *x_leap = c + num_species; 
+    double *mu = x_leap + num_species; 
+    double *sigma = mu + num_species; 
+    double *a = sigma + num_species; 
+    double *k_leap = a + (num_reactions > 0 ? num_reactions : 1); 
+    double since_resum = 0.0; 
+
+    for (i = 0; i < num_species; ++i) {
+        x[i] = floor(ivalues[i]*zeta + 0.5); 
+        c[i] = x[i]/zeta; 
+    }
+    for (j = 0; j < num_reactions; ++j) {
+        a[j] = ssa_propensity(j, c, rates, zeta); 
+        a0 += a[j]; 
+    }
+
+    for (tidx = 0; tidx < tvec_size && flag == 0; ++tidx) {
+        double tout = tvec[tidx]; 
+        while (t < tout) {
+            if (!(a0 == a0) || a0 == HUGE_VAL) { 
+                flag = -2; 
+                break; 
+            }
+            if (*num_events > SSA_MAX_EVENTS) { 
+                flag = -1; 
+                break; 
+            }
+
+            steps = 1; 
+            if (method == SSA_TAU_LEAPING && a0 > 0.0) {
+                /* tau of cao et al. (2006), with g_i = 2 for every species */
+                double tau = HUGE_VAL; 
+                for (i = 0; i < num_species; ++i) 
+                    mu[i] = sigma[i] = 0.0; 
+                for (j = 0; j < num_reactions; ++j) 
+                    for (e = stoich_start_[j]; e < stoich_start_[j+1]; ++e) {
+                        mu[stoich_species_[e]] += stoich_coef_[e]*a[j]; 
+                        sigma[stoich_species_[e]] += 
+                            stoich_coef_[e]*stoich_coef_[e]*a[j]; 
+                    }
+                for (i = 0; i < num_species; ++i) {
+                    double bound = epsilon*x[i]/2.0 > 1.0 ? epsilon*x[i]/2.0 : 1.0; 
+                    if (mu[i] != 0.0 && bound/fabs(mu[i]) < tau) 
+                        tau = bound/fabs(mu[i]); 
+                    if (sigma[i] > 0.0 && bound*bound/sigma[i] < tau) 
+                        tau = bound*bound/sigma[i]; 
+                }
+                if (tau*a0 >= SSA_LEAP_MIN_EVENTS) {
+                    int negative = 1; 
+                    double fired = 0.0; 
+                    if (tau > tout - t) 
+                        tau = tout - t; 
+                    while (negative) {
+                        for (i = 0; i < num_species; ++i) 
+                            x_leap[i] = x[i]; 
+                        fired = 0.0; 
+                        for (j = 0; j < num_reactions; ++j) {
+                            k_leap[j] = noise_poisson(stream, a[j]*tau); 
+                            fired += k_leap[j]; 
+                            for (e = stoich_start_[j]; e < stoich_start_[j+1]; ++e) 
+                                x_leap[stoich_species_[e]] += 
+                                    stoich_coef_[e]*k_leap[j]; 
+                        }
+                        negative = 0; 
+                        for (i = 0; i < num_species; ++i) 
+                            if (x_leap[i] < 0.0) 
+                                negative = 1; 
+                        if (negative) 
+                            tau /= 2.0; 
+                    }
+                    t += tau; 
+                    for (i = 0; i < num_species; ++i) {
+                        x[i] = x_leap[i]; 
+                        c[i] = x[i]/zeta; 
+                    }
+                    a0 = 0.0; 
+                    for (j = 0; j < num_reactions; ++j) {
+                        a[j] = ssa_propensity(j, c, rates, zeta); 
+                        a0 += a[j]; 
+                    }
+                    *num_events += fired; 
+                    *num_leaps += 1.0; 
+                    continue; 
+                }
+                steps = SSA_EXACT_STEPS; 
+            }
+
+            /* exact steps of the direct method */
+            for (; steps > 0 && t < tout; --steps) {
+                double target, sum = 0.0; 
+                int fire = -1; 
+                if (a0 <= 0.0) { 
+                    t = tout; /* nothing can happen anymore */
+                    break; 
+                }
+                noise_uniforms(stream, &u, &v); 
+                t += -log(u)/a0; 
+                if (t >= tout) { 
+                    /* the next event is after tout; by the lack of memory 
+                     * of the waiting time it is drawn again from tout */
+                    t = tout; 
+                    break; 
+                }
+                target = v*a0; 
+                for (j = 0; j < num_reactions; ++j) 
+                    if (a[j] > 0.0) {
+                        fire = j; 
+                        sum += a[j]; 
+                        if (sum > target) 
+                            break; 
+                    }
+                if (fire < 0) { 
+                    /* a0 drifted away from the propensities */
+                    a0 = 0.0; 
+                    for (j = 0; j < num_reactions; ++j) 
+                        a0 += a[j]; 
+                    break; 
+                }
+                for (e = stoich_start_[fire]; e < stoich_start_[fire+1]; ++e) {
+                    i = stoich_species_[e]; 
+                    x[i] += stoich_coef_[e]; 
+                    c[i] = x[i]/zeta; 
+                }
+                for (d = depend_start_[fire]; d < depend_start_[fire+1]; ++d) {
+                    j = depend_reaction_[d]; 
+                    a0 -= a[j]; 
+                    a[j] = ssa_propensity(j, c, rates, zeta); 
+                    a0 += a[j]; 
+                }
+                *num_events += 1.0; 
+                if (++since_resum >= SSA_RESUM) {
+                    since_resum = 0.0; 
+                    a0 = 0.0; 
+                    for (j = 0; j < num_reactions; ++j) 
+                        a0 += a[j]; 
+                }
+            }
+        }
+        if (flag == 0) 
+            for (i = 0; i < num_species; ++i) 
+                OUTPUT_STORE(layout, output_y, tidx, i, c[i]); 
+    }
+
+    for (i = 0; i < num_species; ++i) 
+        output_yss[i] = c[i]; 
+    free(x); 
+    return flag; 
+}
+#endif 
+
+
+
+
+#ifdef MATLAB 
+void mexFunction(
+        int nlhs, mxArray *plhs[],
         int nrhs, const mxArray *prhs[]
         )
 {
@@ -273,9 +1529,21 @@ void mexFunction(
 #   define OUT_Y_T plhs[0]
 #   define OUT_YSS_T plhs[1]
 #   define OUT_FLAG plhs[2]
+#   define OUT_STATS plhs[3]
+#   define NUM_OUTPUTS_WITH_STATS 4
+    /* readout mode: [scores, yss, flag, stats, top_y, top_index] */
+#   define OUT_SCORES plhs[0]
+#   define OUT_TOP_Y_T plhs[4]
+#   define OUT_TOP_INDEX plhs[5]
+    /* SENS engines: [y, yss, flag, stats, s] */
+#   define OUT_SENS plhs[4]
 #else 
 #   define OUT_YSS_T plhs[0]
 #   define OUT_FLAG plhs[1]
+#   define OUT_TCONV plhs[2]
+#   define OUT_CONVERGED plhs[3]
+#   define OUT_STATS plhs[4]
+#   define NUM_OUTPUTS_WITH_STATS 5
 #endif
 
 #define TIME_VECTOR prhs[0]
@@ -284,8 +1552,39 @@ void mexFunction(
 #define INP_ZETA prhs[3]
 
     int i = 0, j = 0; 
+
+    /* a file name as the last argument writes the trajectories to that 
+     * .npy file (see engine_to_file) and returns y = []. a struct as the 
+     * last argument, e.g. struct('top_k', 100, 'rank_by', 1), returns the 
+     * READOUT section of the model evaluated in the engine instead of y 
+     * (see engine_readout): [scores, yss, flag, stats, top_y, top_index], 
+     * with top_y laid out as y and 1-based top_index (0 for none). the 
+     * fifth output of SENS engines is s, (samples*timepoints) x species x 
+     * parameters: the sensitivities of y to the parameters of 
+     * engine_set_sens() (see FASTFACILE_SENS); it is [] with a file. */
+#ifndef STEADY
+    char *output_file = NULL; 
+    const mxArray *readout_options = NULL; 
+    if (nrhs > 3 && mxIsChar(prhs[nrhs-1])) {
+        output_file = mxArrayToString(prhs[nrhs-1]); 
+        nrhs--; 
+    } else if (nrhs > 3 && mxIsStruct(prhs[nrhs-1])) {
+        readout_options = prhs[nrhs-1]; 
+        nrhs--; 
+    }
+#endif
+
     /* check the dimensions of input and output */
-    if(nlhs!=2 && nlhs!=1 && nlhs!=3) {
+#ifdef STEADY
+    /* [yss, flag, t_conv, converged, stats] */
+    if(nlhs < 1 || nlhs > 5) {
+#elif defined(SENS)
+    /* [y, yss, flag, stats, s] */
+    if(nlhs < 1 || nlhs > (readout_options != NULL ? 6 : 5)) {
+#else
+    /* [y, yss, flag, stats] */
+    if(nlhs < 1 || nlhs > (readout_options != NULL ? 6 : 4)) {
+#endif
         mexErrMsgTxt("Wrong number of output arguments.");
     }
 
@@ -352,16 +1651,24 @@ void mexFunction(
         mexErrMsgTxt("num_samples_rates is not same as the num_samples_ival\n");
     }
 
-#ifdef STEADY 
-    double *y_array = NULL; 
-#else
-    mxArray *OUT_Y = mxCreateDoubleMatrix(
-            num_species_ival, 
-            num_timepoints*num_samples_ival, 
-            mxREAL
-            );
+#ifndef STEADY
+    /* the stored times and species of the trajectories, see output_layout */
+    int output_times, output_stride; 
+    int output_columns[__N_SPECIES__ > 0 ? __N_SPECIES__ : 1]; 
+    int output_species = engine_output(num_timepoints, &output_times, 
+            &output_stride, output_columns); 
 
-    double *y_array = mxGetPr(OUT_Y); 
+    mxArray *OUT_Y = NULL; 
+    double *y_array = NULL; 
+    if (output_file == NULL && readout_options == NULL) {
+        OUT_Y = mxCreateDoubleMatrix(
+                output_species, 
+                output_times*num_samples_ival, 
+                mxREAL
+                );
+
+        y_array = mxGetPr(OUT_Y); 
+    }
 #endif 
 
     OUT_FLAG = mxCreateDoubleMatrix(
@@ -386,7 +1693,19 @@ void mexFunction(
     if(num_params_rates != __N_PARAMETERS__)
         mexErrMsgTxt("wrong number of rates\n");
 
-    engine(
+    /* the solver statistics are only collected when they are asked for. 
+     * they are written as NUM_STATS x samples and returned transposed. */
+    mxArray *OUT_STATS_T = NULL; 
+    if (nlhs >= NUM_OUTPUTS_WITH_STATS) {
+        OUT_STATS_T = mxCreateDoubleMatrix(NUM_STATS, num_samples_ival, mxREAL); 
+        engine_set_stats(mxGetPr(OUT_STATS_T)); 
+    }
+
+#ifdef STEADY
+    OUT_TCONV = mxCreateDoubleMatrix(num_samples_ival, 1, mxREAL); 
+    OUT_CONVERGED = mxCreateDoubleMatrix(num_samples_ival, 1, mxREAL); 
+
+    engine_steady(
             num_timepoints, 
             ptr_timepoints, 
             num_samples_rates,
@@ -394,13 +1713,140 @@ void mexFunction(
             ivalues_array, 
             num_params_rates, 
             rates_array,
-            y_array,
             yss_array,
-            ptr_output_flag
+            ptr_output_flag,
+            mxGetPr(OUT_TCONV), 
+            mxGetPr(OUT_CONVERGED)
 #ifdef LANGEVIN
             ,zeta
 #endif 
             ); 
+#else
+    if (output_file != NULL) {
+        int written = engine_to_file(
+                num_timepoints, 
+                ptr_timepoints, 
+                num_samples_rates,
+                num_species_ival,
+                ivalues_array, 
+                num_params_rates, 
+                rates_array,
+                output_file, 
+                OUTPUT_CHUNK_SAMPLES, 
+                yss_array,
+                ptr_output_flag
+#ifdef LANGEVIN
+                ,zeta
+#endif 
+#ifdef SENS
+                ,NULL
+#endif 
+                ); 
+        mxFree(output_file); 
+#ifdef SENS
+        if (nlhs > 4) 
+            OUT_SENS = mxCreateDoubleMatrix(0, 0, mxREAL); 
+#endif
+        if (written != 0) {
+            engine_set_stats(NULL); 
+            mexErrMsgTxt("the output file could not be written\n");
+        }
+    } else if (readout_options != NULL) {
+        const mxArray *field = mxGetField(readout_options, 0, "top_k"); 
+        int top_k = field != NULL && nlhs > 4 ? (int) mxGetScalar(field) : 0; 
+        field = mxGetField(readout_options, 0, "rank_by"); 
+        int rank_by = field != NULL ? (int) mxGetScalar(field) - 1 : 0; 
+        if (top_k < 0) 
+            top_k = 0; 
+        mxArray *OUT_SCORES_T = mxCreateDoubleMatrix(__N_READOUTS__, 
+                num_samples_ival, mxREAL); 
+        mxArray *OUT_TOP_Y = mxCreateDoubleMatrix(output_species, 
+                output_times*top_k, mxREAL); 
+        mxArray *top_index = mxCreateDoubleMatrix(top_k, 1, mxREAL); 
+        int scored = engine_readout(
+                num_timepoints, 
+                ptr_timepoints, 
+                num_samples_rates,
+                num_species_ival,
+                ivalues_array, 
+                num_params_rates, 
+                rates_array,
+                mxGetPr(OUT_SCORES_T), 
+                top_k, 
+                rank_by, 
+                mxGetPr(OUT_TOP_Y), 
+                mxGetPr(top_index), 
+                yss_array,
+                ptr_output_flag
+#ifdef LANGEVIN
+                ,zeta
+#endif 
+                ); 
+        if (scored != 0) {
+            engine_set_stats(NULL); 
+            mexErrMsgTxt("the model has no READOUT section or rank_by is not one of its readouts\n");
+        }
+        OUT_SCORES = mxCreateDoubleMatrix(num_samples_ival, __N_READOUTS__, 
+                mxREAL); 
+        transp(OUT_SCORES, OUT_SCORES_T); 
+        mxDestroyArray(OUT_SCORES_T); 
+        if (nlhs > 4) {
+            OUT_TOP_Y_T = mxCreateDoubleMatrix(output_times*top_k, 
+                    output_species, mxREAL); 
+            transp(OUT_TOP_Y_T, OUT_TOP_Y); 
+            for (i = 0; i < top_k; ++i) 
+                mxGetPr(top_index)[i] += 1.0; 
+        }
+        if (nlhs > 5) 
+            OUT_TOP_INDEX = top_index; 
+        else 
+            mxDestroyArray(top_index); 
+        mxDestroyArray(OUT_TOP_Y); 
+    } else {
+#ifdef SENS
+        int sens_params[__N_PARAMETERS__ > 0 ? __N_PARAMETERS__ : 1]; 
+        int num_sens = engine_sens(sens_params); 
+        size_t sens_rows = (size_t) num_samples_ival*output_times; 
+        double *sens_array = NULL; 
+        if (nlhs > 4) 
+            sens_array = (double*) mxCalloc(sens_rows*output_species*num_sens + 1, 
+                    sizeof(double)); 
+#endif
+        engine(
+                num_timepoints, 
+                ptr_timepoints, 
+                num_samples_rates,
+                num_species_ival,
+                ivalues_array, 
+                num_params_rates, 
+                rates_array,
+                y_array,
+                yss_array,
+                ptr_output_flag
+#ifdef LANGEVIN
+                ,zeta
+#endif 
+#ifdef SENS
+                ,sens_array
+#endif 
+                ); 
+#ifdef SENS
+        if (sens_array != NULL) {
+            /* (rows, species, parameters) in C order to column major */
+            mwSize dims[3] = { sens_rows, output_species, num_sens }; 
+            size_t r, c, k; 
+            OUT_SENS = mxCreateNumericArray(3, dims, mxDOUBLE_CLASS, mxREAL); 
+            double *s = mxGetPr(OUT_SENS); 
+            for (r = 0; r < sens_rows; ++r) 
+                for (c = 0; c < (size_t) output_species; ++c) 
+                    for (k = 0; k < (size_t) num_sens; ++k) 
+                        s[r + sens_rows*(c + output_species*k)] = 
+                            sens_array[(r*output_species + c)*num_sens + k]; 
+            mxFree(sens_array); 
+        }
+#endif
+    }
+#endif
 
     OUT_YSS_T = mxCreateDoubleMatrix(
             num_samples_ival, 
@@ -410,19 +1856,31 @@ void mexFunction(
 
     transp(OUT_YSS_T, OUT_YSS);
 
-#ifndef STEADY
-    OUT_Y_T = mxCreateDoubleMatrix(
-            num_samples_ival*num_timepoints, 
-            num_species_ival, 
-            mxREAL
-            );
+    if (OUT_STATS_T != NULL) {
+        engine_set_stats(NULL); 
+        OUT_STATS = mxCreateDoubleMatrix(num_samples_ival, NUM_STATS, mxREAL); 
+        transp(OUT_STATS, OUT_STATS_T); 
+        mxDestroyArray(OUT_STATS_T); 
+    }
 
-    transp(OUT_Y_T, OUT_Y);
+#ifndef STEADY
+    if (OUT_Y != NULL) {
+        OUT_Y_T = mxCreateDoubleMatrix(
+                num_samples_ival*output_times, 
+                output_species, 
+                mxREAL
+                );
+
+        transp(OUT_Y_T, OUT_Y);
+    } else if (readout_options == NULL) {
+        OUT_Y_T = mxCreateDoubleMatrix(0, 0, mxREAL); 
+    }
 #endif
 
     mxDestroyArray(OUT_YSS); 
 #ifndef STEADY    
-    mxDestroyArray(OUT_Y);
+    if (OUT_Y != NULL) 
+        mxDestroyArray(OUT_Y);
 #endif
     mxDestroyArray(INP_IVALUES_T); 
     mxDestroyArray(INP_RATES_T); 
@@ -434,7 +1892,18 @@ void mexFunction(
 
 
 
-int engine(
+/* the sample loop of engine() and engine_steady(). tconv_array, 
+ * converged_array and stats_array may be NULL. sample i draws its noise from the stream 
+ * first_sample + i of seed, or sample_index[i] if sample_index is not NULL; 
+ * such a run of selected samples adds to the thread statistics instead of 
+ * starting them again. with scores_array, the trajectory of each sample 
+ * goes to a scratch block of its thread and only its readouts (see 
+ * readout_() in ode_size.h) are kept, in scores_array (samples x 
+ * __N_READOUTS__); y_array is not used. y_array holds the trajectories in 
+ * the layout of output_layout_init(). with SENS, sens_array holds their 
+ * sensitivities in the layout of SENS_STORE(); none are integrated when 
+ * sens_array is NULL. */
+static int run_samples(
         int num_timepoints,
         double *ptr_timepoints, /* 1 x num_timepoints */
         int num_samples_rates, 
@@ -444,78 +1913,1054 @@ int engine(
         double *rates_array, 
         double *y_array, 
         double *yss_array, 
-        double *ptr_output_flag
+        double *ptr_output_flag, 
+        double *tconv_array, 
+        double *converged_array, 
+        double *stats_array, 
+        double *scores_array, 
+        const long long *sample_index, 
+        unsigned long long seed, 
+        long long first_sample
 #ifdef LANGEVIN 
         , double zeta
+#endif
+#ifdef SENS
+        , double *sens_array
 #endif
         )
 {
 
-    int i,j; 
-
-    int chunk_size = PACKAGE_SIZE; 
-
-    if (chunk_size == 0) chunk_size = 1; 
+    int i; 
 
-    if (chunk_size == 1) { 
-        omp_set_num_threads(1); 
-    } else {
-        omp_set_num_threads(THREAD_NUM); /* bug??? */
-    }
+    int num_threads = engine_schedule(); 
 
-    gsl_rng *rng = gsl_rng_alloc(gsl_rng_mt19937);
-    long seed = time(NULL)*getpid();
-    gsl_rng_set(rng, seed); 
+    /* the readouts are evaluated on the full trajectories */
+    output_layout layout; 
+    output_layout_init(&layout, num_timepoints, scores_array != NULL); 
+    size_t sample_values = OUTPUT_VALUES(&layout); 
+    size_t scratch_values = sample_values; 
+    double *scratch = NULL; 
+#ifdef SDE
+    scratch_values *= SDE_BLOCK; 
+#endif
+    if (scores_array != NULL) 
+        scratch = (double*) malloc(sizeof(double)*scratch_values*num_threads); 
+#ifdef SENS
+    sens_selection sens; 
+    sens_selection_init(&sens); 
+    if (sens_array == NULL) 
+        sens.count = 0; 
+    size_t sens_values = sample_values*sens.count; 
+#endif
 
-    if (THREAD_NUM == -1) 
-        omp_set_num_threads(omp_get_max_threads()); 
-    else
-        omp_set_num_threads(THREAD_NUM);
+#ifndef NETWORK_ENGINE
+    solver_context *contexts = (solver_context*) calloc(num_threads, 
+            sizeof(solver_context)); 
+#endif
 
-    /* too many outputs will be repressed by following code */
-    FILE *freopenResult = freopen("/dev/null","w",stderr);
+    double wall_start = omp_get_wtime(); 
 
+#ifdef SDE
+    /* one block of SDE_BLOCK samples per iteration */
+    int num_blocks = (num_samples_rates + SDE_BLOCK - 1)/SDE_BLOCK; 
+    double dt = sde_step(); 
 #ifdef WITH_OMP
-#pragma omp parallel for shared(chunk_size, num_samples_rates,ptr_timepoints,\
-        num_timepoints, num_species_ival,num_params_rates,rates_array,\
-        ivalues_array,yss_array) private (j,i)
+#pragma omp parallel for schedule(runtime) shared(num_blocks,\
+        num_samples_rates, ptr_timepoints, num_timepoints, num_species_ival,\
+        num_params_rates, rates_array, ivalues_array, yss_array) private (i)
 #endif
-    for (j = 0; j < num_samples_rates; j += chunk_size) {
-        for(i = j; i <= j + chunk_size - 1 ; ++i) {
-            if(i >= num_samples_rates) 
-                continue; 
+    for (i = 0; i < num_blocks; ++i) {
+        double block_start = omp_get_wtime(); 
+        int tid = omp_get_thread_num(); 
+        int first = i*SDE_BLOCK; 
+        int n = num_samples_rates - first < SDE_BLOCK ? 
+            num_samples_rates - first : SDE_BLOCK; 
+        double *block_y = scratch != NULL ? &scratch[tid*scratch_values] 
+            : y_array != NULL ? &y_array[first*sample_values] : NULL; 
+        long steps = sde_block(n, ptr_timepoints, num_timepoints, num_species_ival, 
+                num_params_rates, 
+                &ivalues_array[(size_t) first*num_species_ival], 
+                &rates_array[(size_t) first*num_params_rates], 
+                block_y, 
+                &layout, 
+                &yss_array[(size_t) first*num_species_ival], 
+                &ptr_output_flag[first], 
+                seed, first_sample + first, 
+                sample_index != NULL ? &sample_index[first] : NULL, zeta, dt); 
+        if (scores_array != NULL) {
+            int k; 
+            for (k = 0; k < n; ++k) 
+                readout_(ptr_timepoints, num_timepoints, 
+                        &block_y[k*sample_values], 
+                        &rates_array[(size_t) (first + k)*num_params_rates], 
+                        &scores_array[(size_t) (first + k)*__N_READOUTS__]); 
+        }
+        double block_time = omp_get_wtime() - block_start; 
+        if (stats_array != NULL) {
+            int k; 
+            for (k = first; k < first + n; ++k) {
+                memset(&stats_array[(size_t) k*NUM_STATS], 0, 
+                        sizeof(double)*NUM_STATS); 
+                stats_array[(size_t) k*NUM_STATS + STAT_STEPS] = (double) steps; 
+                stats_array[(size_t) k*NUM_STATS + STAT_WALL] = block_time/n; 
+            }
+        }
+        if (tid < stats_threads_) { 
+            stats_busy_[tid] += block_time; 
+            stats_samples_[tid] += n; 
+        }
+    }
+#else
+#ifdef SSA
+    int ssa_method = ssa_method_resolved(); 
+    double ssa_epsilon = ssa_epsilon_ > 0.0 ? ssa_epsilon_ 
+        : env_double("FASTFACILE_SSA_EPSILON", SSA_EPSILON); 
+#endif
+    /* one sample per iteration; how samples are handed to threads is 
+     * decided by engine_schedule(). stiff samples take much longer than 
+     * others, so dynamic or guided schedules keep every thread busy until 
+     * the end of the batch. */
+#ifdef WITH_OMP
+#pragma omp parallel for schedule(runtime) shared(num_samples_rates,\
+        ptr_timepoints, num_timepoints, num_species_ival,num_params_rates,\
+        rates_array, ivalues_array,yss_array) private (i)
+#endif
+    for (i = 0; i < num_samples_rates; ++i) {
+        double sample_start = omp_get_wtime(); 
+        int tid = omp_get_thread_num(); 
+        noise_stream stream; 
+        noise_stream_init(&stream, seed, 
+                sample_index != NULL ? sample_index[i] : first_sample + i); 
 #define IVALUES_ARRAY(k) &ivalues_array[0 + (k)*num_species_ival] 
 #define RATES_ARRAY(k) &rates_array[0 + (k)*num_params_rates] 
-#define OUTPUT_Y_ARRAY(k) &y_array[0 + (k)*num_timepoints*num_species_ival]
 #define OUTPUT_YSS_ARRAY(k) &yss_array[0 + (k)*num_species_ival]
-            ptr_output_flag[i] = (double) worker( 
-                    ptr_timepoints, 
-                    num_timepoints, 
-                    num_species_ival, 
-                    num_params_rates, 
-                    IVALUES_ARRAY(i), 
-                    RATES_ARRAY(i), 
+#ifndef STEADY
+        double *sample_y = y_array != NULL ? &y_array[i*sample_values] : NULL; 
+        if (scratch != NULL) {
+            /* timepoints after a solver failure are not written */
+            sample_y = &scratch[tid*scratch_values]; 
+            memset(sample_y, 0, sizeof(double)*scratch_values); 
+        }
+#endif
+#ifdef SSA
+        double events = 0.0, leaps = 0.0; 
+        ptr_output_flag[i] = (double) ssa_sample(
+                ptr_timepoints, 
+                num_timepoints, 
+                num_species_ival, 
+                IVALUES_ARRAY(i), 
+                RATES_ARRAY(i), 
+                sample_y, 
+                &layout, 
+                OUTPUT_YSS_ARRAY(i), 
+                &stream, 
+                zeta, 
+                ssa_method, 
+                ssa_epsilon, 
+                &events, 
+                &leaps
+                );
+        if (stats_array != NULL) {
+            memset(&stats_array[(size_t) i*NUM_STATS], 0, 
+                    sizeof(double)*NUM_STATS); 
+            stats_array[(size_t) i*NUM_STATS + STAT_STEPS] = events; 
+        }
+        if (tid < stats_threads_) { 
+            stats_events_[tid] += events; 
+            stats_leaps_[tid] += leaps; 
+        }
+#else
+        ptr_output_flag[i] = (double) worker( 
+                ptr_timepoints, 
+                num_timepoints, 
+                num_species_ival, 
+                num_params_rates, 
+                IVALUES_ARRAY(i), 
+                RATES_ARRAY(i), 
 #ifndef STEADY 
-                    OUTPUT_Y_ARRAY(i), 
+                sample_y, 
 #else
-                    NULL, 
+                NULL, 
 #endif
-                    OUTPUT_YSS_ARRAY(i), 
-                    rng
+                &layout, 
+                OUTPUT_YSS_ARRAY(i), 
+                &stream, 
+                &contexts[tid], 
+                tconv_array != NULL ? &tconv_array[i] : NULL, 
+                converged_array != NULL ? &converged_array[i] : NULL, 
+                stats_array != NULL ? &stats_array[(size_t) i*NUM_STATS] : NULL
 #ifdef LANGEVIN
-                    ,zeta
+                ,zeta
 #endif
-                    );
+#ifdef SENS
+                ,sens_array != NULL ? &sens_array[i*sens_values] : NULL
+                ,&sens
+#endif
+                );
+#endif
+#ifndef STEADY
+        if (scores_array != NULL) 
+            readout_(ptr_timepoints, num_timepoints, sample_y, RATES_ARRAY(i), 
+                    &scores_array[(size_t) i*__N_READOUTS__]); 
+#endif
+        double sample_time = omp_get_wtime() - sample_start; 
+        if (stats_array != NULL) 
+            stats_array[(size_t) i*NUM_STATS + STAT_WALL] = sample_time; 
+        if (tid < stats_threads_) { 
+            stats_busy_[tid] += sample_time; 
+            stats_samples_[tid] += 1.0; 
         }
     }
+#endif
 
-    freopenResult = freopen("/dev/tty","w",stderr);
+    stats_wall_ += omp_get_wtime() - wall_start; 
 
-    gsl_rng_free(rng);
+    free(scratch); 
+
+#ifndef NETWORK_ENGINE
+    for (i = 0; i < num_threads; ++i) 
+        solver_free(&contexts[i]); 
+    free(contexts); 
+#endif
 
     return 0; 
 }
 
+int engine(
+        int num_timepoints,
+        double *ptr_timepoints, /* 1 x num_timepoints */
+        int num_samples_rates, 
+        int num_species_ival, 
+        double *ivalues_array, 
+        int num_params_rates, 
+        double *rates_array, 
+        double *y_array, 
+        double *yss_array, 
+        double *ptr_output_flag
+#ifdef LANGEVIN 
+        , double zeta
+#endif
+#ifdef SENS
+        , double *sens_array
+#endif
+        )
+{
+    stats_reset(engine_schedule()); 
+    return run_samples(num_timepoints, ptr_timepoints, num_samples_rates, 
+            num_species_ival, ivalues_array, num_params_rates, rates_array, 
+            y_array, yss_array, ptr_output_flag, NULL, NULL, stats_array_, 
+            NULL, NULL, engine_seed(), seed_first_
+#ifdef LANGEVIN 
+            , zeta
+#endif
+#ifdef SENS
+            , sens_array
+#endif
+            ); 
+}
+
+
+#ifdef STEADY
+/* engine() of steady engines that also returns, for every sample, the 
+ * time the convergence test passed (-1 if it never did) and whether it 
+ * did (1.0 or 0.0). */
+int engine_steady(
+        int num_timepoints,
+        double *ptr_timepoints, 
+        int num_samples_rates, 
+        int num_species_ival, 
+        double *ivalues_array, 
+        int num_params_rates, 
+        double *rates_array, 
+        double *yss_array, 
+        double *ptr_output_flag, 
+        double *tconv_array, 
+        double *converged_array
+#ifdef LANGEVIN 
+        , double zeta
+#endif
+        )
+{
+    stats_reset(engine_schedule()); 
+    return run_samples(num_timepoints, ptr_timepoints, num_samples_rates, 
+            num_species_ival, ivalues_array, num_params_rates, rates_array, 
+            NULL, yss_array, ptr_output_flag, tconv_array, converged_array, 
+            stats_array_, NULL, NULL, engine_seed(), seed_first_
+#ifdef LANGEVIN 
+            , zeta
+#endif
+            ); 
+}
+#endif 
+
+
+#if !defined(LANGEVIN) && !defined(SENS)
+/* steady state continuation along one parameter, e.g. the BIFURC_PARAM of 
+ * the model. a branch is an ordered sweep of the values of the parameter 
+ * with the other rates of the branch fixed; the branches of a call (the 
+ * rows of a 2-d grid, or sweeps up and down) are spread over the threads 
+ * like samples. every point starts from the secant extrapolation of the 
+ * two points before it and is corrected with damped newton iterations on 
+ * the jacobian of the model ($(MODEL)_jac). the first point of a branch, 
+ * and a point where newton fails (past a fold), ends at negative 
+ * concentrations or moves further than CONTINUATION_MAX_CHANGE from the 
+ * extrapolation (to another branch), is integrated first, from the initial values or from 
+ * the point before, until the rhs is below the steady state tolerance or 
+ * t_settle is reached. the jacobian of a model with conservation laws is 
+ * singular, so newton needs reduce_moieties (factools.py -m); without it 
+ * every point is such an integration from the point before. */
+#define CONTINUATION_REL_TOL        1.0e-6
+#define CONTINUATION_ABS_TOL        1.0e-12
+#define CONTINUATION_NEWTON_ITERS   (20)
+#define CONTINUATION_HALVINGS       (10)
+/* pivots below CONTINUATION_PIVOT_TOL times the largest entry of the 
+ * jacobian count as zero */
+#define CONTINUATION_PIVOT_TOL      1.0e-12
+/* largest newton correction of a continued point, relative to the largest 
+ * state of the branch so far (initial values included) */
+#define CONTINUATION_MAX_CHANGE     0.5
+#define CONTINUATION_SETTLE_POINTS  (64)
+/* flags of a point */
+#define CONTINUATION_NEWTON         (0)
+#define CONTINUATION_INTEGRATED     (1)
+#define CONTINUATION_FAILED         (-1)
+
+/* newton work space of one thread, in the order of the solver states */
+typedef struct {
+    int n; 
+    N_Vector y, f, ytry, ftry; 
+    DenseMat jac; 
+    int *piv; 
+    double *dy; 
+    double *weight; /* of the residual in the steps of an iteration */
+} newton_work; 
+
+static void newton_work_init(newton_work *w, int n)
+{
+    w->n = n; 
+    w->y = N_VNew_Serial(n); 
+    w->f = N_VNew_Serial(n); 
+    w->ytry = N_VNew_Serial(n); 
+    w->ftry = N_VNew_Serial(n); 
+    w->jac = DenseAllocMat(n, n); 
+    w->piv = (int*) malloc(sizeof(int)*n); 
+    w->dy = (double*) malloc(sizeof(double)*n); 
+    w->weight = (double*) malloc(sizeof(double)*n); 
+}
+
+static void newton_work_free(newton_work *w)
+{
+    N_VDestroy_Serial(w->y); 
+    N_VDestroy_Serial(w->f); 
+    N_VDestroy_Serial(w->ytry); 
+    N_VDestroy_Serial(w->ftry); 
+    DenseFreeMat(w->jac); 
+    free(w->piv); 
+    free(w->dy); 
+    free(w->weight); 
+}
+
+/* max_i |f_i| / (abs_tol + rel_tol*|y_i|) */
+static double scaled_norm(N_Vector f, N_Vector y, int n, double rel_tol, 
+        double abs_tol)
+{
+    int i; 
+    double norm = 0.0; 
+    for (i = 0; i < n; ++i) {
+        double r = fabs(NV_Ith_S(f, i))/(abs_tol + rel_tol*fabs(NV_Ith_S(y, i))); 
+        if (!(r <= norm)) /* NaN as well */
+            norm = r; 
+    }
+    return norm; 
+}
+
+/* root mean square of f weighted by w->weight */
+static double weighted_rms(newton_work *w, N_Vector f)
+{
+    int i; 
+    double sum = 0.0; 
+    for (i = 0; i < w->n; ++i) {
+        double r = NV_Ith_S(f, i)*w->weight[i]; 
+        sum += r*r; 
+    }
+    return w->n > 0 ? sqrt(sum/w->n) : 0.0; 
+}
+
+/* the jacobian of the model at w->y into w->jac. the cv files of cvgen.py 
+ * only write its nonzero entries. */
+static void newton_jacobian(newton_work *w, realtype *rates)
+{
+    int i, j; 
+    for (j = 0; j < w->n; ++j) 
+        for (i = 0; i < w->n; ++i) 
+            DENSE_ELEM(w->jac, i, j) = 0.0; 
+    $(MODEL)_jac(w->n, w->jac, 0.0, w->y, w->f, rates, NULL, NULL, NULL); 
+}
+
+/* lu factorisation with partial pivoting of w->jac in place; -1 if it is 
+ * singular. */
+static int newton_factor(newton_work *w)
+{
+    int i, j, k, n = w->n; 
+    DenseMat a = w->jac; 
+    double tiny = 0.0; 
+    for (j = 0; j < n; ++j) 
+        for (i = 0; i < n; ++i) 
+            if (fabs(DENSE_ELEM(a, i, j)) > tiny) 
+                tiny = fabs(DENSE_ELEM(a, i, j)); 
+    tiny *= CONTINUATION_PIVOT_TOL; 
+    for (k = 0; k < n; ++k) {
+        int p = k; 
+        for (i = k + 1; i < n; ++i) 
+            if (fabs(DENSE_ELEM(a, i, k)) > fabs(DENSE_ELEM(a, p, k))) 
+                p = i; 
+        w->piv[k] = p; 
+        if (!(fabs(DENSE_ELEM(a, p, k)) > tiny)) 
+            return -1; 
+        if (p != k) 
+            for (j = 0; j < n; ++j) {
+                double swap = DENSE_ELEM(a, k, j); 
+                DENSE_ELEM(a, k, j) = DENSE_ELEM(a, p, j); 
+                DENSE_ELEM(a, p, j) = swap; 
+            }
+        for (i = k + 1; i < n; ++i) 
+            DENSE_ELEM(a, i, k) /= DENSE_ELEM(a, k, k); 
+        for (j = k + 1; j < n; ++j) {
+            double akj = DENSE_ELEM(a, k, j); 
+            for (i = k + 1; i < n; ++i) 
+                DENSE_ELEM(a, i, j) -= DENSE_ELEM(a, i, k)*akj; 
+        }
+    }
+    return 0; 
+}
+
+/* solves jac*x = b with the factors of newton_factor(); x overwrites b. 
+ * the rows of l were swapped with the later pivots, so all the swaps come 
+ * before the forward substitution. */
+static void newton_solve(newton_work *w, double *b)
+{
+    int i, k, n = w->n; 
+    DenseMat a = w->jac; 
+    for (k = 0; k < n; ++k) 
+        if (w->piv[k] != k) {
+            double swap = b[k]; 
+            b[k] = b[w->piv[k]]; 
+            b[w->piv[k]] = swap; 
+        }
+    for (k = 0; k < n; ++k) 
+        for (i = k + 1; i < n; ++i) 
+            b[i] -= DENSE_ELEM(a, i, k)*b[k]; 
+    for (k = n - 1; k >= 0; --k) {
+        b[k] /= DENSE_ELEM(a, k, k); 
+        for (i = 0; i < k; ++i) 
+            b[i] -= DENSE_ELEM(a, i, k)*b[k]; 
+    }
+}
+
+/* -1 if a state of w->y is negative beyond the error tolerance of the 
+ * solver, else iter */
+static int newton_result(newton_work *w, int iter)
+{
+    int i; 
+    for (i = 0; i < w->n; ++i) 
+        if (NV_Ith_S(w->y, i) < -SOLVER_ABS_ERROR) 
+            return -1; 
+    return iter; 
+}
+
+/* newton iterations from w->y to the steady state of rates. a step is 
+ * halved until it decreases the rhs, weighted by the steady state 
+ * tolerance at the start of the step; the iterations have converged when 
+ * the full step is within the error tolerance of the solver, or when no 
+ * step decreases a rhs that is already below the steady state tolerance 
+ * (an ill-conditioned jacobian). returns the number of iterations, or -1 
+ * if they did not converge or ended at negative concentrations. */
+static int newton_steady(newton_work *w, realtype *rates)
+{
+    int i, k, iter, n = w->n; 
+    $(MODEL)_vf(0.0, w->y, w->f, rates); 
+    for (iter = 1; iter <= CONTINUATION_NEWTON_ITERS; ++iter) {
+        newton_jacobian(w, rates); 
+        if (newton_factor(w) != 0) 
+            return -1; 
+        for (i = 0; i < n; ++i) 
+            w->dy[i] = -NV_Ith_S(w->f, i); 
+        newton_solve(w, w->dy); 
+
+        double step = 0.0; 
+        for (i = 0; i < n; ++i) {
+            double r = fabs(w->dy[i])/(SOLVER_ABS_ERROR 
+                    + SOLVER_REL_ERROR*fabs(NV_Ith_S(w->y, i))); 
+            if (!(r <= step)) 
+                step = r; 
+        }
+        if (step <= 1.0) {
+            for (i = 0; i < n; ++i) 
+                NV_Ith_S(w->y, i) += w->dy[i]; 
+            return newton_result(w, iter); 
+        }
+
+        for (i = 0; i < n; ++i) 
+            w->weight[i] = 1.0/(CONTINUATION_ABS_TOL 
+                    + CONTINUATION_REL_TOL*fabs(NV_Ith_S(w->y, i))); 
+        double residual = weighted_rms(w, w->f); 
+        double lambda = 1.0; 
+        for (k = 0; k <= CONTINUATION_HALVINGS; ++k, lambda *= 0.5) {
+            for (i = 0; i < n; ++i) 
+                NV_Ith_S(w->ytry, i) = NV_Ith_S(w->y, i) + lambda*w->dy[i]; 
+            $(MODEL)_vf(0.0, w->ytry, w->ftry, rates); 
+            if (weighted_rms(w, w->ftry) < residual) 
+                break; 
+        }
+        if (k > CONTINUATION_HALVINGS) 
+            return scaled_norm(w->f, w->y, n, CONTINUATION_REL_TOL, 
+                    CONTINUATION_ABS_TOL) <= 1.0 ? newton_result(w, iter) : -1; 
+        N_Vector swap = w->y; 
+        w->y = w->ytry; 
+        w->ytry = swap; 
+        swap = w->f; 
+        w->f = w->ftry; 
+        w->ftry = swap; 
+    }
+    return -1; 
+}
+
+/* integrates from ivalues (model order) with rates until the rhs is below 
+ * the steady state tolerance at one of CONTINUATION_SETTLE_POINTS even 
+ * checkpoints, or until t_settle; the state goes to w->y. returns 1 if the 
+ * rhs test passed, 0 if t_settle was reached first and the cvode flag if 
+ * the integration failed. */
+static int continuation_settle(solver_context *ctx, newton_work *w, 
+        realtype *ivalues, realtype *rates, double t_settle)
+{
+    int i, k, cvode_flag, settled = 0; 
+    realtype t = RCONST(0.0); 
+    realtype solver_param_[4] = { 
+        RCONST(SOLVER_ABS_ERROR), 
+        RCONST(SOLVER_REL_ERROR), 
+        RCONST(t_settle), 
+        RCONST(MAX_STEPS) 
+    };
+
+    cvode_flag = solver_init(ctx, w->n, ivalues, rates, solver_param_); 
+    /* the checkpoints are much further apart than the points of a tvec */
+    cvode_flag = CVodeSetMaxNumSteps(ctx->cvode_mem, (long) solver_param_[3]); 
+    for (k = 1; k <= CONTINUATION_SETTLE_POINTS; ++k) {
+        cvode_flag = CVode(ctx->cvode_mem, t_settle*k/CONTINUATION_SETTLE_POINTS, 
+                ctx->yt, &t, CV_NORMAL); 
+        if (cvode_flag != CV_SUCCESS && cvode_flag != CV_TSTOP_RETURN) 
+            return cvode_flag; 
+        $(MODEL)_vf(t, ctx->yt, w->f, rates); 
+        settled = scaled_norm(w->f, ctx->yt, w->n, CONTINUATION_REL_TOL, 
+                CONTINUATION_ABS_TOL) <= 1.0; 
+        if (settled) 
+            break; 
+    }
+    for (i = 0; i < w->n; ++i) 
+        NV_Ith_S(w->y, i) = NV_Ith_S(ctx->yt, i); 
+    return settled; 
+}
+
+/* one branch of engine_continuation(); rates is the row of the branch and 
+ * is changed at param. */
+static void continuation_branch(
+        solver_context *ctx, 
+        newton_work *w, 
+        int num_points, 
+        realtype *ivalues, 
+        realtype *rates, 
+        int param, 
+        double *values, 
+        double t_settle, 
+        double *yss, 
+        double *jac, 
+        double *flags)
+{
+    int i, j, k, n = w->n; 
+    int have_prev = 0, have_secant = 0; 
+    double size = 0.0; 
+    double *prev = (double*) malloc(sizeof(double)*n*3); 
+    double *prev2 = &prev[n]; 
+    double *settled_y = &prev[2*n]; 
+    realtype *start = (realtype*) malloc(sizeof(realtype)*n); 
+    for (i = 0; i < n; ++i) 
+        if (fabs(ivalues[i]) > size) 
+            size = fabs(ivalues[i]); 
+
+    for (k = 0; k < num_points; ++k) {
+        int flag = CONTINUATION_FAILED; 
+        rates[param] = values[k]; 
+        if (have_prev) {
+            double s = 0.0, change = 0.0; 
+            if (have_secant && values[k-1] != values[k-2]) 
+                s = (values[k] - values[k-1])/(values[k-1] - values[k-2]); 
+            for (i = 0; i < n; ++i) {
+                settled_y[i] = prev[i] + s*(prev[i] - prev2[i]); 
+                NV_Ith_S(w->y, i) = settled_y[i]; 
+            }
+            if (newton_steady(w, rates) >= 0) {
+                for (i = 0; i < n; ++i) 
+                    if (fabs(NV_Ith_S(w->y, i) - settled_y[i]) > change) 
+                        change = fabs(NV_Ith_S(w->y, i) - settled_y[i]); 
+                if (change <= CONTINUATION_MAX_CHANGE*size + SOLVER_ABS_ERROR) 
+                    flag = CONTINUATION_NEWTON; 
+            }
+        }
+        if (flag == CONTINUATION_FAILED) {
+            for (i = 0; i < n; ++i) 
+                start[STATE_INDEX(i)] = have_prev ? prev[i] 
+                    : ivalues[STATE_INDEX(i)]; 
+            int settled = continuation_settle(ctx, w, start, rates, t_settle); 
+            if (settled >= 0) {
+                /* the integrated state stands if newton fails from it */
+                for (i = 0; i < n; ++i) 
+                    settled_y[i] = NV_Ith_S(w->y, i); 
+                if (newton_steady(w, rates) >= 0) 
+                    flag = CONTINUATION_INTEGRATED; 
+                else if (settled == 1) {
+                    for (i = 0; i < n; ++i) 
+                        NV_Ith_S(w->y, i) = settled_y[i]; 
+                    flag = CONTINUATION_INTEGRATED; 
+                }
+            }
+        }
+
+        flags[k] = (double) flag; 
+        for (i = 0; i < n; ++i) 
+            yss[(size_t) k*n + STATE_INDEX(i)] = NV_Ith_S(w->y, i); 
+        if (jac != NULL) {
+            double *jk = &jac[(size_t) k*n*n]; 
+            newton_jacobian(w, rates); 
+            for (i = 0; i < n; ++i) 
+                for (j = 0; j < n; ++j) 
+                    jk[(size_t) STATE_INDEX(i)*n + STATE_INDEX(j)] = 
+                        flag != CONTINUATION_FAILED ? DENSE_ELEM(w->jac, i, j) 
+                        : 0.0; 
+        }
+        if (flag != CONTINUATION_FAILED) {
+            memcpy(prev2, prev, sizeof(double)*n); 
+            for (i = 0; i < n; ++i) {
+                prev[i] = NV_Ith_S(w->y, i); 
+                if (fabs(prev[i]) > size) 
+                    size = fabs(prev[i]); 
+            }
+            /* no secant across a jump to another branch */
+            have_secant = have_prev && flag == CONTINUATION_NEWTON; 
+            have_prev = 1; 
+        } else {
+            /* the next point starts from the last one found, without 
+             * extrapolation */
+            have_secant = 0; 
+        }
+    }
+    free(prev); 
+    free(start); 
+}
+
+/* steady states of num_branches branches of num_points values of param 
+ * each (values_array, branches x points, in the order of the sweep). every 
+ * branch has its own initial values and rates (branches x species, 
+ * branches x parameters). yss_array (branches x points x species) holds 
+ * the steady states and ptr_output_flag (branches x points) 
+ * CONTINUATION_NEWTON (0) where newton continued from the points before, 
+ * CONTINUATION_INTEGRATED (1) where the point was integrated first and 
+ * CONTINUATION_FAILED (-1) where no steady state was found. jac_array 
+ * (branches x points x species x species, row major) receives the 
+ * jacobians at the steady states when it is not NULL, e.g. for their 
+ * eigenvalues. returns -1 for bad arguments. */
+int engine_continuation(
+        int num_branches, 
+        int num_points, 
+        int num_species_ival, 
+        double *ivalues_array, 
+        int num_params_rates, 
+        double *rates_array, 
+        int param, 
+        double *values_array, 
+        double t_settle, 
+        double *yss_array, 
+        double *jac_array, 
+        double *ptr_output_flag
+        )
+{
+    int i; 
+    if (num_species_ival != __N_SPECIES__ || num_params_rates != __N_PARAMETERS__ 
+            || param < 0 || param >= num_params_rates || num_points < 1 
+            || !(t_settle > 0.0)) 
+        return -1; 
+
+    int num_threads = engine_schedule(); 
+    solver_context *contexts = (solver_context*) calloc(num_threads, 
+            sizeof(solver_context)); 
+    newton_work *work = (newton_work*) malloc(sizeof(newton_work)*num_threads); 
+    for (i = 0; i < num_threads; ++i) 
+        newton_work_init(&work[i], num_species_ival); 
+
+    stats_reset(num_threads); 
+    double wall_start = omp_get_wtime(); 
+
+#ifdef WITH_OMP
+#pragma omp parallel for schedule(runtime) private(i)
+#endif
+    for (i = 0; i < num_branches; ++i) {
+        double branch_start = omp_get_wtime(); 
+        int tid = omp_get_thread_num(); 
+        realtype rates[__N_PARAMETERS__ > 0 ? __N_PARAMETERS__ : 1]; 
+        memcpy(rates, &rates_array[(size_t) i*num_params_rates], 
+                sizeof(realtype)*num_params_rates); 
+        continuation_branch(&contexts[tid], &work[tid], num_points, 
+                &ivalues_array[(size_t) i*num_species_ival], rates, param, 
+                &values_array[(size_t) i*num_points], t_settle, 
+                &yss_array[(size_t) i*num_points*num_species_ival], 
+                jac_array != NULL ? &jac_array[(size_t) i*num_points 
+                    *num_species_ival*num_species_ival] : NULL, 
+                &ptr_output_flag[(size_t) i*num_points]); 
+        if (tid < stats_threads_) { 
+            stats_busy_[tid] += omp_get_wtime() - branch_start; 
+            stats_samples_[tid] += num_points; 
+        }
+    }
+
+    stats_wall_ += omp_get_wtime() - wall_start; 
+    for (i = 0; i < num_threads; ++i) {
+        solver_free(&contexts[i]); 
+        newton_work_free(&work[i]); 
+    }
+    free(contexts); 
+    free(work); 
+    return 0; 
+}
+#endif
+
+
+
+
+#ifndef STEADY
+/* a sample and its score for the top-K selection of engine_readout() */
+typedef struct {
+    double score; 
+    long long index; 
+} ranked_sample; 
+
+/* larger scores first, ties by sample index */
+static int ranked_compare(const void *a, const void *b)
+{
+    const ranked_sample *x = (const ranked_sample*) a; 
+    const ranked_sample *y = (const ranked_sample*) b; 
+    if (x->score != y->score) 
+        return x->score > y->score ? -1 : 1; 
+    return x->index < y->index ? -1 : x->index > y->index; 
+}
+
+/* engine() that keeps only the readouts of every sample instead of its 
+ * trajectory: the READOUT section of the model (readout_() of ode_size.h) 
+ * is evaluated on each trajectory right after it is integrated, and 
+ * scores_array (samples x __N_READOUTS__) is the only output that grows 
+ * with the trajectories. yss and flag are filled as by engine(). 
+ *
+ * with top_k > 0, top_y_array gets the trajectories of the top_k samples, 
+ * in the layout of engine() (see engine_output()), of the top_k samples with the largest readout rank_by, best 
+ * first, and top_index_array their indices (-1 where there are fewer 
+ * samples with a score that is not nan). they are integrated once more 
+ * after the batch, with the same seed and noise streams, so they are the 
+ * trajectories that engine() returns for them. returns 0, or -1 if the 
+ * model has no readouts or rank_by is not one of them. */
+int engine_readout(
+        int num_timepoints,
+        double *ptr_timepoints, 
+        int num_samples_rates, 
+        int num_species_ival, 
+        double *ivalues_array, 
+        int num_params_rates, 
+        double *rates_array, 
+        double *scores_array, 
+        int top_k, 
+        int rank_by, 
+        double *top_y_array, 
+        double *top_index_array, 
+        double *yss_array, 
+        double *ptr_output_flag
+#ifdef LANGEVIN 
+        , double zeta
+#endif
+        )
+{
+    int i, k, num_ranked = 0; 
+    unsigned long long seed = engine_seed(); 
+    ranked_sample *ranked; 
+    long long *top_sample; 
+    double *top_ivalues, *top_rates, *top_yss, *top_flag; 
+
+    if (__N_READOUTS__ == 0 || (top_k > 0 && (rank_by < 0 || 
+                    rank_by >= __N_READOUTS__))) 
+        return -1; 
+
+    stats_reset(engine_schedule()); 
+
+    run_samples(num_timepoints, ptr_timepoints, num_samples_rates, 
+            num_species_ival, ivalues_array, num_params_rates, rates_array, 
+            NULL, yss_array, ptr_output_flag, NULL, NULL, stats_array_, 
+            scores_array, NULL, seed, seed_first_
+#ifdef LANGEVIN 
+            , zeta
+#endif
+#ifdef SENS
+            , NULL
+#endif
+            ); 
+    if (top_k <= 0 || top_y_array == NULL || top_index_array == NULL) 
+        return 0; 
+
+    output_layout layout; 
+    output_layout_init(&layout, num_timepoints, 0); 
+    memset(top_y_array, 0, sizeof(double)*top_k*OUTPUT_VALUES(&layout)); 
+    for (k = 0; k < top_k; ++k) 
+        top_index_array[k] = -1.0; 
+
+    ranked = (ranked_sample*) malloc(sizeof(ranked_sample)*
+            (num_samples_rates > 0 ? num_samples_rates : 1)); 
+    for (i = 0; i < num_samples_rates; ++i) {
+        double score = scores_array[(size_t) i*__N_READOUTS__ + rank_by]; 
+        if (!isnan(score)) {
+            ranked[num_ranked].score = score; 
+            ranked[num_ranked].index = i; 
+            num_ranked++; 
+        }
+    }
+    qsort(ranked, num_ranked, sizeof(ranked_sample), ranked_compare); 
+    if (top_k > num_ranked) 
+        top_k = num_ranked; 
+
+    top_sample = (long long*) malloc(sizeof(long long)*(top_k + 1)); 
+    top_ivalues = (double*) malloc(sizeof(double)*(top_k + 1)*num_species_ival); 
+    top_rates = (double*) malloc(sizeof(double)*(top_k + 1)*num_params_rates); 
+    top_yss = (double*) malloc(sizeof(double)*(top_k + 1)*num_species_ival); 
+    top_flag = (double*) malloc(sizeof(double)*(top_k + 1)); 
+    for (k = 0; k < top_k; ++k) {
+        i = (int) ranked[k].index; 
+        top_sample[k] = seed_first_ + i; 
+        memcpy(&top_ivalues[(size_t) k*num_species_ival], 
+                &ivalues_array[(size_t) i*num_species_ival], 
+                sizeof(double)*num_species_ival); 
+        memcpy(&top_rates[(size_t) k*num_params_rates], 
+                &rates_array[(size_t) i*num_params_rates], 
+                sizeof(double)*num_params_rates); 
+        top_index_array[k] = (double) i; 
+    }
+    if (top_k > 0) 
+        run_samples(num_timepoints, ptr_timepoints, top_k, num_species_ival, 
+                top_ivalues, num_params_rates, top_rates, top_y_array, 
+                top_yss, top_flag, NULL, NULL, NULL, NULL, top_sample, seed, 0
+#ifdef LANGEVIN 
+                , zeta
+#endif
+#ifdef SENS
+                , NULL
+#endif
+                ); 
+
+    free(ranked); 
+    free(top_sample); 
+    free(top_ivalues); 
+    free(top_rates); 
+    free(top_yss); 
+    free(top_flag); 
+    return 0; 
+}
+
+/* the header of a version 1.0 .npy file holding a C ordered float64 array 
+ * of shape (d0, d1, d2), or (d0, d1, d2, d3) if d3 >= 0. the header is 
+ * padded so that the data starts at a multiple of 64 bytes; its length is 
+ * the little endian uint16 at byte 8, and the data starts at byte 10 + 
+ * that length. */
+static int write_npy_header(FILE *out, long d0, long d1, long d2, long d3)
+{
+    char dict[256]; 
+    int len = d3 < 0 ? snprintf(dict, sizeof(dict), 
+            "{'descr': '<f8', 'fortran_order': False, 'shape': (%ld, %ld, %ld), }", 
+            d0, d1, d2) : snprintf(dict, sizeof(dict), 
+            "{'descr': '<f8', 'fortran_order': False, 'shape': (%ld, %ld, %ld, %ld), }", 
+            d0, d1, d2, d3); 
+    int header_len = ((10 + len + 1 + 63)/64)*64 - 10; 
+    unsigned char prefix[10] = { 0x93, 'N', 'U', 'M', 'P', 'Y', 1, 0, 
+        header_len & 0xff, (header_len >> 8) & 0xff }; 
+
+    if (fwrite(prefix, 1, 10, out) != 10) 
+        return -1; 
+    while (len < header_len - 1) 
+        dict[len++] = ' '; 
+    dict[len++] = '\n'; 
+    return fwrite(dict, 1, len, out) == len ? 0 : -1; 
+}
+
+/* the axes of the .npy written by engine_to_file(), as json in path.json. 
+ * num_params >= 0 adds the axis of the parameters of params (the 
+ * sensitivities of SENS engines). */
+static int write_npy_axes(const char *path, long num_samples, 
+        double *ptr_timepoints, const output_layout *layout, int num_params, 
+        const int *params)
+{
+    int k, column; 
+    size_t n = strlen(path); 
+    char *axes_path = (char*) malloc(n + 6); 
+    FILE *out; 
+
+    memcpy(axes_path, path, n); 
+    memcpy(axes_path + n, ".json", 6); 
+    out = fopen(axes_path, "w"); 
+    free(axes_path); 
+    if (out == NULL) 
+        return -1; 
+
+    fprintf(out, "{\"axes\": [\"sample\", \"time\", \"species\"%s],\n", 
+            num_params >= 0 ? ", \"parameter\"" : ""); 
+    fprintf(out, " \"shape\": [%ld, %d, %d", num_samples, layout->num_times, 
+            layout->num_species); 
+    if (num_params >= 0) 
+        fprintf(out, ", %d", num_params); 
+    fprintf(out, "],\n"); 
+    fprintf(out, " \"time\": ["); 
+    for (k = 0; k < layout->num_times; ++k) 
+        fprintf(out, "%s%.17g", k ? ", " : "", ptr_timepoints[k*layout->stride]); 
+    fprintf(out, "],\n \"species\": ["); 
+    for (column = 0; column < layout->num_species; ++column) 
+        for (k = 0; k < __N_SPECIES__; ++k) 
+            if (layout->position[k] == column) 
+                fprintf(out, "%s\"%s\"", column ? ", " : "", varnames_[k]); 
+    fprintf(out, "]"); 
+    if (num_params >= 0) {
+        fprintf(out, ",\n \"parameter\": ["); 
+        for (k = 0; k < num_params; ++k) 
+            fprintf(out, "%s\"%s\"", k ? ", " : "", parnames_[params[k]]); 
+        fprintf(out, "]"); 
+    }
+    fprintf(out, "}\n"); 
+    return fclose(out) == 0 ? 0 : -1; 
+}
+
+/* integrates chunk_samples samples at a time (OUTPUT_CHUNK_SAMPLES if 
+ * chunk_samples <= 0) and appends their trajectories to path, a .npy file 
+ * of shape (samples, timepoints, species) in the layout of engine() (see 
+ * engine_output()). memory use is bounded by the 
+ * chunk, not by the number of samples, and the file can be opened lazily 
+ * (numpy.load(path, mmap_mode='r'), memmapfile in matlab). yss and flag 
+ * are filled as by engine(). with SENS and a sens_path, the sensitivities 
+ * go to sens_path, a second .npy of shape (samples, timepoints, species, 
+ * parameters) in the layout of sens_array. returns 0, or -1 if the files 
+ * could not be written. */
+int engine_to_file(
+        int num_timepoints,
+        double *ptr_timepoints, 
+        int num_samples_rates, 
+        int num_species_ival, 
+        double *ivalues_array, 
+        int num_params_rates, 
+        double *rates_array, 
+        const char *path, 
+        int chunk_samples, 
+        double *yss_array, 
+        double *ptr_output_flag
+#ifdef LANGEVIN 
+        , double zeta
+#endif
+#ifdef SENS
+        , const char *sens_path
+#endif
+        )
+{
+    int first, n, failed; 
+    unsigned long long seed = engine_seed(); 
+    size_t chunk_values; 
+    double *buffer; 
+    output_layout layout; 
+    FILE *out = fopen(path, "wb"); 
+#ifdef SENS
+    sens_selection sens; 
+    size_t sens_values = 0; 
+    double *sens_buffer = NULL; 
+    FILE *sens_out = NULL; 
+#endif
+
+    if (out == NULL) 
+        return -1; 
+    if (chunk_samples <= 0) 
+        chunk_samples = OUTPUT_CHUNK_SAMPLES; 
+    if (chunk_samples > num_samples_rates) 
+        chunk_samples = num_samples_rates > 0 ? num_samples_rates : 1; 
+    output_layout_init(&layout, num_timepoints, 0); 
+    chunk_values = chunk_samples*OUTPUT_VALUES(&layout); 
+    buffer = (double*) malloc(sizeof(double)*chunk_values); 
+
+    failed = buffer == NULL || write_npy_header(out, num_samples_rates, 
+                layout.num_times, layout.num_species, -1) != 0; 
+#ifdef SENS
+    sens_selection_init(&sens); 
+    if (sens_path != NULL && !failed) {
+        sens_values = OUTPUT_VALUES(&layout)*sens.count; 
+        sens_out = fopen(sens_path, "wb"); 
+        sens_buffer = (double*) malloc(sizeof(double)*
+                (chunk_samples*sens_values + 1)); 
+        failed = sens_out == NULL || sens_buffer == NULL 
+            || write_npy_header(sens_out, num_samples_rates, layout.num_times, 
+                    layout.num_species, sens.count) != 0; 
+    }
+#endif
+
+    stats_reset(engine_schedule()); 
+    for (first = 0; first < num_samples_rates && !failed; first += chunk_samples) {
+        n = num_samples_rates - first < chunk_samples ? 
+            num_samples_rates - first : chunk_samples; 
+        chunk_values = n*OUTPUT_VALUES(&layout); 
+        /* timepoints after a solver failure are not written by worker() 
+         * and must not keep values of the previous chunk */
+        memset(buffer, 0, sizeof(double)*chunk_values); 
+#ifdef SENS
+        if (sens_buffer != NULL) 
+            memset(sens_buffer, 0, sizeof(double)*n*sens_values); 
+#endif
+        run_samples(num_timepoints, ptr_timepoints, n, num_species_ival, 
+                &ivalues_array[(size_t) first*num_species_ival], 
+                num_params_rates, 
+                &rates_array[(size_t) first*num_params_rates], 
+                buffer, 
+                &yss_array[(size_t) first*num_species_ival], 
+                &ptr_output_flag[first], NULL, NULL, 
+                stats_array_ != NULL ? 
+                    &stats_array_[(size_t) first*NUM_STATS] : NULL, 
+                NULL, NULL, seed, seed_first_ + first
+#ifdef LANGEVIN 
+                , zeta
+#endif
+#ifdef SENS
+                , sens_buffer
+#endif
+                ); 
+        failed = fwrite(buffer, sizeof(double), chunk_values, out) != chunk_values; 
+#ifdef SENS
+        if (sens_out != NULL && !failed) 
+            failed = fwrite(sens_buffer, sizeof(double), n*sens_values, 
+                    sens_out) != n*sens_values; 
+#endif
+    }
+
+    free(buffer); 
+    if (fclose(out) != 0) 
+        failed = 1; 
+#ifdef SENS
+    free(sens_buffer); 
+    if (sens_out != NULL && fclose(sens_out) != 0) 
+        failed = 1; 
+    if (sens_out != NULL && !failed) 
+        failed = write_npy_axes(sens_path, num_samples_rates, ptr_timepoints, 
+                &layout, sens.count, sens.params) != 0; 
+#endif
+    if (failed) 
+        return -1; 
+    return write_npy_axes(path, num_samples_rates, ptr_timepoints, &layout, 
+            -1, NULL); 
+}
+#endif 
+
 
 
 
@@ -0,0 +1,352 @@
+#!/usr/bin/python
+'''modelir.py reads a model once and keeps it as a typed in-memory
+representation (IR) that genDefaultPar, genRange, factools, vftool and the
+python engines all work from.
+
+The .eqn file gives the parameters with their default values and
+#{min, max} ranges, the initial values, the reaction lines and the
+MOIETY, PROBE, BIFURC_PARAM, CONFIG and READOUT sections. The .maple file
+written by facile.pl -L gives the constants, dependent species,
+expressions and species odes in the order the engines use them. Each
+file is scanned line by line, once.
+
+Each parsed file is cached next to it as a pickle (<file>.mir) together
+with its size and mtime, so later stages load it without parsing again as
+long as the file did not change.
+
+usage:
+    model = Load('hello.eqn', 'hello.maple')
+'''
+import os, re, sys
+import cPickle as pickle
+
+IR_VERSION = 3
+IR_SUFFIX = '.mir'
+
+DEFAULT_MIN = '1.0E-1'
+DEFAULT_MAX = '1.0E+1'
+
+EQN_SECTIONS = ['EQN', 'INIT', 'MOIETY', 'BIFURC_PARAM', 'CONFIG', 'PROMOTER', 'PROBE',
+        'READOUT']
+
+_range = re.compile(r'\{\s*([^,{}]+?)\s*,\s*([^,{}]+?)\s*\}')
+_variable = re.compile(r'^(variable|parameter)\s+([^\s=]+)\s*=\s*(.*)$')
+
+class Parameter(object):
+    '''a model parameter (rate constant). value, lower and upper are kept
+    as the text of the model file; the range is None where no #{min, max}
+    was given.
+    '''
+    __slots__ = ('name', 'value', 'lower', 'upper')
+    def __init__(self, name, value, lower=None, upper=None):
+        self.name = name
+        self.value = value
+        self.lower = lower
+        self.upper = upper
+
+    def bounds(self):
+        '''(min, max) text, with the genRange defaults for missing ranges. '''
+        if self.lower is None:
+            return DEFAULT_MIN, DEFAULT_MAX
+        return self.lower, self.upper
+
+    def fixed(self):
+        '''a parameter whose range is a single value. '''
+        if self.lower is None:
+            return False
+        try:
+            return float(self.lower) == float(self.upper)
+        except ValueError:
+            return self.lower == self.upper
+
+class Species(object):
+    '''a species with its initial value and, once the maple file was read,
+    the right hand side of its ode.
+    '''
+    __slots__ = ('name', 'initial', 'ode')
+    def __init__(self, name, initial, ode=None):
+        self.name = name
+        self.initial = initial
+        self.ode = ode
+
+class Expression(object):
+    __slots__ = ('name', 'formula')
+    def __init__(self, name, formula):
+        self.name = name
+        self.formula = formula
+
+class Model(object):
+    '''IR of one model.
+
+    eqn_parameters/eqn_species are what the .eqn file declares (variable
+    lines and the INIT section), parameters/species are the engine vectors
+    from the .maple file, in engine order. readouts are the 'name =
+    formula' lines of the READOUT section, as Expressions over the
+    trajectory of a sample (see factools.EmitReadoutC). moieties are the
+    'independent X' and 'dependent Y' lines of the MOIETY section (see
+    factools.ReduceMoieties).
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.eqn_parameters = []
+        self.eqn_species = []
+        self.reactions = []
+        self.moieties = []
+        self.probes = []
+        self.bifurc_params = []
+        self.config = []
+        self.readouts = []
+        self.parameters = []
+        self.species = []
+        self.dependent_species = []
+        self.expressions = []
+        self.sources = {}
+
+    def parameter(self, name):
+        '''looks up an engine parameter, falling back to the eqn variables. '''
+        for p in self.parameters:
+            if p.name == name:
+                return p
+        for p in self.eqn_parameters:
+            if p.name == name:
+                return p
+        return None
+
+    def config_value(self, key, default=None):
+        '''the value of a 'key = value' line of the CONFIG section. '''
+        for line in self.config:
+            words = line.split('=', 1)
+            if len(words) == 2 and words[0].strip() == key:
+                return words[1].strip()
+        return default
+
+    def ranges(self):
+        '''#{min, max} ranges by parameter name. '''
+        result = {}
+        for p in self.eqn_parameters:
+            if p.lower is not None:
+                result[p.name] = (p.lower, p.upper)
+        return result
+
+def _strip_comment(a_line):
+    if a_line.find('#') > -1:
+        return a_line[0:a_line.find('#')].strip(), a_line[a_line.find('#')+1:]
+    return a_line, ''
+
+def ParseEqn(inputfile, model=None):
+    '''reads a facile .eqn file into model (a new Model if None). '''
+    if model is None:
+        model = Model(os.path.basename(inputfile).split('.')[0])
+    section = 'EQN'
+    for a_line in file(inputfile):
+        a_line = a_line.strip()
+        if a_line == '' or a_line[0] == '#':
+            continue
+        body, comment = _strip_comment(a_line)
+        body = body.split('//')[0].strip()
+        if body == '':
+            continue
+        if body.rstrip(':') in EQN_SECTIONS and \
+                (body.endswith(':') or body in EQN_SECTIONS):
+            section = body.rstrip(':')
+            continue
+
+        if section == 'EQN':
+            m = _variable.match(body)
+            if m:
+                lower, upper = None, None
+                r = _range.search(comment)
+                if r:
+                    lower, upper = r.group(1), r.group(2)
+                model.eqn_parameters.append(Parameter(m.group(2),
+                    m.group(3).strip(), lower, upper))
+            elif re.search(r'<[-=]|[-=]>', body):
+                model.reactions.append(body)
+        elif section == 'INIT':
+            for an_init in body.split(';'):
+                if an_init.strip() == '':
+                    continue
+                words = an_init.split('=')
+                value = words[1].strip() if len(words) > 1 else '0'
+                model.eqn_species.append(Species(words[0].strip(), value))
+        elif section == 'MOIETY':
+            model.moieties.append(body)
+        elif section == 'PROBE':
+            model.probes.append(re.sub(r'^probe\s+', '', body))
+        elif section == 'BIFURC_PARAM':
+            model.bifurc_params += [ w for w in re.split(r'[\s,]+', body) if w ]
+        elif section == 'CONFIG':
+            model.config.append(body.rstrip(';'))
+        elif section == 'READOUT':
+            words = body.rstrip(';').split('=', 1)
+            if len(words) != 2:
+                raise ValueError('%s: name = formula expected in READOUT, not %s' % (inputfile, body))
+            model.readouts.append(Expression(words[0].strip(), words[1].strip()))
+    model.sources[os.path.abspath(inputfile)] = _stamp(inputfile)
+    return model
+
+def ParseMaple(inputfile, model=None):
+    '''reads the maple output of facile (facile.pl -L) into model. '''
+    if model is None:
+        model = Model(os.path.basename(inputfile).split('.')[0])
+    block = '?'
+    species = {}
+    blocks = {
+        '# initial values': 'iv',
+        '# constants': 'con',
+        '# moiety totals': 'con',
+        '# dependent species': 'depspec',
+        '# expressions': 'expr',
+        '# ode for independent species': 'species',
+        }
+    for a_line in file(inputfile):
+        a_line = a_line.strip()
+        if a_line == '':
+            continue
+        if a_line.find(' #') > -1:
+            a_line = a_line[0:a_line.find(' #')]
+        if a_line in blocks:
+            block = blocks[a_line]
+            continue
+        if a_line[0] == '#':
+            continue
+        words = a_line.split(':=')
+        if len(words) != 2:
+            continue
+        name = words[0].strip()
+        value = words[1].replace(';', '').strip()
+        if block == 'iv':
+            # iA := 1e-5;
+            s = Species(name[1:], value)
+            model.species.append(s)
+            species[s.name] = s
+        elif block == 'con':
+            model.parameters.append(Parameter(name, value))
+        elif block == 'depspec':
+            model.dependent_species.append(Expression(name, value))
+        elif block == 'expr':
+            model.expressions.append(Expression(name, value))
+        elif block == 'species':
+            # dAdt := ...;
+            species[name[1:-2]].ode = value
+
+    ApplyRanges(model)
+    model.sources[os.path.abspath(inputfile)] = _stamp(inputfile)
+    return model
+
+def WriteMaple(model, path):
+    '''writes the engine vectors of model in the block layout of facile.pl
+    -L, for models that were not made by facile (scaled or synthetic).
+    '''
+    f = open(path, 'w')
+    f.write('# initial values\n')
+    for s in model.species:
+        f.write('i%s := %s;\n' % (s.name, s.initial))
+    f.write('\n# constants\n')
+    for p in model.parameters:
+        f.write('%s := %s;\n' % (p.name, p.value))
+    f.write('\n# dependent species\n')
+    for e in model.dependent_species:
+        f.write('%s := %s;\n' % (e.name, e.formula))
+    f.write('\n# expressions\n')
+    for e in model.expressions:
+        f.write('%s := %s;\n' % (e.name, e.formula))
+    f.write('\n# ode for independent species\n')
+    for s in model.species:
+        f.write('d%sdt := %s;\n' % (s.name, s.ode))
+    f.close()
+    return path
+
+def ApplyRanges(model):
+    '''the ranges of the maple constants come from the eqn variables. '''
+    eqn = dict([ (p.name, p) for p in model.eqn_parameters ])
+    for p in model.parameters:
+        if p.name in eqn:
+            p.lower, p.upper = eqn[p.name].lower, eqn[p.name].upper
+
+def _stamp(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime)
+
+def CacheFile(source):
+    return source + IR_SUFFIX
+
+def Save(model, path):
+    '''writes model to a binary cache file (atomically). '''
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp, 'wb')
+    pickle.dump((IR_VERSION, model), f, pickle.HIGHEST_PROTOCOL)
+    f.close()
+    os.rename(tmp, path)
+    return path
+
+def _load_cache(path, source):
+    '''the cached model at path if it was built from source as it is now. '''
+    try:
+        f = open(path, 'rb')
+        version, model = pickle.load(f)
+        f.close()
+    except (IOError, EOFError, ValueError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+    if version != IR_VERSION:
+        return None
+    if model.sources != { os.path.abspath(source): _stamp(source) }:
+        return None
+    return model
+
+def _parse(source, parser, cache):
+    if cache:
+        model = _load_cache(CacheFile(source), source)
+        if model is not None:
+            return model
+    model = parser(source)
+    if cache:
+        try:
+            Save(model, CacheFile(source))
+        except (IOError, OSError):
+            pass
+    return model
+
+def Load(eqnfile=None, maplefile=None, cache=True):
+    '''the model of eqnfile and/or maplefile. each file is parsed once and
+    cached in <file>.mir; later calls load the cache while the file is
+    unchanged.
+    '''
+    if eqnfile is None and maplefile is None:
+        raise ValueError('an eqn or maple file is needed')
+    model = None
+    if eqnfile is not None:
+        model = _parse(eqnfile, ParseEqn, cache)
+    if maplefile is not None:
+        maple = _parse(maplefile, ParseMaple, cache)
+        if model is None:
+            model = maple
+        else:
+            model.parameters = maple.parameters
+            model.species = maple.species
+            model.dependent_species = maple.dependent_species
+            model.expressions = maple.expressions
+            model.sources.update(maple.sources)
+            ApplyRanges(model)
+    return model
+
+def main(argv):
+    '''modelir.py model.eqn [model.maple] : parses and caches the model. '''
+    eqnfile = [ a for a in argv if a.endswith('.eqn') ]
+    maplefile = [ a for a in argv if a.endswith('.maple') ]
+    if not eqnfile and not maplefile:
+        print main.__doc__
+        sys.exit()
+    for source, parser in [(eqnfile, ParseEqn), (maplefile, ParseMaple)]:
+        if source:
+            model = parser(source[0])
+            print '%s: %d parameters, %d species, %d expressions -> %s' % (
+                    source[0], len(model.parameters or model.eqn_parameters),
+                    len(model.species or model.eqn_species),
+                    len(model.expressions), Save(model, CacheFile(source[0])))
+
+if __name__ == '__main__':
+    # run through the imported module so that pickled classes are
+    # modelir.Model and not __main__.Model
+    import modelir
+    modelir.main(sys.argv[1:])
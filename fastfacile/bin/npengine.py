@@ -0,0 +1,414 @@
+#!/usr/bin/python
+'''npengine.py is a pure numpy engine for a facile model. It is the fallback
+when the cmex/.so engines can not be built (no matlab, no sundials).
+
+The right hand side is generated once from the blocks of the maple file
+(constants, dependent species, expressions and species odes) as a python
+function that works on a whole (samples, species) block at once. The block
+is advanced by a batched Rosenbrock stepper, the same modified Rosenbrock
+2(3) pair as matlab ode23s, so each sample keeps its own step size while
+all samples share one set of numpy calls per step.
+
+usage:
+    eng = NumpyEngine('hello.maple')
+    y, yss, flag = eng.run(tvec, ivalues, rates)
+'''
+import os, re, sys, time
+import numpy as np
+import modelir
+
+# the tolerances of the cvode engines (SOLVER_REL_ERROR and
+# SOLVER_ABS_ERROR in mex_mat.c)
+RELTOL = 1.0e-7
+ABSTOL = 1.0e-8
+MAX_STEPS = 100000
+
+# cvode style return flags
+SOLVER_SUCCESS = 0
+SOLVER_TOO_MUCH_WORK = -1
+SOLVER_CONV_FAILURE = -4
+
+# numbers are matched first so that the exponent of 1e-70 is not taken as
+# an identifier
+_token = re.compile(r'(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?|[A-Za-z_][A-Za-z0-9_]*')
+
+def _is_identifier(word):
+    return word[0].isalpha() or word[0] == '_'
+
+# functions allowed in maple formulas
+_functions = {
+    'exp': np.exp,
+    'log': np.log,
+    'ln': np.log,
+    'log10': np.log10,
+    'sqrt': np.sqrt,
+    'abs': np.abs,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'tanh': np.tanh,
+    'min': np.minimum,
+    'max': np.maximum,
+    'pow': np.power,
+    'Pi': np.pi,
+    'pi': np.pi,
+    }
+
+def Symbols(formula):
+    '''returns the set of identifiers used in a formula. '''
+    return set([ w for w in _token.findall(formula) if _is_identifier(w) ])
+
+def SortExpressions(expressions):
+    '''orders expressions so that every expression comes after the
+    expressions it uses.
+    '''
+    expressionDict = dict([ (e.name, e.formula) for e in expressions ])
+    ordered = []
+    done = set()
+    def visit(name, stack):
+        if name in done:
+            return
+        if name in stack:
+            raise ValueError('circular expression: %s' % ' -> '.join(stack + [name]))
+        for dep in Symbols(expressionDict[name]):
+            if dep in expressionDict and dep != name:
+                visit(dep, stack + [name])
+        done.add(name)
+        ordered.append(name)
+    for e in expressions:
+        visit(e.name, [])
+    return ordered
+
+def _translate(formula, names):
+    '''maple formula -> python expression over the generated local names. '''
+    formula = formula.replace('^', '**')
+    def repl(m):
+        word = m.group(0)
+        if not _is_identifier(word):
+            return word
+        if word in names:
+            return names[word]
+        if word in _functions:
+            return word
+        raise ValueError('unknown symbol %s in formula %s' % (word, formula))
+    return _token.sub(repl, formula)
+
+def MakeRhsSource(model):
+    '''generates the source of rhs(y, p) -> dydt, vectorized over the rows
+    of y (samples, species) and p (samples, parameters).
+    '''
+    names = {}
+    for i, s in enumerate(model.species):
+        names[s.name] = 'y_%d' % i
+    for i, p in enumerate(model.parameters):
+        names[p.name] = 'p_%d' % i
+    for i, d in enumerate(model.dependent_species):
+        names[d.name] = 'd_%d' % i
+    expressions = dict([ (e.name, e.formula) for e in model.expressions ])
+    ordered = SortExpressions(model.expressions)
+    for i, a_key in enumerate(ordered):
+        names[a_key] = 'e_%d' % i
+
+    lines = ['def rhs(y, p):']
+    for i, s in enumerate(model.species):
+        lines.append('    y_%d = y[:, %d]' % (i, i))
+    for i, p in enumerate(model.parameters):
+        lines.append('    p_%d = p[:, %d]' % (i, i))
+    for d in model.dependent_species:
+        lines.append('    %s = %s' % (names[d.name], _translate(d.formula, names)))
+    for a_key in ordered:
+        lines.append('    %s = %s' % (names[a_key],
+            _translate(expressions[a_key], names)))
+    lines.append('    dydt = np.empty(y.shape)')
+    for i, s in enumerate(model.species):
+        lines.append('    dydt[:, %d] = %s' % (i, _translate(s.ode, names)))
+    lines.append('    return dydt')
+    return '\n'.join(lines) + '\n'
+
+def MakeJacobian(model):
+    '''returns jac(y, p) -> (samples, species, species) built from analytic
+    derivatives, or None if sympy is not available.
+    '''
+    try:
+        import sympy
+    except ImportError:
+        return None
+
+    n = len(model.species)
+    symbols = {}
+    for i, s in enumerate(model.species):
+        symbols[s.name] = sympy.Symbol('y_%d' % i)
+    for i, p in enumerate(model.parameters):
+        symbols[p.name] = sympy.Symbol('p_%d' % i)
+    local = dict(symbols)
+    local['ln'] = sympy.log
+    local['Pi'] = sympy.pi
+    # substitute dependent species and expressions in dependency order
+    for d in model.dependent_species:
+        local[d.name] = sympy.sympify(d.formula.replace('^', '**'), locals=local)
+    expressions = dict([ (e.name, e.formula) for e in model.expressions ])
+    for a_key in SortExpressions(model.expressions):
+        local[a_key] = sympy.sympify(expressions[a_key].replace('^', '**'), locals=local)
+
+    lines = ['def jac(y, p):']
+    for i, s in enumerate(model.species):
+        lines.append('    y_%d = y[:, %d]' % (i, i))
+    for i, p in enumerate(model.parameters):
+        lines.append('    p_%d = p[:, %d]' % (i, i))
+    lines.append('    J = np.zeros((y.shape[0], %d, %d))' % (n, n))
+    for i, s in enumerate(model.species):
+        f = sympy.sympify(s.ode.replace('^', '**'), locals=local)
+        for j, b in enumerate(model.species):
+            dfdy = sympy.diff(f, symbols[b.name])
+            if dfdy == 0:
+                continue
+            lines.append('    J[:, %d, %d] = %s' % (i, j, sympy.pycode(dfdy)
+                .replace('math.', '')))
+    lines.append('    return J')
+    namespace = {'np': np}
+    namespace.update(_functions)
+    exec '\n'.join(lines) + '\n' in namespace
+    return namespace['jac']
+
+class NumpyEngine(object):
+    '''vectorized engine compiled from a maple file. '''
+    def __init__(self, maplefile, analytic_jacobian=True):
+        model = modelir.Load(maplefile=maplefile)
+        self.maplefile = maplefile
+        self.species = [ s.name for s in model.species ]
+        self.parameters = [ p.name for p in model.parameters ]
+        self.num_species = len(self.species)
+        self.num_parameters = len(self.parameters)
+        self.default_ivalues = np.array([ float(s.initial) for s in model.species ])
+        self.default_rates = np.array([ float(p.value) for p in model.parameters ])
+
+        self.source = MakeRhsSource(model)
+        namespace = {'np': np}
+        namespace.update(_functions)
+        exec self.source in namespace
+        self.rhs = namespace['rhs']
+
+        self.jac = None
+        if analytic_jacobian:
+            self.jac = MakeJacobian(model)
+        if self.jac is None:
+            self.jac = self._fd_jacobian
+
+    def _fd_jacobian(self, y, p):
+        '''forward difference jacobian, one batched rhs call per species. '''
+        f0 = self.rhs(y, p)
+        J = np.empty((y.shape[0], self.num_species, self.num_species))
+        eps = np.sqrt(np.finfo(float).eps)
+        for j in range(self.num_species):
+            dy = eps*np.maximum(np.abs(y[:, j]), 1.0)
+            yj = y.copy()
+            yj[:, j] += dy
+            J[:, :, j] = (self.rhs(yj, p) - f0)/dy[:, None]
+        return J
+
+    def broadcast(self, ivalues, rates):
+        ivalues = np.atleast_2d(np.asarray(ivalues, dtype=np.float64))
+        rates = np.atleast_2d(np.asarray(rates, dtype=np.float64))
+        if ivalues.shape[0] == rates.shape[0]:
+            pass
+        elif ivalues.shape[0] == 1:
+            ivalues = np.repeat(ivalues, rates.shape[0], axis=0)
+        elif rates.shape[0] == 1:
+            rates = np.repeat(rates, ivalues.shape[0], axis=0)
+        else:
+            raise ValueError('unknown dimension of inputs, ivalues and rates')
+        return ivalues, rates
+
+    def run(self, tvec, ivalues, rates, reltol=RELTOL, abstol=ABSTOL,
+            max_steps=MAX_STEPS):
+        '''integrates every sample and returns (y, yss, flag) with the same
+        layout as pyengine.Engine.run(): y is (samples, timepoints, species).
+        like the compiled engines every sample starts at t = 0, so a tvec
+        that does not start at 0 gives the states at its times.
+        '''
+        tvec = np.asarray(tvec, dtype=np.float64)
+        ivalues, rates = self.broadcast(ivalues, rates)
+        num_samples = ivalues.shape[0]
+
+        y = np.empty((num_samples, tvec.size, self.num_species))
+        flag = np.zeros(num_samples)
+        state = ivalues.copy()
+        t = np.zeros(num_samples)
+        h = np.zeros(num_samples)
+        ok = np.ones(num_samples, dtype=bool)
+
+        for tidx in range(tvec.size):
+            if tvec[tidx] > 0.0:
+                self._advance(state, rates, t, h, tvec[tidx], ok, flag,
+                        reltol, abstol, max_steps)
+            y[:, tidx, :] = state
+        return y, state, flag
+
+    def _advance(self, state, rates, t, h, tout, ok, flag, reltol, abstol,
+            max_steps):
+        '''advances all samples that are still ok up to tout. state, t and h
+        are updated in place.
+        '''
+        d = 1.0/(2.0 + np.sqrt(2.0))
+        e32 = 6.0 + np.sqrt(2.0)
+        pow_ = 1.0/3.0
+        n = self.num_species
+        eye = np.eye(n)
+
+        active = np.nonzero(ok & (t < tout))[0]
+        if active.size == 0:
+            return
+
+        # initial step size, as in ode23s
+        first = active[h[active] == 0.0]
+        if first.size > 0:
+            f0 = self.rhs(state[first], rates[first])
+            wt = np.maximum(np.abs(state[first]), abstol/reltol)
+            rh = 1.25*np.max(np.abs(f0)/wt, axis=1)/reltol**pow_
+            span = tout - t[first]
+            h[first] = np.where(rh*span > 1.0, 1.0/np.maximum(rh, 1e-300), span)
+
+        steps = 0
+        while active.size > 0:
+            steps += 1
+            if steps > max_steps:
+                ok[active] = False
+                flag[active] = SOLVER_TOO_MUCH_WORK
+                return
+            ya = state[active]
+            pa = rates[active]
+            ta = t[active]
+            ha = np.minimum(h[active], tout - ta)
+
+            F0 = self.rhs(ya, pa)
+            J = self.jac(ya, pa)
+            W = eye - (ha*d)[:, None, None]*J
+            try:
+                Winv = np.linalg.inv(W)
+            except np.linalg.LinAlgError:
+                Winv = np.linalg.pinv(W)
+            solve = lambda b: np.einsum('sij,sj->si', Winv, b)
+
+            k1 = solve(F0)
+            F1 = self.rhs(ya + (0.5*ha)[:, None]*k1, pa)
+            k2 = solve(F1 - k1) + k1
+            ynew = ya + ha[:, None]*k2
+            F2 = self.rhs(ynew, pa)
+            k3 = solve(F2 - e32*(k2 - F1) - 2.0*(k1 - F0))
+
+            wt = np.maximum(np.maximum(np.abs(ya), np.abs(ynew)), abstol/reltol)
+            err = np.max(np.abs((ha/6.0)[:, None]*(k1 - 2.0*k2 + k3))/wt, axis=1)/reltol
+            err[~np.isfinite(err)] = np.inf
+            accept = err <= 1.0
+
+            idx = active[accept]
+            state[idx] = ynew[accept]
+            t[idx] = np.where(tout - (ta[accept] + ha[accept]) <=
+                    16.0*np.finfo(float).eps*abs(tout), tout, ta[accept] + ha[accept])
+
+            scale = np.where(err > 0.0, 0.8*np.power(np.maximum(err, 1e-300), -pow_), 5.0)
+            scale = np.where(accept, np.minimum(scale, 5.0), np.maximum(scale, 0.1))
+            h[active] = ha*scale
+
+            # a step size that underflows the time means the solver failed
+            tiny = ~accept & (h[active] <= 16.0*np.finfo(float).eps*np.abs(ta))
+            if np.any(tiny):
+                ok[active[tiny]] = False
+                flag[active[tiny]] = SOLVER_CONV_FAILURE
+
+            active = active[ok[active] & (t[active] < tout)]
+
+def Load(maplefile, libfile=None):
+    '''returns the compiled engine of libfile if it can be loaded, otherwise
+    the numpy engine of maplefile, as $(MODEL)_engine.m does with its
+    MexSolver/BuiltInSolver.
+    '''
+    if libfile is not None:
+        try:
+            import pyengine
+            return pyengine.Engine(libfile)
+        except (OSError, ImportError, ValueError), e:
+            print >> sys.stderr, 'npengine: %s, falling back to numpy' % e
+    return NumpyEngine(maplefile)
+
+def Throughput(engine, tvec, ivalues, rates):
+    '''(samples/sec, y) of one run of engine. '''
+    t0 = time.time()
+    y = engine.run(tvec, ivalues, rates)[0]
+    return ivalues.shape[0]/(time.time() - t0), y
+
+def Compare(maplefile, libfile, nsamps=1000, t_final=10.0, num_tvec=20):
+    '''prints the throughput of the numpy engine of maplefile and, if
+    libfile is given, of the compiled engine and the largest relative
+    difference of their trajectories.
+    '''
+    eng = NumpyEngine(maplefile)
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues,
+            np.random.rand(nsamps, eng.num_parameters))
+    print maplefile
+    rate, y = Throughput(eng, tvec, ivalues, rates)
+    print '  numpy engine   : %12.1f samples/sec' % rate
+    if libfile is None:
+        return
+    import pyengine
+    ceng = pyengine.Engine(libfile)
+    crate, cy = Throughput(ceng, tvec, ivalues, rates)
+    print '  compiled engine: %12.1f samples/sec (%.1fx)' % (crate, crate/rate)
+    if cy.shape == y.shape:
+        diff = np.abs(y - cy)/np.maximum(np.abs(cy), ABSTOL/RELTOL)
+        print '  max relative difference: %.2g' % np.nanmax(diff)
+
+def usage():
+    print 'npengine.py [options] [model ...]'
+    print 'every model is a path without extension, e.g.'
+    print '../example_hello/hello ../example_yeast/g4n, whose .maple file is'
+    print 'integrated by the numpy engine and whose .so, if it exists, by the'
+    print 'compiled engine.'
+    print 'options and arguments:'
+    print '-i maple_file    : model in maple format (facile.pl -L).'
+    print '-l library       : compiled model library to compare with (optional).'
+    print '-n nsamps        : number of samples (default 1000).'
+    print '-t t_final       : final time (default 10).'
+    print '-k num_tvec      : number of time points (default 20).'
+
+def main(argv):
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv, "hi:l:n:t:k:",
+                ["help", "input", "library", "nsamps", "tfinal", "num_tvec"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    maplefile, libfile = None, None
+    nsamps, t_final, num_tvec = 1000, 10.0, 20
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-i', '--input'):
+            maplefile = arg
+        elif opt in ('-l', '--library'):
+            libfile = arg
+        elif opt in ('-n', '--nsamps'):
+            nsamps = int(arg)
+        elif opt in ('-t', '--tfinal'):
+            t_final = float(arg)
+        elif opt in ('-k', '--num_tvec'):
+            num_tvec = int(arg)
+    models = []
+    if maplefile is not None:
+        models.append((maplefile, libfile))
+    for stem in args:
+        libfile = stem + '.so'
+        models.append((stem + '.maple',
+            libfile if os.path.exists(libfile) else None))
+    if not models:
+        usage()
+        sys.exit()
+
+    for maplefile, libfile in models:
+        Compare(maplefile, libfile, nsamps, t_final, num_tvec)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,1307 @@
+#!/usr/bin/python
+'''pyengine.py calls engine() of a compiled model library ($(MODEL).so or
+$(MODEL)_L.so, built from mex_mat.c without -DMATLAB) directly from python.
+
+The input arrays are handed to engine() as they are, so ivalues and rates
+should be C-contiguous float64 arrays of shape (samples, species) and
+(samples, parameters). engine() writes trajectories sample by sample, which
+is exactly a C-ordered (samples, timepoints, species) array, so the output
+needs neither a copy nor a transpose. ctypes releases the GIL for the whole
+engine() call, so other python threads keep running during a batch.
+
+usage:
+    eng = Engine('hello.so')
+    y, yss, flag = eng.run(tvec, ivalues, rates)
+
+a forward sensitivity engine ($(MODEL)_SENS.so, -DSENS) also returns dy/dp:
+    eng = Engine('hello_SENS.so')
+    eng.set_sens(['k1', 'k2'])
+    y, yss, flag, dy = eng.run(tvec, ivalues, rates, sens=True)
+'''
+import os, sys, time, json, warnings
+import ctypes
+import numpy as np
+
+ENGINE_VARIANT_LANGEVIN = 1
+ENGINE_VARIANT_STEADY = 2
+ENGINE_VARIANT_SDE = 4
+ENGINE_VARIANT_SSA = 8
+ENGINE_VARIANT_SENS = 16
+
+# methods of engine_set_ssa()
+SSA_METHODS = {'direct': 1, 'tau': 2}
+
+# columns of the per-sample solver statistics (engine_set_stats)
+STATS = ['steps', 'rhs_evals', 'jac_evals', 'err_test_fails', 'nonlin_fails',
+        'retries', 'wall']
+
+# schedule kinds of engine_set_schedule()
+SCHEDULES = {'static': 1, 'dynamic': 2, 'guided': 3}
+
+# default zeta of the mex interface: nano molar unit and 1 pl volume.
+AVOGADRO = 6.02214E+23
+DEFAULT_MOLAR_UNIT = 1.0E-9
+DEFAULT_VOLUME_IN_LITER = 1.0E-12
+DEFAULT_ZETA = DEFAULT_MOLAR_UNIT*AVOGADRO*DEFAULT_VOLUME_IN_LITER
+
+# samples per engine() call of run_to_file(), as OUTPUT_CHUNK_SAMPLES in
+# mex_mat.c
+OUTPUT_CHUNK_SAMPLES = 10000
+
+# longest integration of a point of continuation(), in model time units
+CONTINUATION_T_SETTLE = 1000.0
+
+c_double_p = ctypes.POINTER(ctypes.c_double)
+c_int_p = ctypes.POINTER(ctypes.c_int)
+
+def _pointer(a):
+    return a.ctypes.data_as(c_double_p)
+
+def _buffer(a, shape, name):
+    '''returns a as a C-contiguous float64 array of the given shape. arrays
+    that already have the right layout are passed through without a copy.
+    '''
+    a = np.require(a, dtype=np.float64, requirements=['C_CONTIGUOUS', 'ALIGNED'])
+    if a.shape != shape:
+        raise ValueError('%s should have shape %s, not %s' % (name, shape, a.shape))
+    return a
+
+class Engine(object):
+    '''a loaded model library.
+
+    The number of species and parameters and their names are read from the
+    globals that ode_size.h puts into the library (N_, P_, varnames_,
+    parnames_), so no matlab side file is needed. readouts are the names of
+    the READOUT section of the model (R_, readoutnames_), if any. which
+    species and timepoints the trajectories keep is given by output().
+    '''
+    def __init__(self, libfile, langevin=None):
+        self.libfile = os.path.abspath(libfile)
+        self.lib = ctypes.CDLL(self.libfile)
+
+        self.num_species = ctypes.c_int.in_dll(self.lib, 'N_').value
+        self.num_parameters = ctypes.c_int.in_dll(self.lib, 'P_').value
+        self.species = self._names('varnames_', self.num_species)
+        self.parameters = self._names('parnames_', self.num_parameters)
+        self.default_ivalues = self._values('def_y_', self.num_species)
+        self.default_rates = self._values('def_p_', self.num_parameters)
+        try:
+            num_readouts = ctypes.c_int.in_dll(self.lib, 'R_').value
+        except ValueError:
+            num_readouts = 0
+        self.readouts = self._names('readoutnames_', num_readouts)
+
+        if hasattr(self.lib, 'engine_variant'):
+            self.lib.engine_variant.restype = ctypes.c_int
+            self.variant = self.lib.engine_variant()
+        else:
+            # libraries built before engine_variant() existed.
+            self.variant = 0
+            base = os.path.splitext(os.path.basename(libfile))[0]
+            if base.endswith('_L'):
+                self.variant |= ENGINE_VARIANT_LANGEVIN
+        if langevin is not None:
+            if langevin:
+                self.variant |= ENGINE_VARIANT_LANGEVIN
+            else:
+                self.variant &= ~ENGINE_VARIANT_LANGEVIN
+
+        argtypes = [ctypes.c_int, c_double_p, ctypes.c_int, ctypes.c_int,
+                c_double_p, ctypes.c_int, c_double_p, c_double_p,
+                c_double_p, c_double_p]
+        if self.langevin:
+            argtypes.append(ctypes.c_double)
+        if self.sens:
+            argtypes.append(c_double_p)
+            self.lib.engine_set_sens.argtypes = [ctypes.c_int, c_int_p]
+            self.lib.engine_set_sens.restype = ctypes.c_int
+            self.lib.engine_sens.argtypes = [c_int_p]
+            self.lib.engine_sens.restype = ctypes.c_int
+        self.lib.engine.argtypes = argtypes
+        self.lib.engine.restype = ctypes.c_int
+
+        if hasattr(self.lib, 'engine_steady'):
+            argtypes = [ctypes.c_int, c_double_p, ctypes.c_int, ctypes.c_int,
+                    c_double_p, ctypes.c_int, c_double_p, c_double_p,
+                    c_double_p, c_double_p, c_double_p]
+            if self.langevin:
+                argtypes.append(ctypes.c_double)
+            self.lib.engine_steady.argtypes = argtypes
+            self.lib.engine_steady.restype = ctypes.c_int
+            self.lib.engine_set_steady.argtypes = [ctypes.c_double,
+                    ctypes.c_double, ctypes.c_int]
+            self.lib.engine_set_steady.restype = ctypes.c_int
+
+        # libraries built before the runtime schedule have neither function
+        self.schedulable = hasattr(self.lib, 'engine_set_schedule')
+        # the statistics summed over the chunks of the last run_to_file()
+        self._batch_stats = None
+        if self.schedulable:
+            self.lib.engine_set_schedule.argtypes = [ctypes.c_int,
+                    ctypes.c_int, ctypes.c_int]
+            self.lib.engine_set_schedule.restype = ctypes.c_int
+            self.lib.engine_thread_stats.argtypes = [c_double_p, c_double_p,
+                    ctypes.c_int, c_double_p]
+            self.lib.engine_thread_stats.restype = ctypes.c_int
+
+        # per-sample noise streams (engine_set_seed) came after the schedule
+        self.seedable = hasattr(self.lib, 'engine_set_seed')
+        if self.seedable:
+            self.lib.engine_set_seed.argtypes = [ctypes.c_int,
+                    ctypes.c_ulonglong, ctypes.c_longlong]
+            self.lib.engine_set_seed.restype = ctypes.c_int
+            self.lib.engine_last_seed.argtypes = []
+            self.lib.engine_last_seed.restype = ctypes.c_ulonglong
+        self._seed = (None, 0)
+
+        if hasattr(self.lib, 'engine_readout'):
+            argtypes = [ctypes.c_int, c_double_p, ctypes.c_int, ctypes.c_int,
+                    c_double_p, ctypes.c_int, c_double_p, c_double_p,
+                    ctypes.c_int, ctypes.c_int, c_double_p, c_double_p,
+                    c_double_p, c_double_p]
+            if self.langevin:
+                argtypes.append(ctypes.c_double)
+            self.lib.engine_readout.argtypes = argtypes
+            self.lib.engine_readout.restype = ctypes.c_int
+
+        self.has_stats = hasattr(self.lib, 'engine_set_stats')
+        if self.has_stats:
+            self.lib.engine_set_stats.argtypes = [c_double_p]
+            self.lib.engine_set_stats.restype = ctypes.c_int
+
+        # steady state continuation (engine_continuation) is not built into
+        # the langevin, stochastic and SENS engines
+        self.has_continuation = hasattr(self.lib, 'engine_continuation')
+        if self.has_continuation:
+            self.lib.engine_continuation.argtypes = [ctypes.c_int, ctypes.c_int,
+                    ctypes.c_int, c_double_p, ctypes.c_int, c_double_p,
+                    ctypes.c_int, c_double_p, ctypes.c_double, c_double_p,
+                    c_double_p, c_double_p]
+            self.lib.engine_continuation.restype = ctypes.c_int
+
+        # libraries built before engine_output() keep every species at
+        # every timepoint
+        self.has_output = hasattr(self.lib, 'engine_output')
+        if self.has_output:
+            self.lib.engine_set_output.argtypes = [ctypes.c_int, ctypes.c_int]
+            self.lib.engine_output.argtypes = [ctypes.c_int, c_int_p, c_int_p,
+                    c_int_p]
+            self.lib.engine_output.restype = ctypes.c_int
+
+    @property
+    def langevin(self):
+        return bool(self.variant & ENGINE_VARIANT_LANGEVIN)
+
+    @property
+    def steady(self):
+        return bool(self.variant & ENGINE_VARIANT_STEADY)
+
+    @property
+    def sde(self):
+        return bool(self.variant & ENGINE_VARIANT_SDE)
+
+    @property
+    def ssa(self):
+        return bool(self.variant & ENGINE_VARIANT_SSA)
+
+    @property
+    def sens(self):
+        return bool(self.variant & ENGINE_VARIANT_SENS)
+
+    def _names(self, symbol, n):
+        return [ s for s in (ctypes.c_char_p*n).in_dll(self.lib, symbol) ]
+
+    def _values(self, symbol, n):
+        return np.array((ctypes.c_double*n).in_dll(self.lib, symbol))
+
+    def _stats(self, stats, num_samples):
+        '''the (samples, len(STATS)) buffer of the stats argument of run():
+        a new one for True, stats itself for an array.
+        '''
+        if not self.has_stats:
+            raise RuntimeError('%s has no solver statistics, rebuild it' % self.libfile)
+        if stats is True:
+            return np.zeros((num_samples, len(STATS)))
+        return _buffer(stats, (num_samples, len(STATS)), 'stats')
+
+    def _call(self, function, args, stats):
+        '''calls an engine function with stats (or None) as the target of
+        the solver statistics.
+        '''
+        self._batch_stats = None
+        if stats is None:
+            return function(*args)
+        self.lib.engine_set_stats(_pointer(stats))
+        try:
+            return function(*args)
+        finally:
+            self.lib.engine_set_stats(None)
+
+    def _sum_stats(self, totals):
+        '''adds the thread (and SSA) statistics of the last chunk to totals,
+        a list of the arrays of thread_stats() and ssa_stats().
+        '''
+        current = list(self.thread_stats())
+        if self.ssa:
+            current += self.ssa_stats()
+        if totals is None:
+            return current
+        return [a + b for a, b in zip(totals, current)]
+
+    def set_schedule(self, num_threads=None, schedule=None, chunk=None):
+        '''sets how engine() spreads samples over threads. num_threads 0
+        uses every processor, schedule is static, dynamic or guided and a
+        chunk of 0 is the default of the schedule. None leaves the
+        FASTFACILE_THREADS/_SCHEDULE/_CHUNK environment (or the built-in
+        default: all processors, dynamic, 1) in charge.
+        '''
+        if not self.schedulable:
+            raise RuntimeError('%s has no runtime schedule, rebuild it' % self.libfile)
+        if schedule is not None and schedule not in SCHEDULES:
+            raise ValueError('schedule should be one of %s' % ', '.join(sorted(SCHEDULES)))
+        self.lib.engine_set_schedule(
+                -1 if num_threads is None else num_threads,
+                -1 if schedule is None else SCHEDULES[schedule],
+                -1 if chunk is None else chunk)
+
+    def thread_stats(self):
+        '''(busy seconds, samples) per thread and the wall time of the
+        sample loop of the last run(), or of all chunks of the last
+        run_to_file().
+        '''
+        if not self.schedulable:
+            raise RuntimeError('%s has no thread statistics, rebuild it' % self.libfile)
+        if self._batch_stats is not None:
+            return tuple(self._batch_stats[:3])
+        num_threads = self.lib.engine_thread_stats(None, None, 0, None)
+        busy = np.zeros(num_threads)
+        samples = np.zeros(num_threads)
+        wall = ctypes.c_double()
+        self.lib.engine_thread_stats(_pointer(busy), _pointer(samples),
+                num_threads, ctypes.byref(wall))
+        return busy, samples, wall.value
+
+    def set_seed(self, seed=None, first_sample=0):
+        '''sets the master seed of the langevin noise. sample i of the
+        following runs draws from stream first_sample + i of the seed, so
+        its noise does not depend on the number of threads or the schedule.
+        None goes back to FASTFACILE_SEED or a seed from the clock.
+        '''
+        if not self.seedable:
+            raise RuntimeError('%s has no per-sample noise streams, rebuild it' % self.libfile)
+        if seed is not None and not 0 <= seed < 2**64:
+            raise ValueError('seed should be an unsigned 64 bit integer')
+        if self.lib.engine_set_seed(seed is not None,
+                0 if seed is None else seed, first_sample) != 0:
+            raise ValueError('first_sample should be >= 0')
+        self._seed = (seed, first_sample)
+
+    def last_seed(self):
+        '''the master seed used by the last run. '''
+        if not self.seedable:
+            raise RuntimeError('%s has no per-sample noise streams, rebuild it' % self.libfile)
+        return self.lib.engine_last_seed()
+
+    def set_sde(self, dt=None):
+        '''sets the largest euler-maruyama step of an SDE engine (-DSDE).
+        None goes back to FASTFACILE_SDE_DT or the built-in 1e-3.
+        '''
+        if not self.sde:
+            raise RuntimeError('%s is not an SDE engine' % self.libfile)
+        self.lib.engine_set_sde.argtypes = [ctypes.c_double]
+        self.lib.engine_set_sde(-1.0 if dt is None else dt)
+
+    def set_ssa(self, method=None, epsilon=None):
+        '''sets the method of an SSA engine (-DSSA): direct (gillespie) or
+        tau (tau-leaping, where epsilon bounds the relative change of a
+        species in a leap). None goes back to FASTFACILE_SSA and
+        FASTFACILE_SSA_EPSILON or the built-in direct and 3e-2.
+        '''
+        if not self.ssa:
+            raise RuntimeError('%s is not an SSA engine' % self.libfile)
+        if method is not None and method not in SSA_METHODS:
+            raise ValueError('method should be one of %s' % ', '.join(sorted(SSA_METHODS)))
+        self.lib.engine_set_ssa.argtypes = [ctypes.c_int, ctypes.c_double]
+        self.lib.engine_set_ssa(-1 if method is None else SSA_METHODS[method],
+                -1.0 if epsilon is None else epsilon)
+
+    def ssa_stats(self):
+        '''(events, leaps) per thread of the last run() of an SSA engine. '''
+        if not self.ssa:
+            raise RuntimeError('%s is not an SSA engine' % self.libfile)
+        if self._batch_stats is not None:
+            return tuple(self._batch_stats[3:])
+        self.lib.engine_ssa_stats.argtypes = [c_double_p, c_double_p, ctypes.c_int]
+        num_threads = self.lib.engine_ssa_stats(None, None, 0)
+        events = np.zeros(num_threads)
+        leaps = np.zeros(num_threads)
+        self.lib.engine_ssa_stats(_pointer(events), _pointer(leaps), num_threads)
+        return events, leaps
+
+    def set_sens(self, parameters=None):
+        '''selects the parameters (names or indices) whose sensitivities a
+        SENS engine (-DSENS) integrates and run() returns, in that order.
+        None goes back to FASTFACILE_SENS (comma separated names) or all
+        parameters.
+        '''
+        if not self.sens:
+            raise RuntimeError('%s is not a SENS engine' % self.libfile)
+        if parameters is None:
+            self.lib.engine_set_sens(-1, None)
+            return
+        indices = [ self.parameters.index(p) if isinstance(p, basestring) else p
+                for p in parameters ]
+        params = (ctypes.c_int*max(len(indices), 1))(*indices)
+        if self.lib.engine_set_sens(len(indices), params) != 0:
+            raise ValueError('parameters should be names or indices of the %d '
+                    'parameters' % self.num_parameters)
+
+    def sens_parameters(self):
+        '''the names of the parameters of the sensitivities, the last axis
+        of dy. '''
+        if not self.sens:
+            raise RuntimeError('%s is not a SENS engine' % self.libfile)
+        params = (ctypes.c_int*max(self.num_parameters, 1))()
+        n = self.lib.engine_sens(params)
+        return [ self.parameters[k] for k in params[:n] ]
+
+    def set_output(self, probes=None, stride=None):
+        '''sets what the trajectories keep: only the species of the PROBE
+        section of the model (probes True) or all of them, at every
+        stride-th timepoint of tvec. the solver still stops at every
+        timepoint, so the kept values do not change. None goes back to
+        FASTFACILE_OUTPUT_PROBES and FASTFACILE_OUTPUT_STRIDE or the model
+        (the probes if it has any, output_stride of its CONFIG section).
+        '''
+        if not self.has_output:
+            raise RuntimeError('%s stores every species, rebuild it' % self.libfile)
+        self.lib.engine_set_output(-1 if probes is None else int(bool(probes)),
+                -1 if stride is None else stride)
+
+    def _output(self, num_timepoints):
+        '''(timepoints, stride, species indices) of trajectories over
+        num_timepoints points of tvec. '''
+        if not self.has_output:
+            return num_timepoints, 1, range(self.num_species)
+        num_times, stride = ctypes.c_int(0), ctypes.c_int(1)
+        columns = (ctypes.c_int*max(self.num_species, 1))()
+        n = self.lib.engine_output(num_timepoints, ctypes.byref(num_times),
+                ctypes.byref(stride), columns)
+        return num_times.value, stride.value, list(columns[:n])
+
+    def output(self, tvec):
+        '''(times, species) of the trajectories run() returns for tvec:
+        the timepoints and the names of the species that are kept.
+        '''
+        num_times, stride, columns = self._output(len(tvec))
+        return np.asarray(tvec)[::stride], [ self.species[k] for k in columns ]
+
+    def set_steady(self, rel_tol=1.0e-6, abs_tol=1.0e-12, window=2):
+        '''sets the convergence test of steady engines: a sample has
+        converged when max |dy/dt| / (abs_tol + rel_tol*|y|) <= 1 at window
+        consecutive points of tvec.
+        '''
+        if not hasattr(self.lib, 'engine_steady'):
+            raise RuntimeError('%s is not a steady engine with early exit' % self.libfile)
+        if self.lib.engine_set_steady(rel_tol, abs_tol, window) != 0:
+            raise ValueError('tolerances should be >= 0 and window >= 1')
+
+    def steady_state(self, tvec, ivalues, rates, zeta=DEFAULT_ZETA, stats=None,
+            **schedule):
+        '''integrates every sample until it converges (see set_steady) or
+        reaches tvec[-1]. returns (yss, flag, t_conv, converged): t_conv is
+        -1 and converged False for samples that did not converge. with
+        stats (True or an array, see run()) the solver statistics are
+        returned as a fifth element.
+        '''
+        if not hasattr(self.lib, 'engine_steady'):
+            raise RuntimeError('%s is not a steady engine with early exit' % self.libfile)
+        tvec = np.require(tvec, dtype=np.float64, requirements=['C_CONTIGUOUS'])
+        ivalues, rates = np.asarray(ivalues), np.asarray(rates)
+        if tvec.ndim != 1 or tvec.size < 3:
+            raise ValueError('tvec should be a 1-d vector of at least 3 timepoints')
+        if ivalues.ndim != 2 or rates.ndim != 2 or \
+                ivalues.shape[0] != rates.shape[0]:
+            raise ValueError('ivalues and rates should be (samples, ?) arrays '
+                    'with the same number of samples')
+        num_samples = ivalues.shape[0]
+        ivalues = _buffer(ivalues, (num_samples, self.num_species), 'ivalues')
+        rates = _buffer(rates, (num_samples, self.num_parameters), 'rates')
+        yss = np.empty((num_samples, self.num_species))
+        flag = np.empty(num_samples)
+        if stats is not None:
+            stats = self._stats(stats, num_samples)
+        t_conv = np.empty(num_samples)
+        converged = np.empty(num_samples)
+        args = [tvec.size, _pointer(tvec), num_samples, self.num_species,
+                _pointer(ivalues), self.num_parameters, _pointer(rates),
+                _pointer(yss), _pointer(flag), _pointer(t_conv),
+                _pointer(converged)]
+        if self.langevin:
+            args.append(zeta)
+        if schedule:
+            self.set_schedule(**schedule)
+        self._call(self.lib.engine_steady, args, stats)
+        if stats is not None:
+            return yss, flag, t_conv, converged.astype(bool), stats
+        return yss, flag, t_conv, converged.astype(bool)
+
+    def run_to_file(self, path, tvec, ivalues, rates, zeta=DEFAULT_ZETA,
+            chunk=OUTPUT_CHUNK_SAMPLES, stats=None, sens_path=None, **schedule):
+        '''integrates chunk samples at a time straight into path, a .npy
+        file of shape (samples, timepoints, species) mapped into memory, and
+        writes the time and species axes (see output()) to path.json. returns (yss, flag),
+        and the solver statistics with stats (see run()); the trajectories
+        are read back with OpenTrajectories(path). SENS engines write the
+        sensitivities to sens_path in the same way, with the parameters of
+        sens_parameters() as a fourth axis.
+        '''
+        if self.steady:
+            raise RuntimeError('steady engines have no trajectories')
+        tvec = np.require(tvec, dtype=np.float64, requirements=['C_CONTIGUOUS'])
+        ivalues, rates = np.asarray(ivalues), np.asarray(rates)
+        if ivalues.ndim != 2 or rates.ndim != 2 or \
+                ivalues.shape[0] != rates.shape[0]:
+            raise ValueError('ivalues and rates should be (samples, ?) arrays '
+                    'with the same number of samples')
+        num_samples = ivalues.shape[0]
+        times, species = self.output(tvec)
+        y = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                shape=(num_samples, len(times), len(species)))
+        dy = None
+        if sens_path is not None:
+            parameters = self.sens_parameters()
+            dy = np.lib.format.open_memmap(sens_path, mode='w+', dtype=np.float64,
+                    shape=(num_samples, len(times), len(species), len(parameters)))
+        yss = np.empty((num_samples, self.num_species))
+        flag = np.empty(num_samples)
+        if stats is not None:
+            stats = self._stats(stats, num_samples)
+        chunk = max(1, chunk)
+        seed, first_sample = self._seed
+        totals = None
+        for first in range(0, num_samples, chunk):
+            last = min(first + chunk, num_samples)
+            if self.seedable:
+                # every chunk continues the noise streams of the first one
+                self.lib.engine_set_seed(first > 0 or seed is not None,
+                        seed or 0, first_sample + first)
+            # rows of a C ordered memmap are contiguous, so the engine
+            # writes into the mapped pages directly
+            self.run(tvec, ivalues[first:last], rates[first:last], zeta,
+                    out=(y[first:last], yss[first:last], flag[first:last]),
+                    stats=stats[first:last] if stats is not None else None,
+                    sens=dy[first:last] if dy is not None else None,
+                    **schedule)
+            if self.schedulable:
+                totals = self._sum_stats(totals)
+            y.flush()
+            if dy is not None:
+                dy.flush()
+            if self.seedable and seed is None:
+                seed = self.last_seed()
+        if self.seedable:
+            self.set_seed(*self._seed)
+        if self.schedulable:
+            self._batch_stats = totals
+        del y
+        WriteAxes(path, num_samples, times, species)
+        if dy is not None:
+            del dy
+            WriteAxes(sens_path, num_samples, times, species, parameters)
+        if stats is not None:
+            return yss, flag, stats
+        return yss, flag
+
+    def readout(self, tvec, ivalues, rates, zeta=DEFAULT_ZETA, top_k=0,
+            rank_by=0, stats=None, **schedule):
+        '''integrates every sample but keeps only its readouts, the
+        READOUT section of the model evaluated on its trajectory inside the
+        engine. returns (scores, yss, flag) with scores of shape (samples,
+        len(readouts)); no (samples, timepoints, species) array is made.
+
+        with top_k, (top_y, top_index) follow: the trajectories of the
+        top_k samples with the largest readout rank_by (an index or a name
+        of readouts), best first, and their sample indices (-1 where fewer
+        samples have a score). they are the trajectories run() gives for
+        these samples, with the timepoints and species of output(). stats
+        is as in run() and comes last.
+        '''
+        if not hasattr(self.lib, 'engine_readout'):
+            raise RuntimeError('%s has no readout engine' % self.libfile)
+        if not self.readouts:
+            raise RuntimeError('the model of %s has no READOUT section' % self.libfile)
+        if not isinstance(rank_by, int):
+            rank_by = self.readouts.index(rank_by)
+        tvec = np.require(tvec, dtype=np.float64, requirements=['C_CONTIGUOUS'])
+        ivalues, rates = np.asarray(ivalues), np.asarray(rates)
+        if tvec.ndim != 1 or tvec.size < 3:
+            raise ValueError('tvec should be a 1-d vector of at least 3 timepoints')
+        if ivalues.ndim != 2 or rates.ndim != 2 or \
+                ivalues.shape[0] != rates.shape[0]:
+            raise ValueError('ivalues and rates should be (samples, ?) arrays '
+                    'with the same number of samples')
+        num_samples = ivalues.shape[0]
+        ivalues = _buffer(ivalues, (num_samples, self.num_species), 'ivalues')
+        rates = _buffer(rates, (num_samples, self.num_parameters), 'rates')
+        scores = np.empty((num_samples, len(self.readouts)))
+        yss = np.empty((num_samples, self.num_species))
+        flag = np.empty(num_samples)
+        top_k = max(0, top_k)
+        num_times, stride, columns = self._output(tvec.size)
+        top_y = np.empty((top_k, num_times, len(columns)))
+        top_index = np.empty(top_k)
+        if stats is not None:
+            stats = self._stats(stats, num_samples)
+        args = [tvec.size, _pointer(tvec), num_samples, self.num_species,
+                _pointer(ivalues), self.num_parameters, _pointer(rates),
+                _pointer(scores), top_k, rank_by, _pointer(top_y),
+                _pointer(top_index), _pointer(yss), _pointer(flag)]
+        if self.langevin:
+            args.append(zeta)
+        if schedule:
+            self.set_schedule(**schedule)
+        if self._call(self.lib.engine_readout, args, stats) != 0:
+            raise ValueError('rank_by should be one of %d readouts' % len(self.readouts))
+        result = (scores, yss, flag)
+        if top_k:
+            result += (top_y, top_index.astype(int))
+        if stats is not None:
+            result += (stats,)
+        return result
+
+    def empty(self, num_samples, num_timepoints):
+        '''allocates (y, yss, flag) output buffers for run() over
+        num_timepoints points of tvec. '''
+        if self.steady:
+            y = None
+        else:
+            num_times, stride, columns = self._output(num_timepoints)
+            y = np.empty((num_samples, num_times, len(columns)))
+        yss = np.empty((num_samples, self.num_species))
+        flag = np.empty(num_samples)
+        return y, yss, flag
+
+    def broadcast(self, ivalues, rates):
+        '''repeats a single row of ivalues or rates to the number of samples
+        of the other one, as $(MODEL)_engine.m does.
+        '''
+        ivalues = np.atleast_2d(np.asarray(ivalues, dtype=np.float64))
+        rates = np.atleast_2d(np.asarray(rates, dtype=np.float64))
+        if ivalues.shape[0] == rates.shape[0]:
+            pass
+        elif ivalues.shape[0] == 1:
+            ivalues = np.repeat(ivalues, rates.shape[0], axis=0)
+        elif rates.shape[0] == 1:
+            rates = np.repeat(rates, ivalues.shape[0], axis=0)
+        else:
+            raise ValueError('unknown dimension of inputs, ivalues and rates')
+        return ivalues, rates
+
+    def run(self, tvec, ivalues, rates, zeta=DEFAULT_ZETA, out=None,
+            num_threads=None, schedule=None, chunk=None, stats=None, sens=None):
+        '''integrates every sample and returns (y, yss, flag).
+
+        y is a (samples, timepoints, species) array (None for steady
+        engines) of the timepoints and species of output(tvec), yss holds
+        the last state of every species of each sample and flag the
+        cvode return value. ivalues and rates must have the same number of
+        rows. Preallocated buffers from empty() can be passed as out.
+        num_threads, schedule and chunk are passed to set_schedule() when
+        any of them is given. with stats (True, or a (samples, len(STATS))
+        array to fill) the solver statistics of every sample are collected
+        and returned as a fourth element; without, they cost nothing.
+
+        with sens (True, or a (samples, timepoints, species, parameters)
+        array to fill) a SENS engine also returns dy, the sensitivities
+        dy/dp of y to the parameters of sens_parameters(), before stats.
+        without it, a SENS engine integrates no sensitivities.
+        '''
+        tvec = np.require(tvec, dtype=np.float64, requirements=['C_CONTIGUOUS'])
+        ivalues = np.asarray(ivalues)
+        rates = np.asarray(rates)
+        if tvec.ndim != 1:
+            raise ValueError('tvec should be a 1-d vector')
+        if tvec.size < 3:
+            raise ValueError('tvec should have at least 3 timepoints')
+        if ivalues.ndim != 2 or rates.ndim != 2 or \
+                ivalues.shape[0] != rates.shape[0]:
+            raise ValueError('ivalues and rates should be (samples, ?) arrays '
+                    'with the same number of samples')
+
+        num_samples = ivalues.shape[0]
+        num_timepoints = tvec.size
+        ivalues = _buffer(ivalues, (num_samples, self.num_species), 'ivalues')
+        rates = _buffer(rates, (num_samples, self.num_parameters), 'rates')
+
+        if out is None:
+            out = self.empty(num_samples, num_timepoints)
+        y, yss, flag = out
+        if y is not None:
+            num_times, stride, columns = self._output(num_timepoints)
+            y = _buffer(y, (num_samples, num_times, len(columns)), 'y')
+        yss = _buffer(yss, (num_samples, self.num_species), 'yss')
+        flag = _buffer(flag, (num_samples,), 'flag')
+        if stats is not None:
+            stats = self._stats(stats, num_samples)
+        if sens is not None:
+            num_times, stride, columns = self._output(num_timepoints)
+            shape = (num_samples, num_times, len(columns),
+                    len(self.sens_parameters()))
+            # timepoints after a solver failure are not written
+            sens = np.zeros(shape) if sens is True else _buffer(sens, shape, 'sens')
+
+        args = [num_timepoints, _pointer(tvec), num_samples, self.num_species,
+                _pointer(ivalues), self.num_parameters, _pointer(rates),
+                _pointer(y) if y is not None else None, _pointer(yss),
+                _pointer(flag)]
+        if self.langevin:
+            args.append(zeta)
+        if self.sens:
+            args.append(_pointer(sens) if sens is not None else None)
+        if num_threads is not None or schedule is not None or chunk is not None:
+            self.set_schedule(num_threads, schedule, chunk)
+        self._call(self.lib.engine, args, stats)
+
+        result = (y, yss, flag)
+        if sens is not None:
+            result += (sens,)
+        if stats is not None:
+            result += (stats,)
+        return result
+
+    def continuation(self, parameter, values, ivalues=None, rates=None,
+            t_settle=CONTINUATION_T_SETTLE, jac=False, **schedule):
+        '''steady states along the values of parameter (a name or an
+        index), each point started from the points before it (see
+        engine_continuation() in mex_mat.c). values is one ordered sweep, or
+        a (branches, points) array of sweeps that run in parallel, e.g. the
+        rows of a 2-d grid; every branch has its row of ivalues and rates
+        (a single row, default_ivalues and default_rates by default, is
+        used for all). t_settle bounds the integration of the first point
+        of a branch and of points where newton fails.
+
+        returns (yss, flag, unstable): yss is (branches, points, species),
+        or (points, species) for a 1-d sweep, flag is 0 where newton
+        continued from the points before, 1 where the point was integrated
+        first and -1 where no steady state was found, and unstable the
+        number of eigenvalues of the jacobian with a positive real part
+        (0 at stable steady states, see Unstable()). with jac the jacobians
+        (..., species, species) are returned as a fourth element.
+        '''
+        if not self.has_continuation:
+            raise RuntimeError('%s has no steady state continuation' % self.libfile)
+        param = self.parameters.index(parameter) \
+                if isinstance(parameter, basestring) else parameter
+        values = np.asarray(values, dtype=np.float64)
+        sweep = values.ndim == 1
+        values = np.require(np.atleast_2d(values), requirements=['C_CONTIGUOUS'])
+        if values.ndim != 2 or values.shape[1] < 1:
+            raise ValueError('values should be a (points,) or (branches, points) array')
+        num_branches, num_points = values.shape
+        ivalues, rates = self.broadcast(
+                self.default_ivalues if ivalues is None else ivalues,
+                self.default_rates if rates is None else rates)
+        if ivalues.shape[0] == 1:
+            ivalues = np.repeat(ivalues, num_branches, axis=0)
+            rates = np.repeat(rates, num_branches, axis=0)
+        ivalues = _buffer(ivalues, (num_branches, self.num_species), 'ivalues')
+        rates = _buffer(rates, (num_branches, self.num_parameters), 'rates')
+        yss = np.zeros((num_branches, num_points, self.num_species))
+        flag = np.empty((num_branches, num_points))
+        n = self.num_species
+        jacobian = np.zeros((num_branches, num_points, n, n))
+        if schedule:
+            self.set_schedule(**schedule)
+        self._batch_stats = None
+        if self.lib.engine_continuation(num_branches, num_points, n,
+                _pointer(ivalues), self.num_parameters, _pointer(rates), param,
+                _pointer(values), t_settle, _pointer(yss), _pointer(jacobian),
+                _pointer(flag)) != 0:
+            raise ValueError('parameter should be one of the %d parameters and '
+                    't_settle > 0' % self.num_parameters)
+        unstable = np.where(flag >= 0, Unstable(jacobian), -1)
+        result = (yss, flag, unstable)
+        if jac:
+            result += (jacobian,)
+        if sweep:
+            result = tuple(r[0] for r in result)
+        return result
+
+def Unstable(jac, tol=1.0e-8):
+    '''the number of eigenvalues with a real part above tol times the
+    largest eigenvalue of each jacobian of a (..., n, n) array. '''
+    jac = np.asarray(jac)
+    if jac.shape[-1] == 0:
+        return np.zeros(jac.shape[:-2], dtype=int)
+    eig = np.linalg.eigvals(jac.reshape((-1,) + jac.shape[-2:]))
+    scale = np.abs(eig).max(axis=-1)[:, None]
+    return (eig.real > tol*scale).sum(axis=-1).reshape(jac.shape[:-2])
+
+def WriteAxes(path, num_samples, tvec, species, parameters=None):
+    '''the axes of a trajectory file, in the format of engine_to_file().
+    parameters adds the parameter axis of a sensitivity file. '''
+    axes = {'axes': ['sample', 'time', 'species'],
+        'shape': [num_samples, len(tvec), len(species)],
+        'time': [ float(t) for t in tvec ], 'species': list(species)}
+    if parameters is not None:
+        axes['axes'].append('parameter')
+        axes['shape'].append(len(parameters))
+        axes['parameter'] = list(parameters)
+    f = open(path + '.json', 'w')
+    json.dump(axes, f)
+    f.close()
+
+def OpenTrajectories(path):
+    '''(y, axes) of a trajectory file written by run_to_file() or by
+    engine_to_file(). y is a read-only memory map of shape (samples,
+    timepoints, species), or (samples, timepoints, species, parameters) for
+    sensitivities; only the pages that are indexed are read.
+    '''
+    y = np.load(path, mmap_mode='r')
+    axes = json.load(open(path + '.json'))
+    if list(y.shape) != axes['shape']:
+        raise ValueError('%s does not match its axes %s.json' % (path, path))
+    return y, axes
+
+def HeterogeneousRates(eng, nsamps, stiff_fraction=0.05, stiffness=1.0e3, seed=0):
+    '''default rates scaled per sample by a log-uniform factor in [0.1, 10],
+    with stiff_fraction of the samples scaled up by stiffness. the stiff
+    samples take far more solver steps than the rest, like the outliers of
+    a parameter scan.
+    '''
+    rs = np.random.RandomState(seed)
+    rates = eng.default_rates[None, :] * 10**rs.uniform(-1, 1,
+            (nsamps, eng.num_parameters))
+    stiff = rs.rand(nsamps) < stiff_fraction
+    rates[stiff] *= stiffness
+    return rates
+
+def ScheduleBenchmark(eng, nsamps=2000, num_tvec=20, t_final=10.0,
+        num_threads=0, configs=None):
+    '''runs the same heterogeneous batch with several schedules and prints
+    the wall time, the busy time of the least and most loaded threads and
+    the idle fraction (1 - total busy / threads*wall). ('static', 10) is
+    the split of the former PACKAGE_SIZE loop.
+    '''
+    if configs is None:
+        configs = [('static', 10), ('static', 0), ('dynamic', 1),
+                ('dynamic', 4), ('guided', 1)]
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues,
+            HeterogeneousRates(eng, nsamps))
+    out = eng.empty(nsamps, num_tvec)
+    print '%-8s %5s %7s %10s %10s %10s %6s' % ('schedule', 'chunk', 'threads',
+            'wall', 'min busy', 'max busy', 'idle')
+    for schedule, chunk in configs:
+        eng.run(tvec, ivalues, rates, out=out, num_threads=num_threads,
+                schedule=schedule, chunk=chunk)
+        busy, samples, wall = eng.thread_stats()
+        idle = 1.0 - busy.sum()/(len(busy)*wall) if wall > 0 else 0.0
+        print '%-8s %5d %7d %9.4fs %9.4fs %9.4fs %5.1f%%' % (schedule, chunk,
+                len(busy), wall, busy.min(), busy.max(), 100*idle)
+
+def NoiseBenchmark(eng, nsamps=2000, num_tvec=20, t_final=10.0, seed=1,
+        configs=None):
+    '''runs the same langevin batch with a fixed seed on 1, 2 and all
+    processors and several schedules, and prints the throughput of each
+    run and whether its trajectories are bit-identical to the single
+    thread run. returns True if all of them are.
+    '''
+    if not eng.langevin or not eng.seedable:
+        raise RuntimeError('%s is not a langevin engine with noise streams' % eng.libfile)
+    if configs is None:
+        configs = [(1, 'static', 0), (2, 'static', 0), (2, 'dynamic', 1),
+                (0, 'dynamic', 1), (0, 'guided', 1), (0, 'static', 7)]
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues,
+            HeterogeneousRates(eng, nsamps))
+    eng.set_seed(seed)
+    reference = None
+    identical = True
+    print '%7s %-8s %5s %10s %12s %s' % ('threads', 'schedule', 'chunk',
+            'wall', 'samples/s', 'identical')
+    for num_threads, schedule, chunk in configs:
+        # timepoints after a solver failure are not written; zeros keep
+        # them comparable between runs
+        y = np.zeros((nsamps, num_tvec, eng.num_species))
+        yss, flag = np.empty((nsamps, eng.num_species)), np.empty(nsamps)
+        t0 = time.time()
+        eng.run(tvec, ivalues, rates, out=(y, yss, flag),
+                num_threads=num_threads, schedule=schedule, chunk=chunk)
+        elapsed = time.time() - t0
+        if reference is None:
+            reference = y
+        same = np.array_equal(y.view(np.uint64), reference.view(np.uint64))
+        identical = identical and same
+        print '%7d %-8s %5d %9.4fs %12.1f %s' % (len(eng.thread_stats()[0]),
+                schedule, chunk, elapsed, nsamps/elapsed, same)
+    eng.set_seed(None)
+    return identical
+
+def SdeBenchmark(sde, langevin, nsamps=10, num_tvec=1000, t_final=10.0,
+        steps=(1.0e-2, 1.0e-3, 1.0e-4), repeat=5):
+    '''times runs like run_hello_sde.m (default rates, num_tvec output
+    times) with the langevin engine and with the SDE engine at several
+    steps, and prints the time per run and the mean and spread of the
+    final states.
+    '''
+    if not sde.sde:
+        raise RuntimeError('%s is not an SDE engine' % sde.libfile)
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = sde.broadcast(sde.default_ivalues,
+            np.repeat(sde.default_rates[None, :], nsamps, axis=0))
+    runs = [('%s' % os.path.basename(langevin.libfile), langevin, None)]
+    runs += [ ('%s dt=%g' % (os.path.basename(sde.libfile), dt), sde, dt)
+            for dt in steps ]
+    print '%-28s %12s %12s %12s' % ('engine', 'sec/run', 'mean yss', 'std yss')
+    for name, eng, dt in runs:
+        if dt is not None:
+            eng.set_sde(dt)
+        t0 = time.time()
+        for k in range(repeat):
+            y, yss, flag = eng.run(tvec, ivalues, rates)
+        elapsed = (time.time() - t0)/repeat
+        print '%-28s %12.6f %12.4g %12.4g' % (name, elapsed, yss.mean(),
+                yss.std(axis=0).mean())
+    sde.set_sde(None)
+
+def VarianceBenchmark(sde, langevin, nsamps=2000, num_tvec=11, t_final=10.0,
+        seed=1):
+    '''runs one batch at the default rates with the langevin engine and with
+    the SDE engine and prints the variance of the final state of every
+    species and of the difference of every pair of species under both. the
+    SDE noise comes from the reactions of the .eqn file, so species made by
+    two reactions with the same velocity (b -> c + d; f1 and b -> e; f1)
+    differ by as much as under the langevin engine instead of not at all.
+    '''
+    if not sde.sde:
+        raise RuntimeError('%s is not an SDE engine' % sde.libfile)
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = sde.broadcast(sde.default_ivalues,
+            np.repeat(sde.default_rates[None, :], nsamps, axis=0))
+    final = []
+    for eng in (langevin, sde):
+        eng.set_seed(seed)
+        y, yss, flag = eng.run(tvec, ivalues, rates)
+        eng.set_seed(None)
+        final.append(yss[flag >= 0])
+    n = sde.num_species
+    rows = [ (sde.species[i], [ f[:, i] for f in final ]) for i in range(n) ]
+    rows += [ ('%s-%s' % (sde.species[i], sde.species[k]),
+        [ f[:, i] - f[:, k] for f in final ]) for i in range(n) for k in range(i + 1, n) ]
+    print '%-24s %12s %12s %8s' % ('final state', 'var langevin', 'var SDE', 'ratio')
+    for name, (a, b) in rows:
+        print '%-24s %12.4g %12.4g %8.3g' % (name, a.var(), b.var(),
+                b.var()/a.var() if a.var() > 0 else np.nan)
+
+def SsaBenchmark(eng, nsamps=100, num_tvec=20, t_final=10.0,
+        zeta=DEFAULT_ZETA, methods=('direct', 'tau')):
+    '''runs an SSA engine with the default rates and both methods and
+    prints the number of events per second of busy thread time (events/sec
+    per core) and the mean and spread of the final states.
+    '''
+    if not eng.ssa:
+        raise RuntimeError('%s is not an SSA engine' % eng.libfile)
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues,
+            np.repeat(eng.default_rates[None, :], nsamps, axis=0))
+    print '%-8s %10s %14s %10s %14s %12s %12s' % ('method', 'sec', 'events',
+            'leaps', 'events/s/core', 'mean yss', 'std yss')
+    for method in methods:
+        eng.set_ssa(method)
+        t0 = time.time()
+        y, yss, flag = eng.run(tvec, ivalues, rates, zeta=zeta)
+        elapsed = time.time() - t0
+        events, leaps = eng.ssa_stats()
+        busy = eng.thread_stats()[0].sum()
+        print '%-8s %10.4f %14.0f %10.0f %14.4g %12.4g %12.4g' % (method,
+                elapsed, events.sum(), leaps.sum(),
+                events.sum()/busy if busy > 0 else 0.0, yss.mean(),
+                yss.std(axis=0).mean())
+    eng.set_ssa(None)
+
+def ReadoutBenchmark(eng, nsamps=10000, num_tvec=100, t_final=10.0, top_k=10,
+        repeat=3):
+    '''times run() and readout() on the same batch of random rates
+    (HeterogeneousRates), prints the bytes of their outputs and checks that
+    the top_k trajectories of readout() are the ones of run().
+    '''
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues, HeterogeneousRates(eng, nsamps))
+    if eng.seedable:
+        eng.set_seed(1)
+    best = {}
+    for k in range(repeat):
+        t0 = time.time()
+        y, yss, flag = eng.run(tvec, ivalues, rates)
+        best['run'] = min(best.get('run', np.inf), time.time() - t0)
+        del yss, flag
+        t0 = time.time()
+        scores, yss, flag, top_y, top_index = eng.readout(tvec, ivalues, rates,
+                top_k=top_k)
+        best['readout'] = min(best.get('readout', np.inf), time.time() - t0)
+    print '%d samples, %d timepoints, %d species, %d readouts (best of %d):' % (
+            nsamps, num_tvec, eng.num_species, len(eng.readouts), repeat)
+    print '  run()     %8.3fs %12d bytes of trajectories' % (best['run'], y.nbytes)
+    print '  readout() %8.3fs %12d bytes of scores and top %d' % (best['readout'],
+            scores.nbytes + top_y.nbytes, top_k)
+    found = top_index[top_index >= 0]
+    same = np.array_equal(y[found], top_y[:len(found)])
+    print '  top %d trajectories equal to run(): %s' % (len(found), same)
+    for name, column in zip(eng.readouts, scores.T):
+        print '  %-12s best sample %8d %12.4g' % (name, np.nanargmax(column),
+                np.nanmax(column))
+
+def OutputBenchmark(eng, nsamps=10000, num_tvec=1000, t_final=10.0, stride=10,
+        repeat=3):
+    '''times run() keeping every species at every timepoint and keeping
+    the probes of the model at every stride-th timepoint on the same batch
+    of random rates (HeterogeneousRates), prints the bytes of both outputs
+    and checks that the second is a slice of the first on the samples that
+    finished (the rows of failed samples are not all written).
+    '''
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues, HeterogeneousRates(eng, nsamps))
+    if eng.seedable:
+        eng.set_seed(1)
+    best, y, flag = {}, {}, {}
+    try:
+        for k in range(repeat):
+            for name, probes, step in (('full', False, 1), ('probes', True, stride)):
+                eng.set_output(probes, step)
+                y[name] = None
+                t0 = time.time()
+                y[name], yss, flag[name] = eng.run(tvec, ivalues, rates)
+                best[name] = min(best.get(name, np.inf), time.time() - t0)
+        eng.set_output(True, stride)
+        times, species = eng.output(tvec)
+    finally:
+        eng.set_output(None, None)
+    print '%d samples, %d timepoints, %d species (best of %d, with allocation):' % (
+            nsamps, num_tvec, eng.num_species, repeat)
+    print '  all species, every timepoint %8.3fs %12d bytes' % (best['full'],
+            y['full'].nbytes)
+    print '  %-28s %8.3fs %12d bytes' % ('%s, stride %d' % (','.join(species), stride),
+            best['probes'], y['probes'].nbytes)
+    columns = [ eng.species.index(s) for s in species ]
+    done = (flag['full'] >= 0) & (flag['probes'] >= 0)
+    same = np.array_equal(y['full'][done][:, ::stride][:, :, columns], y['probes'][done])
+    print '  equal to the slice of the full output on %d finished samples: %s' % (
+            done.sum(), same)
+    return same
+
+def _histogram(values, bins):
+    '''text histogram of positive values on log2 spaced bins. '''
+    values = values[values > 0]
+    if values.size == 0:
+        return
+    lo, hi = np.floor(np.log2(values.min())), np.ceil(np.log2(values.max()))
+    edges = 2.0**np.linspace(lo, max(hi, lo + 1), bins + 1)
+    counts = np.histogram(values, edges)[0]
+    for k in range(bins):
+        print '    %10.3g - %-10.3g %8d %s' % (edges[k], edges[k+1], counts[k],
+                '#'*int(round(40.0*counts[k]/max(counts.max(), 1))))
+
+def _outliers(rates, parameters, i, count=3):
+    '''the count parameters of sample i farthest from the batch median, in
+    standard deviations of their logarithm, as 'name=value' strings.
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        logs = np.log(np.where(rates > 0, rates, np.nan))
+        spread = np.nanstd(logs, axis=0)
+        z = np.abs(logs[i] - np.nanmedian(logs, axis=0))/spread
+    z[~np.isfinite(z)] = 0
+    return [ '%s=%.3g' % (parameters[k], rates[i, k])
+            for k in np.argsort(z)[::-1][:count] if z[k] > 0 ]
+
+def StatsReport(stats, flag=None, rates=None, parameters=None, slowest=10, bins=8):
+    '''prints a summary of per-sample solver statistics (from run(...,
+    stats=True)): percentiles of every column, histograms of the wall time
+    and the steps, and the slowest samples with their flag and, given the
+    rates and parameter names, the rates that are most unusual for them.
+    '''
+    stats = np.asarray(stats)
+    print '%-15s %12s %12s %12s %12s %12s' % ('', 'mean', 'median', 'p90', 'p99', 'max')
+    for k, name in enumerate(STATS):
+        column = stats[:, k]
+        print '%-15s %12.4g %12.4g %12.4g %12.4g %12.4g' % ((name, column.mean()) +
+                tuple(np.percentile(column, [50, 90, 99])) + (column.max(),))
+    for name in ('wall', 'steps'):
+        print '%s:' % name
+        _histogram(stats[:, STATS.index(name)], bins)
+    order = np.argsort(stats[:, STATS.index('wall')])[::-1][:slowest]
+    print 'slowest %d samples:' % len(order)
+    print '%8s %12s %10s %10s %8s %6s' % ('sample', 'wall', 'steps',
+            'rhs_evals', 'retries', 'flag')
+    for i in order:
+        row = stats[i]
+        outliers = []
+        if rates is not None and parameters is not None:
+            outliers = _outliers(np.asarray(rates), parameters, i)
+        print '%8d %12.4g %10d %10d %8d %6s %s' % (i, row[STATS.index('wall')],
+                row[STATS.index('steps')], row[STATS.index('rhs_evals')],
+                row[STATS.index('retries')],
+                '%d' % flag[i] if flag is not None else '', ' '.join(outliers))
+
+def StatsBenchmark(eng, nsamps=1000, num_tvec=20, t_final=10.0, repeat=5,
+        seed=0):
+    '''runs a batch of random rates (HeterogeneousRates) with and without
+    solver statistics, prints the best time of both and the report of the
+    statistics.
+    '''
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues,
+            HeterogeneousRates(eng, nsamps, seed=seed))
+    out = eng.empty(nsamps, num_tvec)
+    stats = np.zeros((nsamps, len(STATS)))
+    best = {}
+    for k in range(repeat):
+        for with_stats in (False, True):
+            t0 = time.time()
+            eng.run(tvec, ivalues, rates, out=out,
+                    stats=stats if with_stats else None)
+            elapsed = time.time() - t0
+            best[with_stats] = min(best.get(with_stats, elapsed), elapsed)
+    print 'best of %d: %.4fs without statistics, %.4fs with (%+.1f%%)' % (repeat,
+            best[False], best[True], 100.0*(best[True]/best[False] - 1.0))
+    StatsReport(stats, out[2], rates, eng.parameters)
+
+def SensBenchmark(eng, plain, nsamps=1000, num_tvec=20, t_final=10.0,
+        step=1.0e-3, seed=0):
+    '''computes dy/dp of a batch of random rates (HeterogeneousRates without
+    stiff samples) with the forward sensitivities of a SENS engine and with
+    forward differences of the plain engine, one run of the batch for
+    every parameter with that parameter raised by step*|p|, and prints the
+    time and rhs evaluations of both and their largest difference relative
+    to the largest sensitivity of each parameter. returns that difference.
+    '''
+    if not eng.sens:
+        raise RuntimeError('%s is not a SENS engine' % eng.libfile)
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues,
+            HeterogeneousRates(eng, nsamps, stiff_fraction=0.0, seed=seed))
+    parameters = eng.sens_parameters()
+    columns = [ eng.parameters.index(p) for p in parameters ]
+
+    t0 = time.time()
+    y, yss, flag, dy, stats = eng.run(tvec, ivalues, rates, sens=True,
+            stats=True)
+    sens_time = time.time() - t0
+    sens_evals = stats[:, STATS.index('rhs_evals')].sum()
+
+    t0 = time.time()
+    y0, yss, flag0, stats = plain.run(tvec, ivalues, rates, stats=True)
+    fd_evals = stats[:, STATS.index('rhs_evals')].sum()
+    fd = np.zeros(dy.shape)
+    done = (flag >= 0) & (flag0 >= 0)
+    for i, k in enumerate(columns):
+        h = step*np.where(rates[:, k] != 0, np.abs(rates[:, k]), 1.0)
+        shifted = rates.copy()
+        shifted[:, k] += h
+        y1, yss, flag1, stats = plain.run(tvec, ivalues, shifted, stats=True)
+        fd_evals += stats[:, STATS.index('rhs_evals')].sum()
+        fd[..., i] = (y1 - y0)/h[:, None, None]
+        done &= flag1 >= 0
+    fd_time = time.time() - t0
+
+    scale = np.abs(dy[done]).reshape(-1, len(columns)).max(axis=0)
+    diff = np.abs(fd[done] - dy[done]).reshape(-1, len(columns)).max(axis=0)
+    error = (diff/np.where(scale > 0, scale, 1.0)).max() if len(columns) else 0.0
+    print '%d samples, %d timepoints, %d of %d parameters:' % (nsamps,
+            num_tvec, len(columns), eng.num_parameters)
+    print '  %-28s %9s %14s' % ('', 'sec', 'rhs evals')
+    print '  %-28s %8.3fs %14d' % ('forward sensitivities', sens_time, sens_evals)
+    print '  %-28s %8.3fs %14d' % ('forward differences (%d runs)' % (len(columns) + 1),
+            fd_time, fd_evals)
+    print '  largest relative difference on %d finished samples: %.3g' % (
+            done.sum(), error)
+    return error
+
+def ContinuationBenchmark(eng, parameter, values, t_final=1000.0,
+        num_tvec=100, rates=None):
+    '''finds the steady states of the model along values of parameter with
+    continuation() and with cold starts, every point a sample of run()
+    integrated from the initial values to t_final, and prints the time of
+    both and their largest difference relative to the largest steady state
+    of each species, on the points where both succeeded. returns that
+    difference.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    if rates is None:
+        rates = eng.default_rates
+    t0 = time.time()
+    yss, flag, unstable = eng.continuation(parameter, values, rates=rates)
+    cont_time = time.time() - t0
+
+    param = eng.parameters.index(parameter) \
+            if isinstance(parameter, basestring) else parameter
+    ivalues, cold_rates = eng.broadcast(eng.default_ivalues, rates)
+    ivalues = np.repeat(ivalues, len(values), axis=0)
+    cold_rates = np.repeat(cold_rates, len(values), axis=0)
+    cold_rates[:, param] = values
+    tvec = np.linspace(0, t_final, num_tvec)
+    t0 = time.time()
+    y, cold, cold_flag = eng.run(tvec, ivalues, cold_rates)
+    cold_time = time.time() - t0
+
+    done = (flag >= 0) & (cold_flag >= 0)
+    scale = np.abs(cold[done]).max(axis=0) if done.any() else np.zeros(0)
+    diff = np.abs(yss[done] - cold[done]).max(axis=0) if done.any() else np.zeros(0)
+    error = (diff/np.where(scale > 0, scale, 1.0)).max() if diff.size else 0.0
+    print '%d points of %s, %d species:' % (len(values), eng.parameters[param],
+            eng.num_species)
+    print '  continuation: %8.4fs, %d by newton, %d integrated, %d failed, ' \
+            '%d unstable' % (cont_time, (flag == 0).sum(), (flag == 1).sum(),
+                    (flag < 0).sum(), (unstable > 0).sum())
+    print '  cold starts:  %8.4fs to t = %g, %d failed (%.1fx)' % (cold_time,
+            t_final, (cold_flag < 0).sum(), cold_time/max(cont_time, 1e-9))
+    print '  largest relative difference on %d points: %.3g' % (done.sum(), error)
+    return error
+
+def usage():
+    print 'usage: pyengine.py [options] model.so [nsamps] [num_tvec] [t_final]'
+    print '-j num_threads   : number of threads (0 = all processors).'
+    print '-s schedule      : static, dynamic or guided.'
+    print '-c chunk         : samples per chunk (0 = default of the schedule).'
+    print '-b               : compare schedules on a heterogeneous batch.'
+    print '-r seed          : master seed of the langevin noise.'
+    print '-n               : check that langevin runs with a fixed seed are'
+    print '                   identical on 1, 2 and all threads.'
+    print '-l langevin.so   : compare an SDE engine (model_SDE.so) with the'
+    print '                   langevin engine on run_hello_sde.m like runs.'
+    print '-v langevin.so   : compare the variances of the final states and'
+    print '                   their pairwise differences of an SDE engine with'
+    print '                   the langevin engine.'
+    print '-e zeta          : events/sec per core of an SSA engine'
+    print '                   (model_SSA.so), direct and tau-leaping.'
+    print '-S               : report per-sample solver statistics of a batch'
+    print '                   and the cost of collecting them.'
+    print '-R top_k         : compare run() with the in-engine readouts of the'
+    print '                   model (readout()) and keep the top_k trajectories.'
+    print '-o stride        : compare run() keeping every species at every'
+    print '                   timepoint with keeping the probes of the model at'
+    print '                   every stride-th timepoint.'
+    print '-p k1,k2,...     : parameters of the sensitivities of a SENS engine.'
+    print '-f model.so      : compare the forward sensitivities of a SENS engine'
+    print '                   (model_SENS.so) with forward differences of the'
+    print '                   plain engine model.so.'
+    print '-C parameter     : compare the steady states of nsamps points of'
+    print '                   parameter between 0.1 and 10 times its default'
+    print '                   by continuation and by cold starts to t_final.'
+
+def main(argv):
+    import getopt
+    try:
+        opts, argv = getopt.getopt(argv, "hj:s:c:br:nl:v:e:SR:o:p:f:C:",
+                ["help", "threads", "schedule", "chunk", "benchmark", "seed",
+                    "noise", "langevin", "variance", "events", "stats", "readout", "output",
+                    "parameters", "differences", "continuation"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    num_threads, schedule, chunk, benchmark = None, None, None, False
+    seed, noise, langevin, events, stats = None, False, None, None, False
+    top_k, stride, sens, differences = None, None, None, None
+    continuation, variance = None, None
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-j', '--threads'):
+            num_threads = int(arg)
+        elif opt in ('-s', '--schedule'):
+            schedule = arg
+        elif opt in ('-c', '--chunk'):
+            chunk = int(arg)
+        elif opt in ('-b', '--benchmark'):
+            benchmark = True
+        elif opt in ('-r', '--seed'):
+            seed = int(arg, 0)
+        elif opt in ('-n', '--noise'):
+            noise = True
+        elif opt in ('-l', '--langevin'):
+            langevin = arg
+        elif opt in ('-v', '--variance'):
+            variance = arg
+        elif opt in ('-e', '--events'):
+            events = float(arg)
+        elif opt in ('-S', '--stats'):
+            stats = True
+        elif opt in ('-R', '--readout'):
+            top_k = int(arg)
+        elif opt in ('-o', '--output'):
+            stride = int(arg)
+        elif opt in ('-p', '--parameters'):
+            sens = arg.split(',')
+        elif opt in ('-f', '--differences'):
+            differences = arg
+        elif opt in ('-C', '--continuation'):
+            continuation = arg
+    if len(argv) < 1:
+        usage()
+        sys.exit()
+    nsamps = int(argv[1]) if len(argv) > 1 else 1000
+    num_tvec = int(argv[2]) if len(argv) > 2 else 20
+    t_final = float(argv[3]) if len(argv) > 3 else 10.0
+
+    eng = Engine(argv[0])
+    if noise:
+        if not NoiseBenchmark(eng, nsamps, num_tvec, t_final,
+                seed if seed is not None else 1):
+            sys.exit(1)
+        return
+    if seed is not None:
+        eng.set_seed(seed)
+    if sens is not None:
+        eng.set_sens(sens)
+    if differences is not None:
+        SensBenchmark(eng, Engine(differences), nsamps, num_tvec, t_final)
+        return
+    if continuation is not None:
+        default = eng.default_rates[eng.parameters.index(continuation)]
+        default = default if default > 0 else 1.0
+        ContinuationBenchmark(eng, continuation, default*np.logspace(-1, 1,
+            int(argv[1]) if len(argv) > 1 else 100),
+            float(argv[3]) if len(argv) > 3 else 1000.0, num_tvec)
+        return
+    if langevin is not None:
+        SdeBenchmark(eng, Engine(langevin), int(argv[1]) if len(argv) > 1 else 10,
+                int(argv[2]) if len(argv) > 2 else 1000, t_final)
+        return
+    if variance is not None:
+        VarianceBenchmark(eng, Engine(variance), int(argv[1]) if len(argv) > 1 else 2000,
+                int(argv[2]) if len(argv) > 2 else 11, t_final)
+        return
+    if events is not None:
+        SsaBenchmark(eng, int(argv[1]) if len(argv) > 1 else 100, num_tvec,
+                t_final, events)
+        return
+    if stats:
+        StatsBenchmark(eng, nsamps, num_tvec, t_final)
+        return
+    if top_k is not None:
+        ReadoutBenchmark(eng, nsamps, num_tvec, t_final, top_k)
+        return
+    if stride is not None:
+        if not OutputBenchmark(eng, nsamps, num_tvec, t_final, stride):
+            sys.exit(1)
+        return
+    if benchmark:
+        ScheduleBenchmark(eng, nsamps, num_tvec, t_final,
+                num_threads if num_threads is not None else 0)
+        return
+    tvec = np.linspace(0, t_final, num_tvec)
+    ivalues, rates = eng.broadcast(eng.default_ivalues,
+            np.random.rand(nsamps, eng.num_parameters))
+
+    t0 = time.time()
+    y, yss, flag = eng.run(tvec, ivalues, rates, num_threads=num_threads,
+            schedule=schedule, chunk=chunk)
+    elapsed = time.time() - t0
+    print '%d ode equations executed in %fsec (%f #/sec)' % (nsamps, elapsed,
+            nsamps/elapsed)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
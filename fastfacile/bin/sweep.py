@@ -0,0 +1,509 @@
+#!/usr/bin/python
+'''sweep.py runs a compiled model over a design of parameter sets drawn from
+the #{min, max} ranges of its .eqn file (the bounds of ranges.m).
+
+The design (uniform random, latin hypercube or sobol, on a linear or a log
+scale) is generated lazily, chunk by chunk, so that a chunk only depends on
+the settings of the sweep and its own index. Chunks are handed to a pool of
+processes, each calling the engine library. A finished chunk leaves
+chunk_<index>.npz (parameter sets, final states, flags) and, for engines
+with trajectories, chunk_<index>.npy in the sweep directory; the .npz is
+renamed into place last, so it marks the chunk as done. Running the same
+sweep again skips the finished chunks, so an interrupted sweep resumes
+where it stopped.
+
+Parameters whose range is a single value (min == max, e.g. the e2..e10
+edge switches of g4n.eqn) are held at that value, and parameters that the
+.eqn file does not list keep their default value.
+
+usage:
+    sweep.py [options] MODEL.eqn MODEL.so nsamps sweep_dir
+'''
+import os, sys, time, json
+import numpy as np
+import modelir
+import pyengine
+
+DESIGNS = ['uniform', 'lhs', 'sobol']
+SCALES = ['linear', 'log']
+DEFAULT_CHUNK = 10000
+SETTINGS_FILE = 'sweep.json'
+
+SOBOL_BITS = 52
+
+# (degree s, inner coefficients a, initial direction numbers m_1..m_s) of
+# dimensions 2..128 of the sobol sequence, from new-joe-kuo-6.21201 of Joe
+# and Kuo (https://web.maths.unsw.edu.au/~fkuo/sobol/). the first dimension
+# is van der corput.
+JOE_KUO = [
+    (1, 0, (1,)),
+    (2, 1, (1, 3)),
+    (3, 1, (1, 3, 1)),
+    (3, 2, (1, 1, 1)),
+    (4, 1, (1, 1, 3, 3)),
+    (4, 4, (1, 3, 5, 13)),
+    (5, 2, (1, 1, 5, 5, 17)),
+    (5, 4, (1, 1, 5, 5, 5)),
+    (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)),
+    (5, 13, (1, 1, 1, 3, 11)),
+    (5, 14, (1, 3, 5, 5, 31)),
+    (6, 1, (1, 3, 3, 9, 7, 49)),
+    (6, 13, (1, 1, 1, 15, 21, 21)),
+    (6, 16, (1, 3, 1, 13, 27, 49)),
+    (6, 19, (1, 1, 1, 15, 7, 5)),
+    (6, 22, (1, 3, 1, 15, 13, 25)),
+    (6, 25, (1, 1, 5, 5, 19, 61)),
+    (7, 1, (1, 3, 7, 11, 23, 15, 103)),
+    (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+    (7, 7, (1, 1, 3, 13, 7, 35, 63)),
+    (7, 8, (1, 3, 5, 9, 1, 25, 53)),
+    (7, 14, (1, 3, 1, 13, 9, 35, 107)),
+    (7, 19, (1, 3, 1, 5, 27, 61, 31)),
+    (7, 21, (1, 1, 5, 11, 19, 41, 61)),
+    (7, 28, (1, 3, 5, 3, 3, 13, 69)),
+    (7, 31, (1, 1, 7, 13, 1, 19, 1)),
+    (7, 32, (1, 3, 7, 5, 13, 19, 59)),
+    (7, 37, (1, 1, 3, 9, 25, 29, 41)),
+    (7, 41, (1, 3, 5, 13, 23, 1, 55)),
+    (7, 42, (1, 3, 7, 3, 13, 59, 17)),
+    (7, 50, (1, 3, 1, 3, 5, 53, 69)),
+    (7, 55, (1, 1, 5, 5, 23, 33, 13)),
+    (7, 56, (1, 1, 7, 7, 1, 61, 123)),
+    (7, 59, (1, 1, 7, 9, 13, 61, 49)),
+    (7, 62, (1, 3, 3, 5, 3, 55, 33)),
+    (8, 14, (1, 3, 1, 15, 31, 13, 49, 245)),
+    (8, 21, (1, 3, 5, 15, 31, 59, 63, 97)),
+    (8, 22, (1, 3, 1, 11, 11, 11, 77, 249)),
+    (8, 38, (1, 3, 1, 11, 27, 43, 71, 9)),
+    (8, 47, (1, 1, 7, 15, 21, 11, 81, 45)),
+    (8, 49, (1, 3, 7, 3, 25, 31, 65, 79)),
+    (8, 50, (1, 3, 1, 1, 19, 11, 3, 205)),
+    (8, 52, (1, 1, 5, 9, 19, 21, 29, 157)),
+    (8, 56, (1, 3, 7, 11, 1, 33, 89, 185)),
+    (8, 67, (1, 3, 3, 3, 15, 9, 79, 71)),
+    (8, 70, (1, 3, 7, 11, 15, 39, 119, 27)),
+    (8, 84, (1, 1, 3, 1, 11, 31, 97, 225)),
+    (8, 97, (1, 1, 1, 3, 23, 43, 57, 177)),
+    (8, 103, (1, 3, 7, 7, 17, 17, 37, 71)),
+    (8, 115, (1, 3, 1, 5, 27, 63, 123, 213)),
+    (8, 122, (1, 1, 3, 5, 11, 43, 53, 133)),
+    (9, 8, (1, 3, 5, 5, 29, 17, 47, 173, 479)),
+    (9, 13, (1, 3, 3, 11, 3, 1, 109, 9, 69)),
+    (9, 16, (1, 1, 1, 5, 17, 39, 23, 5, 343)),
+    (9, 22, (1, 3, 1, 5, 25, 15, 31, 103, 499)),
+    (9, 25, (1, 1, 1, 11, 11, 17, 63, 105, 183)),
+    (9, 44, (1, 1, 5, 11, 9, 29, 97, 231, 363)),
+    (9, 47, (1, 1, 5, 15, 19, 45, 41, 7, 383)),
+    (9, 52, (1, 3, 7, 7, 31, 19, 83, 137, 221)),
+    (9, 55, (1, 1, 1, 3, 23, 15, 111, 223, 83)),
+    (9, 59, (1, 1, 5, 13, 31, 15, 55, 25, 161)),
+    (9, 62, (1, 1, 3, 13, 25, 47, 39, 87, 257)),
+    (9, 67, (1, 1, 1, 11, 21, 53, 125, 249, 293)),
+    (9, 74, (1, 1, 7, 11, 11, 7, 57, 79, 323)),
+    (9, 81, (1, 1, 5, 5, 17, 13, 81, 3, 131)),
+    (9, 82, (1, 1, 7, 13, 23, 7, 65, 251, 475)),
+    (9, 87, (1, 3, 5, 1, 9, 43, 3, 149, 11)),
+    (9, 91, (1, 1, 3, 13, 31, 13, 13, 255, 487)),
+    (9, 94, (1, 3, 3, 1, 5, 63, 89, 91, 127)),
+    (9, 103, (1, 1, 3, 3, 1, 19, 123, 127, 237)),
+    (9, 104, (1, 1, 5, 7, 23, 31, 37, 243, 289)),
+    (9, 109, (1, 1, 5, 11, 17, 53, 117, 183, 491)),
+    (9, 122, (1, 1, 1, 5, 1, 13, 13, 209, 345)),
+    (9, 124, (1, 1, 3, 15, 1, 57, 115, 7, 33)),
+    (9, 137, (1, 3, 1, 11, 7, 43, 81, 207, 175)),
+    (9, 138, (1, 3, 1, 1, 15, 27, 63, 255, 49)),
+    (9, 143, (1, 3, 5, 3, 27, 61, 105, 171, 305)),
+    (9, 145, (1, 1, 5, 3, 1, 3, 57, 249, 149)),
+    (9, 152, (1, 1, 3, 5, 5, 57, 15, 13, 159)),
+    (9, 157, (1, 1, 1, 11, 7, 11, 105, 141, 225)),
+    (9, 167, (1, 3, 3, 5, 27, 59, 121, 101, 271)),
+    (9, 173, (1, 3, 5, 9, 11, 49, 51, 59, 115)),
+    (9, 176, (1, 1, 7, 1, 23, 45, 125, 71, 419)),
+    (9, 181, (1, 1, 3, 5, 23, 5, 105, 109, 75)),
+    (9, 182, (1, 1, 7, 15, 7, 11, 67, 121, 453)),
+    (9, 185, (1, 3, 7, 3, 9, 13, 31, 27, 449)),
+    (9, 191, (1, 3, 1, 15, 19, 39, 39, 89, 15)),
+    (9, 194, (1, 1, 1, 1, 1, 33, 73, 145, 379)),
+    (9, 199, (1, 3, 1, 15, 15, 43, 29, 13, 483)),
+    (9, 218, (1, 1, 7, 3, 19, 27, 85, 131, 431)),
+    (9, 220, (1, 3, 3, 3, 5, 35, 23, 195, 349)),
+    (9, 227, (1, 3, 3, 7, 9, 27, 39, 59, 297)),
+    (9, 229, (1, 1, 3, 9, 11, 17, 13, 241, 157)),
+    (9, 230, (1, 3, 7, 15, 25, 57, 33, 189, 213)),
+    (9, 234, (1, 1, 7, 1, 9, 55, 73, 83, 217)),
+    (9, 236, (1, 3, 3, 13, 19, 27, 23, 113, 249)),
+    (9, 241, (1, 3, 5, 3, 23, 43, 3, 253, 479)),
+    (9, 244, (1, 1, 5, 5, 11, 5, 45, 117, 217)),
+    (9, 253, (1, 3, 3, 7, 29, 37, 33, 123, 147)),
+    (10, 4, (1, 3, 1, 15, 5, 5, 37, 227, 223, 459)),
+    (10, 13, (1, 1, 7, 5, 5, 39, 63, 255, 135, 487)),
+    (10, 19, (1, 3, 1, 7, 9, 7, 87, 249, 217, 599)),
+    (10, 22, (1, 1, 3, 13, 9, 47, 7, 225, 363, 247)),
+    (10, 50, (1, 3, 7, 13, 19, 13, 9, 67, 9, 737)),
+    (10, 55, (1, 3, 5, 5, 19, 59, 7, 41, 319, 677)),
+    (10, 64, (1, 1, 5, 3, 31, 63, 15, 43, 207, 789)),
+    (10, 69, (1, 1, 7, 9, 13, 39, 3, 47, 497, 169)),
+    (10, 98, (1, 3, 1, 7, 21, 17, 97, 19, 415, 905)),
+    (10, 107, (1, 3, 7, 1, 3, 31, 71, 111, 165, 127)),
+    (10, 115, (1, 1, 5, 11, 1, 61, 83, 119, 203, 847)),
+    (10, 121, (1, 3, 3, 13, 9, 61, 19, 97, 47, 35)),
+    (10, 127, (1, 1, 7, 7, 15, 29, 63, 95, 417, 469)),
+    (10, 134, (1, 3, 1, 9, 25, 9, 71, 57, 213, 385)),
+    (10, 140, (1, 3, 5, 13, 31, 47, 101, 57, 39, 341)),
+    (10, 145, (1, 1, 3, 3, 31, 57, 125, 173, 365, 551)),
+    (10, 152, (1, 3, 7, 1, 13, 57, 67, 157, 451, 707)),
+    (10, 158, (1, 1, 1, 7, 21, 13, 105, 89, 429, 965)),
+    (10, 161, (1, 1, 5, 9, 17, 51, 45, 119, 157, 141)),
+    (10, 171, (1, 3, 7, 7, 13, 45, 91, 9, 129, 741)),
+    (10, 181, (1, 3, 7, 1, 23, 57, 67, 141, 151, 571)),
+    (10, 194, (1, 1, 3, 11, 17, 47, 93, 107, 375, 157)),
+    (10, 199, (1, 3, 3, 5, 11, 21, 43, 51, 169, 915)),
+    (10, 203, (1, 1, 5, 3, 15, 55, 101, 67, 455, 625)),
+    (10, 208, (1, 3, 5, 9, 1, 23, 29, 47, 345, 595)),
+    (10, 227, (1, 3, 7, 7, 5, 49, 29, 155, 323, 589)),
+    (10, 242, (1, 3, 3, 7, 5, 41, 127, 61, 261, 717)),
+]
+
+def SobolDirections(dim):
+    '''direction numbers (dim, SOBOL_BITS) of the sobol sequence with the
+    joe-kuo initial direction numbers of JOE_KUO.
+    '''
+    v = np.zeros((dim, SOBOL_BITS), dtype=np.uint64)
+    for k in range(SOBOL_BITS):
+        v[0, k] = 1 << (SOBOL_BITS - 1 - k)
+    for j, (s, a, m) in enumerate(JOE_KUO[:dim - 1]):
+        m = list(m)
+        for k in range(s, SOBOL_BITS):
+            new = m[k - s] ^ (m[k - s] << s)
+            for i in range(1, s):
+                if (a >> (s - 1 - i)) & 1:
+                    new ^= m[k - i] << i
+            m.append(new)
+        for k in range(SOBOL_BITS):
+            v[j + 1, k] = m[k] << (SOBOL_BITS - 1 - k)
+    return v
+
+def _parity(x):
+    '''parity of the bits of each uint64 of x. '''
+    for shift in (32, 16, 8, 4, 2, 1):
+        x = x ^ (x >> np.uint64(shift))
+    return x & np.uint64(1)
+
+def Scramble(directions, seed):
+    '''(directions, shift) of a linear matrix scrambled and digitally
+    shifted sobol sequence: every dimension gets its own random lower
+    triangular bit matrix with a unit diagonal, applied to its direction
+    numbers, and its own random shift, xored into its points. both are
+    drawn from seed; the scrambled points keep the stratification of the
+    sobol sequence.
+    '''
+    rng = np.random.RandomState(seed)
+    dim = directions.shape[0]
+    scrambled = np.zeros(directions.shape, dtype=np.uint64)
+    for j in range(dim):
+        rows = np.tril(rng.randint(0, 2, (SOBOL_BITS, SOBOL_BITS)), -1)
+        rows[np.arange(SOBOL_BITS), np.arange(SOBOL_BITS)] = 1
+        for r in range(SOBOL_BITS):
+            # row r makes bit r (counted from the top) of every direction
+            # number from the bits above it
+            mask = sum([ 1 << (SOBOL_BITS - 1 - c)
+                for c in np.nonzero(rows[r])[0] ])
+            bit = _parity(directions[j] & np.uint64(mask))
+            scrambled[j] |= bit << np.uint64(SOBOL_BITS - 1 - r)
+    shift = np.array([ sum([ int(b) << k for k, b in
+        enumerate(rng.randint(0, 2, SOBOL_BITS)) ]) for j in range(dim) ],
+        dtype=np.uint64)
+    return scrambled, shift
+
+def Sobol(directions, first, count, shift=None):
+    '''points first..first+count-1 of the sobol sequence of directions, in
+    [0, 1), xored with shift (see Scramble()). each point is computed from
+    its gray code on its own, so a chunk does not need the points before
+    it.
+    '''
+    index = np.arange(first, first + count, dtype=np.uint64)
+    gray = index ^ (index >> np.uint64(1))
+    x = np.zeros((count, directions.shape[0]), dtype=np.uint64)
+    if shift is not None:
+        x ^= shift
+    for k in range(SOBOL_BITS):
+        bit = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        if not bit.any():
+            continue
+        x[bit] ^= directions[:, k]
+    return x.astype(np.float64)/float(1 << SOBOL_BITS)
+
+def _QmcSobol(dim, seed, first, count):
+    '''points first..first+count-1 of the scrambled sobol sequence of
+    scipy.stats.qmc (scipy >= 1.7), for more dimensions than JOE_KUO has.
+    '''
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        raise ValueError('sobol designs of more than %d dimensions need '
+                'scipy.stats.qmc' % (len(JOE_KUO) + 1))
+    sobol = qmc.Sobol(dim, scramble=True, seed=seed)
+    sobol.fast_forward(first)
+    return sobol.random(count)
+
+def LatinHypercube(rng, count, dim):
+    '''a latin hypercube of count points in [0, 1)^dim: each dimension has
+    one point in each of its count strata.
+    '''
+    u = (rng.rand(count, dim) + np.arange(count)[:, None])/count
+    for j in range(dim):
+        u[:, j] = u[rng.permutation(count), j]
+    return u
+
+class Sweep(object):
+    '''a sweep of libfile over nsamps parameter sets in directory.
+
+    The free parameters are sampled between their bounds, the fixed ones
+    (min == max) and the ones without an .eqn variable are held. Each chunk
+    of chunk samples is its own design, seeded by (seed, chunk index): a
+    latin hypercube of the chunk for lhs, a slice of one sobol sequence,
+    scrambled by seed, for sobol. Langevin engines draw sample i from noise stream i of seed, so
+    a resumed sweep gives the same trajectories as an uninterrupted one.
+    '''
+    def __init__(self, directory, eqnfile, libfile, nsamps, tvec,
+            design='lhs', scale='linear', seed=0, chunk=DEFAULT_CHUNK,
+            zeta=pyengine.DEFAULT_ZETA):
+        if design not in DESIGNS:
+            raise ValueError('design should be one of %s' % ', '.join(DESIGNS))
+        if scale not in SCALES:
+            raise ValueError('scale should be one of %s' % ', '.join(SCALES))
+        self.directory = directory
+        self.libfile = os.path.abspath(libfile)
+        self.nsamps = int(nsamps)
+        self.tvec = [ float(t) for t in tvec ]
+        self.design = design
+        self.scale = scale
+        self.seed = int(seed)
+        self.chunk = max(1, int(chunk))
+        self.zeta = float(zeta)
+
+        eng = pyengine.Engine(self.libfile)
+        model = modelir.Load(eqnfile=eqnfile)
+        eqn = dict([ (p.name, p) for p in model.eqn_parameters ])
+        self.parameters = eng.parameters
+        self.default_rates = [ float(r) for r in eng.default_rates ]
+        self.default_ivalues = [ float(v) for v in eng.default_ivalues ]
+        self.lower, self.upper, self.free = [], [], []
+        for i, name in enumerate(eng.parameters):
+            if name in eqn:
+                lower, upper = [ float(b) for b in eqn[name].bounds() ]
+            else:
+                lower = upper = self.default_rates[i]
+            self.lower.append(lower)
+            self.upper.append(upper)
+            if lower != upper:
+                self.free.append(i)
+        if scale == 'log':
+            bad = [ self.parameters[i] for i in self.free if self.lower[i] <= 0.0 ]
+            if bad:
+                raise ValueError('log scale needs positive bounds: %s' % ', '.join(bad))
+        self._check_settings()
+
+    def settings(self):
+        return {'libfile': self.libfile, 'nsamps': self.nsamps,
+                'tvec': self.tvec, 'design': self.design, 'scale': self.scale,
+                'seed': self.seed, 'chunk': self.chunk, 'zeta': self.zeta,
+                'parameters': self.parameters, 'lower': self.lower,
+                'upper': self.upper, 'ivalues': self.default_ivalues}
+
+    def _check_settings(self):
+        '''writes sweep.json for a new sweep; refuses to resume a sweep
+        whose settings differ, as its finished chunks would not fit.
+        '''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, SETTINGS_FILE)
+        settings = self.settings()
+        if os.path.isfile(path):
+            old = json.load(open(path))
+            changed = [ k for k in sorted(settings) if old.get(k) != settings[k] ]
+            if changed:
+                raise ValueError('%s was started with other settings (%s)' %
+                        (self.directory, ', '.join(changed)))
+            return
+        f = open(path + '.tmp', 'w')
+        json.dump(settings, f, indent=1, sort_keys=True)
+        f.close()
+        os.rename(path + '.tmp', path)
+
+    def num_chunks(self):
+        return (self.nsamps + self.chunk - 1)//self.chunk
+
+    def chunk_file(self, index, ext='.npz'):
+        return os.path.join(self.directory, 'chunk_%06d%s' % (index, ext))
+
+    def done(self, index):
+        return os.path.isfile(self.chunk_file(index))
+
+    def pending(self):
+        return [ k for k in range(self.num_chunks()) if not self.done(k) ]
+
+    def rates(self, index):
+        '''the parameter sets of chunk index, (samples, parameters). '''
+        first = index*self.chunk
+        count = min(self.chunk, self.nsamps - first)
+        dim = len(self.free)
+        if self.design == 'sobol' and dim > len(JOE_KUO) + 1:
+            u = _QmcSobol(dim, self.seed, first, count)
+        elif self.design == 'sobol':
+            if not hasattr(self, '_directions'):
+                self._directions, self._shift = Scramble(
+                        SobolDirections(max(dim, 1)), self.seed)
+            u = Sobol(self._directions, first, count, self._shift)[:, :dim]
+        else:
+            rng = np.random.RandomState([self.seed, index])
+            if self.design == 'lhs':
+                u = LatinHypercube(rng, count, dim)
+            else:
+                u = rng.rand(count, dim)
+        rates = np.repeat(np.array(self.default_rates)[None, :], count, axis=0)
+        lower = np.array(self.lower)
+        upper = np.array(self.upper)
+        rates[:, lower == upper] = lower[lower == upper]
+        lower, upper = lower[self.free], upper[self.free]
+        if self.scale == 'log':
+            rates[:, self.free] = lower*(upper/lower)**u
+        else:
+            rates[:, self.free] = lower + (upper - lower)*u
+        return rates
+
+    def run_chunk(self, eng, index, **schedule):
+        '''runs chunk index with the loaded engine eng and checkpoints it. '''
+        first = index*self.chunk
+        rates = self.rates(index)
+        ivalues, rates = eng.broadcast(self.default_ivalues, rates)
+        if eng.seedable and eng.langevin:
+            eng.set_seed(self.seed, first)
+        tvec = np.array(self.tvec)
+        if eng.steady:
+            y, yss, flag = eng.run(tvec, ivalues, rates, self.zeta, **schedule)
+        else:
+            yss, flag = eng.run_to_file(self.chunk_file(index, '.npy'), tvec,
+                    ivalues, rates, self.zeta, **schedule)
+        tmp = self.chunk_file(index, '.tmp.npz')
+        np.savez(tmp, rates=rates, yss=yss, flag=flag,
+                samples=np.arange(first, first + rates.shape[0]))
+        os.rename(tmp, self.chunk_file(index))
+
+    def run(self, processes=1, threads=None, verbose=True):
+        '''runs the pending chunks on processes processes, with threads
+        engine threads each (1 if processes > 1, all processors otherwise).
+        '''
+        pending = self.pending()
+        if threads is None:
+            threads = 1 if processes > 1 else 0
+        t0 = time.time()
+        if processes > 1 and len(pending) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes, _init_worker, (self, threads))
+            try:
+                for index in pool.imap_unordered(_run_worker, pending):
+                    _report(verbose, self, index, t0)
+                pool.close()
+            except KeyboardInterrupt:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            eng = pyengine.Engine(self.libfile)
+            for index in pending:
+                self.run_chunk(eng, index, num_threads=threads)
+                _report(verbose, self, index, t0)
+        return len(pending)
+
+    def collect(self):
+        '''(rates, yss, flag) of the finished chunks, in sample order. '''
+        done = [ k for k in range(self.num_chunks()) if self.done(k) ]
+        parts = [ np.load(self.chunk_file(k)) for k in done ]
+        if not parts:
+            return None, None, None
+        return tuple([ np.concatenate([ p[name] for p in parts ])
+            for name in ('rates', 'yss', 'flag') ])
+
+# the engine of a pool process, loaded once by _init_worker
+_worker = {}
+
+def _init_worker(sweep, threads):
+    _worker['sweep'] = sweep
+    _worker['engine'] = pyengine.Engine(sweep.libfile)
+    _worker['threads'] = threads
+
+def _run_worker(index):
+    _worker['sweep'].run_chunk(_worker['engine'], index,
+            num_threads=_worker['threads'])
+    return index
+
+def _report(verbose, sweep, index, t0):
+    if verbose:
+        done = sweep.num_chunks() - len(sweep.pending())
+        print 'chunk %d done (%d/%d, %.1fs)' % (index, done,
+                sweep.num_chunks(), time.time() - t0)
+        sys.stdout.flush()
+
+def usage():
+    print 'usage: sweep.py [options] MODEL.eqn MODEL.so nsamps sweep_dir'
+    print '-d design        : uniform, lhs or sobol (default lhs).'
+    print '-l               : sample on a log scale (log-uniform for -d uniform).'
+    print '-r seed          : seed of the design and of the langevin noise (default 0).'
+    print '-c chunk         : samples per chunk and checkpoint (default %d).' % DEFAULT_CHUNK
+    print '-p processes     : number of processes (default 1).'
+    print '-j num_threads   : engine threads per process.'
+    print '-t t_final       : last output time (default 10).'
+    print '-n num_tvec      : number of output times (default 20).'
+    print '-z zeta          : zeta of langevin engines.'
+    print 'an interrupted sweep is resumed by running it again with the same options.'
+
+def main(argv):
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv, "hd:lr:c:p:j:t:n:z:",
+                ["help", "design", "log", "seed", "chunk", "processes",
+                    "threads", "t_final", "num_tvec", "zeta"])
+    except getopt.GetoptError:
+        print 'use -h or --help to show usage'
+        sys.exit(2)
+    design, scale, seed, chunk = 'lhs', 'linear', 0, DEFAULT_CHUNK
+    processes, threads, t_final, num_tvec = 1, None, 10.0, 20
+    zeta = pyengine.DEFAULT_ZETA
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            usage()
+            sys.exit()
+        elif opt in ('-d', '--design'):
+            design = arg
+        elif opt in ('-l', '--log'):
+            scale = 'log'
+        elif opt in ('-r', '--seed'):
+            seed = int(arg, 0)
+        elif opt in ('-c', '--chunk'):
+            chunk = int(arg)
+        elif opt in ('-p', '--processes'):
+            processes = int(arg)
+        elif opt in ('-j', '--threads'):
+            threads = int(arg)
+        elif opt in ('-t', '--t_final'):
+            t_final = float(arg)
+        elif opt in ('-n', '--num_tvec'):
+            num_tvec = int(arg)
+        elif opt in ('-z', '--zeta'):
+            zeta = float(arg)
+    if len(args) != 4:
+        usage()
+        sys.exit(2)
+
+    sweep = Sweep(args[3], args[0], args[1], int(float(args[2])),
+            np.linspace(0, t_final, num_tvec), design, scale, seed, chunk, zeta)
+    print '%d of %d parameters sampled (%s, %s), %d chunks pending' % (
+            len(sweep.free), len(sweep.parameters), design, scale,
+            len(sweep.pending()))
+    sweep.run(processes, threads)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,19 +1,12 @@
-import os,sys,re
+import os,sys
 import getopt
-def SaveRateVariables(vffile,outfile):
-    colnames = []
-    values = []
-    for aline in file(vffile):
-        aline=aline.strip()
-        if aline=='': continue
-        if aline.find('<Parameter Name=') == 0:
-            aline = aline.replace('<Parameter Name=','')
-            aline = aline.replace('DefaultValue=','')
-            aline = aline.replace('/>','')
-            aline = aline.replace('\"','')
-            splited = aline.split()
-            colnames.append(splited[0])
-            values.append(splited[1])
+import modelir
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+def WriteCsv(colnames, values, outfile):
     csvfile_singleline = []
     fout1 = open(outfile,'w')
     for col in colnames:
@@ -24,54 +17,115 @@ def SaveRateVariables(vffile,outfile):
     for v in values:
         csvfile_singleline.append('%15.8E' % float(v))
     fout1.write(",".join(csvfile_singleline))
+    fout1.close()
+
+def SaveModelVariables(model, ratesfile, ivaluesfile, npy=False):
+    '''writes rates.csv and ivalues.csv from the model IR instead of the vf
+    file. 
+    '''
+    WriteCsv([ p.name for p in model.parameters ],
+            [ p.value for p in model.parameters ], ratesfile)
+    print 'SaveRateVariables: %s is generated.' % ratesfile
+    WriteCsv([ s.name for s in model.species ],
+            [ s.initial for s in model.species ], ivaluesfile)
+    print 'SaveStateVariables: %s is generated.' % ivaluesfile
+    if npy:
+        SaveNpy([ p.value for p in model.parameters ],
+                os.path.splitext(ratesfile)[0] + '.npy')
+        SaveNpy([ s.initial for s in model.species ],
+                os.path.splitext(ivaluesfile)[0] + '.npy')
+
+def ReadVf(vffile):
+    '''reads the parameters and state variables of a vfgen file in one
+    incremental pass. returns (rate names, rate values, state names,
+    initial values) with the values as text.
+
+    The file is parsed as xml with iterparse and every element is dropped
+    once it was read, so memory stays constant in the size of the file;
+    attributes may come in any order and span several lines.
+    '''
+    ratenames, rates, statenames, ivalues = [], [], [], []
+    context = iter(ElementTree.iterparse(vffile, events=('start', 'end')))
+    event, root = context.next()
+    for event, elem in context:
+        if event != 'end':
+            continue
+        if elem.tag == 'Parameter':
+            ratenames.append(elem.get('Name'))
+            rates.append(elem.get('DefaultValue', '0'))
+        elif elem.tag == 'StateVariable':
+            statenames.append(elem.get('Name'))
+            ivalues.append(elem.get('DefaultInitialCondition', '0'))
+        root.clear()
+    return ratenames, rates, statenames, ivalues
+
+def SaveNpy(values, outfile):
+    '''writes values as a (1, n) float64 array that can be passed to the
+    engine as it is.
+    '''
+    import numpy as np
+    np.save(outfile, np.array([ [ float(v) for v in values ] ]))
+    print 'SaveNpy: %s is generated.' % outfile
+
+def SaveVfVariables(vffile, ratesfile, ivaluesfile, npy=False):
+    '''writes rates.csv and ivalues.csv (and .npy files of the same
+    base name with npy) from one pass over vffile.
+    '''
+    ratenames, rates, statenames, ivalues = ReadVf(vffile)
+    WriteCsv(ratenames, rates, ratesfile)
+    print 'SaveRateVariables: %s is generated.' % ratesfile
+    WriteCsv(statenames, ivalues, ivaluesfile)
+    print 'SaveStateVariables: %s is generated.' % ivaluesfile
+    if npy:
+        SaveNpy(rates, os.path.splitext(ratesfile)[0] + '.npy')
+        SaveNpy(ivalues, os.path.splitext(ivaluesfile)[0] + '.npy')
+
+def SaveRateVariables(vffile,outfile):
+    ratenames, rates, statenames, ivalues = ReadVf(vffile)
+    WriteCsv(ratenames, rates, outfile)
     print 'SaveRateVariables: %s is generated.' % outfile
 
 def SaveStateVariables(vffile,outfile):
-    colnames = []
-    values = []
-    for aline in file(vffile):
-        aline=aline.strip()
-        if aline=='': continue
-        if aline.find('<StateVariable Name=') == 0:
-            aline = aline.replace('<Parameter Name=','')
-            splited = aline.split('\"')
-            #splited[1], splited[5]
-            colnames.append(splited[1])
-            values.append(splited[5])
-    csvfile_singleline = []
-    fout1 = open(outfile,'w')
-    for col in colnames:
-        csvfile_singleline.append('%15s' % col)
-    fout1.write(",".join(csvfile_singleline))
-    fout1.write("\n")
-    csvfile_singleline = []
-    for v in values:
-        csvfile_singleline.append('%15.8E' % float(v))
-    fout1.write(",".join(csvfile_singleline))
+    ratenames, rates, statenames, ivalues = ReadVf(vffile)
+    WriteCsv(statenames, ivalues, outfile)
     print 'SaveStateVariables: %s is generated.' % outfile
 
 def usage():
     print 'optionas and arguments:'
     print '-i vf_file       : give a name for the vf_file.'
+    print '-m maple_file    : take the variables from the model (facile.pl -L output).'
+    print '-n               : also write rates.npy and ivalues.npy.'
 
 def main(argv):
     try:
-        opts, args = getopt.getopt(argv,"hi:",["help","input"])
+        opts, args = getopt.getopt(argv,"hi:m:n",["help","input","model","npy"])
     except getopt.GetoptError:
         print 'use -h or --help to show usage'
         sys.exit(2)
     if opts == []:
         usage()
         sys.exit()
+    npy = False
+    vffile = None
+    maplefile = None
     for opt, arg in opts:
         if opt == '-h':
             usage()
             sys.exit()
         elif opt in ("-i", "--input"):
             vffile = arg
+        elif opt in ("-m", "--model"):
+            maplefile = arg
+        elif opt in ("-n", "--npy"):
+            npy = True
 
-    SaveRateVariables(vffile,'rates.csv')
-    SaveStateVariables(vffile,'ivalues.csv')
+    if maplefile is not None:
+        SaveModelVariables(modelir.Load(maplefile=maplefile), 'rates.csv',
+                'ivalues.csv', npy)
+    elif vffile is not None:
+        SaveVfVariables(vffile, 'rates.csv', 'ivalues.csv', npy)
+    else:
+        usage()
 
 if __name__=='__main__':
     main(sys.argv[1:])
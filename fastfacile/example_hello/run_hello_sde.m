@@ -20,6 +20,15 @@ tic
 fprintf('%d sde equations executed in %fsec (%f #/sec)\n', ...
     nsamps, toc, nsamps/toc);
 
+% the chemical langevin engine integrates the same samples with 
+% euler-maruyama steps of at most 1e-3 (setenv('FASTFACILE_SDE_DT', ...)) 
+% instead of kicking the ode solution at every output time. 
+tic
+[y_sde, yf_sde, flag_sde] = hello_SDE(tvec, ivaluesArray, ratesArray);
+
+fprintf('%d sde equations executed in %fsec (%f #/sec) by hello_SDE\n', ...
+    nsamps, toc, nsamps/toc);
+
 idx = reshape(ones(num_tvec,1) * [1:nsamps], [nsamps*num_tvec,1]);
 
 y_with_idx = [idx y];
@@ -76,7 +76,8 @@ sub read_and_preprocess_input_file {
     }
 
     # the section that the input file is assumed to begin with should be first element of array
-    my @section_names = ("EQN", "INIT", "MOIETY", "BIFURC_PARAM", "CONFIG", "PROMOTER", "PROBE");
+    # READOUT is read by fastfacile (factools.py), facile ignores it
+    my @section_names = ("EQN", "INIT", "MOIETY", "BIFURC_PARAM", "CONFIG", "PROMOTER", "PROBE", "READOUT");
 
     # since file is assumed to start with EQN section,
     # it should be first in section_names array
@@ -676,6 +677,8 @@ sub parse_config_section {
 	    $config_ref->{SS_AbsTol} = $1;
 	} elsif ($line =~ /^easystoch_sample_times\s*{(\S+)}\s*=\s*(\S.*)/) {
 	  $config_ref->{easystoch_sample_times}{$1} = $2;
+	} elsif ($line =~ /^(output_stride|reduce_moieties|fold_fixed)\s*=\s*(\S+)/) {
+	    # read by fastfacile (factools.py), not used by facile
 	} elsif ($line =~ /^@/) {
 	    push @{$config_ref->{xpp_config}}, $line;
 	} else {